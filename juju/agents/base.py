@@ -6,7 +6,7 @@ import logging
 import zookeeper
 
 from twisted.application import service
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twisted.scripts._twistd_unix import UnixApplicationRunner, UnixAppLogger
 from twisted.python.log import PythonLoggingObserver
 
@@ -14,8 +14,11 @@ from txzookeeper import ZookeeperClient
 
 from juju.control.options import setup_twistd_options
 from juju.errors import NoConnection, JujuError
+from juju.lib.lograte import LogRateLimiter
 from juju.lib.zklog import ZookeeperHandler
+from juju.lib.zkprofile import enable_profiling
 from juju.state.environment import GlobalSettingsStateManager
+from juju.state.watches import watch_registry
 
 
 class TwistedOptionNamespace(object):
@@ -95,6 +98,19 @@ class BaseAgent(object, service.Service):
     # Distributed debug log handler
     _debug_log_handler = None
 
+    # Debug log records are shipped in batches of up to this many records,
+    # buffered for at most this many seconds.
+    debug_log_batch_size = 100
+    debug_log_flush_interval = 0.5
+
+    # Debug log records are shipped at this sustained rate per second, and
+    # burst, unless the global settings set other limits.
+    debug_log_rate = 50
+    debug_log_burst = 500
+
+    # Zookeeper operation profiler, if enabled.
+    _zk_profiler = None
+
     @classmethod
     def run(cls):
         """Runs the agent as a unix daemon.
@@ -187,6 +203,12 @@ class BaseAgent(object, service.Service):
     # conventions.
     @inlineCallbacks
     def startService(self):
+        if self.config.get("profile_zk") and self._zk_profiler is None:
+            self._zk_profiler = enable_profiling(
+                log=logging.getLogger("juju.agents.profile"),
+                at_exit=False)
+        watch_registry.dump_on_signal(
+            logging.getLogger("juju.agents.watches"))
         yield self.connect()
         yield self.start()
 
@@ -197,9 +219,14 @@ class BaseAgent(object, service.Service):
     def stopService(self):
         try:
             yield self.stop()
+            # Ship any buffered debug log records.
+            yield self.stop_debug_log()
         finally:
             if self.client and self.client.connected:
                 self.client.close()
+            if self._zk_profiler is not None:
+                self._zk_profiler.dump(
+                    log=logging.getLogger("juju.agents.profile"))
 
     def set_watch_enabled(self, flag):
         """Set boolean flag for whether this agent should watching zookeeper.
@@ -234,9 +261,28 @@ class BaseAgent(object, service.Service):
         """
         if (yield self.global_settings_state.is_debug_log_enabled()):
             yield self.start_debug_log()
+            limits = yield self.global_settings_state.get_debug_log_limits()
+            self.configure_debug_log(limits)
         else:
             self.stop_debug_log()
 
+    def configure_debug_log(self, limits=None):
+        """Apply the debug log rate limits of the global settings.
+
+        The agent's default rate and burst apply unless set by `limits`,
+        a rate of 0 disables the rate limit.
+        """
+        if self._debug_log_handler is None:
+            return
+        limits = limits or {}
+        rate = limits.get("rate")
+        burst = limits.get("burst")
+        if rate is None:
+            rate = self.debug_log_rate
+            burst = burst or self.debug_log_burst
+        self._debug_log_handler.rate_limiter.configure(
+            rate or None, burst, limits.get("sampling"))
+
     @inlineCallbacks
     def start_debug_log(self):
         """Enable the distributed debug log handler.
@@ -245,19 +291,27 @@ class BaseAgent(object, service.Service):
             returnValue(None)
         context_name = self.get_agent_name()
         self._debug_log_handler = ZookeeperHandler(
-            self.client, context_name)
+            self.client, context_name,
+            batch_size=self.debug_log_batch_size,
+            flush_interval=self.debug_log_flush_interval, partitioned=True,
+            rate_limiter=LogRateLimiter(
+                self.debug_log_rate, self.debug_log_burst))
         yield self._debug_log_handler.open()
         log_root = logging.getLogger()
         log_root.addHandler(self._debug_log_handler)
 
     def stop_debug_log(self):
         """Disable any configured debug log handler.
+
+        Returns a deferred firing once its buffered records are written.
         """
         if self._debug_log_handler is None:
-            return
+            return succeed(None)
         handler, self._debug_log_handler = self._debug_log_handler, None
         log_root = logging.getLogger()
         log_root.removeHandler(handler)
+        handler.close()
+        return handler.flush()
 
     def get_agent_name(self):
         """Return the agent's name and context such that it can be identified.
@@ -285,3 +339,8 @@ def setup_default_agent_options(parser, cls):
     parser.add_argument(
         "--juju-directory", default=juju_home, type=os.path.abspath,
         help="juju working directory ($JUJU_HOME)")
+
+    parser.add_argument(
+        "--profile-zk", default=False, action="store_true",
+        help="Log a profile of the zookeeper operations on SIGUSR2 and "
+        "on shutdown")
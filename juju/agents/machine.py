@@ -1,12 +1,14 @@
 import logging
 import os
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.python.failure import Failure
 
 from juju.errors import JujuError
+from juju.lib.twistutils import parallel_map
 from juju.machine.unit import get_deploy_factory
 
-from juju.unit.charm import download_charm
+from juju.unit.charm import CharmCache
 
 from juju.state.charm import CharmStateManager
 from juju.state.environment import GlobalSettingsStateManager
@@ -36,6 +38,15 @@ class MachineAgent(BaseAgent):
     name = "juju-machine-agent"
     unit_agent_module = "juju.agents.unit"
 
+    # Default maximum number of units started or stopped concurrently.
+    unit_concurrency = 4
+
+    def __init__(self):
+        super(MachineAgent, self).__init__()
+        # In-flight charm downloads, keyed by (charm_id, sha256), mapped
+        # to the deferreds waiting on their completion.
+        self._charm_downloads = {}
+
     @property
     def charms_directory(self):
         return os.path.join(self.config["juju_directory"], "charms")
@@ -65,6 +76,12 @@ class MachineAgent(BaseAgent):
         if not os.path.exists(self.unit_state_directory):
             os.makedirs(self.unit_state_directory)
 
+        # The charm cache is shared with the unit agents on this machine.
+        cache_size = self.config.get("charm_cache_size")
+        self.charm_cache = CharmCache(
+            self.charms_directory,
+            cache_size and cache_size * 1024 * 1024 or None)
+
         # Get state managers we'll be utilizing.
         self.service_state_manager = ServiceStateManager(self.client)
         self.charm_state_manager = CharmStateManager(self.client)
@@ -89,20 +106,49 @@ class MachineAgent(BaseAgent):
         log.info("Machine agent started id:%s deploy:%r provider:%r" % (
             self.get_machine_id(), self.deploy_factory, self.provider_type))
 
+    @inlineCallbacks
     def download_charm(self, charm_state):
         """Retrieve a charm from the provider storage to the local machine.
 
-        Utilizes a local charm cache to avoid repeated downloading of the
-        same charm.
+        Utilizes the local charm cache to avoid repeated downloading of
+        the same charm. Concurrent requests for the same charm id and sha256
+        are coalesced, such that only one download is in flight at a time.
         """
+        checksum = yield charm_state.get_sha256()
+        key = (charm_state.id, checksum)
+
+        if key in self._charm_downloads:
+            log.debug("Waiting on in-flight download of charm %s",
+                      charm_state.id)
+            waiter = Deferred()
+            self._charm_downloads[key].append(waiter)
+            bundle = yield waiter
+            returnValue(bundle)
+
+        waiters = self._charm_downloads[key] = []
         log.debug("Downloading charm %s to %s",
                   charm_state.id, self.charms_directory)
-        return download_charm(
-            self.client, charm_state.id, self.charms_directory)
+        try:
+            bundle = yield self.charm_cache.fetch(charm_state)
+        except Exception:
+            failure = Failure()
+            del self._charm_downloads[key]
+            for waiter in waiters:
+                waiter.errback(failure)
+            raise
+
+        del self._charm_downloads[key]
+        for waiter in waiters:
+            waiter.callback(bundle)
+        returnValue(bundle)
 
     @inlineCallbacks
     def watch_service_units(self, old_units, new_units):
         """Callback invoked when the assigned service units change.
+
+        Removed units are stopped before new units are started, each
+        group being processed concurrently up to the configured unit
+        concurrency.
         """
         if old_units is None:
             old_units = set()
@@ -112,20 +158,27 @@ class MachineAgent(BaseAgent):
 
         stopped = old_units - new_units
         started = new_units - old_units
+        concurrency = self.config.get(
+            "unit_concurrency") or self.unit_concurrency
+
+        yield parallel_map(self._stop_unit, sorted(stopped), concurrency)
+        yield parallel_map(self._start_unit, sorted(started), concurrency)
 
-        for unit_name in stopped:
-            log.debug("Stopping service unit: %s ...", unit_name)
-            try:
-                yield self.kill_service_unit(unit_name)
-            except Exception:
-                log.exception("Error stopping unit: %s", unit_name)
+    @inlineCallbacks
+    def _stop_unit(self, unit_name):
+        log.debug("Stopping service unit: %s ...", unit_name)
+        try:
+            yield self.kill_service_unit(unit_name)
+        except Exception:
+            log.exception("Error stopping unit: %s", unit_name)
 
-        for unit_name in started:
-            log.debug("Starting service unit: %s ...", unit_name)
-            try:
-                yield self.start_service_unit(unit_name)
-            except Exception:
-                log.exception("Error starting unit: %s", unit_name)
+    @inlineCallbacks
+    def _start_unit(self, unit_name):
+        log.debug("Starting service unit: %s ...", unit_name)
+        try:
+            yield self.start_service_unit(unit_name)
+        except Exception:
+            log.exception("Error starting unit: %s", unit_name)
 
     @inlineCallbacks
     def start_service_unit(self, service_unit_name):
@@ -142,25 +195,38 @@ class MachineAgent(BaseAgent):
         charm_state = yield self.charm_state_manager.get_charm_state(
             charm_id)
 
-        # Download the charm.
-        bundle = yield self.download_charm(charm_state)
-
-        # Use deployment to setup the workspace and start the unit agent.
-        deployment = self.deploy_factory(
-            service_unit_name, self.config["juju_directory"])
-
-        running = yield deployment.is_running()
-        if not running:
-            log.debug("Starting service unit %s", service_unit_name)
-            yield deployment.start(
-                self.get_machine_id(), self.client.servers, bundle)
-            log.info("Started service unit %s", service_unit_name)
+        # Keep the bundle cached until the unit is deployed from it, as
+        # concurrent deploys, or unit agents sharing the cache, may
+        # otherwise evict it.
+        checksum = yield charm_state.get_sha256()
+        self.charm_cache.pin(checksum)
+        try:
+            # Download the charm.
+            bundle = yield self.download_charm(charm_state)
+
+            # Use deployment to setup the workspace and start the unit
+            # agent.
+            deployment = self.get_deployment(service_unit_name)
+
+            running = yield deployment.is_running()
+            if not running:
+                log.debug("Starting service unit %s", service_unit_name)
+                yield deployment.start(
+                    self.get_machine_id(), self.client.servers, bundle)
+                log.info("Started service unit %s", service_unit_name)
+        finally:
+            self.charm_cache.unpin(checksum)
+
+    def get_deployment(self, service_unit_name):
+        """Return the deployment of a service unit on the machine."""
+        return self.deploy_factory(
+            service_unit_name, self.config["juju_directory"],
+            charm_cache_size=self.config.get("charm_cache_size"))
 
     def kill_service_unit(self, service_unit_name):
         """Stop service unit and destroy disk state, ala SIGKILL or lxc-destroy
         """
-        deployment = self.deploy_factory(
-            service_unit_name, self.config["juju_directory"])
+        deployment = self.get_deployment(service_unit_name)
         log.info("Stopping service unit %s...", service_unit_name)
         return deployment.destroy()
 
@@ -185,6 +251,14 @@ class MachineAgent(BaseAgent):
         machine_id = os.environ.get("JUJU_MACHINE_ID", "")
         parser.add_argument(
             "--machine-id", default=machine_id)
+        parser.add_argument(
+            "--unit-concurrency", type=int, default=cls.unit_concurrency,
+            help="Maximum number of units deployed concurrently")
+        parser.add_argument(
+            "--charm-cache-size", type=int,
+            default=os.environ.get("JUJU_CHARM_CACHE_SIZE"),
+            help="Size cap of the local charm cache, in megabytes "
+                 "($JUJU_CHARM_CACHE_SIZE)")
         return parser
 
 if __name__ == '__main__':
@@ -1,14 +1,19 @@
 import logging
+import time
 
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import (
+    DeferredList, inlineCallbacks, maybeDeferred, returnValue, succeed)
 from zookeeper import NoNodeException
 
 from juju.environment.config import EnvironmentsConfig
-from juju.errors import ProviderError
-from juju.lib.twistutils import concurrent_execution_guard
+from juju.errors import MachinesNotFound, ProviderError
+from juju.lib.twistutils import concurrent_execution_guard, parallel_map
+from juju.lib.zklog import LogJanitor
+from juju.state.agent import PresenceIndex, MACHINE_AGENTS_PATH
 from juju.state.errors import MachineStateNotFound, StateChanged, StopWatcher
 from juju.state.firewall import FirewallManager
 from juju.state.machine import MachineStateManager
+from juju.state.pool import MachinePoolManager
 from juju.state.service import ServiceStateManager
 
 from .base import BaseAgent
@@ -23,15 +28,42 @@ class ProvisioningAgent(BaseAgent):
 
     _current_machines = ()
 
-    # time in seconds
-    machine_check_period = 60
+    # time in seconds, between checks of dirty machines
+    machine_check_period = 10
+
+    # time in seconds, between full reconciliations against the provider
+    full_check_period = 600
+
+    # time in seconds, initial and maximum backoff on failed checks
+    machine_retry_delay = 10
+    machine_retry_max_delay = 600
+
+    # Maximum number of machine states read concurrently.
+    machine_read_concurrency = 10
+
+    # Maximum number of machines launched by a single provider request.
+    machine_launch_batch_size = 10
+
+    # time in seconds, between runs of the debug log janitor
+    log_janitor_period = 300
 
     def get_agent_name(self):
         return "provision:%s" % (self.environment.type)
 
+    def __init__(self):
+        super(ProvisioningAgent, self).__init__()
+        # machine id -> (failure count, time the machine is due a check)
+        self._dirty_machines = {}
+        self._full_check_failures = 0
+        self._next_full_check = 0
+        self._next_log_cleanup = 0
+        self.last_check_report = None
+
     @inlineCallbacks
     def start(self):
         self._running = True
+        self.full_check_period = (
+            self.config.get("full_check_period") or self.full_check_period)
 
         self.environment = yield self.configure_environment()
         self.provider = self.environment.get_machine_provider()
@@ -39,8 +71,17 @@ class ProvisioningAgent(BaseAgent):
         self.service_state_manager = ServiceStateManager(self.client)
         self.firewall_manager = FirewallManager(
             self.client, self.is_running, self.provider)
+        self.machine_presence = PresenceIndex(
+            self.client, MACHINE_AGENTS_PATH)
+        self.machine_pool = MachinePoolManager(
+            self.client, presence=self.machine_presence,
+            **self.environment.machine_pool)
+        self.log_janitor = LogJanitor(
+            self.client, self.provider.get_file_storage(),
+            **self.environment.debug_log_retention)
 
         if self.get_watch_enabled():
+            yield self.machine_presence.watch()
             self.machine_state_manager.watch_machine_states(
                 self.watch_machine_changes)
             self.service_state_manager.watch_service_states(
@@ -55,6 +96,8 @@ class ProvisioningAgent(BaseAgent):
     def stop(self):
         log.info("Stopping provisioning agent")
         self._running = False
+        if getattr(self, "machine_presence", None) is not None:
+            self.machine_presence.stop()
         return succeed(True)
 
     def is_running(self):
@@ -101,6 +144,10 @@ class ProvisioningAgent(BaseAgent):
 
         self.environment = yield self.configure_environment()
         self.provider = self.environment.get_machine_provider()
+        self.machine_pool.configure(**self.environment.machine_pool)
+        self.log_janitor.configure(
+            self.provider.get_file_storage(),
+            **self.environment.debug_log_retention)
 
     def periodic_machine_check(self):
         """A periodic checking of machine states and provider machines.
@@ -115,14 +162,76 @@ class ProvisioningAgent(BaseAgent):
         which may have prevent processing of an individual machine state, as
         well as verifying the current state of the provider's running machines
         against the zk state, thus pruning unused resources.
+
+        Most checks only recheck the dirty machines which are due, a full
+        reconciliation against the provider is done every
+        C{full_check_period} seconds. The standby machine pool is then
+        brought up to date, and the debug log is pruned every
+        C{log_janitor_period} seconds.
         """
         from twisted.internet import reactor
-        d = self.process_machines(self._current_machines)
+        d = self.check_machines()
+        d.addBoth(lambda result: self.check_machine_pool())
+        d.addBoth(lambda result: self.check_debug_log())
         d.addBoth(
             lambda result: reactor.callLater(
                 self.machine_check_period, self.periodic_machine_check))
         return d
 
+    @inlineCallbacks
+    def check_machine_pool(self):
+        """Bring the standby machine pool up to date, logging any error."""
+        try:
+            yield self.machine_pool.check_pool()
+        except (StateChanged, MachineStateNotFound):
+            log.exception("Cannot check the standby machine pool")
+
+    @inlineCallbacks
+    def check_debug_log(self):
+        """Archive the debug log entries past their retention, if due.
+
+        Failures are logged, the entries are archived on a later run.
+        """
+        now = time.time()
+        if self._next_log_cleanup > now:
+            return
+        self._next_log_cleanup = now + self.log_janitor_period
+        try:
+            report = yield self.log_janitor.run(now)
+        except Exception:
+            log.exception("Cannot archive the debug log")
+            return
+        if report["nodes"]:
+            log.info(
+                "Archived %d debug log nodes in %d chunks, reclaimed %d "
+                "bytes", report["nodes"], report["chunks"], report["bytes"])
+        if report["streams"]:
+            log.info("Removed %d empty debug log streams", report["streams"])
+
+    def check_machines(self):
+        """Reconcile fully if due, else recheck the due dirty machines."""
+        if self._next_full_check <= time.time():
+            return self.process_machines(self._current_machines)
+        return self.process_dirty_machines()
+
+    def mark_machine_dirty(self, machine_id, failed=False):
+        """Schedule a recheck of a machine.
+
+        A changed machine is due a check immediately, while a machine whose
+        processing failed is rechecked with an exponential backoff.
+        """
+        failures = 0
+        if failed:
+            failures = self._dirty_machines.get(machine_id, (0, 0))[0] + 1
+        self._dirty_machines[machine_id] = (
+            failures, time.time() + self._get_backoff(failures))
+
+    def _get_backoff(self, failures):
+        if not failures:
+            return 0
+        return min(self.machine_retry_delay * 2 ** (failures - 1),
+                   self.machine_retry_max_delay)
+
     @inlineCallbacks
     def watch_machine_changes(self, old_machines, new_machines):
         """Watches and processes machine state changes.
@@ -137,6 +246,10 @@ class ProvisioningAgent(BaseAgent):
         function will automatically be rescheduled to run whenever a topology
         state change happens that involves machines.
 
+        Added machines are marked dirty and checked immediately, while
+        removed machines cause a full reconciliation so their provider
+        machines are shut down.
+
         This functional also caches the current set of machines as an agent
         instance attribute.
 
@@ -146,9 +259,14 @@ class ProvisioningAgent(BaseAgent):
         if not self._running:
             raise StopWatcher()
         log.debug("Machines changed old:%s new:%s", old_machines, new_machines)
+        old_machines = set(old_machines or ())
         self._current_machines = new_machines
+        for machine_id in set(new_machines) - old_machines:
+            self.mark_machine_dirty(machine_id)
+        if old_machines - set(new_machines):
+            self._next_full_check = 0
         try:
-            yield self.process_machines(self._current_machines)
+            yield self.check_machines()
         except Exception:
             # Log and effectively retry later in periodic_machine_check
             log.exception(
@@ -166,34 +284,45 @@ class ProvisioningAgent(BaseAgent):
 
         Utilizes concurrent execution guard, to ensure that this is only being
         executed at most once per process.
+
+        Returns a report of the work done, see L{_log_report}.
         """
         # XXX this is obviously broken, but the margins of 80 columns prevent
         # me from describing. hint think concurrent agents, and use a lock.
+        start = time.time()
+        report = {"full": True, "checked": len(current_machines),
+                  "launched": 0, "failed": 0, "shutdown": 0}
+
+        # Schedule the next full check up front, such that a request for
+        # one made while this check runs is not lost.
+        self._next_full_check = start + self.full_check_period
 
         # map of instance_id -> machine
         try:
             provider_machines = yield self.provider.get_machines()
         except ProviderError:
             log.exception("Cannot get machine list")
+            self._full_check_failures += 1
+            self._next_full_check = min(
+                self._next_full_check,
+                start + self._get_backoff(self._full_check_failures))
             return
+        self._full_check_failures = 0
 
         provider_machines = dict(
             [(m.instance_id, m) for m in provider_machines])
 
-        instance_ids = []
-        for machine_state_id in current_machines:
-            try:
-                instance_id = yield self.process_machine(
-                    machine_state_id, provider_machines)
-            except (StateChanged,
-                    MachineStateNotFound,
-                    ProviderError):
-                log.exception("Cannot process machine %s", machine_state_id)
-                continue
-            instance_ids.append(instance_id)
+        # Resynchronize the firewall's view of the opened ports.
+        try:
+            yield self.firewall_manager.refresh_opened_ports()
+        except ProviderError:
+            log.exception("Cannot get opened ports")
+
+        instance_ids = yield self._process_machine_ids(
+            current_machines, set(provider_machines), report)
 
         # Terminate all unused juju machines running within the cluster.
-        unused = set(provider_machines.keys()) - set(instance_ids)
+        unused = set(provider_machines.keys()) - set(instance_ids.values())
         for instance_id in unused:
             log.info("Shutting down machine id:%s ...", instance_id)
             machine = provider_machines[instance_id]
@@ -201,39 +330,209 @@ class ProvisioningAgent(BaseAgent):
                 yield self.provider.shutdown_machine(machine)
             except ProviderError:
                 log.exception("Cannot shutdown machine %s", instance_id)
+                report["failed"] += 1
                 continue
+            report["shutdown"] += 1
+
+        self._log_report(report, start)
+        returnValue(report)
 
+    @concurrent_execution_guard("_processing_machines")
     @inlineCallbacks
-    def process_machine(self, machine_state_id, provider_machine_map):
-        """Ensure a provider machine for a machine state id.
+    def process_dirty_machines(self):
+        """Recheck the dirty machines which are due a check.
 
-        For each machine_id in new machines which represents the current state
-        of the topology:
+        Only the machine states of the dirty machines are read, and only
+        their provider machines are looked up. Shares the concurrent
+        execution guard of L{process_machines}.
 
-          * Check to ensure its state reflects that it has been
-            launched. If it hasn't then create the machine and update
-            the state.
+        Returns a report of the work done, see L{_log_report}.
+        """
+        start = time.time()
+        current = set(self._current_machines)
+        due = []
+        for machine_id, (failures, due_time) in self._dirty_machines.items():
+            if machine_id not in current:
+                del self._dirty_machines[machine_id]
+            elif due_time <= start:
+                due.append(machine_id)
+        report = {"full": False, "checked": len(due),
+                  "launched": 0, "failed": 0, "shutdown": 0}
+        if not due:
+            returnValue(report)
+
+        yield self._process_machine_ids(sorted(due), None, report)
+        self._log_report(report, start)
+        returnValue(report)
 
-          * Watch the machine's assigned services so that changes can
-            be applied to the firewall for service exposing support.
+    @inlineCallbacks
+    def _process_machine_ids(self, machine_ids, running_ids, report):
+        """Ensure a provider machine for each of the machine state ids.
+
+        @param running_ids: the instance ids of the running provider
+            machines, or None to look up the instance ids of the machines.
+
+        Successfully processed machines are no longer dirty, while failed
+        ones are marked dirty for a retry. Returns a dictionary mapping
+        the ids of the processed machines to their instance ids.
+        """
+        # Read the machine states, and their instance ids, concurrently.
+        machines = yield parallel_map(
+            self._get_machine, machine_ids, self.machine_read_concurrency)
+        for machine_id, machine in zip(machine_ids, machines):
+            if machine is None:
+                self._record_failure(machine_id, report)
+        machines = [machine for machine in machines if machine is not None]
+
+        if running_ids is None:
+            try:
+                running_ids = yield self._get_running_ids(
+                    [instance_id for machine_state, instance_id in machines
+                     if instance_id is not None])
+            except ProviderError:
+                log.exception("Cannot get machine list")
+                for machine_state, instance_id in machines:
+                    self._record_failure(machine_state.id, report)
+                returnValue({})
+
+        # Launch the machines without a running provider machine, in
+        # batches of provider requests.
+        pending = [machine_state for machine_state, instance_id in machines
+                   if instance_id is None or
+                   not instance_id in running_ids]
+        launched = {}
+        batch_size = self.machine_launch_batch_size
+        for index in range(0, len(pending), batch_size):
+            launched.update(
+                (yield self.launch_machines(
+                    pending[index:index + batch_size])))
+        report["launched"] += len(launched)
+
+        instance_ids = {}
+        for machine_state, instance_id in machines:
+            if not (instance_id is not None and
+                    instance_id in running_ids):
+                if machine_state.id not in launched:
+                    # Launching failed, retried on a later check.
+                    self._record_failure(machine_state.id, report)
+                    continue
+                instance_id = launched[machine_state.id]
+            try:
+                # The firewall manager also needs to be checked for any
+                # outstanding retries on this machine
+                yield self.firewall_manager.process_machine(machine_state)
+            except (StateChanged,
+                    MachineStateNotFound,
+                    ProviderError):
+                log.exception("Cannot process machine %s", machine_state.id)
+                self._record_failure(machine_state.id, report)
+                continue
+            self._dirty_machines.pop(machine_state.id, None)
+            instance_ids[machine_state.id] = instance_id
+        returnValue(instance_ids)
+
+    @inlineCallbacks
+    def _get_running_ids(self, instance_ids):
+        """Return which of the instance ids have a running provider machine.
+        """
+        if not instance_ids:
+            returnValue(set())
+        try:
+            yield self.provider.get_machines(instance_ids)
+        except MachinesNotFound, e:
+            returnValue(set(instance_ids) - set(e.instance_ids))
+        returnValue(set(instance_ids))
+
+    def _record_failure(self, machine_id, report):
+        report["failed"] += 1
+        self.mark_machine_dirty(machine_id, failed=True)
+
+    def _log_report(self, report, start):
+        """Record and log the work done by a machine check.
+
+        A report counts the machines checked, launched, shut down and
+        failed by a full (or incremental) check.
         """
-        # fetch the machine state
-        machine_state = yield self.machine_state_manager.get_machine_state(
-            machine_state_id)
-        instance_id = yield machine_state.get_instance_id()
+        report["duration"] = time.time() - start
+        self.last_check_report = report
+        log.debug(
+            "%s machine check in %0.3fs, checked %d launched %d "
+            "shutdown %d failed %d",
+            report["full"] and "Full" or "Incremental", report["duration"],
+            report["checked"], report["launched"], report["shutdown"],
+            report["failed"])
+
+    @inlineCallbacks
+    def _get_machine(self, machine_state_id):
+        """Return a machine state and its instance id, or None on error."""
+        try:
+            machine_state = yield self.machine_state_manager.\
+                get_machine_state(machine_state_id)
+            instance_id = yield machine_state.get_instance_id()
+        except (StateChanged,
+                MachineStateNotFound,
+                ProviderError):
+            log.exception("Cannot process machine %s", machine_state_id)
+            returnValue(None)
+        returnValue((machine_state, instance_id))
+
+    @inlineCallbacks
+    def launch_machines(self, machine_states):
+        """Launch provider machines for the given machine states.
+
+        Utilizes the provider's optional bulk `start_machines` api when
+        available, falling back to starting each machine individually
+        if the provider lacks it or the bulk request fails as a whole.
 
-        # Verify a machine id has state and is running, else launch it.
-        if instance_id is None or not instance_id in provider_machine_map:
+        Returns a dictionary mapping the ids of the successfully
+        launched machine states to their new instance ids.
+        """
+        machines_data = []
+        for machine_state in machine_states:
             log.info("Starting machine id:%s ...", machine_state.id)
-            machines = yield self.provider.start_machine(
-                {"machine-id": machine_state.id})
-            instance_id = machines[0].instance_id
-            yield machine_state.set_instance_id(instance_id)
-
-        # The firewall manager also needs to be checked for any
-        # outstanding retries on this machine
-        yield self.firewall_manager.process_machine(machine_state)
-        returnValue(instance_id)
+            machines_data.append({"machine-id": machine_state.id})
+
+        results = None
+        start_machines = getattr(self.provider, "start_machines", None)
+        if start_machines is not None:
+            try:
+                results = yield start_machines(machines_data)
+            except ProviderError:
+                log.exception(
+                    "Cannot start machines in bulk, starting individually")
+
+        if results is None:
+            results = yield DeferredList(
+                [maybeDeferred(self.provider.start_machine, machine_data)
+                 for machine_data in machines_data],
+                consumeErrors=True)
+
+        launched = {}
+        for machine_state, (success, result) in zip(machine_states, results):
+            try:
+                if not success:
+                    result.raiseException()
+                instance_id = result[0].instance_id
+                # A new provider machine starts with no opened ports.
+                self.firewall_manager.invalidate_opened_ports(
+                    machine_state.id)
+                yield machine_state.set_instance_id(instance_id)
+            except Exception:
+                # Any failure is contained to its machine, such that the
+                # instances started for the others are recorded.
+                log.exception("Cannot process machine %s", machine_state.id)
+                continue
+            launched[machine_state.id] = instance_id
+        returnValue(launched)
+
+    @classmethod
+    def setup_options(cls, parser):
+        super(ProvisioningAgent, cls).setup_options(parser)
+        parser.add_argument(
+            "--full-check-period", type=int, default=cls.full_check_period,
+            help="Seconds between full reconciliations of the machines "
+                 "against the provider")
+        return parser
 
 if __name__ == '__main__':
     ProvisioningAgent().run()
@@ -414,8 +414,8 @@ class AgentDebugLogSettingsWatch(AgentTestBase):
     agent_class = BaseAgent
 
     @inlineCallbacks
-    def get_log_entry(self, number, wait=True):
-        entry_path = "/logs/log-%010d" % number
+    def get_log_entry(self, number, wait=True, container="/logs"):
+        entry_path = "%s/log-%010d" % (container, number)
         exists_d, watch_d = self.client.exists_and_watch(entry_path)
 
         exists = yield exists_d
@@ -473,11 +473,40 @@ class AgentDebugLogSettingsWatch(AgentTestBase):
         root_log.info("goodbye")
         root_log.info("world")
 
-        entry = yield self.get_log_entry(0)
-        self.assertTrue(entry)
+        # Records are shipped in batches, flushed on stop, to the stream
+        # of the agent's debug records.
+        stream_path = "/logs/streams/BaseAgent@DEBUG"
+        [entry] = yield self.get_log_entry(0, container=stream_path)
         self.assertEqual(entry["levelname"], "DEBUG")
-        entry = yield self.get_log_entry(1, wait=False)
+        entry = yield self.get_log_entry(1, wait=False, container=stream_path)
         self.assertFalse(entry)
+        self.assertEqual(
+            (yield self.client.get_children("/logs/streams")),
+            ["BaseAgent@DEBUG"])
 
         # Else zookeeper is closing on occassion in teardown
         yield self.sleep(0.1)
+
+    @inlineCallbacks
+    def test_log_rate_limits(self):
+        """The debug log is rate limited, as set by the global settings."""
+        yield self.agent.connect()
+        yield self.agent.start_global_settings_watch()
+        yield self.agent.global_settings_state.set_debug_log(True)
+        yield self.sleep(0.1)
+        limiter = self.agent._debug_log_handler.rate_limiter
+        self.assertEqual(
+            (limiter.rate, limiter.burst),
+            (self.agent.debug_log_rate, self.agent.debug_log_burst))
+
+        yield self.agent.global_settings_state.set_debug_log_limits(
+            rate=5, sampling={"hook.output": 0.1})
+        yield self.sleep(0.1)
+        self.assertEqual((limiter.rate, limiter.burst), (5, 5))
+        self.assertEqual(limiter.sampling, {"hook.output": 0.1})
+
+        # A rate of 0 disables the rate limit.
+        yield self.agent.global_settings_state.set_debug_log_limits(rate=0)
+        yield self.sleep(0.1)
+        self.assertEqual(limiter.rate, None)
+        yield self.agent.stop_debug_log()
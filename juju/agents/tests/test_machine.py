@@ -13,7 +13,6 @@ from juju.charm.directory import CharmDirectory
 from juju.charm.publisher import CharmPublisher
 from juju.charm.tests import local_charm_id
 from juju.charm.tests.test_repository import RepositoryTestBase
-from juju.lib import under
 from juju.lib.mocker import MATCH
 from juju.state.environment import EnvironmentStateManager
 from juju.state.machine import MachineStateManager, MachineState
@@ -164,8 +163,7 @@ class MachineAgentTest(AgentTestBase, RepositoryTestBase):
 
         checksum = self.charm.get_sha256()
         charm_id = local_charm_id(self.charm)
-        charm_key = under.quote("%s:%s" % (charm_id, checksum))
-        charm_path = os.path.join(self.agent.charms_directory, charm_key)
+        charm_path = os.path.join(self.agent.charms_directory, checksum)
 
         self.assertTrue(os.path.exists(charm_path))
         bundle = CharmBundle(charm_path)
@@ -175,6 +173,101 @@ class MachineAgentTest(AgentTestBase, RepositoryTestBase):
         self.assertIn(
             "Downloading charm %s" % charm_id, self.output.getvalue())
 
+    @inlineCallbacks
+    def test_charm_download_coalesced(self):
+        """Concurrent downloads of the same charm share one download."""
+        yield self.agent.startService()
+        downloads = []
+        pending = []
+        original_fetch = self.agent.charm_cache.fetch
+
+        def fetch(charm_state):
+            downloads.append(charm_state.id)
+            d = Deferred()
+            d.addCallback(lambda _: original_fetch(charm_state))
+            pending.append(d)
+            return d
+
+        self.patch(self.agent.charm_cache, "fetch", fetch)
+
+        first = self.agent.download_charm(self.charm_state)
+        second = self.agent.download_charm(self.charm_state)
+        self.assertEqual(len(downloads), 1)
+        pending[0].callback(None)
+
+        first_bundle = yield first
+        second_bundle = yield second
+        self.assertIdentical(first_bundle, second_bundle)
+        self.assertIn("Waiting on in-flight download of charm %s" % (
+            self.charm_state.id), self.output.getvalue())
+
+        # Once complete, a subsequent request goes to the cache again.
+        third = self.agent.download_charm(self.charm_state)
+        self.assertEqual(len(downloads), 2)
+        pending[1].callback(None)
+        yield third
+
+    @inlineCallbacks
+    def test_charm_download_coalesced_error(self):
+        """A failed download is reported to every coalesced caller."""
+        yield self.agent.startService()
+        pending = Deferred()
+        self.patch(self.agent.charm_cache, "fetch", lambda *args: pending)
+
+        first = self.agent.download_charm(self.charm_state)
+        second = self.agent.download_charm(self.charm_state)
+        pending.errback(OSError("Bad"))
+        yield self.assertFailure(first, OSError)
+        yield self.assertFailure(second, OSError)
+        self.assertEqual(self.agent._charm_downloads, {})
+
+    @inlineCallbacks
+    def test_charm_download_cached(self):
+        """A charm already in the cache is not downloaded again."""
+        yield self.agent.startService()
+        bundle = yield self.agent.download_charm(self.charm_state)
+        os.remove(self.charm_state.bundle_url[len("file://"):])
+        cached = yield self.agent.download_charm(self.charm_state)
+        self.assertEqual(cached.path, bundle.path)
+
+    def test_agent_charm_cache_size_option(self):
+        self.change_environment(JUJU_CHARM_CACHE_SIZE="64")
+        self.change_args("es-agent")
+        parser = argparse.ArgumentParser()
+        self.agent.setup_options(parser)
+        config = parser.parse_args(namespace=TwistedOptionNamespace())
+        self.assertEqual(config["charm_cache_size"], 64)
+
+    def test_agent_unit_concurrency_option(self):
+        self.change_args("es-agent", "--unit-concurrency", "7")
+        parser = argparse.ArgumentParser()
+        self.agent.setup_options(parser)
+        config = parser.parse_args(namespace=TwistedOptionNamespace())
+        self.assertEqual(config["unit_concurrency"], 7)
+
+    @inlineCallbacks
+    def test_watch_service_units_concurrent(self):
+        """New units are started concurrently, bounded by the configured
+        unit concurrency."""
+        self.options["unit_concurrency"] = 2
+        pending = []
+        mock_agent = self.mocker.patch(self.agent)
+        for i in range(3):
+            mock_agent.start_service_unit("fatality-blog/%d" % i)
+            self.mocker.call(lambda name: pending.append(Deferred()) or
+                             pending[-1])
+        self.mocker.replay()
+
+        d = self.agent.watch_service_units(
+            None, set(["fatality-blog/0", "fatality-blog/1",
+                       "fatality-blog/2"]))
+        self.assertEqual(len(pending), 2)
+        pending[0].callback(None)
+        self.assertEqual(len(pending), 3)
+        pending[1].callback(None)
+        pending[2].callback(None)
+        yield d
+
     @inlineCallbacks
     def test_watch_new_service_unit(self):
         """
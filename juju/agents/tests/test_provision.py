@@ -1,23 +1,29 @@
+import argparse
+import json
 import logging
+import time
 
 import zookeeper
 
-from twisted.internet.defer import inlineCallbacks, fail, succeed
+from twisted.internet.defer import (
+    DeferredList, inlineCallbacks, fail, maybeDeferred, succeed)
 from twisted.internet import reactor
 
 from txzookeeper.client import ZOO_OPEN_ACL_UNSAFE
 
+from juju.agents.base import TwistedOptionNamespace
 from juju.agents.provision import ProvisioningAgent
 from juju.environment.environment import Environment
 from juju.environment.config import EnvironmentsConfig
 from juju.environment.errors import EnvironmentsConfigError
 from juju.environment.tests.test_config import SAMPLE_ENV
 
-from juju.errors import ProviderInteractionError
+from juju.errors import ProviderError, ProviderInteractionError
 from juju.lib.mocker import MATCH
 from juju.providers.dummy import DummyMachine
 from juju.state.errors import StopWatcher
 from juju.state.machine import MachineState, MachineStateManager
+from juju.state.placement import place_unit
 from juju.state.tests.test_service import ServiceStateManagerTestBase
 
 from .common import AgentTestBase
@@ -290,7 +296,7 @@ class ProvisioningAgentTest(ProvisioningTestBase):
     def test_periodic_task(self):
         """
         The agent schedules period checks that execute the process machines
-        call.
+        call, check the standby machine pool and prune the debug log.
         """
         mock_reactor = self.mocker.patch(reactor)
         mock_reactor.callLater(self.agent.machine_check_period,
@@ -298,6 +304,10 @@ class ProvisioningAgentTest(ProvisioningTestBase):
         mock_agent = self.mocker.patch(self.agent)
         mock_agent.process_machines(())
         self.mocker.result(succeed(None))
+        mock_agent.check_machine_pool()
+        self.mocker.result(succeed(None))
+        mock_agent.check_debug_log()
+        self.mocker.result(succeed(None))
         self.mocker.replay()
 
         # mocker magic test
@@ -330,6 +340,97 @@ class ProvisioningAgentTest(ProvisioningTestBase):
             "Cannot process machine 0",
             self.output.getvalue())
 
+    def add_bulk_start_machines(self, fail_machine_ids=(),
+                                error_class=ProviderInteractionError):
+        """Give the dummy provider a bulk start_machines api.
+
+        Returns a list recording the machine ids of each bulk request.
+        """
+        provider = self.agent.provider
+        requests = []
+
+        def start_machines(machines_data):
+            requests.append([data["machine-id"] for data in machines_data])
+            deferreds = []
+            for data in machines_data:
+                if data["machine-id"] in fail_machine_ids:
+                    deferreds.append(fail(error_class()))
+                else:
+                    deferreds.append(
+                        maybeDeferred(provider.start_machine, data))
+            return DeferredList(deferreds, consumeErrors=True)
+
+        self.patch(provider, "start_machines", start_machines)
+        return requests
+
+    @inlineCallbacks
+    def test_process_machines_bulk_launch(self):
+        """Machines are launched in batches via a provider's bulk api."""
+        requests = self.add_bulk_start_machines()
+        self.agent.machine_launch_batch_size = 2
+        manager = MachineStateManager(self.client)
+        machine_states = []
+        for i in range(3):
+            machine_states.append((yield manager.add_machine_state()))
+
+        yield self.agent.process_machines([m.id for m in machine_states])
+
+        self.assertEqual(requests, [[0, 1], [2]])
+        for machine_state in machine_states:
+            self.assertEqual(
+                (yield machine_state.get_instance_id()), machine_state.id)
+
+    @inlineCallbacks
+    def test_process_machines_bulk_launch_machine_error(self):
+        """A failure of one machine in a bulk launch is logged, and the
+        other machines are processed."""
+        self.add_bulk_start_machines(fail_machine_ids=(0,))
+        manager = MachineStateManager(self.client)
+        machine_state0 = yield manager.add_machine_state()
+        machine_state1 = yield manager.add_machine_state()
+
+        yield self.agent.process_machines(
+            [machine_state0.id, machine_state1.id])
+
+        self.assertEqual((yield machine_state0.get_instance_id()), None)
+        self.assertEqual((yield machine_state1.get_instance_id()), 0)
+        self.assertIn("Cannot process machine 0", self.output.getvalue())
+
+    @inlineCallbacks
+    def test_process_machines_bulk_launch_unexpected_error(self):
+        """An unexpected failure of one machine in a bulk launch does not
+        keep the instances of the others from being recorded."""
+        self.add_bulk_start_machines(
+            fail_machine_ids=(0,), error_class=RuntimeError)
+        manager = MachineStateManager(self.client)
+        machine_state0 = yield manager.add_machine_state()
+        machine_state1 = yield manager.add_machine_state()
+
+        yield self.agent.process_machines(
+            [machine_state0.id, machine_state1.id])
+
+        self.assertEqual((yield machine_state0.get_instance_id()), None)
+        self.assertEqual((yield machine_state1.get_instance_id()), 0)
+        self.assertIn("Cannot process machine 0", self.output.getvalue())
+
+    @inlineCallbacks
+    def test_process_machines_bulk_launch_fallback(self):
+        """If a bulk launch fails as a whole, machines are started
+        individually."""
+        self.patch(self.agent.provider, "start_machines",
+                   lambda machines_data: fail(ProviderError("bulk")))
+        manager = MachineStateManager(self.client)
+        machine_state0 = yield manager.add_machine_state()
+        machine_state1 = yield manager.add_machine_state()
+
+        yield self.agent.process_machines(
+            [machine_state0.id, machine_state1.id])
+
+        self.assertEqual((yield machine_state0.get_instance_id()), 0)
+        self.assertEqual((yield machine_state1.get_instance_id()), 1)
+        self.assertIn("Cannot start machines in bulk",
+                      self.output.getvalue())
+
     @inlineCallbacks
     def test_transient_provider_error_on_shutdown_machine(self):
         """
@@ -446,6 +547,139 @@ class ProvisioningAgentTest(ProvisioningTestBase):
             "'NoneType' object is not iterable",
             self.output.getvalue())
 
+    def record_get_machines(self):
+        """Record the instance ids of each provider get_machines call."""
+        provider = self.agent.provider
+        get_machines = provider.get_machines
+        calls = []
+
+        def record(instance_ids=()):
+            calls.append(list(instance_ids))
+            return get_machines(instance_ids)
+
+        self.patch(provider, "get_machines", record)
+        return calls
+
+    @inlineCallbacks
+    def test_watch_machine_changes_checks_added_machines(self):
+        """Once fully reconciled, only added machines are checked."""
+        manager = MachineStateManager(self.client)
+        machine_state0 = yield manager.add_machine_state()
+        yield self.agent.watch_machine_changes(None, [machine_state0.id])
+        report = self.agent.last_check_report
+        self.assertTrue(report["full"])
+        self.assertEqual(report["launched"], 1)
+
+        calls = self.record_get_machines()
+        machine_state1 = yield manager.add_machine_state()
+        yield self.agent.watch_machine_changes(
+            [machine_state0.id], [machine_state0.id, machine_state1.id])
+
+        self.assertEqual(calls, [])
+        self.assertEqual((yield machine_state1.get_instance_id()), 1)
+        report = self.agent.last_check_report
+        self.assertFalse(report["full"])
+        self.assertEqual(report["checked"], 1)
+        self.assertEqual(report["launched"], 1)
+        self.assertEqual(self.agent._dirty_machines, {})
+
+    @inlineCallbacks
+    def test_watch_machine_changes_removed_machine_full_check(self):
+        """A removed machine causes a full check, shutting it down."""
+        manager = MachineStateManager(self.client)
+        machine_state0 = yield manager.add_machine_state()
+        yield self.agent.watch_machine_changes(None, [machine_state0.id])
+        yield manager.remove_machine_state(machine_state0.id)
+
+        yield self.agent.watch_machine_changes([machine_state0.id], [])
+        self.assertTrue(self.agent.last_check_report["full"])
+        self.assertEqual(self.agent.last_check_report["shutdown"], 1)
+        self.assertFalse((yield self.agent.provider.get_machines()))
+
+    @inlineCallbacks
+    def test_failed_machine_retried_with_backoff(self):
+        """A machine which fails is rechecked with an exponential backoff.
+        """
+        manager = MachineStateManager(self.client)
+        machine_state0 = yield manager.add_machine_state()
+        mock_provider = self.mocker.patch(self.agent.provider)
+        mock_provider.start_machine({"machine-id": 0})
+        self.mocker.count(2)
+        self.mocker.result(fail(ProviderInteractionError()))
+        self.mocker.replay()
+
+        yield self.agent.watch_machine_changes(None, [machine_state0.id])
+        self.assertEqual(self.agent.last_check_report["failed"], 1)
+        failures, due = self.agent._dirty_machines[machine_state0.id]
+        self.assertEqual(failures, 1)
+        self.assertTrue(
+            due > time.time() + self.agent.machine_retry_delay / 2.0)
+
+        # Not yet due, nothing is checked.
+        report = yield self.agent.check_machines()
+        self.assertEqual(report["checked"], 0)
+
+        # Once due, the machine is checked again, and the backoff doubled.
+        self.agent._dirty_machines[machine_state0.id] = (failures, 0)
+        report = yield self.agent.check_machines()
+        self.assertFalse(report["full"])
+        self.assertEqual(report["failed"], 1)
+        failures, next_due = self.agent._dirty_machines[machine_state0.id]
+        self.assertEqual(failures, 2)
+        self.assertTrue(next_due > due + self.agent.machine_retry_delay / 2.0)
+
+    def test_backoff_is_bounded(self):
+        self.assertEqual(self.agent._get_backoff(0), 0)
+        self.assertEqual(
+            self.agent._get_backoff(1), self.agent.machine_retry_delay)
+        self.assertEqual(
+            self.agent._get_backoff(2), self.agent.machine_retry_delay * 2)
+        self.assertEqual(
+            self.agent._get_backoff(100), self.agent.machine_retry_max_delay)
+
+    @inlineCallbacks
+    def test_full_check_schedule(self):
+        """A full check is done once the full check period elapses."""
+        yield self.agent.check_machines()
+        self.assertTrue(self.agent.last_check_report["full"])
+
+        report = yield self.agent.check_machines()
+        self.assertFalse(report["full"])
+
+        self.agent._next_full_check = 0
+        report = yield self.agent.check_machines()
+        self.assertTrue(report["full"])
+
+    def test_full_check_period_option(self):
+        self.change_args("es-agent", "--full-check-period", "30")
+        parser = argparse.ArgumentParser()
+        self.agent.setup_options(parser)
+        config = parser.parse_args(namespace=TwistedOptionNamespace())
+        self.assertEqual(config["full_check_period"], 30)
+
+    @inlineCallbacks
+    def test_check_debug_log(self):
+        """The debug log is archived to the provider storage when due."""
+        yield self.client.create("/logs")
+        for i in range(3):
+            yield self.client.create(
+                "/logs/log-", json.dumps({"msg": str(i)}),
+                flags=zookeeper.SEQUENCE)
+        storage = self.agent.provider.get_file_storage()
+        self.agent.log_janitor.configure(storage, max_entries=1)
+        yield self.agent.check_debug_log()
+        self.assertEqual(
+            sorted((yield self.client.get_children("/logs"))),
+            ["archive", "log-0000000002"])
+        self.assertIn("Archived 2 debug log nodes in 1 chunks",
+                      self.output.getvalue())
+
+        # The next run is only due after the janitor period.
+        yield self.client.create("/logs/log-", flags=zookeeper.SEQUENCE)
+        yield self.agent.check_debug_log()
+        self.assertEqual(
+            len((yield self.client.get_children("/logs"))), 3)
+
     @inlineCallbacks
     def test_start_agent_with_watch(self):
         mock_reactor = self.mocker.patch(reactor)
@@ -540,3 +774,47 @@ class FirewallManagerTest(
         machine_state = yield machine_manager.add_machine_state()
         yield self.agent.process_machines([machine_state.id])
         self.assertEqual(seen, [machine_state])
+
+
+class MachinePoolTest(ProvisioningTestBase, ServiceStateManagerTestBase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(MachinePoolTest, self).setUp()
+        yield self.client.create(
+            "/environment", self.get_serialized_environment())
+        self.agent.set_watch_enabled(False)
+        yield self.agent.startService()
+
+    @inlineCallbacks
+    def test_machine_pool(self):
+        """Units are placed on warm standby machines launched by the agent.
+        """
+        self.agent.machine_pool.configure(size=1)
+        manager = MachineStateManager(self.client)
+        yield manager.add_machine_state()
+        yield self.agent.check_machine_pool()
+        yield self.agent.process_machines([0, 1])
+        self.assertEqual(len((yield self.agent.provider.get_machines())), 2)
+
+        # The standby machine's agent connects, making it ready.
+        standby_machine = yield manager.get_machine_state(1)
+        yield standby_machine.connect_agent()
+        yield self.agent.check_machine_pool()
+        topology = yield self.get_topology()
+        self.assertEqual(
+            topology.get_machine_standby(standby_machine.internal_id),
+            "ready")
+
+        # A new unit is placed on the standby machine, and the pool
+        # is refilled.
+        service_state = yield self.add_service_from_charm("wordpress")
+        unit_state = yield service_state.add_unit_state()
+        machine_state = yield place_unit(self.client, None, unit_state)
+        self.assertEqual(machine_state.id, 1)
+        yield self.agent.check_machine_pool()
+        yield self.agent.process_machines([0, 1, 2])
+        self.assertEqual(len((yield self.agent.provider.get_machines())), 3)
+        topology = yield self.get_topology()
+        self.assertEqual(
+            topology.get_machine_standby("machine-%010d" % 2), "pending")
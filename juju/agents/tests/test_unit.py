@@ -9,8 +9,12 @@ from twisted.internet.defer import (
 from juju.agents.unit import UnitAgent, CharmUpgradeOperation
 from juju.agents.base import TwistedOptionNamespace
 from juju.charm import get_charm_from_path
+from juju.charm.delta import CharmDelta, get_manifest
+from juju.charm.publisher import CharmPublisher
+from juju.charm.tests import local_charm_id
 from juju.charm.url import CharmURL
-from juju.errors import JujuError
+from juju.errors import CharmError, JujuError
+from juju.lib import under
 from juju.state.environment import GlobalSettingsStateManager
 from juju.state.errors import ServiceStateNotFound
 from juju.state.service import NO_HOOKS, RETRY_HOOKS
@@ -599,6 +603,88 @@ class UnitAgentUpgradeTest(
         self.assertEqual(
             self.charm.get_revision() + 1, new_charm.get_revision())
 
+    @inlineCallbacks
+    def publish_upgrade_delta(self):
+        """Publish an upgrade of the unit's charm along with its delta.
+
+        Returns the path of the unit's deployed charm.
+        """
+        # Deploy the unit's charm, and publish its manifest.
+        charm_path = os.path.join(self.agent.unit_directory, "charm")
+        bundle = self.charm.as_bundle()
+        bundle.extract_to(charm_path)
+        unit_charm_id = yield self.states["unit"].get_charm_id()
+        publisher = CharmPublisher(self.client, self.storage)
+        node_path = "/charms/%s" % under.quote(unit_charm_id)
+        content, stat = yield self.client.get(node_path)
+        charm_data = yaml.load(content)
+        charm_data["manifest"] = yield publisher.publish_manifest(
+            unit_charm_id, get_manifest(bundle))
+        yield self.client.set(node_path, yaml.safe_dump(charm_data))
+
+        # Publish the upgrade, along with its delta.
+        repository = self.increment_charm(self.charm)
+        charm = yield repository.find(CharmURL.parse("local:series/mysql"))
+        yield publisher.add_charm(
+            local_charm_id(charm), charm, base_charm_id=unit_charm_id)
+        charm_state = (yield publisher.publish())[0]
+        self.assertNotEqual(charm_state.delta, None)
+        yield self.states["service"].set_charm_id(charm_state.id)
+        yield self.states["unit"].set_upgrade_flag()
+        returnValue(charm_path)
+
+    @inlineCallbacks
+    def test_agent_upgrade_delta(self):
+        """The agent only retrieves the changed files of its charm, if a
+        delta from the unit's charm was published."""
+        self.agent.set_watch_enabled(False)
+        yield self.agent.startService()
+        charm_path = yield self.publish_upgrade_delta()
+
+        hook_done = self.wait_on_hook(
+            "upgrade-charm", executor=self.agent.executor)
+        self.write_hook("upgrade-charm", "#!/bin/bash\nexit 0")
+        output = self.capture_logging("unit.upgrade", level=logging.DEBUG)
+
+        upgrade = CharmUpgradeOperation(self.agent)
+        self.patch(upgrade, "retrieve_charm",
+                   lambda charm_id: fail(JujuError("Not a delta upgrade")))
+        value = yield upgrade.run()
+        self.assertIdentical(value, True)
+        self.assertIn("Applying charm delta", output.getvalue())
+        yield hook_done
+
+        new_charm = get_charm_from_path(charm_path)
+        self.assertEqual(
+            self.charm.get_revision() + 1, new_charm.get_revision())
+        self.assertFalse(
+            os.path.exists(os.path.join(charm_path, "hooks", "install")))
+
+    @inlineCallbacks
+    def test_agent_upgrade_delta_failure(self):
+        """A unit is left untouched if the delta cannot be applied, and
+        the charm cannot be retrieved either."""
+        self.agent.set_watch_enabled(False)
+        yield self.agent.startService()
+        charm_path = yield self.publish_upgrade_delta()
+        unit_charm_id = yield self.states["unit"].get_charm_id()
+        files = sorted(os.listdir(charm_path))
+
+        def stage(delta, directory):
+            raise CharmError(directory, "cannot stage")
+        self.patch(CharmDelta, "stage", stage)
+        upgrade = CharmUpgradeOperation(self.agent)
+        self.patch(upgrade, "retrieve_charm",
+                   lambda charm_id: fail(JujuError("Cannot download")))
+        output = self.capture_logging("unit.upgrade", level=logging.DEBUG)
+
+        yield self.assertFailure(upgrade.run(), JujuError)
+        self.assertIn("Cannot apply charm delta", output.getvalue())
+        self.assertEqual(
+            (yield self.states["unit"].get_charm_id()), unit_charm_id)
+        self.assertEqual(sorted(os.listdir(charm_path)), files)
+        self.assertTrue(self.agent.executor.running)
+
     @inlineCallbacks
     def test_agent_upgrade_bad_unit_state(self):
         """The an upgrade fails if the unit is in a bad state."""
@@ -1,11 +1,10 @@
 import os
 import logging
-import shutil
-import tempfile
 
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.python.failure import Failure
 
-from juju.errors import JujuError
+from juju.errors import CharmError, JujuError
 from juju.state.service import ServiceStateManager, RETRY_HOOKS
 from juju.hooks.protocol import UnitSettingsFactory
 from juju.hooks.executor import HookExecutor
@@ -14,7 +13,9 @@ from juju.unit.address import get_unit_address
 from juju.unit.lifecycle import UnitLifecycle, HOOK_SOCKET_FILE
 from juju.unit.workflow import UnitWorkflowState
 
-from juju.unit.charm import download_charm
+from juju.charm.delta import replace_directory
+from juju.unit.charm import (
+    download_charm, download_charm_delta, ExtractedCharmStore)
 
 from juju.agents.base import BaseAgent
 
@@ -209,25 +210,29 @@ class CharmUpgradeOperation(object):
     def __init__(self, agent):
         self._agent = agent
         self._log = logging.getLogger("unit.upgrade")
-        self._charm_directory = tempfile.mkdtemp(
-            suffix="charm-upgrade", prefix="tmp")
+        # Shared with the machine agent's charm cache.
+        self._charm_directory = os.path.join(
+            self._agent.config["juju_directory"], "charms")
 
     def retrieve_charm(self, charm_id):
         return download_charm(
             self._agent.client, charm_id, self._charm_directory)
 
-    def _remove_tree(self, result):
-        if os.path.exists(self._charm_directory):
-            shutil.rmtree(self._charm_directory)
-        return result
-
-    def run(self):
-        d = self._run()
-        d.addBoth(self._remove_tree)
-        return d
+    @inlineCallbacks
+    def retrieve_charm_delta(self, charm_id, base_charm_id):
+        """Retrieve the delta from the unit's charm, None if unavailable.
+        """
+        try:
+            delta = yield download_charm_delta(
+                self._agent.client, charm_id, base_charm_id,
+                self._charm_directory)
+        except JujuError, e:
+            self._log.warning("Cannot retrieve charm delta: %s", e)
+            delta = None
+        returnValue(delta)
 
     @inlineCallbacks
-    def _run(self):
+    def run(self):
         self._log.info("Starting charm upgrade...")
 
         # Verify the workflow state
@@ -267,22 +272,51 @@ class CharmUpgradeOperation(object):
             yield self._agent.unit_state.clear_upgrade_flag()
             returnValue(True)
 
-        # Retrieve charm
+        # Retrieve the files changed since the unit's charm if a delta
+        # was published, else the whole charm.
         self._log.debug("Retrieving charm %s", service_charm_id)
-        charm = yield self.retrieve_charm(service_charm_id)
+        charm = staging = None
+        delta = yield self.retrieve_charm_delta(
+            service_charm_id, unit_charm_id)
+        if delta is None:
+            charm = yield self.retrieve_charm(service_charm_id)
 
         # Stop hook executions
         self._log.debug("Stopping hook execution.")
         yield self._agent.executor.stop()
 
+        # The delta is applied to a verified staging copy of the charm
+        # directory, the unit is left untouched until the new charm is on
+        # disk.
+        charm_path = os.path.join(self._agent.unit_directory, "charm")
+        if delta is not None:
+            self._log.debug("Applying charm delta.")
+            try:
+                staging = delta.stage(charm_path)
+            except (CharmError, IOError, OSError), e:
+                self._log.warning(
+                    "Cannot apply charm delta, retrieving charm: %s", e)
+                try:
+                    charm = yield self.retrieve_charm(service_charm_id)
+                except Exception:
+                    failure = Failure()
+                    yield self._agent.executor.start()
+                    failure.raiseException()
+
         # Note the current charm version
         self._log.debug("Setting unit charm id to %s", service_charm_id)
         yield self._agent.unit_state.set_charm_id(service_charm_id)
 
-        # Extract charm
-        self._log.debug("Extracting new charm.")
-        charm.extract_to(
-            os.path.join(self._agent.unit_directory, "charm"))
+        if staging is not None:
+            replace_directory(charm_path, staging)
+
+        # Extract charm, files shared via the extracted charm store are
+        # replaced rather than overwritten in place.
+        if charm is not None:
+            self._log.debug("Extracting new charm.")
+            charm_store = ExtractedCharmStore(os.path.join(
+                self._agent.config["juju_directory"], "extracted-charms"))
+            charm_store.deploy(charm, charm_path)
 
         # Upgrade
         self._log.debug("Invoking upgrade transition.")
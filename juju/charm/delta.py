@@ -0,0 +1,203 @@
+"""Delta distribution of charm upgrades.
+
+A published charm carries a manifest of the files of its bundle, the
+sha256 digest and mode of every file by archive name, directories having
+a digest of None. When a charm is published as the upgrade of another
+one, a delta bundle holding only the files added or changed since the
+upgraded charm is published along with it.
+
+The manifests are stored in the provider file storage, as json, the
+charm state only holding their url and sha256.
+
+A unit upgrading from the upgraded charm applies the delta to a staging
+copy of its charm directory, hardlinking its files: changed files are
+replaced rather than written in place, files absent from the new
+manifest are removed, and the copy is then verified against the new
+manifest, before it replaces the charm directory.
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from juju.errors import CharmError
+from juju.lib.filehash import compute_file_hash
+
+
+def get_manifest(bundle):
+    """Return the manifest of a charm bundle."""
+    manifest = {}
+    zf = ZipFile(bundle.path, "r")
+    for info in zf.infolist():
+        mode = stat.S_IMODE(info.external_attr >> 16)
+        if info.filename.endswith("/"):
+            manifest[info.filename.rstrip("/")] = [None, mode]
+            continue
+        digest = hashlib.sha256()
+        source = zf.open(info)
+        for chunk in iter(lambda: source.read(8192), ""):
+            digest.update(chunk)
+        manifest[info.filename] = [digest.hexdigest(), mode]
+    zf.close()
+    return manifest
+
+
+def dump_manifest(manifest):
+    """Return the serialization of a manifest, stable for its digest."""
+    return json.dumps(manifest, sort_keys=True)
+
+
+def load_manifest(content):
+    """Return a manifest given its serialization."""
+    return json.loads(content)
+
+
+def get_changes(base_manifest, manifest):
+    """Return the names added or changed, and removed, between manifests.
+    """
+    changed = sorted(
+        name for name, entry in manifest.items()
+        if base_manifest.get(name) != entry)
+    removed = sorted(set(base_manifest) - set(manifest))
+    return changed, removed
+
+
+def make_delta(bundle, base_manifest, path):
+    """Write the delta of a bundle against a base manifest to `path`.
+
+    Returns the number of files in the delta.
+    """
+    changed = set(get_changes(base_manifest, get_manifest(bundle))[0])
+    source = ZipFile(bundle.path, "r")
+    target = ZipFile(path, "w", ZIP_DEFLATED)
+    count = 0
+    for info in source.infolist():
+        if info.filename.rstrip("/") not in changed:
+            continue
+        target.writestr(info, source.read(info))
+        count += 1
+    target.close()
+    source.close()
+    return count
+
+
+class CharmDelta(object):
+    """The delta from a charm to its upgrade, as published.
+
+    :param path: The path of the delta bundle.
+    :param base_manifest: The manifest of the upgraded charm.
+    :param manifest: The manifest of the upgrade.
+    """
+
+    def __init__(self, path, base_manifest, manifest):
+        self.path = path
+        self.base_manifest = base_manifest
+        self.manifest = manifest
+
+    def stage(self, directory):
+        """Return an upgraded copy of the charm directory at `directory`.
+
+        The copy is made next to the directory, hardlinking its files,
+        which leaves the directory untouched. Raises a `CharmError` if
+        the upgraded copy does not match the manifest, once removed.
+        """
+        staging = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(directory)),
+            prefix=".upgrade-")
+        try:
+            shutil.copymode(directory, staging)
+            _link_tree(directory, staging)
+            self._apply(staging)
+            self.verify(staging)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return staging
+
+    def _apply(self, directory):
+        """Upgrade the charm directory at `directory`.
+
+        Returns the number of files replaced and removed.
+        """
+        changed, removed = get_changes(self.base_manifest, self.manifest)
+        zf = ZipFile(self.path, "r")
+        names = dict((info.filename.rstrip("/"), info)
+                     for info in zf.infolist())
+        for name in changed:
+            target_path = os.path.join(directory, name)
+            digest, mode = self.manifest[name]
+            if digest is None:
+                if not os.path.isdir(target_path):
+                    os.makedirs(target_path)
+                continue
+            if name not in names:
+                raise CharmError(
+                    self.path, "delta does not contain %r" % name)
+            target_dir = os.path.dirname(target_path)
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            fd, temp_path = tempfile.mkstemp(dir=target_dir, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as output:
+                    shutil.copyfileobj(zf.open(names[name]), output)
+                os.chmod(temp_path, mode or 0644)
+                os.rename(temp_path, target_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        zf.close()
+
+        # Remove files before their directories, deepest first.
+        for name in sorted(removed, reverse=True):
+            target_path = os.path.join(directory, name)
+            if self.base_manifest[name][0] is not None:
+                if os.path.lexists(target_path):
+                    os.remove(target_path)
+            elif os.path.isdir(target_path):
+                try:
+                    os.rmdir(target_path)
+                except OSError:
+                    # Left over files of hooks are kept.
+                    pass
+        return len(changed) + len(removed)
+
+    def verify(self, directory):
+        """Raise a `CharmError` unless `directory` matches the manifest."""
+        for name, (digest, mode) in self.manifest.items():
+            path = os.path.join(directory, name)
+            if digest is None:
+                valid = os.path.isdir(path)
+            else:
+                valid = os.path.isfile(path) and \
+                    compute_file_hash(hashlib.sha256, path) == digest
+            if not valid:
+                raise CharmError(
+                    directory, "%r does not match the charm manifest" % name)
+
+
+def replace_directory(directory, staging):
+    """Replace `directory` by its upgraded `staging` copy."""
+    backup = staging + ".old"
+    os.rename(directory, backup)
+    os.rename(staging, directory)
+    shutil.rmtree(backup, ignore_errors=True)
+
+
+def _link_tree(source, target):
+    """Copy the tree at `source` to `target`, hardlinking its files."""
+    for dirpath, dirnames, filenames in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(dirpath, source))
+        for name in dirnames + filenames:
+            source_path = os.path.join(dirpath, name)
+            target_path = os.path.join(target_dir, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+            elif os.path.isdir(source_path):
+                os.mkdir(target_path)
+                shutil.copymode(source_path, target_path)
+            else:
+                os.link(source_path, target_path)
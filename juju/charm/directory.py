@@ -1,4 +1,10 @@
+import hashlib
+import json
+import logging
 import os
+import shutil
+import struct
+import time
 import zipfile
 import tempfile
 
@@ -6,6 +12,42 @@ from juju.charm.base import CharmBase, get_revision
 from juju.charm.bundle import CharmBundle
 from juju.charm.config import ConfigOptions
 from juju.charm.metadata import MetaData
+from juju.lib.filehash import compute_file_hash
+
+
+log = logging.getLogger("juju.charm")
+
+
+def _copy_zip_entry(source, info, target, date_time, mode):
+    """Copy a compressed zip file entry to another zip file, as is.
+
+    The entry's data is copied without being decompressed and compressed
+    again, only its modification time and file mode are updated to
+    `date_time` and `mode`.
+    """
+    zinfo = zipfile.ZipInfo(info.filename, date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = (mode & 0xFFFF) << 16L
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.flag_bits = 0x00
+    zinfo.header_offset = target.fp.tell()
+
+    # The data follows the local file header, and its variable length
+    # file name and extra field.
+    source.fp.seek(info.header_offset + 26)
+    name_length, extra_length = struct.unpack("<HH", source.fp.read(4))
+    source.fp.seek(info.header_offset + 30 + name_length + extra_length)
+    target.fp.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, 8192))
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+    target.filelist.append(zinfo)
+    target.NameToInfo[zinfo.filename] = zinfo
+    target._didModify = True
 
 
 class CharmDirectory(CharmBase):
@@ -17,8 +59,18 @@ class CharmDirectory(CharmBase):
 
     - ``metadata.yaml``
 
+    The bundle of the directory is cached, along with its digest and a
+    manifest of the size, modification time, mode and content hash of the
+    bundled files. It is reused as long as the files are unchanged, and
+    else rebuilt reusing the compressed entries of the unchanged files.
     """
 
+    # The directory bundles are cached in, disabled if None.
+    bundle_cache_path = os.path.expanduser("~/.juju/cache/bundles")
+
+    # The number of charm directories whose bundle is cached.
+    bundle_cache_size = 20
+
     def __init__(self, path):
         self.path = path
         self.metadata = MetaData(os.path.join(path, "metadata.yaml"))
@@ -39,6 +91,7 @@ class CharmDirectory(CharmBase):
         self.config.load(os.path.join(path, "config.yaml"))
         self._temp_bundle = None
         self._temp_bundle_file = None
+        self._bundle_sha256 = None
 
     def get_revision(self):
         return self._revision
@@ -48,30 +101,69 @@ class CharmDirectory(CharmBase):
         with open(os.path.join(self.path, "revision"), "w") as f:
             f.write(str(revision) + "\n")
 
-    def make_archive(self, path):
-        """Create archive of directory and write to ``path``.
-
-        :param path: Path to archive
+    def _walk(self):
+        """Return the (path, archive name, stat) of the files to archive.
 
         - build/* - This is used for packing the charm itself and any
                     similar tasks.
         - */.*    - Hidden files are all ignored for now.  This will most
                     likely be changed into a specific ignore list (.bzr, etc)
         """
-
-        zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
-
+        entries = []
         for dirpath, dirnames, filenames in os.walk(self.path):
             relative_path = dirpath[len(self.path) + 1:]
             if relative_path and not self._ignore(relative_path):
-                zf.write(dirpath, relative_path)
+                entries.append((dirpath, relative_path, os.stat(dirpath)))
             for name in filenames:
                 archive_name = os.path.join(relative_path, name)
                 if not self._ignore(archive_name):
                     real_path = os.path.join(dirpath, name)
-                    zf.write(real_path, archive_name)
+                    entries.append(
+                        (real_path, archive_name, os.stat(real_path)))
+        return entries
+
+    def make_archive(self, path, previous=None):
+        """Create archive of directory and write to ``path``.
+
+        :param path: Path to archive
+        :param previous: The path and manifest of a previous archive of
+            the directory, whose compressed entries are reused for the
+            files whose content is unchanged.
+
+        Returns the manifest of the archive, the size, modification time,
+        mode and sha1 digest of its files by name.
+        """
+        manifest = {}
+        previous_zf = None
+        previous_manifest = {}
+        if previous is not None:
+            previous_zf = zipfile.ZipFile(previous[0])
+            previous_manifest = previous[1]
 
+        zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        for real_path, archive_name, st in self._walk():
+            key = [st.st_size, st.st_mtime, st.st_mode]
+            if os.path.isdir(real_path):
+                manifest[archive_name] = key + [None]
+                zf.write(real_path, archive_name)
+                continue
+            old_key = previous_manifest.get(archive_name)
+            # The content is only hashed again if the file's stat changed.
+            if old_key and old_key[3] and old_key[:3] == key:
+                key.append(old_key[3])
+            else:
+                key.append(compute_file_hash(hashlib.sha1, real_path))
+            manifest[archive_name] = key
+            if old_key and old_key[3] == key[3]:
+                _copy_zip_entry(
+                    previous_zf, previous_zf.getinfo(archive_name), zf,
+                    time.localtime(st.st_mtime)[:6], st.st_mode)
+            else:
+                zf.write(real_path, archive_name)
         zf.close()
+        if previous_zf is not None:
+            previous_zf.close()
+        return manifest
 
     def _ignore(self, path):
         if path == "build" or path.startswith("build/"):
@@ -83,12 +175,83 @@ class CharmDirectory(CharmBase):
         if self._temp_bundle is None:
             prefix = "%s-%d.charm." % (self.metadata.name, self.get_revision())
             temp_file = tempfile.NamedTemporaryFile(prefix=prefix)
-            self.make_archive(temp_file.name)
+            cached = self._get_cached_bundle()
+            if cached is None:
+                self.make_archive(temp_file.name)
+            else:
+                cached_path, self._bundle_sha256 = cached
+                shutil.copyfile(cached_path, temp_file.name)
             self._temp_bundle = CharmBundle(temp_file.name)
             # Attach the life time of temp_file to self:
             self._temp_bundle_file = temp_file
         return self._temp_bundle
 
+    def _get_cached_bundle(self):
+        """Return the path and sha256 of the cached bundle of the directory.
+
+        The bundle is rebuilt if the directory changed. Returns None if the
+        cache is disabled, or fails.
+        """
+        if self.bundle_cache_path is None:
+            return None
+        key = hashlib.sha1(os.path.abspath(self.path)).hexdigest()
+        bundle_path = os.path.join(self.bundle_cache_path, key + ".charm")
+        manifest_path = os.path.join(self.bundle_cache_path, key + ".json")
+        try:
+            with open(manifest_path) as f:
+                previous = json.loads(f.read())
+            if not os.path.exists(bundle_path):
+                previous = None
+        except (IOError, ValueError):
+            previous = None
+
+        if previous is not None:
+            entries = dict(
+                (archive_name, [st.st_size, st.st_mtime, st.st_mode])
+                for real_path, archive_name, st in self._walk())
+            if entries == dict(
+                    (archive_name, stat_key[:3]) for archive_name, stat_key
+                    in previous["files"].items()):
+                # Mark as recently used.
+                os.utime(bundle_path, None)
+                return bundle_path, str(previous["sha256"])
+
+        try:
+            if not os.path.isdir(self.bundle_cache_path):
+                os.makedirs(self.bundle_cache_path)
+            fd, temp_path = tempfile.mkstemp(
+                suffix=".part", dir=self.bundle_cache_path)
+            os.close(fd)
+            try:
+                files = self.make_archive(
+                    temp_path,
+                    previous and (bundle_path, previous["files"]))
+                sha256 = compute_file_hash(hashlib.sha256, temp_path)
+                os.rename(temp_path, bundle_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            with open(manifest_path, "w") as f:
+                f.write(json.dumps({"sha256": sha256, "files": files}))
+            self._expire_cached_bundles()
+        except (IOError, OSError, zipfile.BadZipfile), e:
+            log.warning("Cannot cache the bundle of %s: %s", self.path, e)
+            return None
+        return bundle_path, sha256
+
+    def _expire_cached_bundles(self):
+        """Remove the least recently used bundles past the cache size."""
+        bundles = [
+            os.path.join(self.bundle_cache_path, name)
+            for name in os.listdir(self.bundle_cache_path)
+            if name.endswith(".charm")]
+        bundles.sort(key=os.path.getmtime, reverse=True)
+        for bundle_path in bundles[self.bundle_cache_size:]:
+            os.remove(bundle_path)
+            manifest_path = bundle_path[:-len(".charm")] + ".json"
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+
     def as_directory(self):
         return self
 
@@ -96,4 +259,7 @@ class CharmDirectory(CharmBase):
         """
         Compute sha256, based on the bundle.
         """
-        return self.as_bundle().compute_sha256()
+        bundle = self.as_bundle()
+        if self._bundle_sha256 is not None:
+            return self._bundle_sha256
+        return bundle.compute_sha256()
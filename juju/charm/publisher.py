@@ -1,13 +1,44 @@
+import hashlib
+import logging
+import tempfile
+from StringIO import StringIO
+
 from zookeeper import NodeExistsException, NoNodeException
 
 from twisted.internet.defer import (
     DeferredList, inlineCallbacks, returnValue, succeed, FirstError)
 
+from juju.charm.delta import (
+    dump_manifest, get_manifest, load_manifest, make_delta)
+from juju.errors import FileNotFound
 from juju.lib import under
+from juju.lib.filehash import compute_file_hash
 from juju.state.charm import CharmStateManager
 from juju.state.errors import CharmStateNotFound, StateChanged
 
 
+log = logging.getLogger("juju.charm")
+
+
+def _log_progress(description):
+    """Return a storage progress callback, logging each tenth uploaded."""
+    logged = [0]
+
+    def progress(sent, total):
+        if not total:
+            return
+        tenths = sent * 10 // total
+        if tenths > logged[0]:
+            logged[0] = tenths
+            log.debug("Uploaded %d%% of %s", tenths * 10, description)
+    return progress
+
+
+def _get_manifest_store_path(charm_id, sha256):
+    """Return the provider storage path of the manifest of a charm."""
+    return under.quote("%s:manifest:%s" % (charm_id, sha256))
+
+
 class CharmPublisher(object):
     """
     Publishes a charm to an environment.
@@ -29,13 +60,17 @@ class CharmPublisher(object):
         returnValue(cls(client, storage))
 
     @inlineCallbacks
-    def add_charm(self, charm_id, charm):
+    def add_charm(self, charm_id, charm, base_charm_id=None):
         """Schedule a charm for addition to an juju environment.
 
+        :param base_charm_id: The id of a published charm the charm is an
+            upgrade of. A delta of the files changed since is published
+            along with the charm, for units to only retrieve those.
+
         Returns true if the charm is scheduled for upload, false if
         the charm is already present in juju.
         """
-        self._charm_add_queue.append((charm_id, charm))
+        self._charm_add_queue.append((charm_id, charm, base_charm_id))
         if charm_id in self._charm_state_cache:
             returnValue(False)
         try:
@@ -48,7 +83,7 @@ class CharmPublisher(object):
             returnValue(False)
         returnValue(True)
 
-    def _publish_one(self, charm_id, charm):
+    def _publish_one(self, charm_id, charm, base_charm_id):
         if charm_id in self._charm_state_cache:
             return succeed(self._charm_state_cache[charm_id])
 
@@ -64,10 +99,12 @@ class CharmPublisher(object):
         def get_charm_url(result):
             return self._storage.get_url(charm_store_path)
 
-        d = self._storage.put(charm_store_path, charm_file)
+        d = self._storage.put(
+            charm_store_path, charm_file, _log_progress(charm_id))
         d.addBoth(close_charm_file)
         d.addCallback(get_charm_url)
-        d.addCallback(self._cb_store_charm_state, charm_id, bundle)
+        d.addCallback(
+            self._cb_store_charm_state, charm_id, bundle, base_charm_id)
         d.addErrback(self._eb_verify_duplicate, charm_id, bundle)
         return d
 
@@ -77,8 +114,9 @@ class CharmPublisher(object):
         Returns the charm_state of all scheduled charms.
         """
         publish_deferreds = []
-        for charm_id, charm in self._charm_add_queue:
-            publish_deferreds.append(self._publish_one(charm_id, charm))
+        for charm_id, charm, base_charm_id in self._charm_add_queue:
+            publish_deferreds.append(
+                self._publish_one(charm_id, charm, base_charm_id))
 
         publish_deferred = DeferredList(publish_deferreds,
                                         fireOnOneErrback=1,
@@ -95,9 +133,80 @@ class CharmPublisher(object):
         failure.trap(FirstError)
         return failure.value.subFailure
 
-    def _cb_store_charm_state(self, charm_url, charm_id, charm):
-        return self._charm_state_manager.add_charm_state(
-            charm_id, charm, charm_url)
+    @inlineCallbacks
+    def _cb_store_charm_state(self, charm_url, charm_id, charm,
+                              base_charm_id=None):
+        manifest = yield self.publish_manifest(charm_id, get_manifest(charm))
+        delta = None
+        if base_charm_id is not None:
+            delta = yield self._publish_delta(
+                charm_id, charm, base_charm_id)
+        charm_state = yield self._charm_state_manager.add_charm_state(
+            charm_id, charm, charm_url, manifest=manifest, delta=delta)
+        returnValue(charm_state)
+
+    @inlineCallbacks
+    def publish_manifest(self, charm_id, manifest):
+        """Store the manifest of a charm's files in the provider storage.
+
+        Returns the url and sha256 of the stored manifest, for the charm
+        state.
+        """
+        content = dump_manifest(manifest)
+        sha256 = hashlib.sha256(content).hexdigest()
+        manifest_store_path = _get_manifest_store_path(charm_id, sha256)
+        yield self._storage.put(manifest_store_path, StringIO(content))
+        manifest_url = yield self._storage.get_url(manifest_store_path)
+        returnValue({"url": manifest_url, "sha256": sha256})
+
+    @inlineCallbacks
+    def _get_manifest(self, charm_state):
+        """Return the manifest of a published charm, None if unavailable.
+        """
+        if charm_state.manifest is None:
+            returnValue(None)
+        sha256 = charm_state.manifest["sha256"]
+        try:
+            manifest_file = yield self._storage.get(
+                _get_manifest_store_path(charm_state.id, sha256))
+        except FileNotFound:
+            returnValue(None)
+        content = manifest_file.read()
+        if hashlib.sha256(content).hexdigest() != sha256:
+            returnValue(None)
+        returnValue(load_manifest(content))
+
+    @inlineCallbacks
+    def _publish_delta(self, charm_id, charm, base_charm_id):
+        """Publish the delta of a charm bundle against its base charm.
+
+        Returns the delta's description for the charm state, or None if
+        the base charm has no manifest.
+        """
+        try:
+            base_state = yield self._charm_state_manager.get_charm_state(
+                base_charm_id)
+        except CharmStateNotFound:
+            returnValue(None)
+        base_manifest = yield self._get_manifest(base_state)
+        if base_manifest is None:
+            returnValue(None)
+
+        delta_file = tempfile.NamedTemporaryFile(suffix=".charm")
+        try:
+            count = make_delta(charm, base_manifest, delta_file.name)
+            sha256 = compute_file_hash(hashlib.sha256, delta_file.name)
+            delta_store_path = under.quote(
+                "%s:delta:%s" % (charm_id, sha256))
+            with open(delta_file.name, "rb") as delta_content:
+                yield self._storage.put(delta_store_path, delta_content)
+            delta_url = yield self._storage.get_url(delta_store_path)
+        finally:
+            delta_file.close()
+        log.debug("Published delta of %d files from %s to %s",
+                  count, base_charm_id, charm_id)
+        returnValue(
+            {"base": base_charm_id, "url": delta_url, "sha256": sha256})
 
     @inlineCallbacks
     def _eb_verify_duplicate(self, failure, charm_id, charm):
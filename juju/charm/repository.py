@@ -1,12 +1,14 @@
+import hashlib
 import json
 import logging
 import os
+import stat
 import tempfile
+import time
 import urllib
 import yaml
 
 from twisted.internet.defer import fail, inlineCallbacks, returnValue, succeed
-from twisted.web.client import downloadPage, getPage
 from twisted.web.error import Error
 
 from juju.charm.errors import MetaDataError, ServiceConfigError
@@ -14,6 +16,7 @@ from juju.charm.provider import get_charm_from_path
 from juju.charm.url import CharmURL
 from juju.errors import FileNotFound
 from juju.lib import under
+from juju.lib.webclient import WebClient, get_header
 
 from .errors import CharmNotFound, CharmError, RepositoryNotFound
 
@@ -32,38 +35,121 @@ def _cache_key(charm_url):
     return under.quote("%s.charm" % charm_url)
 
 
+def _get_stamp(path):
+    """Return the modification stamp of a local repository entry.
+
+    The stamp of a charm directory covers the files its name and revision
+    are read from, as these are usually modified in place.
+    """
+    stamp = []
+    for name in ("", "metadata.yaml", "config.yaml", "revision"):
+        try:
+            info = os.stat(os.path.join(path, name) if name else path)
+        except OSError:
+            stamp.append(None)
+            continue
+        stamp.append([info.st_mtime, info.st_size])
+        if not stat.S_ISDIR(info.st_mode):
+            break
+    return stamp
+
+
 class LocalCharmRepository(object):
-    """Charm repository in a local directory."""
+    """Charm repository in a local directory.
+
+    The name and revision of the charm in each entry of a series
+    directory are kept in an index, which is updated from the modification
+    times of the entries, so that a lookup only constructs the charm
+    returned.
+    """
+
+    # The directory the series indexes are kept in, disabled if None.
+    index_path = os.path.expanduser("~/.juju/cache/repositories")
 
     def __init__(self, path):
         if path is None or not os.path.isdir(path):
             raise RepositoryNotFound(path)
         self.path = path
 
-    def _collection(self, collection):
+    def _load_charm(self, dentry_path, dentry):
+        """Return the charm at `dentry_path` and any warning about it."""
+        try:
+            return get_charm_from_path(dentry_path), None
+        except FileNotFound:
+            pass
+        # There is a broken charm in the repo, but that
+        # shouldn't stop us from continuing
+        except yaml.YAMLError, e:
+            # Log yaml errors for feedback to developers.
+            return None, "Charm %r has a YAML error: %s" % (dentry, e)
+        except (ServiceConfigError, MetaDataError), e:
+            # Log invalid config.yaml and metadata.yaml semantic errors
+            return None, "Charm %r has an error: %r %s" % (dentry, e, e)
+        except CharmError:
+            # This could just be a random directory/file in the repo
+            pass
+        return None, None
+
+    def _get_index_file(self, path):
+        key = hashlib.sha1(os.path.abspath(path)).hexdigest()
+        return os.path.join(self.index_path, "%s.json" % key)
+
+    def _index(self, collection):
+        """Return the index entries of a collection, by directory entry.
+
+        Only the entries modified since the index was saved are loaded,
+        an entry holds the name and revision of its charm, if valid.
+        """
         path = os.path.join(self.path, collection.series)
         if not os.path.exists(path):
-            return
+            return {}
+
+        entries = {}
+        if self.index_path is not None:
+            try:
+                with open(self._get_index_file(path)) as f:
+                    entries = json.loads(f.read())
+            except (IOError, ValueError):
+                pass
 
+        index = {}
         for dentry in os.listdir(path):
             dentry_path = os.path.join(path, dentry)
-            try:
-                yield get_charm_from_path(dentry_path)
-            except FileNotFound:
-                continue
-            # There is a broken charm in the repo, but that
-            # shouldn't stop us from continuing
-            except yaml.YAMLError, e:
-                # Log yaml errors for feedback to developers.
-                log.warning("Charm %r has a YAML error: %s", dentry, e)
-                continue
-            except (ServiceConfigError, MetaDataError), e:
-                # Log invalid config.yaml and metadata.yaml semantic errors
-                log.warning("Charm %r has an error: %r %s", dentry, e, e)
-                continue
-            except CharmError:
-                # This could just be a random directory/file in the repo
-                continue
+            stamp = _get_stamp(dentry_path)
+            entry = entries.get(dentry)
+            if entry is None or entry["stamp"] != stamp:
+                charm, warning = self._load_charm(dentry_path, dentry)
+                entry = {"stamp": stamp, "warning": warning}
+                if charm is not None:
+                    entry["name"] = charm.metadata.name
+                    entry["revision"] = charm.get_revision()
+            if entry["warning"]:
+                log.warning("%s", entry["warning"])
+            index[dentry] = entry
+
+        if self.index_path is not None and index != entries:
+            self._save_index(path, index)
+        return index
+
+    def _save_index(self, path, index):
+        try:
+            _makedirs(self.index_path)
+            fd, temp_path = tempfile.mkstemp(
+                suffix=".part", dir=self.index_path)
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(index))
+            os.rename(temp_path, self._get_index_file(path))
+        except (IOError, OSError), e:
+            log.debug("Cannot save the index of %s: %s", path, e)
+
+    def _get_revisions(self, charm_url):
+        """Return the (revision, entry) of the charms named as `charm_url`,
+        latest first."""
+        index = self._index(charm_url.collection)
+        return sorted(
+            [(entry["revision"], dentry) for dentry, entry in index.items()
+             if entry.get("name") == charm_url.name],
+            reverse=True)
 
     def find(self, charm_url):
         """Find a charm with the given name.
@@ -72,66 +158,180 @@ class LocalCharmRepository(object):
         recent one (greatest revision) will be returned.
         """
         assert charm_url.collection.schema == "local", "schema mismatch"
-        latest = None
-        for charm in self._collection(charm_url.collection):
-            if charm.metadata.name == charm_url.name:
-                if charm.get_revision() == charm_url.revision:
-                    return succeed(charm)
-                if (latest is None or
-                    latest.get_revision() < charm.get_revision()):
-                    latest = charm
-
-        if latest is None or charm_url.revision is not None:
-            return fail(CharmNotFound(self.path, charm_url))
-
-        return succeed(latest)
+        path = os.path.join(self.path, charm_url.collection.series)
+        for revision, dentry in self._get_revisions(charm_url):
+            if charm_url.revision not in (None, revision):
+                continue
+            charm, warning = self._load_charm(
+                os.path.join(path, dentry), dentry)
+            if charm is not None:
+                return succeed(charm)
+        return fail(CharmNotFound(self.path, charm_url))
 
     def latest(self, charm_url):
-        d = self.find(charm_url.with_revision(None))
-        d.addCallback(lambda c: c.get_revision())
-        return d
+        assert charm_url.collection.schema == "local", "schema mismatch"
+        revisions = self._get_revisions(charm_url)
+        if not revisions:
+            return fail(
+                CharmNotFound(self.path, charm_url.with_revision(None)))
+        return succeed(revisions[0][0])
+
+    def close(self):
+        """Nothing is kept open by a local repository."""
+        return succeed(None)
 
 
 class RemoteCharmRepository(object):
+    """Charm repository of a charm store.
+
+    The connections to the store are kept open between requests, see
+    L{juju.lib.webclient}. The info of charms is cached, and used without
+    querying the store for `info_ttl` seconds, after which it is
+    revalidated by its ETag. Downloads are streamed to a partial file in
+    the cache, which an interrupted download is resumed from.
+    """
 
     cache_path = os.path.expanduser("~/.juju/cache")
 
+    # Seconds cached charm info is used without revalidation.
+    info_ttl = 60
+
     def __init__(self, url_base, cache_path=None):
         self.url_base = url_base
         if cache_path is not None:
             self.cache_path = cache_path
+        self._client = None
 
-    @inlineCallbacks
-    def _get_info(self, charm_url):
-        charm_id = str(charm_url)
-        url = "%s/charm-info?charms=%s" % (
-            self.url_base, urllib.quote(charm_id))
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = WebClient()
+        return self._client
+
+    def close(self):
+        """Close the connections kept open to the store."""
+        if self._client is None:
+            return succeed(None)
+        return self._client.close()
+
+    def _get_info_path(self, charm_id):
+        return os.path.join(
+            self.cache_path, "info", "%s.json" % under.quote(charm_id))
+
+    def _read_cached_info(self, charm_id):
         try:
-            all_info = json.loads((yield getPage(url)))
-            charm_info = all_info[charm_id]
+            with open(self._get_info_path(charm_id)) as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def _cache_info(self, charm_id, info, etag):
+        info_dir = os.path.join(self.cache_path, "info")
+        try:
+            _makedirs(info_dir)
+            fd, temp_path = tempfile.mkstemp(suffix=".part", dir=info_dir)
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(
+                    {"info": info, "etag": etag, "time": time.time()}))
+            os.rename(temp_path, self._get_info_path(charm_id))
+        except (IOError, OSError), e:
+            log.debug("Cannot cache the info of %s: %s", charm_id, e)
+
+    @inlineCallbacks
+    def get_info(self, charm_urls):
+        """Return the store's info of several charms, by charm id.
+
+        The info of the charms which is not cached, or expired, is
+        requested in a single query. Raises `CharmError` if the store
+        reports errors for any of the charms.
+        """
+        charm_ids = [str(charm_url) for charm_url in charm_urls]
+        now = time.time()
+        infos = {}
+        stale = []
+        for charm_id in charm_ids:
+            cached = self._read_cached_info(charm_id)
+            if cached is not None and now - cached["time"] < self.info_ttl:
+                infos[charm_id] = cached["info"]
+            else:
+                stale.append((charm_id, cached))
+
+        if stale:
+            url = "%s/charm-info?%s" % (self.url_base, "&".join(
+                "charms=%s" % urllib.quote(charm_id)
+                for charm_id, cached in stale))
+            # An ETag applies to the info of a single charm.
+            headers = {}
+            etag = len(stale) == 1 and stale[0][1] and stale[0][1]["etag"]
+            if etag:
+                headers["If-None-Match"] = etag
+            try:
+                response, body = yield self.client.get_page(url, headers)
+            except Error:
+                raise CharmNotFound(self.url_base, ", ".join(
+                    charm_id for charm_id, cached in stale))
+            if response.code == 304:
+                charm_id, cached = stale[0]
+                self._cache_info(charm_id, cached["info"], etag)
+                infos[charm_id] = cached["info"]
+            else:
+                all_info = json.loads(body)
+                etag = len(stale) == 1 and get_header(response, "ETag")
+                for charm_id, cached in stale:
+                    info = infos[charm_id] = all_info[charm_id]
+                    if not info.get("errors"):
+                        self._cache_info(charm_id, info, etag or None)
+
+        for charm_id in charm_ids:
+            charm_info = infos[charm_id]
             for warning in charm_info.get("warnings", []):
                 log.warning("%s: %s", charm_id, warning)
             errors = charm_info.get("errors", [])
             if errors:
                 raise CharmError(charm_id, "; ".join(errors))
-            returnValue(charm_info)
-        except Error:
-            raise CharmNotFound(self.url_base, charm_url)
+        returnValue(infos)
+
+    @inlineCallbacks
+    def _get_info(self, charm_url):
+        infos = yield self.get_info([charm_url])
+        returnValue(infos[str(charm_url)])
 
     @inlineCallbacks
     def _download(self, charm_url, cache_path):
         url = "%s/charm/%s" % (self.url_base, urllib.quote(charm_url.path))
         downloads = os.path.join(self.cache_path, "downloads")
         _makedirs(downloads)
-        f = tempfile.NamedTemporaryFile(
-            prefix=_cache_key(charm_url), suffix=".part", dir=downloads,
-            delete=False)
-        f.close()
-        downloading_path = f.name
+        downloading_path = os.path.join(
+            downloads, "%s.part" % _cache_key(charm_url))
+
+        # Resume an interrupted download.
+        headers = {}
+        offset = 0
+        if os.path.exists(downloading_path):
+            offset = os.path.getsize(downloading_path)
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
         try:
-            yield downloadPage(url, downloading_path)
-        except Error:
+            response = yield self.client.get(url, headers)
+        except Error, e:
+            if os.path.exists(downloading_path):
+                os.remove(downloading_path)
+            if offset and e.status == "416":
+                # The partial download is not a prefix of the charm.
+                yield self._download(charm_url, cache_path)
+                return
             raise CharmNotFound(self.url_base, charm_url)
+
+        if offset and response.code == 206:
+            log.debug("Resuming download of %s at %d bytes",
+                      charm_url, offset)
+            output = open(downloading_path, "ab")
+        else:
+            output = open(downloading_path, "wb")
+        try:
+            yield self.client.read(response, output)
+        finally:
+            output.close()
         os.rename(downloading_path, cache_path)
 
     @inlineCallbacks
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import shutil
+import stat
+import zipfile
+
+from juju.charm.bundle import CharmBundle
+from juju.charm.delta import (
+    CharmDelta, dump_manifest, get_changes, get_manifest, load_manifest,
+    make_delta, replace_directory)
+from juju.charm.directory import CharmDirectory
+from juju.charm.tests.test_directory import sample_directory
+from juju.errors import CharmError
+from juju.lib.testing import TestCase
+
+
+class CharmDeltaTest(TestCase):
+
+    def setUp(self):
+        self.base_path = os.path.join(self.makeDir(), "base")
+        shutil.copytree(sample_directory, self.base_path)
+        self.base = self.make_bundle(self.base_path)
+
+        # The upgrade changes a hook, adds a file and removes another.
+        self.upgrade_path = os.path.join(self.makeDir(), "upgrade")
+        shutil.copytree(sample_directory, self.upgrade_path)
+        with open(os.path.join(self.upgrade_path, "hooks", "install"),
+                  "a") as f:
+            f.write("echo upgraded\n")
+        with open(os.path.join(self.upgrade_path, "hooks", "upgrade-charm"),
+                  "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(
+            os.path.join(self.upgrade_path, "hooks", "upgrade-charm"), 0755)
+        os.remove(os.path.join(self.upgrade_path, "src", "hello.c"))
+        self.upgrade = self.make_bundle(self.upgrade_path)
+
+    def make_bundle(self, path):
+        bundle_path = self.makeFile(suffix=".charm")
+        CharmDirectory(path).make_archive(bundle_path)
+        return CharmBundle(bundle_path)
+
+    def make_delta(self):
+        base_manifest = get_manifest(self.base)
+        delta_path = self.makeFile(suffix=".charm")
+        make_delta(self.upgrade, base_manifest, delta_path)
+        return CharmDelta(
+            delta_path, base_manifest, get_manifest(self.upgrade))
+
+    def test_get_manifest(self):
+        manifest = get_manifest(self.base)
+        with open(os.path.join(self.base_path, "hooks", "install")) as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        mode = stat.S_IMODE(
+            os.stat(os.path.join(self.base_path, "hooks", "install")).st_mode)
+        self.assertEqual(manifest["hooks/install"], [digest, mode])
+        self.assertEqual(manifest["hooks"][0], None)
+        self.assertIn("metadata.yaml", manifest)
+
+    def test_get_changes(self):
+        changed, removed = get_changes(
+            get_manifest(self.base), get_manifest(self.upgrade))
+        self.assertEqual(changed, ["hooks/install", "hooks/upgrade-charm"])
+        self.assertEqual(removed, ["src/hello.c"])
+
+    def test_make_delta(self):
+        """A delta only holds the added and changed files."""
+        delta = self.make_delta()
+        zf = zipfile.ZipFile(delta.path)
+        self.assertEqual(zf.testzip(), None)
+        self.assertEqual(
+            sorted(zf.namelist()), ["hooks/install", "hooks/upgrade-charm"])
+
+    def test_manifest_serialization(self):
+        manifest = get_manifest(self.base)
+        content = dump_manifest(manifest)
+        self.assertEqual(load_manifest(content), manifest)
+        self.assertEqual(dump_manifest(load_manifest(content)), content)
+
+    def test_stage(self):
+        """A delta upgrades a staging copy of a directory to the manifest.
+        """
+        delta = self.make_delta()
+        staging = delta.stage(self.base_path)
+        self.assertEqual(
+            os.path.dirname(staging), os.path.dirname(self.base_path))
+        delta.verify(staging)
+        self.assertFalse(
+            os.path.exists(os.path.join(staging, "src", "hello.c")))
+        hook_path = os.path.join(staging, "hooks", "upgrade-charm")
+        self.assertEqual(stat.S_IMODE(os.stat(hook_path).st_mode), 0755)
+
+        # The directory itself is untouched, unchanged files are shared.
+        self.assertTrue(
+            os.path.exists(os.path.join(self.base_path, "src", "hello.c")))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.base_path, "hooks", "upgrade-charm")))
+        self.assertEqual(
+            os.stat(os.path.join(staging, "metadata.yaml")).st_ino,
+            os.stat(os.path.join(self.base_path, "metadata.yaml")).st_ino)
+
+        replace_directory(self.base_path, staging)
+        delta.verify(self.base_path)
+        self.assertEqual(
+            os.listdir(os.path.dirname(self.base_path)), ["base"])
+
+    def test_stage_replaces_files(self):
+        """Changed files are replaced, never written in place."""
+        install_path = os.path.join(self.base_path, "hooks", "install")
+        link_path = os.path.join(self.makeDir(), "install")
+        os.link(install_path, link_path)
+        with open(link_path) as f:
+            original = f.read()
+
+        staging = self.make_delta().stage(self.base_path)
+        with open(link_path) as f:
+            self.assertEqual(f.read(), original)
+        with open(install_path) as f:
+            self.assertEqual(f.read(), original)
+        with open(os.path.join(staging, "hooks", "install")) as f:
+            self.assertTrue(f.read().endswith("echo upgraded\n"))
+
+    def test_stage_verifies(self):
+        """A staging copy not matching the manifest once upgraded is an
+        error, and is removed.
+        """
+        with open(os.path.join(self.base_path, "revision"), "w") as f:
+            f.write("999")
+        error = self.assertRaises(
+            CharmError, self.make_delta().stage, self.base_path)
+        self.assertIn("'revision' does not match the charm manifest",
+                      str(error))
+        self.assertEqual(
+            os.listdir(os.path.dirname(self.base_path)), ["base"])
@@ -33,6 +33,10 @@ class DirectoryTest(RepositoryTestBase):
         if not os.path.isdir(empty_dir):
             os.mkdir(empty_dir)
 
+        self.bundle_cache_path = self.makeDir()
+        self.patch(
+            CharmDirectory, "bundle_cache_path", self.bundle_cache_path)
+
     def copy_charm(self):
         dir_ = os.path.join(tempfile.mkdtemp(), "sample")
         shutil.copytree(sample_directory, dir_)
@@ -165,6 +169,97 @@ class DirectoryTest(RepositoryTestBase):
                                             charm_bundle.path),
                           sha256)
 
+    def test_as_bundle_cached(self):
+        """
+        The bundle of an unchanged directory is reused, along with its
+        digest.
+        """
+        directory = CharmDirectory(self.sample_dir1)
+        sha256 = directory.compute_sha256()
+        self.assertEquals(
+            len(os.listdir(self.bundle_cache_path)), 2)
+
+        def make_archive(path, previous=None):
+            self.fail("Bundle should be cached")
+        directory = CharmDirectory(self.sample_dir1)
+        self.patch(directory, "make_archive", make_archive)
+        charm_bundle = directory.as_bundle()
+        self.assertEquals(charm_bundle.metadata.name, "sample")
+        self.assertEquals(directory.compute_sha256(), sha256)
+        self.assertEquals(
+            compute_file_hash(hashlib.sha256, charm_bundle.path), sha256)
+
+    def test_as_bundle_incremental(self):
+        """
+        Only the changed files of a directory are compressed again when
+        its bundle is rebuilt.
+        """
+        dir_ = self.copy_charm()
+        CharmDirectory(dir_).as_bundle()
+        with open(os.path.join(dir_, "src", "hello.c"), "a") as f:
+            f.write("/* changed */\n")
+
+        written = []
+        original_write = zipfile.ZipFile.write
+
+        def write(zf, filename, arcname=None, compress_type=None):
+            written.append(arcname)
+            return original_write(zf, filename, arcname, compress_type)
+        self.patch(zipfile.ZipFile, "write", write)
+
+        directory = CharmDirectory(dir_)
+        charm_bundle = directory.as_bundle()
+        self.assertEquals(
+            sorted(written), ["empty", "hooks", "src", "src/hello.c"])
+
+        zf = zipfile.ZipFile(charm_bundle.path)
+        self.assertEqual(zf.testzip(), None)
+        self.assertTrue(zf.read("src/hello.c").endswith("/* changed */\n"))
+        with open(os.path.join(dir_, "hooks", "install")) as f:
+            self.assertEquals(zf.read("hooks/install"), f.read())
+        self.assertEquals(
+            compute_file_hash(hashlib.sha256, charm_bundle.path),
+            directory.compute_sha256())
+
+    def test_as_bundle_mode_changed(self):
+        """
+        The mode of a file changed since the bundle was cached is updated,
+        even though its compressed entry is reused.
+        """
+        dir_ = self.copy_charm()
+        install_path = os.path.join(dir_, "hooks", "install")
+        os.chmod(install_path, 0644)
+        CharmDirectory(dir_).as_bundle()
+        os.chmod(install_path, 0755)
+
+        charm_bundle = CharmDirectory(dir_).as_bundle()
+        zf = zipfile.ZipFile(charm_bundle.path)
+        info = zf.getinfo("hooks/install")
+        self.assertEquals((info.external_attr >> 16) & 0777, 0755)
+        with open(install_path) as f:
+            self.assertEquals(zf.read("hooks/install"), f.read())
+
+    def test_bundle_cache_expiry(self):
+        """
+        Only the most recently used bundles are kept in the cache.
+        """
+        self.patch(CharmDirectory, "bundle_cache_size", 1)
+        CharmDirectory(self.sample_dir1).as_bundle()
+        CharmDirectory(self.copy_charm()).as_bundle()
+        self.assertEquals(
+            len(os.listdir(self.bundle_cache_path)), 2)
+
+    def test_bundle_cache_disabled(self):
+        """
+        Bundles are not cached if the cache path is None.
+        """
+        self.patch(CharmDirectory, "bundle_cache_path", None)
+        directory = CharmDirectory(self.sample_dir1)
+        self.assertEquals(
+            compute_file_hash(hashlib.sha256, directory.as_bundle().path),
+            directory.compute_sha256())
+        self.assertEquals(os.listdir(self.bundle_cache_path), [])
+
     def test_as_bundle_with_relative_path(self):
         """
         Ensure that as_bundle works correctly with relative paths.
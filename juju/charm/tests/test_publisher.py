@@ -1,8 +1,11 @@
 import fcntl
+import logging
 import os
 import yaml
 import zookeeper
 
+from zipfile import ZipFile
+
 from twisted.internet.defer import inlineCallbacks, fail
 from twisted.python.failure import Failure
 
@@ -10,6 +13,7 @@ from txzookeeper import ZookeeperClient
 from txzookeeper.tests.utils import deleteTree
 
 from juju.charm.bundle import CharmBundle
+from juju.charm.delta import get_changes, get_manifest, load_manifest
 from juju.charm.directory import CharmDirectory
 from juju.charm.publisher import CharmPublisher
 from juju.charm.tests import local_charm_id
@@ -84,6 +88,15 @@ class CharmPublisherTest(RepositoryTestBase):
             result[0].bundle_url, "file://%s/%s" % (
                 self.storage_dir, self.charm_storage_key))
 
+    @inlineCallbacks
+    def test_publish_logs_progress(self):
+        """The upload progress of a charm is logged."""
+        log = self.capture_logging("juju.charm", level=logging.DEBUG)
+        yield self.publisher.add_charm(self.charm_id, self.charm)
+        yield self.publisher.publish()
+        self.assertIn(
+            "Uploaded 100%% of %s" % self.charm_id, log.getvalue())
+
     @inlineCallbacks
     def test_published_charm_sans_unicode(self):
         yield self.publisher.add_charm(self.charm_id, self.charm)
@@ -205,6 +218,59 @@ class CharmPublisherTest(RepositoryTestBase):
         self.assertEqual(result[0].name, self.charm.metadata.name)
         self.assertEqual(result[1].name, self.charm.metadata.name)
 
+    @inlineCallbacks
+    def test_publish_delta(self):
+        """A charm upgrading a published charm carries a delta against it.
+        """
+        yield self.publisher.add_charm(self.charm_id, self.charm)
+        yield self.publisher.publish()
+
+        charm = CharmDirectory(self.sample_dir2)
+        charm_id = local_charm_id(charm)
+        publisher = CharmPublisher(self.client, self.storage)
+        yield publisher.add_charm(
+            charm_id, charm, base_charm_id=self.charm_id)
+        result = yield publisher.publish()
+        charm_state = result[0]
+
+        # The manifest is stored in the file storage, the charm state only
+        # holds its url and sha256.
+        base_manifest = get_manifest(self.charm.as_bundle())
+        manifest = get_manifest(charm.as_bundle())
+        manifest_key = under.quote(
+            "%s:manifest:%s" % (charm_id, charm_state.manifest["sha256"]))
+        self.assertEqual(
+            charm_state.manifest["url"],
+            "file://%s/%s" % (self.storage_dir, manifest_key))
+        manifest_file = yield self.storage.get(manifest_key)
+        self.assertEqual(load_manifest(manifest_file.read()), manifest)
+        self.assertEqual(charm_state.delta["base"], self.charm_id)
+        delta_key = under.quote(
+            "%s:delta:%s" % (charm_id, charm_state.delta["sha256"]))
+        self.assertEqual(
+            charm_state.delta["url"],
+            "file://%s/%s" % (self.storage_dir, delta_key))
+
+        delta_file = yield self.storage.get(delta_key)
+        changed, removed = get_changes(base_manifest, manifest)
+        self.assertIn("revision", changed)
+        self.assertEqual(
+            sorted(name.rstrip("/")
+                   for name in ZipFile(delta_file).namelist()),
+            changed)
+
+    @inlineCallbacks
+    def test_publish_delta_base_without_manifest(self):
+        """No delta is published against a charm lacking a manifest."""
+        yield CharmStateManager(self.client).add_charm_state(
+            self.charm_id, self.charm, "file:///old.charm")
+        charm = CharmDirectory(self.sample_dir2)
+        yield self.publisher.add_charm(
+            local_charm_id(charm), charm, base_charm_id=self.charm_id)
+        result = yield self.publisher.publish()
+        self.assertEqual(result[0].delta, None)
+        self.assertNotEqual(result[0].manifest, None)
+
 
 class EnvironmentPublisherTest(EnvironmentsConfigTestBase):
 
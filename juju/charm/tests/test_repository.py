@@ -1,22 +1,28 @@
+import hashlib
 import json
 import os
 import inspect
 import shutil
 import tempfile
+import urllib
 
-from twisted.internet.defer import fail, inlineCallbacks, succeed
-from twisted.web.error import Error
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.protocols.policies import WrappingFactory
+from twisted.trial.unittest import SkipTest
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
 
+from juju.charm import repository
 from juju.charm.directory import CharmDirectory
 from juju.charm.errors import CharmNotFound, CharmURLError, RepositoryNotFound
 from juju.charm.repository import (
     LocalCharmRepository, RemoteCharmRepository, resolve)
 from juju.charm.url import CharmURL
 from juju.errors import CharmError
-from juju.lib import under
+from juju.lib import under, webclient
 
 from juju.charm import tests
-from juju.lib.mocker import ANY
 from juju.lib.testing import TestCase
 
 
@@ -47,6 +53,8 @@ class LocalRepositoryTest(RepositoryTestBase):
 
     def setUp(self):
         super(LocalRepositoryTest, self).setUp()
+        self.index_path = self.makeDir()
+        self.patch(LocalCharmRepository, "index_path", self.index_path)
 
         # bundle sample charms
         CharmDirectory(self.sample_dir1).make_archive(
@@ -204,6 +212,134 @@ summary: hola""")
         yield self.assert_there("sample-2", self.repository1, 2, 3)
         yield self.assert_there("sample-3", self.repository1, 3)
 
+    def record_loads(self):
+        loaded = []
+
+        def get_charm_from_path(path):
+            loaded.append(os.path.basename(path))
+            return original(path)
+        original = self.patch(
+            repository, "get_charm_from_path", get_charm_from_path)
+        return loaded
+
+    @inlineCallbacks
+    def test_index_only_loads_match(self):
+        """Once indexed, a lookup only loads the charm it returns."""
+        yield self.assert_there("sample", self.repository1, 2)
+        self.assertEqual(len(os.listdir(self.index_path)), 1)
+
+        loaded = self.record_loads()
+        charm = yield self.repository1.find(self.charm_url("sample-1"))
+        self.assertEqual(charm.get_revision(), 1)
+        self.assertEqual(loaded, ["old"])
+
+        del loaded[:]
+        latest = yield self.repository1.latest(self.charm_url("sample"))
+        self.assertEqual(latest, 2)
+        self.assertEqual(loaded, [])
+
+    @inlineCallbacks
+    def test_index_updated_incrementally(self):
+        """Only the added or modified entries of a series are indexed."""
+        yield self.assert_there("sample", self.repository1, 2)
+        newer_path = os.path.join(
+            self.repository1.path, "series", "newer")
+        shutil.copytree(self.sample_dir2, newer_path)
+        with open(os.path.join(newer_path, "revision"), "w") as f:
+            f.write("5")
+
+        loaded = self.record_loads()
+        yield self.assert_there("sample", self.repository1, 5)
+        self.assertEqual(loaded, ["newer", "newer"])
+
+    @inlineCallbacks
+    def test_index_disabled(self):
+        self.patch(LocalCharmRepository, "index_path", None)
+        yield self.assert_there("sample", self.repository1, 2)
+        self.assertEqual(os.listdir(self.index_path), [])
+
+
+class StubStore(Resource):
+    """A stand-in charm store, serving charm info and bundles."""
+
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        # charm id -> info
+        self.infos = {}
+        # charm path -> bundle data
+        self.bundles = {}
+        # (uri, headers) of the requests received
+        self.requests = []
+        # status code of every response, if set
+        self.status = None
+        # bytes of a bundle sent before dropping the connection, if set
+        self.interrupt_at = None
+        # path -> url redirected to
+        self.redirects = {}
+
+    def render_GET(self, request):
+        self.requests.append((request.uri, dict(
+            (name, request.getHeader(name))
+            for name in ("if-none-match", "range")
+            if request.getHeader(name))))
+        if self.status is not None:
+            request.setResponseCode(self.status)
+            return ""
+        if request.path in self.redirects:
+            request.redirect(self.redirects[request.path])
+            return ""
+        if request.path == "/charm-info":
+            return self.render_info(request)
+        return self.render_charm(request)
+
+    def render_info(self, request):
+        body = json.dumps(dict(
+            (charm_id, self.infos.get(
+                charm_id, {"errors": ["entry not found"]}))
+            for charm_id in request.args.get("charms", [])))
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        request.setHeader("ETag", etag)
+        if request.getHeader("if-none-match") == etag:
+            request.setResponseCode(304)
+            return ""
+        return body
+
+    def render_charm(self, request):
+        data = self.bundles.get(
+            urllib.unquote(request.path[len("/charm/"):]))
+        if data is None:
+            request.setResponseCode(404)
+            return ""
+        range_header = request.getHeader("range")
+        if range_header:
+            offset = int(range_header[len("bytes="):].rstrip("-"))
+            if offset >= len(data):
+                request.setResponseCode(416)
+                return ""
+            request.setResponseCode(206)
+            request.setHeader("Content-Range", "bytes %d-%d/%d" % (
+                offset, len(data) - 1, len(data)))
+            data = data[offset:]
+        if self.interrupt_at is not None:
+            # Send the start of the bundle, and drop the connection.
+            request.setHeader("Content-Length", str(len(data)))
+            request.write(data[:self.interrupt_at])
+            self.interrupt_at = None
+            request.transport.loseConnection()
+            return NOT_DONE_YET
+        return data
+
+
+class CountingSite(Site):
+
+    connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return Site.buildProtocol(self, addr)
+
 
 class RemoteRepositoryTest(RepositoryTestBase):
 
@@ -223,12 +359,28 @@ class RemoteRepositoryTest(RepositoryTestBase):
         with open(self.charm.as_bundle().path, "rb") as f:
             self.bundle_data = f.read()
         self.sha256 = self.charm.as_bundle().get_sha256()
-        self.getPage = self.mocker.replace("twisted.web.client.getPage")
-        self.downloadPage = self.mocker.replace(
-            "twisted.web.client.downloadPage")
 
-    def repo(self, url_base):
-        return RemoteCharmRepository(url_base, self.cache_path)
+        self.store = StubStore()
+        self.site = CountingSite(self.store, timeout=None)
+        self.wrapper = WrappingFactory(self.site)
+        self.port = reactor.listenTCP(0, self.wrapper, interface="127.0.0.1")
+        self.url_base = "http://127.0.0.1:%d" % self.port.getHost().port
+        self.repositories = []
+
+    @inlineCallbacks
+    def tearDown(self):
+        for repo in self.repositories:
+            yield repo.close()
+        # Wait for the store's side of the connections to be closed.
+        while self.wrapper.protocols:
+            yield self.sleep(0.01)
+        yield self.port.stopListening()
+        yield super(RemoteRepositoryTest, self).tearDown()
+
+    def repo(self):
+        repo = RemoteCharmRepository(self.url_base, self.cache_path)
+        self.repositories.append(repo)
+        return repo
 
     def cache_location(self, url_str, revision):
         charm_url = CharmURL.parse(url_str)
@@ -236,60 +388,46 @@ class RemoteRepositoryTest(RepositoryTestBase):
             "%s.charm" % (charm_url.with_revision(revision)))
         return os.path.join(self.cache_path, cache_key)
 
-    def charm_info(self, url_str, revision, warnings=None, errors=None):
+    def charm_info(self, revision, warnings=None, errors=None):
         info = {"revision": revision, "sha256": self.sha256}
         if errors:
             info["errors"] = errors
         if warnings:
             info["warnings"] = warnings
-        return json.dumps({url_str: info})
+        return info
 
-    def mock_charm_info(self, url, result):
-        self.getPage(url)
-        self.mocker.result(result)
+    def add_charm(self, url_str, revision=1):
+        self.store.infos[url_str] = self.charm_info(revision)
+        charm_url = CharmURL.parse(url_str).with_revision(revision)
+        self.store.bundles[charm_url.path] = self.bundle_data
 
-    def mock_download(self, url, error=None):
-        self.downloadPage(url, ANY)
-        if error:
-            return self.mocker.result(fail(error))
-
-        def download(_, path):
-            self.assertTrue(path.startswith(self.download_path))
-            with open(path, "wb") as f:
-                f.write(self.bundle_data)
-            return succeed(None)
-        self.mocker.call(download)
+    def get_requested(self):
+        return [uri for uri, headers in self.store.requests]
 
     @inlineCallbacks
-    def assert_find_uncached(self, dns_name, url_str, info_url, find_url):
-        self.mock_charm_info(info_url, succeed(self.charm_info(url_str, 1)))
-        self.mock_download(find_url)
-        self.mocker.replay()
-
-        repo = self.repo(dns_name)
-        charm = yield repo.find(CharmURL.parse(url_str))
+    def assert_find_uncached(self, url_str, info_uri, find_uri):
+        self.add_charm(url_str)
+        charm = yield self.repo().find(CharmURL.parse(url_str))
         self.assertEquals(charm.get_sha256(), self.sha256)
         self.assertEquals(charm.path, self.cache_location(url_str, 1))
         self.assertEquals(os.listdir(self.download_path), [])
+        self.assertEquals(self.get_requested(), [info_uri, find_uri])
 
     @inlineCallbacks
-    def assert_find_cached(self, dns_name, url_str, info_url):
+    def assert_find_cached(self, url_str, info_uri):
         os.makedirs(self.cache_path)
         cache_location = self.cache_location(url_str, 1)
         shutil.copy(self.charm.as_bundle().path, cache_location)
+        self.store.infos[url_str] = self.charm_info(1)
 
-        self.mock_charm_info(info_url, succeed(self.charm_info(url_str, 1)))
-        self.mocker.replay()
-
-        repo = self.repo(dns_name)
-        charm = yield repo.find(CharmURL.parse(url_str))
+        charm = yield self.repo().find(CharmURL.parse(url_str))
         self.assertEquals(charm.get_sha256(), self.sha256)
         self.assertEquals(charm.path, cache_location)
+        self.assertEquals(self.get_requested(), [info_uri])
 
-    def assert_find_error(self, dns_name, url_str, err_type, message):
-        self.mocker.replay()
-        repo = self.repo(dns_name)
-        d = self.assertFailure(repo.find(CharmURL.parse(url_str)), err_type)
+    def assert_find_error(self, url_str, err_type, message):
+        d = self.assertFailure(
+            self.repo().find(CharmURL.parse(url_str)), err_type)
 
         def verify(error):
             self.assertEquals(str(error), message)
@@ -297,16 +435,13 @@ class RemoteRepositoryTest(RepositoryTestBase):
         return d
 
     @inlineCallbacks
-    def assert_latest(self, dns_name, url_str, revision):
-        self.mocker.replay()
-        repo = self.repo(dns_name)
-        result = yield repo.latest(CharmURL.parse(url_str))
+    def assert_latest(self, url_str, revision):
+        result = yield self.repo().latest(CharmURL.parse(url_str))
         self.assertEquals(result, revision)
 
-    def assert_latest_error(self, dns_name, url_str, err_type, message):
-        self.mocker.replay()
-        repo = self.repo(dns_name)
-        d = self.assertFailure(repo.latest(CharmURL.parse(url_str)), err_type)
+    def assert_latest_error(self, url_str, err_type, message):
+        d = self.assertFailure(
+            self.repo().latest(CharmURL.parse(url_str)), err_type)
 
         def verify(error):
             self.assertEquals(str(error), message)
@@ -315,108 +450,84 @@ class RemoteRepositoryTest(RepositoryTestBase):
 
     def test_find_plain_uncached(self):
         return self.assert_find_uncached(
-            "https://somewhe.re", "cs:series/name",
-            "https://somewhe.re/charm-info?charms=cs%3Aseries/name",
-            "https://somewhe.re/charm/series/name-1")
+            "cs:series/name",
+            "/charm-info?charms=cs%3Aseries/name",
+            "/charm/series/name-1")
 
     def test_find_revision_uncached(self):
         return self.assert_find_uncached(
-            "https://somewhe.re", "cs:series/name-1",
-            "https://somewhe.re/charm-info?charms=cs%3Aseries/name-1",
-            "https://somewhe.re/charm/series/name-1")
+            "cs:series/name-1",
+            "/charm-info?charms=cs%3Aseries/name-1",
+            "/charm/series/name-1")
 
     def test_find_user_uncached(self):
         return self.assert_find_uncached(
-            "https://somewhereel.se", "cs:~user/srs/name",
-            "https://somewhereel.se/charm-info?charms=cs%3A%7Euser/srs/name",
-            "https://somewhereel.se/charm/%7Euser/srs/name-1")
+            "cs:~user/srs/name",
+            "/charm-info?charms=cs%3A%7Euser/srs/name",
+            "/charm/%7Euser/srs/name-1")
 
     def test_find_plain_cached(self):
         return self.assert_find_cached(
-            "https://somewhe.re", "cs:series/name",
-            "https://somewhe.re/charm-info?charms=cs%3Aseries/name")
+            "cs:series/name", "/charm-info?charms=cs%3Aseries/name")
 
     def test_find_revision_cached(self):
         return self.assert_find_cached(
-            "https://somewhe.re", "cs:series/name-1",
-            "https://somewhe.re/charm-info?charms=cs%3Aseries/name-1")
+            "cs:series/name-1", "/charm-info?charms=cs%3Aseries/name-1")
 
     def test_find_user_cached(self):
         return self.assert_find_cached(
-            "https://somewhereel.se", "cs:~user/srs/name",
-            "https://somewhereel.se/charm-info?charms=cs%3A%7Euser/srs/name")
+            "cs:~user/srs/name", "/charm-info?charms=cs%3A%7Euser/srs/name")
 
     def test_find_info_http_error(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            fail(Error("500")))
+        self.store.status = 500
         return self.assert_find_error(
-            "https://anoth.er", "cs:series/name", CharmNotFound,
-            "Charm 'cs:series/name' not found in repository https://anoth.er")
+            "cs:series/name", CharmNotFound,
+            "Charm 'cs:series/name' not found in repository %s" %
+            self.url_base)
 
     @inlineCallbacks
     def test_find_info_store_warning(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name-1",
-            succeed(self.charm_info(
-                "cs:series/name-1", 1, warnings=["omg", "halp"])))
-        self.mock_download("https://anoth.er/charm/series/name-1")
-        self.mocker.replay()
-
-        repo = self.repo("https://anoth.er")
+        self.add_charm("cs:series/name-1")
+        self.store.infos["cs:series/name-1"]["warnings"] = ["omg", "halp"]
+
         log = self.capture_logging("juju.charm")
-        charm = yield repo.find(CharmURL.parse("cs:series/name-1"))
+        charm = yield self.repo().find(CharmURL.parse("cs:series/name-1"))
         self.assertIn("omg", log.getvalue())
         self.assertIn("halp", log.getvalue())
         self.assertEquals(charm.get_sha256(), self.sha256)
 
     def test_find_info_store_error(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name-101",
-            succeed(self.charm_info(
-                "cs:series/name-101", 101, errors=["oh", "noes"])))
+        self.store.infos["cs:series/name-101"] = self.charm_info(
+            101, errors=["oh", "noes"])
         return self.assert_find_error(
-            "https://anoth.er", "cs:series/name-101", CharmError,
+            "cs:series/name-101", CharmError,
             "Error processing 'cs:series/name-101': oh; noes")
 
     def test_find_info_bad_revision(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name-99",
-            succeed(self.charm_info("cs:series/name-99", 1)))
+        self.store.infos["cs:series/name-99"] = self.charm_info(1)
         return self.assert_find_error(
-            "https://anoth.er", "cs:series/name-99", AssertionError,
-            "bad url revision")
+            "cs:series/name-99", AssertionError, "bad url revision")
 
     def test_find_download_error(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            succeed(json.dumps({"cs:series/name": {"revision": 123}})))
-        self.mock_download(
-            "https://anoth.er/charm/series/name-123", Error("999"))
+        self.store.infos["cs:series/name"] = {"revision": 123}
         return self.assert_find_error(
-            "https://anoth.er", "cs:series/name", CharmNotFound,
-            "Charm 'cs:series/name-123' not found in repository "
-            "https://anoth.er")
+            "cs:series/name", CharmNotFound,
+            "Charm 'cs:series/name-123' not found in repository %s" %
+            self.url_base)
 
     def test_find_charm_revision_mismatch(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            succeed(json.dumps({"cs:series/name": {"revision": 99}})))
-        self.mock_download("https://anoth.er/charm/series/name-99")
+        self.store.infos["cs:series/name"] = {"revision": 99}
+        self.store.bundles["series/name-99"] = self.bundle_data
         return self.assert_find_error(
-            "https://anoth.er", "cs:series/name", AssertionError,
-            "bad charm revision")
+            "cs:series/name", AssertionError, "bad charm revision")
 
     @inlineCallbacks
     def test_find_downloaded_hash_mismatch(self):
         cache_location = self.cache_location("cs:series/name-1", 1)
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            succeed(json.dumps(
-                {"cs:series/name": {"revision": 1, "sha256": "NO YUO"}})))
-        self.mock_download("https://anoth.er/charm/series/name-1")
+        self.add_charm("cs:series/name")
+        self.store.infos["cs:series/name"]["sha256"] = "NO YUO"
         yield self.assert_find_error(
-            "https://anoth.er", "cs:series/name", CharmError,
+            "cs:series/name", CharmError,
             "Error processing 'cs:series/name-1 (downloaded)': SHA256 "
             "mismatch")
         self.assertFalse(os.path.exists(cache_location))
@@ -427,68 +538,174 @@ class RemoteRepositoryTest(RepositoryTestBase):
         cache_location = self.cache_location("cs:series/name-1", 1)
         shutil.copy(self.charm.as_bundle().path, cache_location)
 
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            succeed(json.dumps(
-                {"cs:series/name": {"revision": 1, "sha256": "NO YUO"}})))
+        self.store.infos["cs:series/name"] = {
+            "revision": 1, "sha256": "NO YUO"}
         yield self.assert_find_error(
-            "https://anoth.er", "cs:series/name", CharmError,
+            "cs:series/name", CharmError,
             "Error processing 'cs:series/name-1 (cached)': SHA256 mismatch")
         self.assertFalse(os.path.exists(cache_location))
 
     def test_latest_plain(self):
-        self.mock_charm_info(
-            "https://somewhe.re/charm-info?charms=cs%3Afoo/bar",
-            succeed(self.charm_info("cs:foo/bar", 99)))
-        return self.assert_latest("https://somewhe.re", "cs:foo/bar-1", 99)
+        self.store.infos["cs:foo/bar"] = self.charm_info(99)
+        return self.assert_latest("cs:foo/bar-1", 99)
 
     def test_latest_user(self):
-        self.mock_charm_info(
-            "https://somewhereel.se/charm-info?charms=cs%3A%7Efee/foo/bar",
-            succeed(self.charm_info("cs:~fee/foo/bar", 123)))
-        return self.assert_latest(
-            "https://somewhereel.se", "cs:~fee/foo/bar", 123)
+        self.store.infos["cs:~fee/foo/bar"] = self.charm_info(123)
+        return self.assert_latest("cs:~fee/foo/bar", 123)
 
+    @inlineCallbacks
     def test_latest_revision(self):
-        self.mock_charm_info(
-            "https://somewhereel.se/charm-info?charms=cs%3A%7Efee/foo/bar",
-            succeed(self.charm_info("cs:~fee/foo/bar", 123)))
-        return self.assert_latest(
-            "https://somewhereel.se", "cs:~fee/foo/bar-99", 123)
+        self.store.infos["cs:~fee/foo/bar"] = self.charm_info(123)
+        yield self.assert_latest("cs:~fee/foo/bar-99", 123)
+        self.assertEquals(
+            self.get_requested(),
+            ["/charm-info?charms=cs%3A%7Efee/foo/bar"])
 
     def test_latest_http_error(self):
-        self.mock_charm_info(
-            "https://andanoth.er/charm-info?charms=cs%3A%7Eblib/blab/blob",
-            fail(Error("404")))
+        self.store.status = 404
         return self.assert_latest_error(
-            "https://andanoth.er", "cs:~blib/blab/blob", CharmNotFound,
-            "Charm 'cs:~blib/blab/blob' not found in repository "
-            "https://andanoth.er")
+            "cs:~blib/blab/blob", CharmNotFound,
+            "Charm 'cs:~blib/blab/blob' not found in repository %s" %
+            self.url_base)
 
     @inlineCallbacks
     def test_latest_store_warning(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            succeed(self.charm_info(
-                "cs:series/name", 1, warnings=["eww", "yuck"])))
-        self.mocker.replay()
-
-        repo = self.repo("https://anoth.er")
+        self.store.infos["cs:series/name"] = self.charm_info(
+            1, warnings=["eww", "yuck"])
         log = self.capture_logging("juju.charm")
-        revision = yield repo.latest(CharmURL.parse("cs:series/name-1"))
+        revision = yield self.repo().latest(
+            CharmURL.parse("cs:series/name-1"))
         self.assertIn("eww", log.getvalue())
         self.assertIn("yuck", log.getvalue())
         self.assertEquals(revision, 1)
 
     def test_latest_store_error(self):
-        self.mock_charm_info(
-            "https://anoth.er/charm-info?charms=cs%3Aseries/name",
-            succeed(self.charm_info(
-                "cs:series/name", 1, errors=["blam", "dink"])))
+        self.store.infos["cs:series/name"] = self.charm_info(
+            1, errors=["blam", "dink"])
         return self.assert_latest_error(
-            "https://anoth.er", "cs:series/name-1", CharmError,
+            "cs:series/name-1", CharmError,
             "Error processing 'cs:series/name': blam; dink")
 
+    @inlineCallbacks
+    def test_info_cached(self):
+        """Charm info is used from the cache until it expires."""
+        self.store.infos["cs:series/name"] = self.charm_info(1)
+        yield self.assert_latest("cs:series/name", 1)
+        self.store.infos["cs:series/name"] = self.charm_info(2)
+        yield self.assert_latest("cs:series/name", 1)
+        self.assertEquals(len(self.store.requests), 1)
+
+        self.patch(RemoteCharmRepository, "info_ttl", 0)
+        yield self.assert_latest("cs:series/name", 2)
+        self.assertEquals(len(self.store.requests), 2)
+
+    @inlineCallbacks
+    def test_info_revalidated(self):
+        """Expired charm info is revalidated with its ETag."""
+        self.patch(RemoteCharmRepository, "info_ttl", 0)
+        self.store.infos["cs:series/name"] = self.charm_info(1)
+        yield self.assert_latest("cs:series/name", 1)
+        yield self.assert_latest("cs:series/name", 1)
+
+        [(uri, headers), (uri, revalidate_headers)] = self.store.requests
+        self.assertEquals(headers, {})
+        self.assertIn("if-none-match", revalidate_headers)
+
+    @inlineCallbacks
+    def test_info_errors_not_cached(self):
+        self.store.infos["cs:series/name"] = self.charm_info(
+            1, errors=["blam"])
+        yield self.assertFailure(
+            self.repo().latest(CharmURL.parse("cs:series/name")),
+            CharmError)
+        self.store.infos["cs:series/name"] = self.charm_info(1)
+        yield self.assert_latest("cs:series/name", 1)
+
+    @inlineCallbacks
+    def test_get_info_bulk(self):
+        """The info of several charms is requested at once."""
+        self.store.infos["cs:series/a"] = self.charm_info(1)
+        self.store.infos["cs:series/b"] = self.charm_info(2)
+        infos = yield self.repo().get_info(
+            [CharmURL.parse("cs:series/a"), CharmURL.parse("cs:series/b")])
+        self.assertEquals(
+            infos, {"cs:series/a": self.charm_info(1),
+                    "cs:series/b": self.charm_info(2)})
+        self.assertEquals(
+            self.get_requested(),
+            ["/charm-info?charms=cs%3Aseries/a&charms=cs%3Aseries/b"])
+
+        # Only the charms whose info is not cached are requested.
+        self.store.infos["cs:series/c"] = self.charm_info(3)
+        infos = yield self.repo().get_info(
+            [CharmURL.parse("cs:series/b"), CharmURL.parse("cs:series/c")])
+        self.assertEquals(sorted(infos), ["cs:series/b", "cs:series/c"])
+        self.assertEquals(
+            self.get_requested()[-1], "/charm-info?charms=cs%3Aseries/c")
+
+    @inlineCallbacks
+    def test_download_resumed(self):
+        """An interrupted download is resumed from where it stopped."""
+        self.add_charm("cs:series/name")
+        self.store.interrupt_at = 100
+        yield self.assertFailure(
+            self.repo().find(CharmURL.parse("cs:series/name")), Exception)
+        [partial] = os.listdir(self.download_path)
+        self.assertEquals(
+            os.path.getsize(os.path.join(self.download_path, partial)), 100)
+
+        charm = yield self.repo().find(CharmURL.parse("cs:series/name"))
+        self.assertEquals(charm.get_sha256(), self.sha256)
+        self.assertEquals(self.store.requests[-1][1], {"range": "bytes=100-"})
+        self.assertEquals(os.listdir(self.download_path), [])
+
+    @inlineCallbacks
+    def test_download_restarted(self):
+        """A partial download longer than the charm is restarted."""
+        self.add_charm("cs:series/name")
+        os.makedirs(self.download_path)
+        with open(os.path.join(self.download_path, "%s.part" % under.quote(
+                "cs:series/name-1.charm")), "w") as f:
+            f.write("x" * (len(self.bundle_data) + 1))
+        charm = yield self.repo().find(CharmURL.parse("cs:series/name"))
+        self.assertEquals(charm.get_sha256(), self.sha256)
+        self.assertEquals(self.store.requests[-1][1], {})
+
+    @inlineCallbacks
+    def test_download_redirected(self):
+        """A redirect of a charm download is followed."""
+        if webclient.RedirectAgent is None:
+            raise SkipTest("Redirects are not followed by this Twisted")
+        self.add_charm("cs:series/name")
+        self.store.bundles["series/other-1"] = self.bundle_data
+        del self.store.bundles["series/name-1"]
+        self.store.redirects["/charm/series/name-1"] = (
+            "%s/charm/series/other-1" % self.url_base)
+        charm = yield self.repo().find(CharmURL.parse("cs:series/name"))
+        self.assertEquals(charm.get_sha256(), self.sha256)
+
+    def test_download_redirect_not_followed(self):
+        """A redirect not followed is an error, not the charm's content."""
+        self.patch(webclient, "RedirectAgent", None)
+        self.add_charm("cs:series/name")
+        self.store.redirects["/charm/series/name-1"] = (
+            "%s/charm/series/other-1" % self.url_base)
+        return self.assert_find_error(
+            "cs:series/name", CharmNotFound,
+            "Charm 'cs:series/name-1' not found in repository %s" %
+            self.url_base)
+
+    @inlineCallbacks
+    def test_connection_reused(self):
+        """The requests to the store share a connection."""
+        repo = self.repo()
+        if not repo.client.persistent:
+            raise SkipTest("Connections are not reused by this Twisted")
+        self.add_charm("cs:series/name")
+        yield repo.find(CharmURL.parse("cs:series/name"))
+        self.assertEquals(len(self.store.requests), 2)
+        self.assertEquals(self.site.connections, 1)
+
 
 class ResolveTest(RepositoryTestBase):
 
@@ -6,6 +6,7 @@ import zookeeper
 from .command import Commander
 from .utils import ParseError
 from juju.environment.config import EnvironmentsConfig
+from juju.lib.zkprofile import enable_profiling
 
 import add_relation
 import add_unit
@@ -105,6 +106,10 @@ def setup_parser(subcommands, **kw):
         "--log-file", "-l", default=sys.stderr, type=argparse.FileType('a'),
         help="Log output to file")
 
+    parser.add_argument(
+        "--profile-zk", default=False, action="store_true",
+        help="Print a profile of the zookeeper operations at exit")
+
     subparsers = parser.add_subparsers()
 
     for module in subcommands:
@@ -133,6 +138,11 @@ def setup_logging(options):
         zookeeper.set_debug_level(0)
 
 
+def setup_profiling(options):
+    if options.profile_zk:
+        enable_profiling(stream=sys.stderr)
+
+
 def admin(args):
     """juju Admin command line interface entry point.
 
@@ -149,6 +159,7 @@ def admin(args):
     parser.set_defaults(log=log)
     options = parser.parse_args(args)
     setup_logging(options)
+    setup_profiling(options)
 
     options.command(options)
 
@@ -178,4 +189,5 @@ def main(args):
         # Otherwise, do be strict
         options = parser.parse_args(args)
     setup_logging(options)
+    setup_profiling(options)
     options.command(options)
@@ -2,6 +2,7 @@
 Command for distributed debug logging output via the cli.
 """
 
+from argparse import ArgumentTypeError
 from fnmatch import fnmatch
 import logging
 import sys
@@ -11,7 +12,7 @@ from twisted.internet.defer import inlineCallbacks
 from juju.control.options import ensure_abs_path
 from juju.control.utils import get_environment
 from juju.state.environment import GlobalSettingsStateManager
-from juju.lib.zklog import LogIterator
+from juju.lib.zklog import MergedLogIterator
 
 
 def configure_subparser(subparsers):
@@ -47,6 +48,17 @@ def configure_subparser(subparsers):
         "-n", "--limit", type=int,
         help="Show n log messages and exit.")
 
+    sub_parser.add_argument(
+        "--rate-limit", type=int, metavar="N",
+        help=("Limit the log messages shipped by each agent to n per "
+              "second, 0 disables the limit."))
+
+    sub_parser.add_argument(
+        "--sample", action="append", type=parse_sampling,
+        metavar="CHANNEL=FRACTION",
+        help=("Only ship this fraction of the log messages of a log "
+              "channel. Multiple values can be specified."))
+
     sub_parser.add_argument(
         "-o", "--output", default="-",
         help="File to log to, defaults to stdout",
@@ -55,6 +67,20 @@ def configure_subparser(subparsers):
     return sub_parser
 
 
+def parse_sampling(value):
+    """Parse a log channel sampling, ie. `hook.output=0.1`."""
+    channel, sep, fraction = value.partition("=")
+    try:
+        fraction = float(fraction)
+    except ValueError:
+        fraction = None
+    if not (channel and sep and fraction is not None and
+            0 <= fraction <= 1):
+        raise ArgumentTypeError(
+            "Invalid sampling %r, expected CHANNEL=FRACTION" % value)
+    return channel, fraction
+
+
 def command(options):
     """Distributed juju debug log watching."""
     environment = get_environment(options)
@@ -73,13 +99,19 @@ def debug_log(config, environment, log, options):
     log.info("Enabling distributed debug log.")
 
     settings_manager = GlobalSettingsStateManager(client)
+    if options.rate_limit is not None or options.sample:
+        limits = (yield settings_manager.get_debug_log_limits()) or {}
+        if options.rate_limit is not None:
+            limits["rate"] = options.rate_limit
+        if options.sample:
+            limits["sampling"] = dict(options.sample)
+        yield settings_manager.set_debug_log_limits(
+            limits.get("rate"), limits.get("burst"), limits.get("sampling"))
     yield settings_manager.set_debug_log(True)
 
     if not options.limit:
         log.info("Tailing logs - Ctrl-C to stop.")
 
-    iterator = LogIterator(client, replay=options.replay)
-
     # Setup the logging output with the user specified file.
     if options.output == "-":
         log_file = sys.stdout
@@ -90,6 +122,38 @@ def debug_log(config, environment, log, options):
     log_level = logging.getLevelName(options.level)
     handler.setLevel(log_level)
 
+    def match_names(names, patterns):
+        for name in names:
+            for pattern in patterns:
+                if fnmatch(name, pattern):
+                    return True
+        return False
+
+    def is_context_name(pattern):
+        # Logger names are dotted names, never holding a "/" or ":".
+        return not [char for char in "*?[" if char in pattern] and (
+            "/" in pattern or ":" in pattern)
+
+    # The log streams read are selected by agent and level.
+    def select(context, levelname):
+        levelno = logging.getLevelName(levelname)
+        if isinstance(levelno, int) and levelno < log_level:
+            return False
+        names = (context.split(":")[-1], context)
+        if options.exclude and match_names(names, options.exclude):
+            return False
+        # Includes may match logger names, only known from the entries
+        # themselves, unless they all are literal unit or agent names.
+        includes = options.include
+        if includes and not [include for include in includes
+                             if not is_context_name(include)]:
+            return match_names(names, includes)
+        return True
+
+    iterator = MergedLogIterator(
+        client, select=select, replay=options.replay,
+        storage=provider.get_file_storage())
+
     formatter = logging.Formatter(
         "%(asctime)s %(context)s: %(name)s %(levelname)s: %(message)s")
     handler.setFormatter(formatter)
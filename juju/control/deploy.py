@@ -99,7 +99,10 @@ def deploy(env_config, environment, repository_path, charm_name,
     if config_file:
         service_options = parse_config_options(config_file, service_name)
 
-    charm = yield repo.find(charm_url)
+    try:
+        charm = yield repo.find(charm_url)
+    finally:
+        yield repo.close()
     charm_id = str(charm_url.with_revision(charm.get_revision()))
 
     provider = environment.get_machine_provider()
@@ -1,12 +1,22 @@
 from twisted.internet.defer import inlineCallbacks, Deferred
 
 from juju.control.utils import get_environment
+from juju.errors import JujuError
+from juju.providers.common.connect import ZookeeperConnect
+from juju.state.tunnel import TunnelServer, get_tunnel_socket_path
 
 
 def configure_subparser(subparsers):
     sub_parser = subparsers.add_parser("open-tunnel", help=command.__doc__)
     sub_parser.add_argument(
         "--environment", "-e", help="Environment to operate on.")
+    sub_parser.add_argument(
+        "--shared", action="store_true", default=False,
+        help="Share the tunnel with other juju commands.")
+    sub_parser.add_argument(
+        "--idle-timeout", type=int, default=600,
+        help="Seconds without any command using a shared tunnel, after "
+        "which it is closed, 0 to keep it open (default 600).")
     # TODO Coming next:
     #sub_parser.add_argument(
     #    "unit_or_machine", nargs="*", help="Name of unit or machine")
@@ -19,6 +29,9 @@ def command(options):
     """
     environment = get_environment(options)
     provider = environment.get_machine_provider()
+    if getattr(options, "shared", False):
+        yield serve_shared_tunnel(options, environment, provider)
+        return
     yield provider.connect(share=True)
 
     options.log.info("Tunnel to the environment is open. "
@@ -27,6 +40,25 @@ def command(options):
     yield hanging_deferred()
 
 
+@inlineCallbacks
+def serve_shared_tunnel(options, environment, provider):
+    """Keep a tunnel open, serving it to other juju commands until idle."""
+    if not provider.connects_via_tunnel:
+        raise JujuError(
+            "The %s provider does not connect through a tunnel" %
+            environment.type)
+
+    server = TunnelServer(
+        lambda: ZookeeperConnect(provider, shared_tunnel=False).run(
+            share=True),
+        options.idle_timeout or None)
+    yield server.start(get_tunnel_socket_path(environment.name))
+
+    options.log.info("Shared tunnel to the environment is open. "
+                     "Press CTRL-C to close it.")
+    yield server.stopped
+
+
 def hanging_deferred():
     # Hang forever.
     return Deferred()
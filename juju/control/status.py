@@ -9,6 +9,8 @@ import yaml
 
 from juju.errors import  ProviderError
 from juju.environment.errors import EnvironmentsConfigError
+from juju.state.agent import (
+    PresenceIndex, MACHINE_AGENTS_PATH, UNIT_AGENTS_PATH)
 from juju.state.errors import UnitRelationStateNotFound
 from juju.state.charm import CharmStateManager
 from juju.state.machine import MachineStateManager
@@ -144,6 +146,12 @@ def collect(scope, machine_provider, client, log):
     machine_manager = MachineStateManager(client)
     charm_manager = CharmStateManager(client)
 
+    # Read the presence of all agents up front, rather than per entity.
+    unit_presence = PresenceIndex(client, UNIT_AGENTS_PATH)
+    machine_presence = PresenceIndex(client, MACHINE_AGENTS_PATH)
+    yield unit_presence.snapshot()
+    yield machine_presence.snapshot()
+
     service_data = {}
     machine_data = {}
     state = dict(services=service_data, machines=machine_data)
@@ -198,7 +206,7 @@ def collect(scope, machine_provider, client, log):
             if not unit_state:
                 u["state"] = "pending"
             else:
-                unit_connected = yield unit.has_agent()
+                unit_connected = yield unit_presence.check_agent(unit)
                 u["state"] = unit_state if unit_connected else "down"
             if exposed:
                 open_ports = yield unit.get_open_ports()
@@ -275,7 +283,7 @@ def collect(scope, machine_provider, client, log):
                 pm = yield machine_provider.get_machine(instance_id)
                 m["dns-name"] = pm.dns_name
                 m["instance-state"] = pm.state
-                if (yield machine_state.has_agent()):
+                if (yield machine_presence.check_agent(machine_state)):
                     # if the agent's connected, we're fine
                     m["state"] = "running"
                 else:
@@ -1,6 +1,7 @@
 import logging
 import time
 import os
+import sys
 
 from StringIO import StringIO
 from argparse import Namespace
@@ -9,7 +10,7 @@ from yaml import dump
 from twisted.internet.defer import inlineCallbacks
 
 from juju.environment.errors import EnvironmentsConfigError
-from juju.control import setup_logging, main, setup_parser
+from juju.control import setup_logging, setup_profiling, main, setup_parser
 from juju.control.options import ensure_abs_path
 from juju.control.command import Commander
 
@@ -190,6 +191,15 @@ class ControlLoggingTest(TestCase):
         setup_logging(Namespace(verbose=False, log_file=None))
         self.assertNotEqual(root.handlers, [])
 
+    def test_profiling(self):
+        """The --profile-zk flag enables zookeeper profiling."""
+        enable_profiling = self.mocker.replace(
+            "juju.control.enable_profiling")
+        enable_profiling(stream=sys.stderr)
+        self.mocker.replay()
+        setup_profiling(Namespace(profile_zk=False))
+        setup_profiling(Namespace(profile_zk=True))
+
     def tearDown(self):
         # remove the logging handlers we installed
         root = logging.getLogger()
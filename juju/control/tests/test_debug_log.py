@@ -1,10 +1,15 @@
+from argparse import ArgumentTypeError
 import json
+import logging
 import yaml
 
 from twisted.internet.defer import inlineCallbacks
 
 from juju.control import main
+from juju.control.debug_log import parse_sampling
 from juju.control.tests.common import ControlToolTest
+from juju.lib.zklog import ZookeeperHandler
+from juju.state.environment import GlobalSettingsStateManager
 from juju.lib.tests.test_zklog import LogTestBase
 
 
@@ -174,6 +179,91 @@ class ControlDebugLogTest(LogTestBase, ControlToolTest):
         self.assertNotIn("provisioning", output)
         self.assertIn("mysql/1", output)
 
+    @inlineCallbacks
+    def test_partitioned_streams(self):
+        """Only the streams of the included agents and level are read."""
+        log = logging.getLogger("hook.output")
+        log.setLevel(logging.DEBUG)
+        handlers = []
+        for context in ("unit:cassandra/1", "unit:mysql/1"):
+            handler = ZookeeperHandler(
+                self.client, context, batch_size=100, partitioned=True)
+            yield handler.open()
+            log.addHandler(handler)
+            self.addCleanup(log.removeHandler, handler)
+            handlers.append(handler)
+        for i in range(3):
+            log.debug("debug %s" % i)
+            log.warning("warning %s" % i)
+        for handler in handlers:
+            yield handler.flush()
+
+        cli_done = self.setup_cli_reactor()
+        self.setup_exit()
+        self.mocker.replay()
+
+        stream = self.capture_stream("stdout")
+        main(["debug-log", "-i", "mysql/1", "-l", "WARNING", "-n", "3"])
+        yield cli_done
+
+        output = stream.getvalue()
+        self.assertNotIn("cassandra/1", output)
+        self.assertNotIn("debug", output)
+        for i in range(3):
+            self.assertIn("unit:mysql/1: hook.output WARNING: warning %s" % i,
+                          output)
+
+    @inlineCallbacks
+    def test_partitioned_include_log_glob(self):
+        """An include glob without a dot still matches logger names."""
+        log = logging.getLogger("hook.output")
+        log.setLevel(logging.DEBUG)
+        handler = ZookeeperHandler(
+            self.client, "unit:mysql/1", batch_size=100, partitioned=True)
+        yield handler.open()
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        log.info("hello")
+        yield handler.flush()
+
+        cli_done = self.setup_cli_reactor()
+        self.setup_exit()
+        self.mocker.replay()
+
+        stream = self.capture_stream("stdout")
+        main(["debug-log", "-i", "hook*", "-n", "1"])
+        yield cli_done
+        self.assertIn("unit:mysql/1: hook.output INFO: hello",
+                      stream.getvalue())
+
+    @inlineCallbacks
+    def test_rate_limit(self):
+        """The rate limits of the agents' log messages can be set."""
+        log = yield self.get_configured_log("hook.output", "unit:mysql/1")
+        log.info("hello")
+
+        cli_done = self.setup_cli_reactor()
+        self.setup_exit()
+        self.mocker.replay()
+
+        self.capture_stream("stdout")
+        main(["debug-log", "--rate-limit", "10",
+              "--sample", "hook.output=0.5", "-n", "1"])
+        yield cli_done
+
+        limits = yield GlobalSettingsStateManager(
+            self.client).get_debug_log_limits()
+        self.assertEqual(
+            limits,
+            {"rate": 10, "burst": None, "sampling": {"hook.output": 0.5}})
+
+    def test_invalid_sampling(self):
+        self.assertRaises(
+            ArgumentTypeError, parse_sampling, "hook.output=2")
+        self.assertRaises(ArgumentTypeError, parse_sampling, "hook.output")
+        self.assertEqual(
+            parse_sampling("hook.output=0.1"), ("hook.output", 0.1))
+
     @inlineCallbacks
     def test_complex_filter(self):
         """Messages can be filtered to include only certain log channels."""
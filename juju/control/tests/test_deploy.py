@@ -7,6 +7,7 @@ from juju.control import deploy, main
 from juju.environment.environment import Environment
 from juju.environment.config import EnvironmentsConfig
 from juju.charm.errors import ServiceConfigValueError
+from juju.charm.repository import LocalCharmRepository
 from juju.state.environment import EnvironmentStateManager
 from juju.state.errors import ServiceStateNameInUse
 from juju.state.service import ServiceStateManager
@@ -114,6 +115,17 @@ class ControlDeployTest(MachineControlToolTest):
             self.client).get_service_state("sample")
         self.assertEqual(service.service_name, "sample")
 
+    @inlineCallbacks
+    def test_deploy_repository_closed(self):
+        """The repository is closed once the charm is found."""
+        closed = []
+        self.patch(LocalCharmRepository, "close",
+                   lambda repository: succeed(closed.append(repository)))
+        environment = self.config.get("firstenv")
+        yield deploy.deploy(self.config, environment, self.unbundled_repo_path,
+                            "local:sample", None, logging.getLogger("deploy"))
+        self.assertEqual(len(closed), 1)
+
     def xtest_deploy_with_nonexistent_environment_specified(self):
         self.capture_logging()
         self.setup_cli_reactor()
@@ -42,3 +42,19 @@ class OpenTunnelTest(ControlToolTest):
             lines,
             ["Tunnel to the environment is open. Press CTRL-C to close it.",
              "'open_tunnel' command finished successfully"])
+
+    def test_open_shared_tunnel_unsupported(self):
+        """Only providers connecting through an ssh tunnel can share it."""
+        config = {
+            "environments": {
+                "firstenv": {
+                    "type": "dummy", "admin-secret": "homer"}}}
+        self.write_config(dump(config))
+        self.setup_cli_reactor()
+        self.setup_exit(1)
+        self.mocker.replay()
+
+        stderr = self.capture_stream("stderr")
+        main(["open-tunnel", "--shared"])
+        self.assertIn("The dummy provider does not connect through a tunnel",
+                      stderr.getvalue())
@@ -5,6 +5,7 @@ import logging
 import os
 from StringIO import StringIO
 import yaml
+import zookeeper
 
 from twisted.internet.defer import inlineCallbacks, returnValue
 
@@ -14,6 +15,7 @@ from juju.agents.unit import UnitAgent
 from juju.environment.environment import Environment
 from juju.control import status
 from juju.control import tests
+from juju.state.agent import AgentStateMixin
 from juju.state.endpoint import RelationEndpoint
 from juju.state.environment import GlobalSettingsStateManager
 from juju.state.tests.test_service import ServiceStateManagerTestBase
@@ -388,6 +390,34 @@ class StatusTest(StatusTestBase):
                             "cache": {"state": "down"}},
                         "state": "installed"}}})
 
+    @inlineCallbacks
+    def test_collect_uses_presence_index(self):
+        """Agent liveness is read for all entities at once."""
+        yield self.build_topology(skip_unit_agents=("varnish/1",))
+
+        def has_agent(domain_object):
+            self.fail("Unexpected has_agent for %s" % domain_object)
+        self.patch(AgentStateMixin, "has_agent", has_agent)
+
+        state = yield status.collect(None, self.provider, self.client, None)
+        units = state["services"]["varnish"]["units"]
+        self.assertEqual(units["varnish/0"]["state"], "started")
+        self.assertEqual(units["varnish/1"]["state"], "down")
+
+    @inlineCallbacks
+    def test_collect_legacy_agents(self):
+        """Agents of earlier versions, while upgrading, aren't down."""
+        state = yield self.build_topology(skip_unit_agents=("varnish/1",))
+        unit = state["relations"]["varnish"][1]
+        self.assertEqual(unit.unit_name, "varnish/1")
+        yield self.client.create(
+            "/units/%s/agent" % unit.internal_id,
+            flags=zookeeper.EPHEMERAL)
+
+        state = yield status.collect(None, self.provider, self.client, None)
+        units = state["services"]["varnish"]["units"]
+        self.assertEqual(units["varnish/1"]["state"], "started")
+
     @inlineCallbacks
     def test_collect_filtering(self):
         yield self.build_topology()
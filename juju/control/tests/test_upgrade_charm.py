@@ -1,11 +1,11 @@
-import json
 import os
 from yaml import dump
 
 from twisted.internet.defer import inlineCallbacks, succeed
 
 from juju.charm.directory import CharmDirectory
-from juju.charm.repository import LocalCharmRepository
+from juju.charm.repository import (
+    LocalCharmRepository, RemoteCharmRepository)
 from juju.charm.tests.test_metadata import test_repository_path
 from juju.charm.url import CharmURL
 from juju.control import main
@@ -384,17 +384,21 @@ class RemoteUpgradeCharmTest(MachineControlToolTest):
         self.output = self.capture_logging()
         self.stderr = self.capture_stream("stderr")
 
+    def mock_store_info(self, infos):
+        def get_info(repository, charm_urls):
+            self.assertEqual(
+                repository.url_base, "https://store.juju.ubuntu.com")
+            self.assertEqual(map(str, charm_urls), infos.keys())
+            return succeed(infos)
+        self.patch(RemoteCharmRepository, "get_info", get_info)
+
     @inlineCallbacks
     def test_latest_dry_run(self):
         """Do nothing; log that nothing would be done"""
         finished = self.setup_cli_reactor()
         self.setup_exit(0)
-        getPage = self.mocker.replace("twisted.web.client.getPage")
-        getPage(
-            "https://store.juju.ubuntu.com/"
-            "charm-info?charms=cs%3Aseries/mysql")
-        self.mocker.result(succeed(json.dumps(
-            {"cs:series/mysql": {"revision": 1, "sha256": "whatever"}})))
+        self.mock_store_info(
+            {"cs:series/mysql": {"revision": 1, "sha256": "whatever"}})
         self.mocker.replay()
 
         main(["upgrade-charm", "--dry-run", "mysql"])
@@ -406,17 +410,30 @@ class RemoteUpgradeCharmTest(MachineControlToolTest):
         upgrade_flag = yield self.service_unit1.get_upgrade_flag()
         self.assertFalse(upgrade_flag)
 
+    @inlineCallbacks
+    def test_store_connections_closed(self):
+        """The connections to the store are closed once upgraded."""
+        finished = self.setup_cli_reactor()
+        self.setup_exit(0)
+        self.mock_store_info(
+            {"cs:series/mysql": {"revision": 1, "sha256": "whatever"}})
+        closed = []
+        self.patch(RemoteCharmRepository, "close",
+                   lambda repository: succeed(closed.append(repository)))
+        self.mocker.replay()
+
+        main(["upgrade-charm", "--dry-run", "mysql"])
+        yield finished
+        self.assertEqual(len(closed), 1)
+
     @inlineCallbacks
     def test_latest_live_fire(self):
         """Do nothing; log that nothing was done"""
         finished = self.setup_cli_reactor()
         self.setup_exit(0)
 
-        getPage = self.mocker.replace("twisted.web.client.getPage")
-        getPage(
-            "https://store.juju.ubuntu.com/charm-info?charms=cs%3Aseries/mysql")
-        self.mocker.result(succeed(json.dumps(
-            {"cs:series/mysql": {"revision": 1, "sha256": "whatever"}})))
+        self.mock_store_info(
+            {"cs:series/mysql": {"revision": 1, "sha256": "whatever"}})
         self.mocker.replay()
 
         main(["upgrade-charm", "mysql"])
@@ -67,47 +67,52 @@ def upgrade_charm(
         str(old_charm_url.with_revision(None)),
         repository_path,
         environment.default_series)
-    new_charm_url = charm_url.with_revision(
-        (yield repo.latest(charm_url)))
-
-    if charm_url.collection.schema == "local":
-        if old_charm_url.revision >= new_charm_url.revision:
-            new_revision = old_charm_url.revision + 1
+    try:
+        new_charm_url = charm_url.with_revision(
+            (yield repo.latest(charm_url)))
+
+        if charm_url.collection.schema == "local":
+            if old_charm_url.revision >= new_charm_url.revision:
+                new_revision = old_charm_url.revision + 1
+                charm = yield repo.find(new_charm_url)
+                if isinstance(charm, CharmDirectory):
+                    if dry_run:
+                        log.info("%s would be set to revision %s",
+                                 charm.path, new_revision)
+                    else:
+                        log.info("Setting %s to revision %s",
+                                 charm.path, new_revision)
+                        charm.set_revision(new_revision)
+                    new_charm_url.revision = new_revision
+
+        new_charm_id = str(new_charm_url)
+
+        # Verify its newer than what's deployed
+        if not new_charm_url.revision > old_charm_url.revision:
+            if dry_run:
+                log.info(
+                    "Service already running latest charm %r", old_charm_id)
+            else:
+                raise NewerCharmNotFound(old_charm_id)
+        elif dry_run:
+            log.info("Service would be upgraded from charm %r to %r",
+                     old_charm_id, new_charm_id)
+
+        # On dry run, stop before modifying state.
+        if not dry_run:
+            # Publish the new charm
+            storage = provider.get_file_storage()
+            publisher = CharmPublisher(client, storage)
             charm = yield repo.find(new_charm_url)
-            if isinstance(charm, CharmDirectory):
-                if dry_run:
-                    log.info("%s would be set to revision %s",
-                             charm.path, new_revision)
-                else:
-                    log.info("Setting %s to revision %s",
-                             charm.path, new_revision)
-                    charm.set_revision(new_revision)
-                new_charm_url.revision = new_revision
-
-    new_charm_id = str(new_charm_url)
-
-    # Verify its newer than what's deployed
-    if not new_charm_url.revision > old_charm_url.revision:
-        if dry_run:
-            log.info("Service already running latest charm %r", old_charm_id)
-        else:
-            raise NewerCharmNotFound(old_charm_id)
-    elif dry_run:
-        log.info("Service would be upgraded from charm %r to %r",
-                 old_charm_id, new_charm_id)
-
-    # On dry run, stop before modifying state.
-    if not dry_run:
-        # Publish the new charm
-        storage = provider.get_file_storage()
-        publisher = CharmPublisher(client, storage)
-        charm = yield repo.find(new_charm_url)
-        yield publisher.add_charm(new_charm_id, charm)
-        result = yield publisher.publish()
-        charm_state = result[0]
-
-        # Update the service charm reference
-        yield service_state.set_charm_id(charm_state.id)
+            yield publisher.add_charm(
+                new_charm_id, charm, base_charm_id=old_charm_id)
+            result = yield publisher.publish()
+            charm_state = result[0]
+
+            # Update the service charm reference
+            yield service_state.set_charm_id(charm_state.id)
+    finally:
+        yield repo.close()
 
     # Mark the units for upgrades
     units = yield service_state.get_all_unit_states()
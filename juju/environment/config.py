@@ -3,7 +3,7 @@ import yaml
 import uuid
 
 from juju.lib.schema import (SchemaError, KeyDict, Dict, String,
-                                 Constant, OneOf, SelectDict)
+                                 Constant, OneOf, SelectDict, Int)
 from juju.errors import FileNotFound, FileAlreadyExists
 
 from juju.environment.environment import Environment
@@ -44,10 +44,20 @@ SCHEMA = KeyDict({
                         "placement": OneOf(
                                 Constant("unassigned"),
                                 Constant("local")),
+                        "machine-pool-size": Int(),
+                        "machine-pool-refill-rate": Int(),
+                        "machine-pool-idle-timeout": Int(),
+                        "debug-log-max-entries": Int(),
+                        "debug-log-max-age": Int(),
                         "default-series": String()},
                        optional=["access-key", "secret-key",
                                  "default-instance-type", "default-ami",
-                                 "region", "ec2-uri", "s3-uri", "placement"]),
+                                 "region", "ec2-uri", "s3-uri", "placement",
+                                 "machine-pool-size",
+                                 "machine-pool-refill-rate",
+                                 "machine-pool-idle-timeout",
+                                 "debug-log-max-entries",
+                                 "debug-log-max-age"]),
         "orchestra": KeyDict({"orchestra-server": String(),
                               "orchestra-user": String(),
                               "orchestra-pass": String(),
@@ -58,9 +68,19 @@ SCHEMA = KeyDict({
                               "storage-user": String(),
                               "storage-pass": String(),
                               "placement": String(),
+                              "machine-pool-size": Int(),
+                              "machine-pool-refill-rate": Int(),
+                              "machine-pool-idle-timeout": Int(),
+                              "debug-log-max-entries": Int(),
+                              "debug-log-max-age": Int(),
                               "default-series": String()},
                              optional=["storage-url", "storage-user",
-                                       "storage-pass", "placement"]),
+                                       "storage-pass", "placement",
+                                       "machine-pool-size",
+                                       "machine-pool-refill-rate",
+                                       "machine-pool-idle-timeout",
+                                       "debug-log-max-entries",
+                                       "debug-log-max-age"]),
         "local": KeyDict({"admin-secret": String(),
                         "data-dir": String(),
                         "placement": Constant("local"),
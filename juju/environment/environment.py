@@ -47,6 +47,33 @@ class Environment(object):
         """
         return self._environment_config.get("placement")
 
+    @property
+    def machine_pool(self):
+        """The settings of the standby machine pool.
+
+        Returns a dictionary of keyword arguments for a
+        L{juju.state.pool.MachinePoolManager}, the pool is disabled
+        unless a machine-pool-size is set.
+        """
+        return {
+            "size": self._environment_config.get("machine-pool-size", 0),
+            "refill_rate": self._environment_config.get(
+                "machine-pool-refill-rate", 1),
+            "idle_timeout": self._environment_config.get(
+                "machine-pool-idle-timeout")}
+
+    @property
+    def debug_log_retention(self):
+        """The retention of the debug log entries stored in zookeeper.
+
+        Returns a dictionary of keyword arguments for the configuration
+        of a L{juju.lib.zklog.LogJanitor}.
+        """
+        return {
+            "max_entries": self._environment_config.get(
+                "debug-log-max-entries", 10000),
+            "max_age": self._environment_config.get("debug-log-max-age")}
+
     @property
     def default_series(self):
         """The Ubuntu series to run on machines in this environment."""
@@ -579,6 +579,47 @@ class EnvironmentsConfigTest(EnvironmentsConfigTestBase):
         provider = self.config.get_default().get_machine_provider()
         self.assertEqual(provider.config["default-series"], "astounding")
 
+    def test_ec2_machine_pool(self):
+        self.config.write_sample()
+        with open(self.default_path) as f:
+            config = yaml.load(f.read())
+        config["environments"]["sample"]["machine-pool-size"] = 3
+        config["environments"]["sample"]["machine-pool-idle-timeout"] = 600
+        self.write_config(yaml.dump(config), other_path=True)
+
+        self.config.load(self.other_path)
+        self.assertEqual(
+            self.config.get_default().machine_pool,
+            {"size": 3, "refill_rate": 1, "idle_timeout": 600})
+
+    def test_ec2_debug_log_retention(self):
+        self.config.write_sample()
+        with open(self.default_path) as f:
+            config = yaml.load(f.read())
+        self.write_config(yaml.dump(config), other_path=True)
+        self.config.load(self.other_path)
+        self.assertEqual(
+            self.config.get_default().debug_log_retention,
+            {"max_entries": 10000, "max_age": None})
+
+        config["environments"]["sample"]["debug-log-max-entries"] = 500
+        config["environments"]["sample"]["debug-log-max-age"] = 86400
+        self.write_config(yaml.dump(config), other_path=True)
+        self.config.load(self.other_path)
+        self.assertEqual(
+            self.config.get_default().debug_log_retention,
+            {"max_entries": 500, "max_age": 86400})
+
+    def test_ec2_verifies_machine_pool(self):
+        self.config.write_sample()
+        with open(self.default_path) as f:
+            config = yaml.load(f.read())
+        config["environments"]["sample"]["machine-pool-size"] = "many"
+        self.write_config(yaml.dump(config), other_path=True)
+
+        self.assertRaises(
+            EnvironmentsConfigError, self.config.load, self.other_path)
+
     def test_orchestra_schema_requires(self):
         requires = (
             "type orchestra-server orchestra-user orchestra-pass "
@@ -21,6 +21,7 @@ from twisted.internet.defer import inlineCallbacks, Deferred, returnValue
 
 from juju.errors import FileNotFound, EnvironmentNotFound
 from juju.providers.ec2 import MachineProvider
+from juju.providers.ec2.files import FileStorage
 from juju.state.sshclient import SSHClient
 
 from juju.lib.testing import TestCase
@@ -245,6 +246,15 @@ class EC2StorageTest(EC2ProviderFunctionalTest):
         s3_content = file_obj.read()
         self.assertEqual(content, s3_content)
 
+    @inlineCallbacks
+    def test_put_object_multipart(self):
+        self.patch(FileStorage, "part_size", 5 * 1024 * 1024)
+        content = "snakes eat rubies" * 400000
+        yield self.storage.put("files/reptiles.txt", StringIO(content))
+
+        file_obj = yield self.storage.get("files/reptiles.txt")
+        self.assertEqual(content, file_obj.read())
+
     def test_get_object_nonexistant(self):
         remote_path = "files/reptile.txt"
         d = self.storage.get(remote_path)
@@ -0,0 +1,397 @@
+"""An in-memory stand-in for a zookeeper server and its clients.
+
+A L{FakeZookeeperServer} holds a zookeeper tree in memory, and
+L{FakeZookeeperClient} implements the txzookeeper client api juju uses
+against it: node creation (sequence and ephemeral), reads, writes and
+deletion with versions, children, one-shot data and child watches,
+ACLs with digest authentication, and session expiry.
+
+Operation results and watch events are delivered in the order they were
+produced, from a single queue, after an optional injected latency. With
+a L{twisted.internet.task.Clock}, delivery only happens when the clock
+is advanced, which makes large simulations deterministic and
+independent of the wall clock.
+"""
+import posixpath
+
+import zookeeper
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.python.failure import Failure
+
+from txzookeeper.client import ClientEvent, ZOO_OPEN_ACL_UNSAFE
+
+from juju.state.auth import make_identity
+
+
+class _Node(object):
+
+    def __init__(self, data, acls, zxid, now, ephemeral_owner=0):
+        self.data = data
+        self.acls = list(acls)
+        self.children = set()
+        self.version = 0
+        self.cversion = 0
+        self.aversion = 0
+        self.czxid = self.mzxid = self.pzxid = zxid
+        self.ctime = self.mtime = now
+        self.ephemeral_owner = ephemeral_owner
+
+    def get_stat(self):
+        return {
+            "czxid": self.czxid, "mzxid": self.mzxid, "pzxid": self.pzxid,
+            "ctime": self.ctime, "mtime": self.mtime,
+            "version": self.version, "cversion": self.cversion,
+            "aversion": self.aversion,
+            "ephemeralOwner": self.ephemeral_owner,
+            "dataLength": len(self.data), "numChildren": len(self.children)}
+
+
+class _Session(object):
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.identities = set()
+        self.expired = False
+
+
+class FakeZookeeperServer(object):
+    """An in-memory zookeeper tree, shared by its clients.
+
+    :param latency: Seconds before an operation's result or a watch event
+        is delivered, or a callable returning that delay. Defaults to 0.
+    :param clock: The L{twisted.internet.interfaces.IReactorTime} used to
+        schedule deliveries, the reactor by default.
+    """
+
+    def __init__(self, latency=0, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.latency = latency
+        self._zxid = 0
+        self._session_ids = 0
+        self._sessions = {}
+        self._nodes = {"/": self._make_node("", [ZOO_OPEN_ACL_UNSAFE])}
+        self._nodes["/zookeeper"] = self._make_node("", [ZOO_OPEN_ACL_UNSAFE])
+        self._nodes["/"].children.add("zookeeper")
+        # path -> [(session, watch deferred)]
+        self._data_watches = {}
+        self._child_watches = {}
+        self._queue = []
+        self._last_due = 0
+        self._delivery = None
+
+    def _make_node(self, data, acls, ephemeral_owner=0):
+        self._zxid += 1
+        return _Node(data, acls, self._zxid,
+                     int(self.clock.seconds() * 1000), ephemeral_owner)
+
+    # Scheduling
+
+    def _get_latency(self):
+        if callable(self.latency):
+            return self.latency()
+        return self.latency or 0
+
+    def _deliver(self, d, result):
+        """Queue the delivery of `result` on `d`.
+
+        Deliveries keep the order they are queued in, even when the
+        injected latency varies.
+        """
+        due = max(self.clock.seconds() + self._get_latency(), self._last_due)
+        self._last_due = due
+        self._queue.append((due, d, result))
+        if self._delivery is None:
+            self._delivery = self.clock.callLater(
+                max(0, due - self.clock.seconds()), self._run_queue)
+
+    def _run_queue(self):
+        self._delivery = None
+        now = self.clock.seconds()
+        while self._queue and self._queue[0][0] <= now:
+            due, d, result = self._queue.pop(0)
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        if self._queue and self._delivery is None:
+            self._delivery = self.clock.callLater(
+                max(0, self._queue[0][0] - now), self._run_queue)
+
+    # Sessions
+
+    def open_session(self):
+        self._session_ids += 1
+        session = _Session(self._session_ids)
+        self._sessions[session.id] = session
+        return session
+
+    def close_session(self, session):
+        """End a session, removing its ephemeral nodes and its watches."""
+        self._sessions.pop(session.id, None)
+        for watches in (self._data_watches, self._child_watches):
+            for path in watches.keys():
+                watches[path] = [
+                    (owner, d) for owner, d in watches[path]
+                    if owner is not session]
+                if not watches[path]:
+                    del watches[path]
+        ephemerals = sorted(
+            [path for path, node in self._nodes.items()
+             if node.ephemeral_owner == session.id], reverse=True)
+        for path in ephemerals:
+            self._delete(path)
+
+    def expire_session(self, client):
+        """Expire the session of `client`, as the server would."""
+        session = client._session
+        if session is None:
+            return
+        session.expired = True
+        self.close_session(session)
+        client._session_expired()
+
+    # Tree operations, raising zookeeper exceptions.
+
+    def _check_path(self, path):
+        if (not isinstance(path, basestring) or not path.startswith("/") or
+                (path != "/" and path.endswith("/")) or "//" in path):
+            raise zookeeper.BadArgumentsException("bad arguments")
+
+    def _get_node(self, path):
+        self._check_path(path)
+        node = self._nodes.get(path)
+        if node is None:
+            raise zookeeper.NoNodeException("no node")
+        return node
+
+    def _check_perms(self, session, node, perm):
+        for ace in node.acls:
+            if not ace["perms"] & perm:
+                continue
+            if ace["scheme"] == "world" and ace["id"] == "anyone":
+                return
+            if (ace["scheme"], ace["id"]) in session.identities:
+                return
+        raise zookeeper.NoAuthException("not authenticated")
+
+    def _fire(self, watches, path, event_type):
+        for session, d in watches.pop(path, ()):
+            self._deliver(d, ClientEvent(
+                event_type, zookeeper.CONNECTED_STATE, path))
+
+    def create(self, session, path, data, acls, flags):
+        self._check_path(path)
+        if path == "/":
+            raise zookeeper.NodeExistsException("node exists")
+        parent_path = posixpath.dirname(path)
+        parent = self._get_node(parent_path)
+        self._check_perms(session, parent, zookeeper.PERM_CREATE)
+        if parent.ephemeral_owner:
+            raise zookeeper.NoChildrenForEphemeralsException(
+                "no children for ephemerals")
+        if flags & zookeeper.SEQUENCE:
+            path = "%s%010d" % (path, parent.cversion)
+        if path in self._nodes:
+            raise zookeeper.NodeExistsException("node exists")
+        if not acls:
+            raise zookeeper.InvalidACLException("invalid acl")
+        ephemeral_owner = flags & zookeeper.EPHEMERAL and session.id or 0
+        node = self._nodes[path] = self._make_node(
+            data or "", acls, ephemeral_owner)
+        parent.children.add(posixpath.basename(path))
+        parent.cversion += 1
+        parent.pzxid = node.czxid
+        self._fire(self._data_watches, path, zookeeper.CREATED_EVENT)
+        self._fire(self._child_watches, parent_path, zookeeper.CHILD_EVENT)
+        return path
+
+    def delete(self, session, path, version):
+        node = self._get_node(path)
+        if path in ("/", "/zookeeper"):
+            raise zookeeper.BadArgumentsException("bad arguments")
+        self._check_perms(
+            session, self._nodes[posixpath.dirname(path)],
+            zookeeper.PERM_DELETE)
+        if version != -1 and version != node.version:
+            raise zookeeper.BadVersionException("bad version")
+        if node.children:
+            raise zookeeper.NotEmptyException("not empty")
+        self._delete(path)
+
+    def _delete(self, path):
+        del self._nodes[path]
+        parent_path = posixpath.dirname(path)
+        parent = self._nodes[parent_path]
+        parent.children.discard(posixpath.basename(path))
+        parent.cversion += 1
+        self._zxid += 1
+        parent.pzxid = self._zxid
+        self._fire(self._data_watches, path, zookeeper.DELETED_EVENT)
+        self._fire(self._child_watches, path, zookeeper.DELETED_EVENT)
+        self._fire(self._child_watches, parent_path, zookeeper.CHILD_EVENT)
+
+    def exists(self, session, path, watch=None):
+        self._check_path(path)
+        if watch is not None:
+            self._data_watches.setdefault(path, []).append((session, watch))
+        node = self._nodes.get(path)
+        return node and node.get_stat() or None
+
+    def get(self, session, path, watch=None):
+        node = self._get_node(path)
+        self._check_perms(session, node, zookeeper.PERM_READ)
+        if watch is not None:
+            self._data_watches.setdefault(path, []).append((session, watch))
+        return node.data, node.get_stat()
+
+    def get_children(self, session, path, watch=None):
+        node = self._get_node(path)
+        self._check_perms(session, node, zookeeper.PERM_READ)
+        if watch is not None:
+            self._child_watches.setdefault(path, []).append((session, watch))
+        return sorted(node.children)
+
+    def set(self, session, path, data, version):
+        node = self._get_node(path)
+        self._check_perms(session, node, zookeeper.PERM_WRITE)
+        if version != -1 and version != node.version:
+            raise zookeeper.BadVersionException("bad version")
+        self._zxid += 1
+        node.data = data or ""
+        node.version += 1
+        node.mzxid = self._zxid
+        node.mtime = int(self.clock.seconds() * 1000)
+        self._fire(self._data_watches, path, zookeeper.CHANGED_EVENT)
+        return node.get_stat()
+
+    def get_acl(self, session, path):
+        node = self._get_node(path)
+        return [dict(ace) for ace in node.acls], node.get_stat()
+
+    def set_acl(self, session, path, acls, version):
+        node = self._get_node(path)
+        self._check_perms(session, node, zookeeper.PERM_ADMIN)
+        if version != -1 and version != node.aversion:
+            raise zookeeper.BadVersionException("bad version")
+        if not acls:
+            raise zookeeper.InvalidACLException("invalid acl")
+        node.acls = [dict(ace) for ace in acls]
+        node.aversion += 1
+        return node.get_stat()
+
+
+class FakeZookeeperClient(object):
+    """A txzookeeper client api, served by a L{FakeZookeeperServer}.
+
+    Watches of a closed or expired session never fire, and operations
+    on it fail with `ConnectionLossException` or
+    `SessionExpiredException`.
+    """
+
+    def __init__(self, server, servers=None, session_timeout=None):
+        self.server = server
+        self.servers = servers
+        self.session_timeout = session_timeout
+        self._session = None
+        self._expired = False
+        self._session_callback = None
+
+    @property
+    def connected(self):
+        return self._session is not None
+
+    @property
+    def session_id(self):
+        return self._session and self._session.id or None
+
+    def connect(self, servers=None, timeout=None):
+        """Open a new session, returns a deferred firing with the client."""
+        if servers is not None:
+            self.servers = servers
+        self._session = self.server.open_session()
+        self._expired = False
+        d = Deferred()
+        self.server._deliver(d, self)
+        return d
+
+    def close(self):
+        """Close the session, removing its ephemeral nodes."""
+        if self._session is not None:
+            session, self._session = self._session, None
+            self.server.close_session(session)
+        return succeed(None)
+
+    def set_session_callback(self, callback):
+        """Set a callback invoked with the session expiration event."""
+        self._session_callback = callback
+
+    def _session_expired(self):
+        self._session = None
+        self._expired = True
+        if self._session_callback is not None:
+            self._session_callback(self, ClientEvent(
+                zookeeper.SESSION_EVENT, zookeeper.EXPIRED_SESSION_STATE, ""))
+
+    def _call(self, operation, *args):
+        d = Deferred()
+        try:
+            if self._session is None:
+                if self._expired:
+                    raise zookeeper.SessionExpiredException(
+                        "session expired")
+                raise zookeeper.ConnectionLossException("not connected")
+            result = getattr(self.server, operation)(self._session, *args)
+        except zookeeper.ZooKeeperException:
+            result = Failure()
+        self.server._deliver(d, result)
+        return d
+
+    def _call_and_watch(self, operation, path):
+        watch = Deferred()
+        return self._call(operation, path, watch), watch
+
+    def add_auth(self, scheme, identity):
+        if scheme != "digest":
+            raise zookeeper.AuthFailedException("unknown scheme")
+        d = Deferred()
+        if self._session is not None:
+            self._session.identities.add(
+                ("digest", make_identity(identity)))
+        self.server._deliver(d, None)
+        return d
+
+    def create(self, path, data="", acls=[ZOO_OPEN_ACL_UNSAFE], flags=0):
+        return self._call("create", path, data, acls, flags)
+
+    def delete(self, path, version=-1):
+        return self._call("delete", path, version)
+
+    def exists(self, path):
+        return self._call("exists", path)
+
+    def exists_and_watch(self, path):
+        return self._call_and_watch("exists", path)
+
+    def get(self, path):
+        return self._call("get", path)
+
+    def get_and_watch(self, path):
+        return self._call_and_watch("get", path)
+
+    def get_children(self, path):
+        return self._call("get_children", path)
+
+    def get_children_and_watch(self, path):
+        return self._call_and_watch("get_children", path)
+
+    def set(self, path, data="", version=-1):
+        return self._call("set", path, data, version)
+
+    def get_acl(self, path):
+        return self._call("get_acl", path)
+
+    def set_acl(self, path, acls, version=-1):
+        return self._call("set_acl", path, acls, version)
@@ -0,0 +1,107 @@
+"""
+Rate limiting and sampling of the log records shipped by an agent.
+
+A runaway process, ie. a hook printing in a loop, can emit records far
+faster than they can be stored remotely. A L{LogRateLimiter} attached to
+a log handler passes the records of a log channel according to its
+sampling rate, and then within the rate of a token bucket shared by all
+the records of the handler's context. Records past the rate are
+suppressed, and counted so that the handler can report them.
+"""
+import logging
+import time
+
+
+class TokenBucket(object):
+    """A token bucket, refilled at `rate` tokens per second up to `burst`.
+    """
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now if now is not None else time.time()
+
+    def consume(self, now=None):
+        """Take a token from the bucket, returning False if it is empty."""
+        if now is None:
+            now = time.time()
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LogRateLimiter(logging.Filter):
+    """A log filter passing records within a rate, and sampled by channel.
+
+    :param rate: The sustained number of records passed per second, the
+        records are not rate limited if None.
+    :param burst: The number of records passed in a burst, defaults to
+        the rate.
+    :param sampling: A dictionary of the fraction of the records passed
+        by log channel. A channel's sampling also applies to its
+        descendants, ie. `{"hook.output": 0.1}` passes one in ten records
+        of `hook.output` and its children.
+    """
+
+    def __init__(self, rate=None, burst=None, sampling=None, clock=None):
+        logging.Filter.__init__(self)
+        self._clock = clock or time.time
+        # The suppressed records not reported yet.
+        self._unreported = 0
+        self.suppressed = 0
+        self.sampled = 0
+        self.rate = self.burst = None
+        self._bucket = None
+        self.configure(rate, burst, sampling)
+
+    def configure(self, rate=None, burst=None, sampling=None):
+        """Change the limits.
+
+        The bucket starts full if the rate or burst changed.
+        """
+        burst = burst or rate
+        if (rate, burst) != (self.rate, self.burst):
+            self._bucket = None
+            if rate is not None:
+                self._bucket = TokenBucket(
+                    rate, max(1, burst), self._clock())
+        self.rate = rate
+        self.burst = burst
+        self.sampling = dict(sampling or {})
+        # channel -> accumulated fraction of records to pass.
+        self._samples = {}
+
+    def _get_sampling(self, name):
+        """Return the sampled channel and its fraction for a logger name."""
+        while name:
+            if name in self.sampling:
+                return name, self.sampling[name]
+            name = name.rpartition(".")[0]
+        return None, 1
+
+    def filter(self, record):
+        channel, fraction = self._get_sampling(record.name)
+        if fraction < 1:
+            sample = self._samples.get(channel, 0) + fraction
+            if sample < 1:
+                self._samples[channel] = sample
+                self.sampled += 1
+                return False
+            self._samples[channel] = sample - 1
+
+        if self._bucket is not None and \
+                not self._bucket.consume(self._clock()):
+            self.suppressed += 1
+            self._unreported += 1
+            return False
+        return True
+
+    def pop_suppressed(self):
+        """Return the number of records suppressed since the last call."""
+        suppressed, self._unreported = self._unreported, 0
+        return suppressed
@@ -24,6 +24,14 @@ class TestCase(TrialTestCase, MockerTestCase):
     # Default value for zookeeper test client
     client = None
 
+    def setUp(self):
+        # Keep the charm caches of the tests out of the user's home.
+        from juju.charm.directory import CharmDirectory
+        from juju.charm.repository import LocalCharmRepository
+        self.patch(CharmDirectory, "bundle_cache_path", self.makeDir())
+        self.patch(LocalCharmRepository, "index_path", self.makeDir())
+        return super(TestCase, self).setUp()
+
     def capture_stream(self, stream_name):
         original = getattr(sys, stream_name)
         new = StringIO.StringIO()
@@ -0,0 +1,238 @@
+import zookeeper
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+
+from txzookeeper.client import ZOO_OPEN_ACL_UNSAFE
+
+from juju.lib.fakezk import FakeZookeeperClient, FakeZookeeperServer
+from juju.lib.testing import TestCase
+from juju.state.auth import make_ace, make_identity
+from juju.state.machine import MachineStateManager
+
+
+class FakeZookeeperTest(TestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(FakeZookeeperTest, self).setUp()
+        self.server = FakeZookeeperServer()
+        self.client = yield FakeZookeeperClient(self.server).connect()
+
+    @inlineCallbacks
+    def assert_fails(self, d, exception):
+        try:
+            yield d
+        except exception:
+            pass
+        else:
+            self.fail("Should have raised %s" % exception.__name__)
+
+    @inlineCallbacks
+    def test_create_get_set(self):
+        path = yield self.client.create("/foo", "bar")
+        self.assertEqual(path, "/foo")
+        content, stat = yield self.client.get("/foo")
+        self.assertEqual(content, "bar")
+        self.assertEqual(stat["version"], 0)
+
+        stat = yield self.client.set("/foo", "baz")
+        self.assertEqual(stat["version"], 1)
+        self.assertEqual(stat["dataLength"], 3)
+        yield self.assert_fails(
+            self.client.set("/foo", "qux", version=0),
+            zookeeper.BadVersionException)
+        content, stat = yield self.client.get("/foo")
+        self.assertEqual(content, "baz")
+
+    @inlineCallbacks
+    def test_create_errors(self):
+        yield self.client.create("/foo")
+        yield self.assert_fails(
+            self.client.create("/foo"), zookeeper.NodeExistsException)
+        yield self.assert_fails(
+            self.client.create("/bar/baz"), zookeeper.NoNodeException)
+        yield self.assert_fails(
+            self.client.create("foo"), zookeeper.BadArgumentsException)
+
+    @inlineCallbacks
+    def test_children_and_delete(self):
+        yield self.client.create("/foo")
+        yield self.client.create("/foo/b")
+        yield self.client.create("/foo/a")
+        children = yield self.client.get_children("/foo")
+        self.assertEqual(children, ["a", "b"])
+        self.assertEqual(
+            (yield self.client.get_children("/")), ["foo", "zookeeper"])
+
+        yield self.assert_fails(
+            self.client.delete("/foo"), zookeeper.NotEmptyException)
+        yield self.assert_fails(
+            self.client.delete("/foo/a", version=3),
+            zookeeper.BadVersionException)
+        yield self.client.delete("/foo/a")
+        yield self.client.delete("/foo/b")
+        yield self.client.delete("/foo")
+        self.assertEqual((yield self.client.exists("/foo")), None)
+
+    @inlineCallbacks
+    def test_sequence_nodes(self):
+        yield self.client.create("/queue")
+        first = yield self.client.create(
+            "/queue/item-", flags=zookeeper.SEQUENCE)
+        second = yield self.client.create(
+            "/queue/item-", flags=zookeeper.SEQUENCE)
+        self.assertEqual(first, "/queue/item-0000000000")
+        self.assertEqual(second, "/queue/item-0000000001")
+
+    @inlineCallbacks
+    def test_ephemeral_nodes(self):
+        """Ephemeral nodes go away with their session."""
+        other = yield FakeZookeeperClient(self.server).connect()
+        yield other.create("/agent", flags=zookeeper.EPHEMERAL)
+        stat = yield self.client.exists("/agent")
+        self.assertEqual(stat["ephemeralOwner"], other.session_id)
+        yield self.assert_fails(
+            other.create("/agent/child"),
+            zookeeper.NoChildrenForEphemeralsException)
+
+        exists_d, watch_d = self.client.exists_and_watch("/agent")
+        yield exists_d
+        other.close()
+        event = yield watch_d
+        self.assertEqual(event.type_name, "deleted")
+        self.assertEqual((yield self.client.exists("/agent")), None)
+
+    @inlineCallbacks
+    def test_data_watches(self):
+        exists_d, watch_d = self.client.exists_and_watch("/foo")
+        self.assertEqual((yield exists_d), None)
+        yield self.client.create("/foo")
+        event = yield watch_d
+        self.assertEqual(event.type_name, "created")
+        self.assertEqual(event.path, "/foo")
+
+        get_d, watch_d = self.client.get_and_watch("/foo")
+        yield get_d
+        yield self.client.set("/foo", "bar")
+        event = yield watch_d
+        self.assertEqual(event.type_name, "changed")
+
+    @inlineCallbacks
+    def test_child_watches(self):
+        yield self.client.create("/foo")
+        children_d, watch_d = self.client.get_children_and_watch("/foo")
+        self.assertEqual((yield children_d), [])
+        yield self.client.create("/foo/bar")
+        event = yield watch_d
+        self.assertEqual(event.type_name, "child")
+        self.assertEqual(event.path, "/foo")
+
+    @inlineCallbacks
+    def test_watch_fires_before_read(self):
+        """A watch event is seen before a read of the change."""
+        yield self.client.create("/foo")
+        events = []
+        get_d, watch_d = self.client.get_and_watch("/foo")
+        yield get_d
+        watch_d.addCallback(lambda event: events.append("event"))
+        self.client.set("/foo", "bar")
+        content, stat = yield self.client.get("/foo")
+        self.assertEqual(events, ["event"])
+        self.assertEqual(content, "bar")
+
+    @inlineCallbacks
+    def test_acls(self):
+        """Digest ACLs are enforced."""
+        identity = make_identity("admin:secret")
+        acl = [make_ace(identity, all=True)]
+        yield self.client.create("/secure", "data", acls=acl)
+        yield self.assert_fails(
+            self.client.get("/secure"), zookeeper.NoAuthException)
+
+        yield self.client.add_auth("digest", "admin:secret")
+        content, stat = yield self.client.get("/secure")
+        self.assertEqual(content, "data")
+
+        acl.append(ZOO_OPEN_ACL_UNSAFE)
+        yield self.client.set_acl("/secure", acl)
+        acls, stat = yield self.client.get_acl("/secure")
+        self.assertEqual(acls, acl)
+        self.assertEqual(stat["aversion"], 1)
+        yield self.assert_fails(
+            self.client.set_acl("/secure", acl, version=0),
+            zookeeper.BadVersionException)
+
+    @inlineCallbacks
+    def test_session_expiry(self):
+        events = []
+        self.client.set_session_callback(
+            lambda client, event: events.append(event))
+        yield self.client.create("/agent", flags=zookeeper.EPHEMERAL)
+        self.server.expire_session(self.client)
+
+        self.assertFalse(self.client.connected)
+        self.assertEqual(events[0].state_name, "expired")
+        yield self.assert_fails(
+            self.client.exists("/agent"), zookeeper.SessionExpiredException)
+
+        yield self.client.connect()
+        self.assertEqual((yield self.client.exists("/agent")), None)
+
+    @inlineCallbacks
+    def test_closed_client(self):
+        self.client.close()
+        yield self.assert_fails(
+            self.client.exists("/"), zookeeper.ConnectionLossException)
+
+    @inlineCallbacks
+    def test_state_api(self):
+        """The state api runs against the fake."""
+        yield self.client.create("/machines")
+        manager = MachineStateManager(self.client)
+        changes = []
+        yield manager.watch_machine_states(
+            lambda old, new: changes.append((old, new)))
+        yield manager.add_machine_state()
+        yield manager.add_machine_state()
+        machines = yield manager.get_all_machine_states()
+        self.assertEqual([machine.id for machine in machines], [0, 1])
+        yield self.poke_zk()
+        self.assertEqual(changes[0][0], None)
+        self.assertEqual(changes[-1][1], set([0, 1]))
+
+
+class DeterministicSchedulingTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.server = FakeZookeeperServer(latency=0.5, clock=self.clock)
+        self.client = FakeZookeeperClient(self.server)
+
+    def test_injected_latency(self):
+        """Results are delivered once the latency elapsed on the clock."""
+        results = []
+        self.client.connect().addCallback(results.append)
+        self.clock.advance(0.4)
+        self.assertEqual(results, [])
+        self.clock.advance(0.1)
+        self.assertEqual(results, [self.client])
+
+        self.client.create("/foo").addCallback(results.append)
+        self.client.exists("/foo").addCallback(
+            lambda stat: results.append(stat["version"]))
+        self.clock.advance(0.5)
+        self.assertEqual(results[1:], ["/foo", 0])
+
+    def test_delivery_order(self):
+        """Deliveries keep their order when the latency varies."""
+        latencies = [1.0, 0.1, 0.5]
+        self.server.latency = lambda: latencies.pop(0)
+        self.client.connect()
+        results = []
+        self.client.create("/a").addCallback(results.append)
+        self.client.create("/b").addCallback(results.append)
+        self.clock.advance(0.9)
+        self.assertEqual(results, [])
+        self.clock.advance(0.1)
+        self.assertEqual(results, ["/a", "/b"])
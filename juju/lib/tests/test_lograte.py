@@ -0,0 +1,82 @@
+import logging
+
+from juju.lib.lograte import LogRateLimiter, TokenBucket
+from juju.lib.testing import TestCase
+
+
+def make_record(name="hook.output"):
+    return logging.makeLogRecord({"name": name, "msg": "hello"})
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(TestCase):
+
+    def test_consume(self):
+        bucket = TokenBucket(2, 3, now=0)
+        self.assertEqual(
+            [bucket.consume(0) for i in range(4)], [True, True, True, False])
+        self.assertTrue(bucket.consume(0.5))
+        self.assertFalse(bucket.consume(0.5))
+        # The bucket never holds more than the burst.
+        self.assertEqual(
+            [bucket.consume(100) for i in range(4)], [True, True, True, False])
+
+
+class LogRateLimiterTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_unlimited(self):
+        limiter = LogRateLimiter(clock=self.clock)
+        for i in range(1000):
+            self.assertTrue(limiter.filter(make_record()))
+        self.assertEqual(limiter.pop_suppressed(), 0)
+
+    def test_rate(self):
+        """Records past the rate are suppressed, and accounted for."""
+        limiter = LogRateLimiter(rate=10, burst=20, clock=self.clock)
+        passed = [limiter.filter(make_record()) for i in range(25)]
+        self.assertEqual(passed.count(True), 20)
+        self.assertEqual(limiter.pop_suppressed(), 5)
+        self.assertEqual(limiter.pop_suppressed(), 0)
+
+        self.clock.now += 0.5
+        passed = [limiter.filter(make_record()) for i in range(10)]
+        self.assertEqual(passed.count(True), 5)
+        self.assertEqual(limiter.suppressed, 10)
+
+    def test_sampling(self):
+        """Channels and their descendants are sampled."""
+        limiter = LogRateLimiter(
+            sampling={"hook.output": 0.25}, clock=self.clock)
+        passed = [limiter.filter(make_record("hook.output.install"))
+                  for i in range(8)]
+        self.assertEqual(passed.count(True), 2)
+        self.assertEqual(limiter.sampled, 6)
+        self.assertTrue(limiter.filter(make_record("hook")))
+        self.assertTrue(limiter.filter(make_record("hook.outputs")))
+        # Sampled records are not reported as suppressed.
+        self.assertEqual(limiter.pop_suppressed(), 0)
+
+    def test_configure(self):
+        """The bucket is only reset by a change of the rate or burst."""
+        limiter = LogRateLimiter(rate=1, clock=self.clock)
+        self.assertTrue(limiter.filter(make_record()))
+        self.assertFalse(limiter.filter(make_record()))
+        limiter.configure(rate=1)
+        self.assertFalse(limiter.filter(make_record()))
+        limiter.configure(rate=2)
+        self.assertTrue(limiter.filter(make_record()))
+        limiter.configure()
+        self.assertEqual(
+            [limiter.filter(make_record()) for i in range(100)],
+            [True] * 100)
@@ -9,7 +9,8 @@ import juju
 
 from juju.lib.testing import TestCase
 from juju.lib.twistutils import (
-    concurrent_execution_guard, gather_results, get_module_directory, sleep)
+    concurrent_execution_guard, gather_results, get_module_directory,
+    parallel_map, sleep)
 
 
 class Bar(object):
@@ -138,6 +139,65 @@ class GatherResultsTest(TestCase):
         return d
 
 
+class ParallelMapTest(TestCase):
+
+    @inlineCallbacks
+    def test_empty(self):
+        result = yield parallel_map(succeed, [], 3)
+        self.assertEqual(result, [])
+
+    @inlineCallbacks
+    def test_results_in_order(self):
+        pending = {}
+
+        def work(item):
+            pending[item] = Deferred()
+            return pending[item].addCallback(lambda _: item * 2)
+
+        d = parallel_map(work, [1, 2, 3], 3)
+        for item in (3, 1, 2):
+            pending[item].callback(None)
+        result = yield d
+        self.assertEqual(result, [2, 4, 6])
+
+    def test_bounded_concurrency(self):
+        pending = []
+
+        def work(item):
+            d = Deferred()
+            pending.append(d)
+            return d
+
+        d = parallel_map(work, range(5), 2)
+        self.assertEqual(len(pending), 2)
+        pending[0].callback(None)
+        self.assertEqual(len(pending), 3)
+        for waiting in pending[1:]:
+            waiting.callback(None)
+        self.assertEqual(len(pending), 5)
+        for waiting in pending[3:]:
+            waiting.callback(None)
+        self.assertTrue(d.called)
+        return d
+
+    def test_failure_waits_for_all(self):
+        pending = []
+
+        def work(item):
+            if item == 0:
+                return fail(AssertionError("Expected failure"))
+            d = Deferred()
+            pending.append(d)
+            return d
+
+        d = parallel_map(work, range(3), 3)
+        self.assertFalse(d.called)
+        for waiting in pending:
+            waiting.callback(None)
+        self.assertFailure(d, AssertionError)
+        return d
+
+
 class ModuleDirectoryTest(TestCase):
 
     def test_get_module_directory(self):
@@ -7,9 +7,13 @@ import zookeeper
 from twisted.internet.defer import inlineCallbacks, returnValue, fail
 from txzookeeper.tests.utils import deleteTree
 
+from juju.lib.lograte import LogRateLimiter
 from juju.lib.mocker import MATCH
 from juju.lib.testing import TestCase
-from juju.lib.zklog import ZookeeperHandler, LogIterator
+from juju.lib.zklog import (
+    ZookeeperHandler, LogIterator, LogJanitor, MergedLogIterator,
+    get_stream_name, parse_stream_name)
+from juju.providers.common.files import FileStorage
 
 
 class LogTestBase(TestCase):
@@ -184,6 +188,286 @@ class ZookeeperLogTest(LogTestBase):
             record["args"], [])
 
 
+class ZookeeperBatchLogTest(LogTestBase):
+
+    @inlineCallbacks
+    def get_batched_log(self, **kw):
+        log = logging.getLogger("test-zk-batch-log")
+        log.setLevel(logging.DEBUG)
+        handler = ZookeeperHandler(self.client, "unit:mysql/0", **kw)
+        yield handler.open()
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        returnValue((log, handler))
+
+    @inlineCallbacks
+    def get_batches(self):
+        children = yield self.client.get_children("/logs")
+        batches = []
+        for child in sorted(children):
+            content, stat = yield self.client.get("/logs/" + child)
+            batches.append([entry["msg"] for entry in json.loads(content)])
+        returnValue(batches)
+
+    @inlineCallbacks
+    def test_batch_size(self):
+        """Records are written in a single node per batch."""
+        log, handler = yield self.get_batched_log(batch_size=3)
+        for i in range(7):
+            log.info(str(i))
+        yield handler.flush()
+        batches = yield self.get_batches()
+        self.assertEqual(batches, [["0", "1", "2"], ["3", "4", "5"], ["6"]])
+
+    @inlineCallbacks
+    def test_flush_interval(self):
+        """Buffered records are written after the flush interval."""
+        log, handler = yield self.get_batched_log(
+            batch_size=100, flush_interval=0.05)
+        log.info("a")
+        log.info("b")
+        self.assertEqual((yield self.get_batches()), [])
+        yield self.sleep(0.2)
+        self.assertEqual((yield self.get_batches()), [["a", "b"]])
+
+    @inlineCallbacks
+    def test_max_batch_bytes(self):
+        """Batches are split to respect the node size cap."""
+        log, handler = yield self.get_batched_log(
+            batch_size=10, max_batch_bytes=1500)
+        for i in range(4):
+            log.info(str(i))
+        yield handler.flush()
+        batches = yield self.get_batches()
+        self.assertTrue(len(batches) > 1)
+        self.assertEqual(sum(batches, []), ["0", "1", "2", "3"])
+
+    @inlineCallbacks
+    def test_rate_limited(self):
+        """Records suppressed by the rate limiter are summarized."""
+        log, handler = yield self.get_batched_log(
+            batch_size=100, rate_limiter=LogRateLimiter(rate=1, burst=2))
+        for i in range(5):
+            log.info(str(i))
+        yield handler.flush()
+        log.info("5")
+        handler.rate_limiter.configure(rate=2)
+        log.info("6")
+        yield handler.flush()
+        batches = yield self.get_batches()
+        self.assertEqual(
+            batches,
+            [["0", "1", "3 log messages suppressed, rate limited"],
+             ["1 log messages suppressed, rate limited", "6"]])
+
+    @inlineCallbacks
+    def test_drops_when_behind(self):
+        """Records past the buffer cap are dropped, and accounted for."""
+        log, handler = yield self.get_batched_log(
+            batch_size=2, max_buffered=2)
+        # Hold the writer, as zookeeper falling behind would.
+        yield handler._write_lock.acquire()
+        for i in range(5):
+            log.info(str(i))
+        self.assertEqual(handler.dropped, 3)
+        handler._write_lock.release()
+        yield handler.flush()
+        batches = yield self.get_batches()
+        self.assertEqual(
+            batches,
+            [["0", "1"], ["3 log records dropped, zookeeper is behind"]])
+
+    @inlineCallbacks
+    def test_close_flushes(self):
+        log, handler = yield self.get_batched_log(batch_size=10)
+        log.info("a")
+        handler.close()
+        yield handler.flush()
+        self.assertEqual((yield self.get_batches()), [["a"]])
+
+
+class PartitionedLogTest(LogTestBase):
+
+    @inlineCallbacks
+    def get_partitioned_log(self, context_name, channel="test-zk-log"):
+        log = logging.getLogger(channel)
+        log.setLevel(logging.DEBUG)
+        handler = ZookeeperHandler(
+            self.client, context_name, batch_size=100, partitioned=True)
+        yield handler.open()
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        returnValue((log, handler))
+
+    def test_stream_name(self):
+        name = get_stream_name("unit:mysql/0", "INFO")
+        self.assertEqual(name, "unit~3Amysql~2F0@INFO")
+        self.assertEqual(parse_stream_name(name), ("unit:mysql/0", "INFO"))
+        self.assertEqual(
+            parse_stream_name(get_stream_name("a~b@c", "Level 5")),
+            ("a~b@c", "Level 5"))
+
+    @inlineCallbacks
+    def test_partitioned_handler(self):
+        """Records are stored in the stream of their context and level."""
+        handler = ZookeeperHandler(
+            self.client, "unit:mysql/0", partitioned=True)
+        yield handler.open()
+        for levelno, msg in ((logging.INFO, "a"), (logging.ERROR, "b"),
+                             (logging.INFO, "c")):
+            yield handler.emit(logging.makeLogRecord({
+                "levelno": levelno, "levelname": logging.getLevelName(levelno),
+                "msg": msg}))
+        streams = yield self.client.get_children("/logs/streams")
+        self.assertEqual(
+            sorted(streams),
+            ["unit~3Amysql~2F0@ERROR", "unit~3Amysql~2F0@INFO"])
+        children = yield self.client.get_children(
+            handler.get_stream_path("INFO"))
+        self.assertEqual(
+            sorted(children), ["log-0000000000", "log-0000000001"])
+
+    @inlineCallbacks
+    def test_partitioned_batches(self):
+        """A batch is written as a node per stream."""
+        log, handler = yield self.get_partitioned_log("unit:mysql/0")
+        log.info("a")
+        log.error("b")
+        log.info("c")
+        yield handler.flush()
+        content, stat = yield self.client.get(
+            handler.get_stream_path("INFO") + "/log-0000000000")
+        self.assertEqual(
+            [entry["msg"] for entry in json.loads(content)], ["a", "c"])
+        content, stat = yield self.client.get(
+            handler.get_stream_path("ERROR") + "/log-0000000000")
+        self.assertEqual(
+            [entry["msg"] for entry in json.loads(content)], ["b"])
+
+    @inlineCallbacks
+    def test_merged_iterator(self):
+        """The streams are interleaved by the creation time of entries."""
+        log, handler = yield self.get_partitioned_log("unit:mysql/0")
+        unpartitioned = yield self.get_configured_log("test-zk-log-legacy")
+        log.info("a")
+        log.error("b")
+        unpartitioned.info("c")
+        log.info("d")
+        yield handler.flush()
+        iter = MergedLogIterator(self.client)
+        messages = []
+        for i in range(4):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, ["a", "b", "c", "d"])
+
+        # New entries, and new streams, are waited for.
+        entry_d = iter.next()
+        yield self.poke_zk()
+        self.assertFalse(entry_d.called)
+        other, handler = yield self.get_partitioned_log(
+            "unit:wordpress/0", "test-zk-log-other")
+        other.warning("e")
+        yield handler.flush()
+        entry = yield entry_d
+        self.assertEqual(entry["msg"], "e")
+
+    @inlineCallbacks
+    def test_merged_iterator_select(self):
+        """Only the selected streams are read."""
+        mysql, handler = yield self.get_partitioned_log("unit:mysql/0")
+        wordpress, other_handler = yield self.get_partitioned_log(
+            "unit:wordpress/0", "test-zk-log-other")
+        mysql.debug("a")
+        mysql.error("b")
+        wordpress.error("c")
+        mysql.error("d")
+        yield handler.flush()
+        yield other_handler.flush()
+
+        def select(context, levelname):
+            return context == "unit:mysql/0" and levelname == "ERROR"
+        iter = MergedLogIterator(self.client, select=select)
+        messages = []
+        for i in range(2):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, ["b", "d"])
+        self.assertEqual(iter.streams, ["unit~3Amysql~2F0@ERROR"])
+
+    @inlineCallbacks
+    def test_janitor_streams(self):
+        """The retention applies to each stream."""
+        log, handler = yield self.get_partitioned_log("unit:mysql/0")
+        for i in range(3):
+            log.info(str(i))
+            log.error(str(i))
+            yield handler.flush()
+        storage = FileStorage(self.makeDir())
+        janitor = LogJanitor(self.client, storage, max_entries=2)
+        report = yield janitor.run()
+        self.assertEqual(report["nodes"], 4)
+        self.assertEqual(report["chunks"], 2)
+        for levelname in ("INFO", "ERROR"):
+            children = yield self.client.get_children(
+                handler.get_stream_path(levelname))
+            self.assertEqual(sorted(children), ["archive", "log-0000000002"])
+
+        iter = MergedLogIterator(self.client, replay=True, storage=storage)
+        messages = []
+        for i in range(6):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, ["0", "0", "1", "1", "2", "2"])
+
+    @inlineCallbacks
+    def test_janitor_shares_budget(self):
+        """The retained log nodes are shared by the streams."""
+        log, handler = yield self.get_partitioned_log("unit:mysql/0")
+        for i in range(4):
+            log.info(str(i))
+            yield handler.flush()
+        log.error("e")
+        yield handler.flush()
+        janitor = LogJanitor(
+            self.client, FileStorage(self.makeDir()), max_entries=3)
+        report = yield janitor.run()
+        self.assertEqual(report["nodes"], 2)
+        children = yield self.client.get_children(
+            handler.get_stream_path("INFO"))
+        self.assertEqual(
+            sorted(children), ["archive", "log-0000000002", "log-0000000003"])
+        children = yield self.client.get_children(
+            handler.get_stream_path("ERROR"))
+        self.assertEqual(children, ["log-0000000000"])
+
+    @inlineCallbacks
+    def test_janitor_removes_empty_streams(self):
+        """Streams left empty by two runs are removed, and written again."""
+        log, handler = yield self.get_partitioned_log("unit:mysql/0")
+        log.info("a")
+        yield handler.flush()
+        iter = MergedLogIterator(self.client)
+        entry = yield iter.next()
+        self.assertEqual(entry["msg"], "a")
+        entry_d = iter.next()
+
+        janitor = LogJanitor(
+            self.client, FileStorage(self.makeDir()), max_entries=None,
+            max_age=60)
+        report = yield janitor.run(time.time() + 120)
+        self.assertEqual((report["nodes"], report["streams"]), (1, 0))
+        report = yield janitor.run(time.time() + 120)
+        self.assertEqual(report["streams"], 1)
+        streams = yield self.client.get_children("/logs/streams")
+        self.assertEqual(streams, [])
+
+        log.info("b")
+        yield handler.flush()
+        entry = yield entry_d
+        self.assertEqual(entry["msg"], "b")
+
+
 class LogIteratorTest(LogTestBase):
 
     @inlineCallbacks
@@ -257,3 +541,213 @@ class LogIteratorTest(LogTestBase):
         # make sure we updated the last seen index.
         data, stat = yield self.client.get("/logs")
         self.assertEqual(json.loads(data), {"next-log-index": 6})
+
+    @inlineCallbacks
+    def test_batched_entries(self):
+        """Single record and batch nodes are both read."""
+        yield self.client.create(
+            "/logs/log-", json.dumps({"msg": "a"}), flags=zookeeper.SEQUENCE)
+        yield self.client.create(
+            "/logs/log-", json.dumps([{"msg": "b"}, {"msg": "c"}]),
+            flags=zookeeper.SEQUENCE)
+        yield self.client.create(
+            "/logs/log-", json.dumps({"msg": "d"}), flags=zookeeper.SEQUENCE)
+        iter = LogIterator(self.client, seen_block_size=1)
+        messages = []
+        for i in range(4):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, ["a", "b", "c", "d"])
+        data, stat = yield self.client.get("/logs")
+        self.assertEqual(json.loads(data), {"next-log-index": 3})
+
+    @inlineCallbacks
+    def test_prefetch_window(self):
+        """Entries past the position are fetched concurrently."""
+        for i in range(10):
+            self.log.info(str(i))
+        iter = LogIterator(self.client, prefetch=5)
+        entry = yield iter.next()
+        self.assertEqual(entry["msg"], "0")
+        self.assertEqual(sorted(iter._fetches), [1, 2, 3, 4])
+
+        messages = []
+        for i in range(9):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, [str(i) for i in range(1, 10)])
+        self.assertEqual(iter._fetches, {})
+
+    @inlineCallbacks
+    def test_skip_removed_entries(self):
+        """Log nodes removed from underneath the iterator are skipped."""
+        for i in ("a", "b", "c"):
+            self.log.info(i)
+        yield self.client.delete("/logs/log-%010d" % 0)
+        yield self.client.delete("/logs/log-%010d" % 1)
+        iter = LogIterator(self.client, replay=True)
+        entry = yield iter.next()
+        self.assertEqual(entry["msg"], "c")
+
+    @inlineCallbacks
+    def test_wait_at_head(self):
+        """At the head of the log, the iterator waits for new entries."""
+        self.log.info("a")
+        iter = LogIterator(self.client)
+        entry = yield iter.next()
+        self.assertEqual(entry["msg"], "a")
+        entry_d = iter.next()
+        yield self.poke_zk()
+        self.assertFalse(entry_d.called)
+        self.log.info("b")
+        entry = yield entry_d
+        self.assertEqual(entry["msg"], "b")
+
+    @inlineCallbacks
+    def test_tail_at_head(self):
+        """At the head, the next log node is watched, not listed for."""
+        self.log.info("a")
+        iter = LogIterator(self.client)
+        yield iter.next()
+
+        listings = []
+        get_children_and_watch = self.client.get_children_and_watch
+
+        def count_listings(path):
+            listings.append(path)
+            return get_children_and_watch(path)
+        self.patch(self.client, "get_children_and_watch", count_listings)
+
+        for i in range(3):
+            entry_d = iter.next()
+            yield iter.wait_at_head()
+            self.log.info(str(i))
+            entry = yield entry_d
+            self.assertEqual(entry["msg"], str(i))
+        self.assertEqual(listings, ["/logs"])
+
+    @inlineCallbacks
+    def test_tail_other_child_created(self):
+        """At the head, other children created shift the next log node."""
+        entry_d = self.iter.next()
+        yield self.iter.wait_at_head()
+        yield self.client.create("/logs/streams")
+        self.log.info("a")
+        entry = yield entry_d
+        self.assertEqual(entry["msg"], "a")
+
+
+class LogJanitorTest(LogTestBase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(LogJanitorTest, self).setUp()
+        self.log = yield self.get_configured_log()
+        self.storage = FileStorage(self.makeDir())
+
+    @inlineCallbacks
+    def get_log_indexes(self):
+        children = yield self.client.get_children("/logs")
+        returnValue(sorted(
+            int(child[4:]) for child in children if child.startswith("log-")))
+
+    @inlineCallbacks
+    def test_max_entries(self):
+        """The oldest log nodes past the retention are archived in chunks."""
+        for i in range(5):
+            self.log.info(str(i))
+        janitor = LogJanitor(
+            self.client, self.storage, max_entries=2, chunk_size=2)
+        report = yield janitor.run()
+        self.assertEqual(report["nodes"], 3)
+        self.assertEqual(report["chunks"], 2)
+        self.assertTrue(report["bytes"] > 0)
+        self.assertEqual((yield self.get_log_indexes()), [3, 4])
+
+        content, stat = yield self.client.get("/logs/archive")
+        chunks = json.loads(content)["chunks"]
+        self.assertEqual(
+            [(chunk["first"], chunk["last"], chunk["nodes"])
+             for chunk in chunks],
+            [(0, 1, 2), (2, 2, 1)])
+        self.assertEqual(
+            sum(chunk["bytes"] for chunk in chunks), report["bytes"])
+        archive = yield self.storage.get(chunks[0]["name"])
+        self.assertEqual(
+            [(log_index, [entry["msg"] for entry in entries])
+             for log_index, entries in json.loads(archive.read())],
+            [(0, ["0"]), (1, ["1"])])
+
+        # Nothing is left past the retention.
+        report = yield janitor.run()
+        self.assertEqual(report["nodes"], 0)
+
+    @inlineCallbacks
+    def test_max_age(self):
+        """Log nodes older than the maximum age are archived."""
+        for i in range(3):
+            self.log.info(str(i))
+        janitor = LogJanitor(
+            self.client, self.storage, max_entries=None, max_age=60)
+        report = yield janitor.run()
+        self.assertEqual(report["nodes"], 0)
+        report = yield janitor.run(time.time() + 120)
+        self.assertEqual(report["nodes"], 3)
+        self.assertEqual((yield self.get_log_indexes()), [])
+
+    @inlineCallbacks
+    def test_replay_archive(self):
+        """Archived log nodes are replayed, from the file storage."""
+        for i in range(5):
+            self.log.info(str(i))
+        janitor = LogJanitor(
+            self.client, self.storage, max_entries=2, chunk_size=2)
+        yield janitor.run()
+
+        iter = LogIterator(self.client, replay=True, storage=self.storage)
+        messages = []
+        for i in range(5):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, ["0", "1", "2", "3", "4"])
+
+        # Without the file storage, only the live log nodes are read.
+        iter = LogIterator(self.client, replay=True)
+        entry = yield iter.next()
+        self.assertEqual(entry["msg"], "3")
+
+    @inlineCallbacks
+    def test_archived_underneath(self):
+        """Log nodes archived while being read are read from the archive."""
+        for i in range(4):
+            self.log.info(str(i))
+        iter = LogIterator(self.client, prefetch=1, storage=self.storage)
+        entry = yield iter.next()
+        self.assertEqual(entry["msg"], "0")
+
+        janitor = LogJanitor(self.client, self.storage, max_entries=1)
+        yield janitor.run()
+        messages = []
+        for i in range(3):
+            entry = yield iter.next()
+            messages.append(entry["msg"])
+        self.assertEqual(messages, ["1", "2", "3"])
+
+    @inlineCallbacks
+    def test_pruned_at_head(self):
+        """A reader at the head follows the log past pruned log nodes."""
+        for i in range(3):
+            self.log.info(str(i))
+        iter = LogIterator(self.client)
+        for i in range(3):
+            yield iter.next()
+        entry_d = iter.next()
+        yield iter.wait_at_head()
+
+        janitor = LogJanitor(self.client, self.storage, max_entries=1)
+        yield janitor.run()
+        self.log.info("3")
+        entry = yield entry_d
+        self.assertEqual(entry["msg"], "3")
+        content, stat = yield self.client.get("/logs/archive")
+        self.assertEqual(json.loads(content)["pruned"], 1)
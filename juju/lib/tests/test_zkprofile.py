@@ -0,0 +1,123 @@
+import logging
+import os
+import signal
+
+import zookeeper
+
+from twisted.internet.defer import DeferredList, inlineCallbacks
+
+from txzookeeper import ZookeeperClient
+from txzookeeper.tests.utils import deleteTree
+
+from juju.lib.testing import TestCase
+from juju.lib.zkprofile import (
+    ZookeeperProfiler, enable_profiling, normalize_path)
+from juju.tests.common import get_test_zookeeper_address
+
+
+class NormalizePathTest(TestCase):
+
+    def test_normalize_path(self):
+        self.assertEqual(normalize_path("/topology"), "/topology")
+        self.assertEqual(normalize_path("/units/unit-0000000001/ports"),
+                         "/units/*/ports")
+        self.assertEqual(
+            normalize_path("/relations/relation-0000000001/settings/"
+                           "unit-0000000002"),
+            "/relations/*/settings/*")
+        self.assertEqual(normalize_path("/"), "/")
+
+
+class ZookeeperProfilerTest(TestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(ZookeeperProfilerTest, self).setUp()
+        zookeeper.set_debug_level(0)
+        self.profiler = ZookeeperProfiler()
+        self.profiler.install()
+        self.addCleanup(self.profiler.uninstall)
+        self.client = ZookeeperClient(get_test_zookeeper_address())
+        yield self.client.connect()
+
+    def tearDown(self):
+        deleteTree(handle=self.client.handle)
+        self.client.close()
+
+    @inlineCallbacks
+    def test_record_operations(self):
+        """Operations are recorded per normalized path."""
+        yield self.client.create("/units")
+        yield self.client.create("/units/unit-0000000001", "abc")
+        yield self.client.create("/units/unit-0000000002", "defg")
+        yield self.client.get("/units/unit-0000000001")
+        get_d, watch_d = self.client.get_and_watch("/units/unit-0000000002")
+        yield get_d
+        try:
+            yield self.client.get("/units/unit-0000000003")
+        except zookeeper.NoNodeException:
+            pass
+
+        stats = self.profiler.stats
+        create = stats[("create", "/units/*")]
+        self.assertEqual(create.count, 2)
+        self.assertEqual(create.bytes, 7)
+        self.assertIn("test_zkprofile.py", create.top_site)
+        self.assertIn("test_record_operations", create.top_site)
+
+        get = stats[("get", "/units/*")]
+        self.assertEqual(get.count, 2)
+        self.assertEqual(get.errors, 1)
+        self.assertEqual(get.bytes, 3)
+        self.assertEqual(stats[("get_and_watch", "/units/*")].bytes, 4)
+
+    @inlineCallbacks
+    def test_uninstall(self):
+        self.profiler.uninstall()
+        yield self.client.exists("/units")
+        self.assertEqual(self.profiler.stats, {})
+
+    @inlineCallbacks
+    def test_round_trips(self):
+        """Concurrent operations share a round trip."""
+        yield self.client.exists("/units")
+        yield self.client.exists("/machines")
+        self.assertEqual(self.profiler.round_trips, 2)
+        yield DeferredList([self.client.exists("/services"),
+                            self.client.exists("/relations"),
+                            self.client.get_children_and_watch("/")[0]])
+        self.assertEqual(self.profiler.round_trips, 3)
+
+    @inlineCallbacks
+    def test_format_summary(self):
+        yield self.client.exists("/units")
+        summary = self.profiler.format_summary().splitlines()
+        self.assertEqual(len(summary), 3)
+        self.assertTrue(summary[0].startswith(
+            "Zookeeper profile: 1 operations in "))
+        self.assertEqual(summary[1].split()[:3],
+                         ["operation", "path", "count"])
+        self.assertEqual(summary[2].split()[:4],
+                         ["exists", "/units", "1", "0"])
+
+    @inlineCallbacks
+    def test_dump_on_signal(self):
+        """The summary is logged on SIGUSR2, the previous handler of the
+        signal is still invoked. SIGUSR1 is left to twistd."""
+        self.profiler.uninstall()
+        output = self.capture_logging("juju.profile")
+        received = []
+        previous = signal.signal(
+            signal.SIGUSR2, lambda signum, frame: received.append(signum))
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous)
+        usr1_handler = signal.getsignal(signal.SIGUSR1)
+        profiler = enable_profiling(
+            log=logging.getLogger("juju.profile"), at_exit=False)
+        self.addCleanup(profiler.uninstall)
+        self.assertEqual(signal.getsignal(signal.SIGUSR1), usr1_handler)
+        yield self.client.exists("/units")
+
+        os.kill(os.getpid(), signal.SIGUSR2)
+        yield self.sleep(0.1)
+        self.assertIn("Zookeeper profile: 1 operations", output.getvalue())
+        self.assertEqual(received, [signal.SIGUSR2])
@@ -3,7 +3,7 @@ import os
 
 from twisted.internet import reactor
 from twisted.internet.defer import (
-    Deferred, maybeDeferred, succeed, DeferredList)
+    Deferred, DeferredList, DeferredSemaphore, maybeDeferred, succeed)
 from twisted.python.util import mergeFunctionMetadata
 
 
@@ -44,6 +44,31 @@ def gather_results(deferreds, consume_errors=True):
     return d
 
 
+def parallel_map(function, items, limit):
+    """Invoke `function` on each of `items` with bounded concurrency.
+
+    At most `limit` invocations are outstanding at any given time. The
+    returned deferred fires with the results in the order of `items`
+    once every invocation has completed. If any invocation fails, the
+    first failure (in `items` order) is raised, but only after all of
+    the invocations have finished, so callers never observe work still
+    in flight after an error.
+    """
+    semaphore = DeferredSemaphore(max(1, limit))
+    d = DeferredList(
+        [semaphore.run(function, item) for item in items],
+        consumeErrors=True)
+
+    def collect(results):
+        for success, value in results:
+            if not success:
+                return value
+        return [value for success, value in results]
+
+    d.addCallback(collect)
+    return d
+
+
 def get_module_directory(module):
     """Determine the directory of a module.
 
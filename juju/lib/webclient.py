@@ -0,0 +1,240 @@
+"""A HTTP client keeping its connections open between requests.
+
+Requests are made with a twisted.web `Agent`. Where the installed Twisted
+provides an `HTTPConnectionPool` (12.1 and later), the connections to a
+host are kept open and reused by later requests, otherwise a connection
+is opened per request.
+
+Redirects are followed where the installed Twisted provides a
+`RedirectAgent`, a redirect not followed is an error status.
+
+Request and response bodies are streamed from and to file objects, so
+that large files are never held in memory. Transfers optionally report
+their progress to a callable, as `progress(transferred, total)` where
+the total is None if unknown.
+"""
+import os
+
+from cStringIO import StringIO
+
+from zope.interface import implements
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.defer import succeed
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import TaskStopped, cooperate
+from twisted.web.client import Agent, ResponseDone
+from twisted.web.error import Error
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+
+try:
+    from twisted.web.client import HTTPConnectionPool
+except ImportError:
+    HTTPConnectionPool = None
+
+try:
+    from twisted.web.client import RedirectAgent
+except ImportError:
+    RedirectAgent = None
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_file_size(file_object):
+    """Return the number of bytes left to read in a file, or None."""
+    try:
+        position = file_object.tell()
+        file_object.seek(0, os.SEEK_END)
+        size = file_object.tell() - position
+        file_object.seek(position)
+    except (AttributeError, IOError, OSError):
+        return None
+    return size
+
+
+class BodyProducer(object):
+    """Streams a request body from a file object.
+
+    :param file_object: The file to read the body from, from its current
+        position.
+    :param length: The number of bytes of the body, the body extends to
+        the end of the file if None. A body of unknown length, ie. read
+        from a pipe, is sent with a chunked transfer encoding.
+    :param progress: A callable reporting the bytes sent.
+    """
+    implements(IBodyProducer)
+
+    def __init__(self, file_object, length=None, progress=None):
+        self._file = file_object
+        if length is None:
+            length = get_file_size(file_object)
+        self.length = UNKNOWN_LENGTH if length is None else length
+        self._progress = progress
+        self._task = None
+
+    def startProducing(self, consumer):
+        self._task = cooperate(self._write_chunks(consumer))
+        d = self._task.whenDone()
+
+        def stopped(failure):
+            failure.trap(TaskStopped)
+            # The request was abandoned, and will never complete.
+            return Deferred()
+        d.addCallbacks(lambda _: None, stopped)
+        return d
+
+    def _write_chunks(self, consumer):
+        total = None if self.length is UNKNOWN_LENGTH else self.length
+        sent = 0
+        while total is None or sent < total:
+            size = CHUNK_SIZE
+            if total is not None:
+                size = min(size, total - sent)
+            data = self._file.read(size)
+            if not data:
+                break
+            consumer.write(data)
+            sent += len(data)
+            if self._progress is not None:
+                self._progress(sent, total)
+            yield None
+        if total is not None and sent != total:
+            raise IOError("File ended after %d of %d bytes" % (sent, total))
+
+    def pauseProducing(self):
+        self._task.pause()
+
+    def resumeProducing(self):
+        self._task.resume()
+
+    def stopProducing(self):
+        self._task.stop()
+
+
+class _BodyReceiver(Protocol):
+    """Writes a response body to `output`, firing `finished` when done."""
+
+    def __init__(self, output, total=None, progress=None):
+        self.output = output
+        self.finished = Deferred()
+        self._total = total
+        self._progress = progress
+        self._received = 0
+
+    def dataReceived(self, data):
+        self.output.write(data)
+        if self._progress is not None:
+            self._received += len(data)
+            self._progress(self._received, self._total)
+
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(None)
+        else:
+            self.finished.errback(reason)
+
+
+class _NullOutput(object):
+
+    def write(self, data):
+        pass
+
+
+class WebClient(object):
+    """Makes GET requests, reusing connections if possible.
+
+    :param persistent: Whether connections are kept open between
+        requests, if supported.
+    """
+
+    def __init__(self, persistent=True):
+        self._pool = None
+        if persistent and HTTPConnectionPool is not None:
+            self._pool = HTTPConnectionPool(reactor, persistent=True)
+            self._agent = Agent(reactor, pool=self._pool)
+        else:
+            self._agent = Agent(reactor)
+        if RedirectAgent is not None:
+            self._agent = RedirectAgent(self._agent)
+
+    @property
+    def persistent(self):
+        """Whether the connections are reused."""
+        return self._pool is not None
+
+    def request(self, method, url, headers=None, body=None):
+        """Make a request, returning the response before its body is read.
+
+        :param body: An optional L{BodyProducer} of the request body.
+
+        The response body must then be consumed with L{read} or
+        L{check_status}, whatever the response status.
+        """
+        request_headers = Headers()
+        for name, value in (headers or {}).items():
+            request_headers.setRawHeaders(name, [value])
+        return self._agent.request(method, url, request_headers, body)
+
+    @inlineCallbacks
+    def check_status(self, response):
+        """Raise an `Error` for an error status, once the body is discarded.
+
+        A redirect not followed is an error, its body is not the resource
+        requested. A 304 Not Modified is left to the caller.
+        """
+        if response.code >= 300 and response.code != 304:
+            yield self.read(response, _NullOutput())
+            raise Error(str(response.code), response.phrase)
+
+    @inlineCallbacks
+    def get(self, url, headers=None):
+        """Request `url`, returning the response before its body is read.
+
+        The body must then be consumed with L{read}. A `twisted.web.error`
+        `Error` is raised for an error status, once the body was
+        discarded.
+        """
+        response = yield self.request("GET", url, headers)
+        yield self.check_status(response)
+        returnValue(response)
+
+    @inlineCallbacks
+    def read(self, response, output=None, progress=None):
+        """Read the body of `response`, streaming it to `output` if given.
+
+        Returns the body if no `output` is given.
+        """
+        buffer = None
+        if output is None:
+            buffer = output = StringIO()
+        total = None
+        if response.length is not UNKNOWN_LENGTH:
+            total = response.length
+        receiver = _BodyReceiver(output, total, progress)
+        response.deliverBody(receiver)
+        yield receiver.finished
+        if buffer is not None:
+            returnValue(buffer.getvalue())
+
+    @inlineCallbacks
+    def get_page(self, url, headers=None):
+        """Return the response to a request of `url`, and its body."""
+        response = yield self.get(url, headers)
+        body = yield self.read(response)
+        returnValue((response, body))
+
+    def close(self):
+        """Close the connections kept open."""
+        if self._pool is None:
+            return succeed(None)
+        return self._pool.closeCachedConnections()
+
+
+def get_header(response, name):
+    """Return the value of a response header, or None."""
+    values = response.headers.getRawHeaders(name)
+    return values and values[-1] or None
@@ -1,25 +1,88 @@
 """
 Logging implementation which utilizes zookeeper for logs.
+
+Log entries are json serialized records stored in sequence nodes of the
+log container. A node holds either a single record, a json object, or a
+batch of records, a json list of objects.
+
+A partitioned log stores the entries of each context and level in their
+own stream, a log container under `streams` named after them, such that
+readers only read the streams they select, see L{MergedLogIterator}.
+
+Log nodes past their retention are compacted by the L{LogJanitor} into
+archive chunks in the provider file storage, a json list of [log index,
+entries] pairs, and are listed in order in the `archive` node of the log
+container, ie.::
+
+  {"chunks": [{"name": "logs/archive-0000000000-0000000499.json",
+               "first": 0, "last": 499, "nodes": 500, "bytes": 91245}]}
 """
 import json
+import logging
+import posixpath
 import sys
+import time
+from StringIO import StringIO
 from logging import Handler, NOTSET, Formatter, LogRecord
+from urllib import quote, unquote
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import (
+    Deferred, DeferredList, DeferredLock, inlineCallbacks, returnValue)
+from twisted.python.failure import Failure
+from txzookeeper.utils import retry_change
 
 import zookeeper
 
+from juju.errors import FileNotFound
+from juju.state.utils import delete_many, get_many
+
 _error_formatter = Formatter()
 
 
+def get_stream_name(context, levelname):
+    """Return the name of the log stream of a context and level.
+
+    The name only uses characters valid in both zookeeper node names and
+    file storage names, ie. `unit:mysql/0@INFO` is `unit~3Amysql~2F0@INFO`.
+    """
+    return "%s@%s" % (
+        quote(context, safe="").replace("%", "~"),
+        quote(levelname, safe="").replace("%", "~"))
+
+
+def parse_stream_name(name):
+    """Return the (context, level name) of a log stream, given its name."""
+    context, levelname = name.rsplit("@", 1)
+    return (unquote(context.replace("~", "%")),
+            unquote(levelname.replace("~", "%")))
+
+
 class ZookeeperHandler(Handler, object):
     """A logging.Handler implementation that stores records in Zookeeper.
 
     Intended use is a lightweight, low-volume distributed logging mechanism.
     Records are stored as json strings in sequence nodes.
+
+    By default each record is written to its own node as it is emitted.
+    When batching, records are buffered and written as a single node per
+    batch, once `batch_size` records are buffered or `flush_interval`
+    seconds after the first buffered record. Only one batch is written
+    at a time; should zookeeper fall behind, at most `max_buffered`
+    records are buffered, further records are dropped and accounted
+    for in the next batch.
+
+    When partitioned, records are stored in the stream of their level
+    and the handler's context, a log container created on demand.
+
+    Given a L{juju.lib.lograte.LogRateLimiter}, records are rate limited
+    and sampled, and the records it suppressed are summarized in a record
+    shipped along the next record or batch.
     """
 
-    def __init__(self, client, context_name, level=NOTSET, log_path="/logs"):
+    def __init__(self, client, context_name, level=NOTSET, log_path="/logs",
+                 batch_size=1, flush_interval=None, max_buffered=1000,
+                 max_batch_bytes=256 * 1024, partitioned=False,
+                 rate_limiter=None):
         """Initialize a Zookeeper Log Handler.
 
         :param client: A connected zookeeper client. The client is managed
@@ -30,13 +93,38 @@ class ZookeeperHandler(Handler, object):
         :param level: As per the logging.Handler api, denotes a minimum level
                    that log records must exceed to be emitted from this Handler
         :param log_path: The location within zookeeper of the log records.
+        :param batch_size: The maximum number of records per node, records
+                   are batched if greater than 1 or given a flush_interval.
+        :param flush_interval: The maximum number of seconds a record is
+                   buffered for when batching.
+        :param max_buffered: The maximum number of buffered records, past
+                   which records are dropped.
+        :param max_batch_bytes: The maximum size of a batch node's content.
+        :param partitioned: Whether records are stored in a stream per
+                   level, rather than in the log container.
+        :param rate_limiter: A log filter limiting the rate of records.
         """
         self._client = client
         self._context_name = context_name
         self._log_container_path, self._log_path = self._format_log_path(
             log_path)
+        self._batching = batch_size > 1 or flush_interval is not None
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._max_buffered = max_buffered
+        self._max_batch_bytes = max_batch_bytes
+        self._buffer = []
+        self._write_lock = DeferredLock()
+        self._queued_flush = None
+        self._flush_call = None
+        self._unreported_drops = 0
+        self.dropped = 0
+        self._partitioned = partitioned
 
         super(ZookeeperHandler, self).__init__(level)
+        self.rate_limiter = rate_limiter
+        if rate_limiter is not None:
+            self.addFilter(rate_limiter)
 
     @property
     def log_container_path(self):
@@ -46,6 +134,19 @@ class ZookeeperHandler(Handler, object):
     def log_path(self):
         return self._log_path
 
+    def get_stream_path(self, levelname):
+        """Return the path of the stream of a level, when partitioned."""
+        return "%s/streams/%s" % (
+            self._log_container_path,
+            get_stream_name(self._context_name, levelname))
+
+    def _get_record_path(self, record):
+        """Return the sequence node path a record is stored at."""
+        if not self._partitioned:
+            return self._log_path
+        return self.get_stream_path(record.levelname) + self._log_path[
+            len(self._log_container_path):]
+
     def emit(self, record):
         """Emit a log record to zookeeper, enriched with context.
 
@@ -55,11 +156,125 @@ class ZookeeperHandler(Handler, object):
         if not self._client.connected:
             return
 
-        json_record = self._format_json(record)
-        return self._client.create(
-            self._log_path,
-            json_record,
-            flags=zookeeper.SEQUENCE).addErrback(self._on_error)
+        suppressed = self._pop_suppressed()
+        if suppressed:
+            self._emit(self._make_warning_record(
+                "%d log messages suppressed, rate limited", suppressed))
+        return self._emit(record)
+
+    def _emit(self, record):
+        if not self._batching:
+            json_record = self._format_json(record)
+            return self._create_log_node(
+                self._get_record_path(record),
+                json_record).addErrback(self._on_error)
+
+        if len(self._buffer) >= self._max_buffered:
+            self.dropped += 1
+            self._unreported_drops += 1
+            return
+        self._buffer.append(
+            (self._get_record_path(record), self._format_json(record)))
+        if len(self._buffer) >= self._batch_size:
+            return self.flush()
+        if self._flush_call is None and self._flush_interval is not None:
+            from twisted.internet import reactor
+            self._flush_call = reactor.callLater(
+                self._flush_interval, self.flush)
+
+    def flush(self):
+        """Write the buffered records.
+
+        Returns a deferred firing once they have been written.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if self._queued_flush is None:
+            self._queued_flush = self._write_lock.run(self._write_buffer)
+        return self._queued_flush
+
+    def close(self):
+        """Flush any buffered records, and close the handler."""
+        self.flush()
+        super(ZookeeperHandler, self).close()
+
+    @inlineCallbacks
+    def _write_buffer(self):
+        # Records buffered from now on need another flush.
+        self._queued_flush = None
+        records = []
+        if self._unreported_drops:
+            records.append(self._make_warning_record(
+                "%d log records dropped, zookeeper is behind",
+                self._unreported_drops))
+            self._unreported_drops = 0
+        suppressed = self._pop_suppressed()
+        if suppressed:
+            records.append(self._make_warning_record(
+                "%d log messages suppressed, rate limited", suppressed))
+        for record in records:
+            self._buffer.append(
+                (self._get_record_path(record), self._format_json(record)))
+
+        while self._buffer and self._client.connected:
+            # A batch is written as a node per log path, ie. per stream.
+            batch = {}
+            paths = []
+            count = 0
+            size = 2
+            while self._buffer and count < self._batch_size:
+                path, json_record = self._buffer[0]
+                size += len(json_record) + 1
+                if count and size > self._max_batch_bytes:
+                    break
+                self._buffer.pop(0)
+                count += 1
+                if path not in batch:
+                    batch[path] = []
+                    paths.append(path)
+                batch[path].append(json_record)
+            for path in paths:
+                try:
+                    yield self._create_log_node(
+                        path, "[%s]" % ",".join(batch[path]))
+                except zookeeper.ZooKeeperException:
+                    self._on_error(Failure())
+
+    def _create_log_node(self, log_path, content):
+        """Create a log node, and its stream on demand if partitioned."""
+        d = self._client.create(log_path, content, flags=zookeeper.SEQUENCE)
+        if not self._partitioned:
+            return d
+
+        def create_stream(failure):
+            failure.trap(zookeeper.NoNodeException)
+            stream_path = posixpath.dirname(log_path)
+            d = self._create_containers(
+                posixpath.dirname(stream_path), stream_path)
+            d.addCallback(lambda result: self._client.create(
+                log_path, content, flags=zookeeper.SEQUENCE))
+            return d
+        return d.addErrback(create_stream)
+
+    @inlineCallbacks
+    def _create_containers(self, *paths):
+        for path in paths:
+            try:
+                yield self._client.create(path)
+            except zookeeper.NodeExistsException:
+                pass
+
+    def _pop_suppressed(self):
+        if self.rate_limiter is None:
+            return 0
+        return self.rate_limiter.pop_suppressed()
+
+    def _make_warning_record(self, msg, count):
+        return logging.makeLogRecord({
+            "name": "juju.lib.zklog", "levelno": logging.WARNING,
+            "levelname": "WARNING", "msg": msg, "args": (count,)})
 
     @inlineCallbacks
     def open(self):
@@ -71,10 +286,10 @@ class ZookeeperHandler(Handler, object):
         to the asynchronous nature of zookeeper interaction, this usage
         is not appropriate.
         """
-        try:
-            yield self._client.create(self._log_container_path)
-        except zookeeper.NodeExistsException:
-            pass
+        paths = [self._log_container_path]
+        if self._partitioned:
+            paths.append(self._log_container_path + "/streams")
+        yield self._create_containers(*paths)
 
     def _on_error(self, failure):
         failure.printTraceback(sys.stderr)
@@ -110,69 +325,535 @@ class ZookeeperHandler(Handler, object):
             raise ValueError("invalid log path %r" % log_path)
 
 
+def _parse_log_index(name):
+    """Return the index of a log node given its name, None if not one."""
+    if name.startswith("log-") and name[4:].isdigit():
+        return int(name[4:])
+
+
+def _ignore_missing(failure):
+    failure.trap(zookeeper.NoNodeException)
+
+
+def _fire_once(d):
+    if not d.called:
+        d.callback(None)
+
+
+def _wait_any(*deferreds):
+    """Return a deferred firing with the result of the first deferred."""
+    result = Deferred()
+
+    def fire(value):
+        if not result.called:
+            result.callback(value)
+    for d in deferreds:
+        d.addBoth(fire)
+    return result
+
+
+def _share_budget(counts, budget):
+    """Share a budget of log nodes among containers, given their counts.
+
+    Returns the number of log nodes retained by container, containers
+    under an even share keep theirs, and what they leave is shared among
+    the others.
+    """
+    retained = {}
+    remaining = budget
+    items = sorted(counts.items(), key=lambda item: (item[1], item[0]))
+    for position, (container, count) in enumerate(items):
+        share = remaining // (len(items) - position)
+        retained[container] = min(count, share)
+        remaining -= retained[container]
+    return retained
+
+
+def _parse_entries(content):
+    """Return the log entries of a log node, single record or batch."""
+    data = json.loads(content)
+    if isinstance(data, list):
+        return data
+    return [data]
+
+
+def _parse_archive_index(content):
+    """Return the archive chunks listed by an archive index node."""
+    data = content and json.loads(content) or {}
+    return data.get("chunks", [])
+
+
+class LogJanitor(object):
+    """Enforces the retention of the log entries stored in zookeeper.
+
+    The oldest log nodes beyond `max_entries` nodes, and those older than
+    `max_age` seconds, are archived to the provider file storage in chunks
+    of up to `chunk_size` nodes, and then removed from zookeeper. A chunk
+    is stored and listed in the archive index before its nodes are
+    removed, such that entries are never lost, and a L{LogIterator} given
+    the file storage replays them transparently.
+
+    The `max_entries` log nodes retained are shared by the log container
+    and the streams of a partitioned log, each keeping at most an even
+    share of those not used by smaller streams. A log node holds a batch
+    of log records. The streams found empty by two consecutive runs are
+    removed, along with their archive index.
+    """
+
+    def __init__(self, client, storage, log_container="/logs",
+                 max_entries=10000, max_age=None, chunk_size=500):
+        """Initialize a log janitor.
+
+        :param client: A connected zookeeper client.
+        :param storage: The provider file storage archives are stored in.
+        :param log_container: The zookeeper log container path.
+        :param max_entries: The number of log nodes retained, across the
+            streams of the log, unlimited if None.
+        :param max_age: The number of seconds log nodes are retained for,
+            unlimited if None.
+        :param chunk_size: The maximum number of log nodes per archive.
+        """
+        self._client = client
+        self._container_path = log_container
+        self._chunk_size = max(1, chunk_size)
+        # The streams found empty by the last run.
+        self._empty_streams = set()
+        self.configure(storage, max_entries, max_age)
+
+    def configure(self, storage, max_entries=10000, max_age=None):
+        """Change the storage and retention, effective on the next run."""
+        self._storage = storage
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    @inlineCallbacks
+    def run(self, now=None):
+        """Archive and remove the log nodes past their retention.
+
+        Returns a report dictionary of the number of archived `nodes`, the
+        number of archive `chunks` stored, the zookeeper `bytes` reclaimed
+        and the number of empty `streams` removed.
+        """
+        if now is None:
+            now = time.time()
+        report = {"nodes": 0, "chunks": 0, "bytes": 0, "streams": 0}
+        streams_path = "%s/streams" % self._container_path
+        try:
+            streams = yield self._client.get_children(streams_path)
+        except zookeeper.NoNodeException:
+            streams = []
+        containers = [self._container_path] + [
+            "%s/%s" % (streams_path, name) for name in sorted(streams)]
+
+        indexes = {}
+        for container in containers:
+            try:
+                children = yield self._client.get_children(container)
+            except zookeeper.NoNodeException:
+                continue
+            indexes[container] = sorted(
+                index for index in map(_parse_log_index, children)
+                if index is not None)
+
+        retained = {}
+        if self.max_entries is not None:
+            retained = _share_budget(
+                dict((container, len(container_indexes))
+                     for container, container_indexes in indexes.items()),
+                self.max_entries)
+
+        empty_streams = set()
+        for container in containers[1:]:
+            if container not in indexes:
+                continue
+            remaining = yield self._prune(
+                container, indexes[container], retained.get(container),
+                now, report)
+            if not remaining:
+                empty_streams.add(container)
+        if self._container_path in indexes:
+            yield self._prune(
+                self._container_path, indexes[self._container_path],
+                retained.get(self._container_path), now, report)
+
+        for container in sorted(empty_streams & self._empty_streams):
+            removed = yield self._remove_stream(container)
+            if removed:
+                report["streams"] += 1
+        self._empty_streams = empty_streams
+        returnValue(report)
+
+    @inlineCallbacks
+    def _prune(self, container, indexes, retained, now, report):
+        """Archive the log nodes of a container past their retention.
+
+        Returns the number of log nodes remaining in the container.
+        """
+        excess = 0
+        if retained is not None:
+            excess = max(0, len(indexes) - retained)
+
+        position = 0
+        expired = True
+        while expired and position < len(indexes):
+            window = indexes[position:position + self._chunk_size]
+            results = yield get_many(
+                self._client,
+                ["%s/log-%010d" % (container, log_index)
+                 for log_index in window],
+                missing_ok=True)
+            chunk = []
+            for log_index, result in zip(window, results):
+                if position >= excess and not self._is_expired(result, now):
+                    expired = False
+                    break
+                position += 1
+                if result is not None:
+                    chunk.append((log_index, result[0]))
+            if chunk:
+                yield self._archive_chunk(container, chunk, report)
+        returnValue(len(indexes) - position)
+
+    @inlineCallbacks
+    def _remove_stream(self, container):
+        """Remove an empty stream, unless it was written meanwhile.
+
+        Returns whether the stream was removed.
+        """
+        try:
+            children = yield self._client.get_children(container)
+            if any(_parse_log_index(name) is not None for name in children):
+                returnValue(False)
+            if "archive" in children:
+                yield self._client.delete("%s/archive" % container)
+            yield self._client.delete(container)
+        except (zookeeper.NoNodeException, zookeeper.NotEmptyException):
+            returnValue(False)
+        returnValue(True)
+
+    def _is_expired(self, result, now):
+        # A missing node is expired, there's nothing to retain.
+        if result is None:
+            return True
+        if self.max_age is None:
+            return False
+        return result[1]["ctime"] / 1000.0 < now - self.max_age
+
+    @inlineCallbacks
+    def _archive_chunk(self, container, chunk, report):
+        """Store a chunk of log nodes, list it, and remove the nodes."""
+        first, last = chunk[0][0], chunk[-1][0]
+        name = "%s/archive-%010d-%010d.json" % (
+            container.strip("/"), first, last)
+        size = sum(len(content) for log_index, content in chunk)
+        yield self._storage.put(name, StringIO(json.dumps(
+            [[log_index, _parse_entries(content)]
+             for log_index, content in chunk])))
+
+        info = {"name": name, "first": first, "last": last,
+                "nodes": len(chunk), "bytes": size}
+
+        def add_chunk(content, stat):
+            data = content and json.loads(content) or {}
+            chunks = [chunk_info for chunk_info
+                      in _parse_archive_index(content)
+                      if chunk_info["name"] != name]
+            chunks.append(info)
+            data["chunks"] = chunks
+            return json.dumps(data)
+        yield retry_change(
+            self._client, "%s/archive" % container, add_chunk)
+
+        yield delete_many(
+            self._client,
+            ["%s/log-%010d" % (container, log_index)
+             for log_index, content in chunk],
+            missing_ok=True)
+
+        # Readers at the head of the log watch the archive index, to learn
+        # of removals shifting the sequence of the next log nodes.
+        def set_pruned(content, stat):
+            data = content and json.loads(content) or {}
+            data["pruned"] = last
+            return json.dumps(data)
+        yield retry_change(
+            self._client, "%s/archive" % container, set_pruned)
+        report["nodes"] += len(chunk)
+        report["chunks"] += 1
+        report["bytes"] += size
+
+
 class LogIterator(object):
     """An iterator over zookeeper stored log entries.
 
     Provides for reading log entries stored in zookeeper, with a persistent
-    position marker, that is updated after size block reads.
+    position marker, that is updated after size block reads. The position
+    marker counts log nodes, the entries of a batch node are returned one
+    by one.
+
+    The log nodes available are discovered by listing the log container,
+    and up to `prefetch` of them are fetched concurrently ahead of the
+    position. Once it reached the head of the log, the iterator waits on
+    a watch of the next log node.
+
+    Given the provider file `storage`, the log nodes archived by the
+    L{LogJanitor} are read from their archive chunks, when replaying or
+    resuming from a saved position.
     """
     def __init__(
-        self, client, replay=False, log_container="/logs", seen_block_size=10):
+        self, client, replay=False, log_container="/logs", seen_block_size=10,
+        prefetch=20, storage=None):
 
         self._client = client
         self._container_path = log_container
         self._container_exists = None
         self._seen_block_size = seen_block_size
         self._replay = replay
+        self._prefetch = max(1, prefetch)
         self._log_index = None
         self._last_seen_index = 0
+        self._saved_index = 0
+        self._entries = []
+        # The indexes of the log nodes known to exist past the position.
+        self._available = []
+        # The index of the next log node, once caught up with the log, and
+        # deferreds firing once the other children of the container, and
+        # the children listed, change.
+        self._next_index = None
+        self._changed = None
+        self._children_changed = None
+        # The creation zxid of the container, telling a recreated stream.
+        self._container_id = None
+        # log index -> deferred content, or None if the node is gone.
+        self._fetches = {}
+        self._storage = storage
+        # The archive chunks not read yet, None until the index is read.
+        self._archive_chunks = None
+        # The (log index, entries) of the archive chunk being read.
+        self._archived = []
+        # Whether the iterator is waiting for the log to be written.
+        self.at_head = False
+        self._head_waiters = []
 
     @inlineCallbacks
     def next(self):
+        if self._entries:
+            returnValue(self._entries.pop(0))
+
         if self._container_exists is None:
             self._container_exists = yield self._wait_for_container()
 
         if self._log_index is None:
             self._last_seen_index = yield self._get_last_seen()
+            self._saved_index = self._last_seen_index
             if not self._replay:
                 self._log_index = self._last_seen_index
             else:
                 self._log_index = 0
+            # A new reader tails the log, archives are only read when
+            # replaying or resuming from a saved position.
+            if self._storage is None or not (
+                    self._replay or self._log_index):
+                self._archive_chunks = []
+
+        while True:
+            entries = yield self._next_archived()
+            if entries is not None:
+                break
+            yield self._wait_for_available()
+            self._prefetch_entries()
+            log_index = self._available.pop(0)
+            data = self._fetches.pop(log_index)
+            if log_index < self._log_index:
+                # Read from the archive meanwhile.
+                continue
+            data = yield data
+            if data is not None:
+                self._log_index = log_index + 1
+                entries = _parse_entries(data)
+                break
+            # Nodes may be removed from underneath, by the janitor, re-read
+            # the archive index in case they were archived.
+            self._next_index = None
+            if self._storage is not None:
+                self._log_index = log_index
+                self._archive_chunks = None
+            else:
+                self._log_index = log_index + 1
 
-        log_entry_path = "/logs/log-%010d" % self._log_index
+        if self._replay and self._log_index > self._last_seen_index:
+            self._replay = False
 
-        try:
-            data, stat = yield self._client.get(log_entry_path)
-        except zookeeper.NoNodeException:
+        if self._log_index - self._saved_index >= self._seen_block_size:
+            yield self._update_last_seen()
+        self._entries = entries
+        entry = yield self.next()
+        returnValue(entry)
+
+    def _get_entry_path(self, log_index):
+        return "%s/log-%010d" % (self._container_path, log_index)
+
+    @inlineCallbacks
+    def _wait_for_available(self):
+        """Wait until a log node past the position is known.
+
+        Once caught up, the next log node is watched by its expected
+        index, rather than listing the container for each new node. The
+        container is listed again once any other change of its children
+        shifted the sequence of the next log nodes, such as the janitor
+        pruning log nodes, or the streams of a partitioned log created.
+        """
+        while not self._available:
+            if self._next_index is None or self._changed.called:
+                yield self._list_available()
+                continue
             exists_d, watch_d = self._client.exists_and_watch(
-                log_entry_path)
+                self._get_entry_path(self._next_index))
             exists = yield exists_d
-            if not exists:
-                yield watch_d
-            entry = yield self.next()
-            returnValue(entry)
-        else:
-            self._log_index += 1
-            if self._replay and self._log_index > self._last_seen_index:
-                self._replay = False
+            if exists:
+                self._available = [self._next_index]
+                self._next_index += 1
+                continue
+            stat = yield self._client.exists(self._container_path)
+            if stat is None or stat["cversion"] != self._next_index:
+                self._next_index = None
+                continue
+            watches = [watch_d, self._changed]
+            if not self._children_changed.called:
+                watches.append(self._children_changed)
+            yield self._wait_at_head(_wait_any(*watches))
+
+    @inlineCallbacks
+    def _list_available(self):
+        """List the log nodes past the position.
+
+        If there are none, the index of the next log node is the child
+        version of the container, the sequence zookeeper assigns next.
+        """
+        # The other children of the container are watched first, such
+        # that their changes after the container is read are noticed.
+        changed = self._changed = Deferred()
+        for name in ("archive", "streams"):
+            exists_d, watch_d = self._client.exists_and_watch(
+                "%s/%s" % (self._container_path, name))
+            yield exists_d
+            watch_d.addBoth(lambda result: _fire_once(changed))
+
+        stat = yield self._client.exists(self._container_path)
+        children = None
+        children_changed = self._children_changed = Deferred()
+        if stat is not None:
+            children_d, watch_d = self._client.get_children_and_watch(
+                self._container_path)
+            watch_d.addBoth(lambda result: _fire_once(children_changed))
+            try:
+                children = yield children_d
+            except zookeeper.NoNodeException:
+                pass
+        if children is None:
+            # The stream was removed by the janitor, once empty.
+            yield self._wait_for_container()
+            return
+        if self._container_id not in (None, stat["czxid"]):
+            # The stream was recreated, its log restarts from the first
+            # index.
+            self._log_index = self._saved_index = 0
+            self._archive_chunks = []
+            self._archived = []
+        self._container_id = stat["czxid"]
+        self._available = sorted(
+            index for index in map(_parse_log_index, children)
+            if index is not None and index >= self._log_index)
+        self._next_index = None
+        if not self._available:
+            self._next_index = max(stat["cversion"], self._log_index)
+
+    def _prefetch_entries(self):
+        """Fetch the next window of log nodes concurrently."""
+        for log_index in self._available[:self._prefetch]:
+            if log_index not in self._fetches:
+                d = self._client.get(self._get_entry_path(log_index))
+                d.addCallbacks(lambda (data, stat): data, _ignore_missing)
+                self._fetches[log_index] = d
 
-            if self._log_index % self._seen_block_size == 0:
-                yield self._update_last_seen()
-            returnValue(json.loads(data))
+    @inlineCallbacks
+    def _next_archived(self):
+        """Return the entries of the next archived log node, if any.
+
+        Returns None once the archived log nodes past the position have
+        been read.
+        """
+        if self._archive_chunks is None:
+            try:
+                content, stat = yield self._client.get(
+                    "%s/archive" % self._container_path)
+            except zookeeper.NoNodeException:
+                content = None
+            self._archive_chunks = _parse_archive_index(content)
+
+        while True:
+            while self._archived and self._archived[0][0] < self._log_index:
+                self._archived.pop(0)
+            if self._archived:
+                break
+            if not self._archive_chunks:
+                returnValue(None)
+            chunk = self._archive_chunks.pop(0)
+            if chunk["last"] >= self._log_index:
+                self._archived = yield self._read_archive_chunk(chunk)
+
+        log_index, entries = self._archived.pop(0)
+        self._log_index = log_index + 1
+        returnValue(entries)
+
+    @inlineCallbacks
+    def _read_archive_chunk(self, chunk):
+        try:
+            archive = yield self._storage.get(chunk["name"])
+        except FileNotFound:
+            returnValue([])
+        returnValue(json.loads(archive.read()))
 
     @inlineCallbacks
     def _wait_for_container(self):
         exists_d, watch_d = self._client.exists_and_watch(self._container_path)
         exists = yield exists_d
         if not exists:
-            yield watch_d
+            yield self._wait_at_head(watch_d)
         returnValue(True)
 
+    def wait_at_head(self):
+        """Return a deferred firing once the iterator is at the head.
+
+        That is once it waits for the log to be written, having read all
+        its entries.
+        """
+        d = Deferred()
+        if self.at_head:
+            d.callback(self)
+        else:
+            self._head_waiters.append(d)
+        return d
+
+    @inlineCallbacks
+    def _wait_at_head(self, watch_d):
+        self.at_head = True
+        waiters, self._head_waiters = self._head_waiters, []
+        for d in waiters:
+            d.callback(self)
+        try:
+            yield watch_d
+        finally:
+            self.at_head = False
+
     def _update_last_seen(self):
         if self._replay:
             return
+        self._saved_index = self._log_index
         data = {"next-log-index": self._log_index}
-        return self._client.set(self._container_path, json.dumps(data))
+        d = self._client.set(self._container_path, json.dumps(data))
+        # A stream may be removed by the janitor once read.
+        return d.addErrback(_ignore_missing)
 
     @inlineCallbacks
     def _get_last_seen(self):
@@ -185,3 +866,141 @@ class LogIterator(object):
                 log_index = data.get("next-log-index", 0)
 
         returnValue(log_index)
+
+
+class MergedLogIterator(object):
+    """An iterator over the streams of a partitioned log.
+
+    Each stream selected by `select`, a callable given the context and
+    level name of a stream, is read by its own L{LogIterator}, with its
+    own position marker, along with the unpartitioned log container
+    itself. Streams created while iterating are picked up as they appear,
+    and those removed by the janitor are dropped.
+
+    The entries of the streams are interleaved by their creation time.
+    An entry is returned once each stream has either an entry ready or
+    is at the head of its log, such that entries are returned in order
+    as long as the reader keeps up with the writers.
+    """
+
+    def __init__(self, client, select=None, replay=False,
+                 log_container="/logs", storage=None, **kw):
+        """Initialize a merged log iterator.
+
+        :param select: A callable given the context and level name of a
+            stream, returning whether the stream is read. All streams are
+            read if None.
+
+        The other keyword arguments are those of the L{LogIterator}s of
+        the streams.
+        """
+        self._client = client
+        self._select = select
+        self._container_path = log_container
+        self._streams_path = "%s/streams" % log_container
+        self._options = dict(kw, replay=replay, storage=storage)
+        # stream name -> the iterator reading it.
+        self._streams = {}
+        # The iterators in order, the unpartitioned log container's first.
+        self._iterators = []
+        # iterator -> the next entry of its stream.
+        self._heads = {}
+        # iterator -> deferred of the next entry of its stream.
+        self._pending = {}
+        self._head_waits = {}
+        self._streams_watch = None
+        self._failure = None
+
+    @property
+    def streams(self):
+        """The names of the streams read."""
+        return sorted(self._streams)
+
+    def _add_iterator(self, container):
+        iterator = LogIterator(
+            self._client, log_container=container, **self._options)
+        self._iterators.append(iterator)
+        return iterator
+
+    def _remove_iterator(self, iterator):
+        # An entry already read is still returned.
+        self._iterators.remove(iterator)
+        self._pending.pop(iterator, None)
+        self._head_waits.pop(iterator, None)
+
+    @inlineCallbacks
+    def next(self):
+        if not self._iterators:
+            self._add_iterator(self._container_path)
+
+        while True:
+            if self._failure is not None:
+                failure, self._failure = self._failure, None
+                failure.raiseException()
+            if self._streams_watch is None or self._streams_watch.called:
+                yield self._update_streams()
+
+            for iterator in self._iterators:
+                if not (iterator in self._heads or
+                        iterator in self._pending):
+                    self._read_head(iterator)
+
+            busy = [iterator for iterator in self._pending
+                    if not iterator.at_head]
+            if self._heads and not busy:
+                iterator = min(
+                    self._heads,
+                    key=lambda iterator: (
+                        self._heads[iterator].get("created", 0),
+                        iterator in self._iterators and
+                        self._iterators.index(iterator)))
+                returnValue(self._heads.pop(iterator))
+
+            waits = self._pending.values() + [self._streams_watch]
+            for iterator in busy:
+                d = self._head_waits.get(iterator)
+                if d is None or d.called:
+                    d = self._head_waits[iterator] = iterator.wait_at_head()
+                waits.append(d)
+            yield DeferredList(
+                waits, fireOnOneCallback=True, consumeErrors=True)
+
+    def _read_head(self, iterator):
+        d = self._pending[iterator] = iterator.next()
+
+        def on_entry(entry):
+            if self._pending.get(iterator) is d:
+                del self._pending[iterator]
+                self._heads[iterator] = entry
+
+        def on_error(failure):
+            # The stream of a dropped iterator was removed underneath it.
+            if self._pending.get(iterator) is d:
+                del self._pending[iterator]
+                self._failure = failure
+        d.addCallbacks(on_entry, on_error)
+
+    @inlineCallbacks
+    def _update_streams(self):
+        """Read the selected streams, and watch for new streams."""
+        children = []
+        exists_d, watch_d = self._client.exists_and_watch(self._streams_path)
+        if (yield exists_d):
+            children_d, children_watch_d = (
+                self._client.get_children_and_watch(self._streams_path))
+            try:
+                children = yield children_d
+                watch_d = children_watch_d
+            except zookeeper.NoNodeException:
+                pass
+        self._streams_watch = watch_d
+
+        for name in sorted(set(self._streams) - set(children)):
+            self._remove_iterator(self._streams.pop(name))
+        for name in sorted(children):
+            if name in self._streams:
+                continue
+            context, levelname = parse_stream_name(name)
+            if self._select is None or self._select(context, levelname):
+                self._streams[name] = self._add_iterator(
+                    "%s/%s" % (self._streams_path, name))
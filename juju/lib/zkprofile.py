@@ -0,0 +1,238 @@
+"""
+Profiling of the zookeeper operations of a process.
+
+A L{ZookeeperProfiler} instruments the zookeeper client class, such
+that every operation of every client in the process is recorded along
+with its normalized path, latency, payload size and calling site. The
+summary table tells which code paths generate zookeeper traffic, and
+how slow it is.
+"""
+import atexit
+import os
+import re
+import signal
+import sys
+import time
+
+from txzookeeper import ZookeeperClient
+
+
+# Operations returning a deferred.
+OPERATIONS = (
+    "create", "delete", "exists", "get", "get_children", "set",
+    "get_acl", "set_acl")
+
+# Operations returning a deferred and a watch deferred.
+WATCH_OPERATIONS = (
+    "exists_and_watch", "get_and_watch", "get_children_and_watch")
+
+_NUMBERED_RE = re.compile(r"\d")
+
+_SKIPPED_MODULES = ("twisted", "txzookeeper")
+
+_MODULE_PATH = os.path.splitext(os.path.abspath(__file__))[0]
+
+
+def normalize_path(path):
+    """Return `path` with any segment naming a specific node as `*`.
+
+    Such segments are recognized by containing a number, as is the case
+    for the ids of units, machines, services, relations and sequence
+    nodes. ie. `/units/unit-0000000001/ports` becomes `/units/*/ports`.
+    """
+    return "/".join(
+        "*" if _NUMBERED_RE.search(segment) else segment
+        for segment in path.split("/")) or "/"
+
+
+def _get_calling_site():
+    """Return the first frame of the call stack outside of libraries."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not (os.path.splitext(os.path.abspath(filename))[0] ==
+                _MODULE_PATH or
+                any(("%s%s%s" % (os.sep, module, os.sep)) in filename
+                    for module in _SKIPPED_MODULES)):
+            return "%s:%d %s" % (
+                os.path.basename(filename), frame.f_lineno,
+                frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+def _payload_size(operation, args, kw, result):
+    if operation in ("create", "set"):
+        data = len(args) > 1 and args[1] or kw.get("data") or ""
+        return len(data)
+    if operation in ("get", "get_and_watch") and result:
+        return len(result[0] or "")
+    if operation in ("get_children", "get_children_and_watch") and result:
+        return sum(len(child) for child in result)
+    return 0
+
+
+class OperationStats(object):
+    """The statistics of an operation on a path prefix."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes = 0
+        self.sites = {}
+
+    def add(self, duration, size, site, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.bytes += size
+        self.sites[site] = self.sites.get(site, 0) + 1
+
+    @property
+    def top_site(self):
+        return max(self.sites.items(), key=lambda item: item[1])[0]
+
+
+class ZookeeperProfiler(object):
+    """Records the zookeeper operations of all clients in the process.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        # The number of times an operation was issued while none was
+        # outstanding, ie. the sequential round trips to zookeeper.
+        # Concurrent operations share a round trip.
+        self.round_trips = 0
+        self._outstanding = 0
+        self._originals = None
+        self.start_time = time.time()
+
+    def record(self, operation, path, duration, size, site, error=False):
+        key = (operation, normalize_path(path))
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = OperationStats()
+        stats.add(duration, size, site, error)
+
+    def install(self):
+        """Instrument the zookeeper client class."""
+        if self._originals is not None:
+            return
+        self._originals = {}
+        for operation in OPERATIONS + WATCH_OPERATIONS:
+            original = getattr(ZookeeperClient, operation)
+            self._originals[operation] = original
+            setattr(ZookeeperClient, operation,
+                    self._instrument(operation, original))
+
+    def uninstall(self):
+        """Remove the instrumentation of the zookeeper client class."""
+        if self._originals is None:
+            return
+        for operation, original in self._originals.items():
+            setattr(ZookeeperClient, operation, original)
+        self._originals = None
+
+    def _instrument(self, operation, original):
+        profiler = self
+        watches = operation in WATCH_OPERATIONS
+
+        def instrumented(client, path, *args, **kw):
+            site = _get_calling_site()
+            start = time.time()
+            if not profiler._outstanding:
+                profiler.round_trips += 1
+            profiler._outstanding += 1
+            try:
+                result = original(client, path, *args, **kw)
+            except:
+                profiler._outstanding -= 1
+                raise
+            d = result[0] if watches else result
+
+            def on_result(value):
+                profiler._outstanding -= 1
+                profiler.record(
+                    operation, path, time.time() - start,
+                    _payload_size(operation, (path,) + args, kw, value),
+                    site)
+                return value
+
+            def on_error(failure):
+                profiler._outstanding -= 1
+                profiler.record(
+                    operation, path, time.time() - start, 0, site,
+                    error=True)
+                return failure
+            d.addCallbacks(on_result, on_error)
+            return result
+
+        instrumented.__name__ = original.__name__
+        instrumented.__doc__ = original.__doc__
+        return instrumented
+
+    def format_summary(self):
+        """Return the summary table of the recorded operations.
+
+        Operations are sorted by their total time, descending.
+        """
+        elapsed = time.time() - self.start_time
+        total = sum(stats.count for stats in self.stats.values())
+        lines = [
+            "Zookeeper profile: %d operations in %0.3fs, %d round trips" % (
+                total, elapsed, self.round_trips),
+            "%-24s %-40s %6s %6s %9s %9s %9s %s" % (
+                "operation", "path", "count", "errors", "total(s)",
+                "max(s)", "bytes", "top caller")]
+        items = sorted(self.stats.items(),
+                       key=lambda item: item[1].total_time, reverse=True)
+        for (operation, path), stats in items:
+            lines.append("%-24s %-40s %6d %6d %9.3f %9.3f %9d %s" % (
+                operation, path, stats.count, stats.errors,
+                stats.total_time, stats.max_time, stats.bytes,
+                stats.top_site))
+        return "\n".join(lines)
+
+    def dump(self, log=None, stream=None):
+        """Write the summary table, to a logger or a stream."""
+        summary = self.format_summary()
+        if log is not None:
+            log.info("%s", summary)
+        else:
+            (stream or sys.stderr).write(summary + "\n")
+
+    def dump_on_signal(self, dump, signum=signal.SIGUSR2):
+        """Invoke `dump` from the reactor whenever `signum` is received.
+
+        Any previous handler of `signum` is still invoked, such as the
+        watch registry's report, also dumped on SIGUSR2. (SIGUSR1 is
+        left alone, twistd reopens its log file on it.)
+        """
+        from twisted.internet import reactor
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame):
+            reactor.callFromThread(dump)
+            if callable(previous):
+                previous(signum, frame)
+        signal.signal(signum, handler)
+
+
+def enable_profiling(log=None, stream=None, at_exit=True):
+    """Profile the zookeeper operations of the process.
+
+    The summary is written to `log` or `stream` on SIGUSR2, and at exit
+    unless `at_exit` is False. Returns the installed profiler.
+    """
+    profiler = ZookeeperProfiler()
+    profiler.install()
+
+    def dump():
+        profiler.dump(log=log, stream=stream)
+    if at_exit:
+        atexit.register(dump)
+    profiler.dump_on_signal(dump)
+    return profiler
@@ -96,6 +96,14 @@ class UnitMachineDeploymentTest(RepositoryTestBase):
         self.assertEqual(environ["JUJU_ZOOKEEPER"], zk_address)
         self.assertEqual(environ["JUJU_MACHINE_ID"], "21")
 
+    def test_deployment_get_environment_charm_cache_size(self):
+        """The machine agent's charm cache size is passed to the unit."""
+        deployment = UnitMachineDeployment(
+            self.unit_name, self.juju_directory, charm_cache_size=64)
+        environ = deployment.get_environment(
+            21, get_test_zookeeper_address())
+        self.assertEqual(environ["JUJU_CHARM_CACHE_SIZE"], "64")
+
     def test_service_unit_start_with_integer_machine_id(self):
         """
         Starting a service unit will result in a unit workspace being created
@@ -267,6 +275,32 @@ class UnitMachineDeploymentTest(RepositoryTestBase):
         self.assertEqual(
             charm.get_revision(), self.charm.get_revision())
 
+    def test_unpack_charm_shared_between_units(self):
+        """
+        Units on the same machine share the extracted charm files.
+        """
+        other = UnitMachineDeployment("wordpress/1", self.juju_directory)
+        self.deployment.unpack_charm(self.bundle)
+        other.unpack_charm(self.bundle)
+
+        metadata = os.stat(os.path.join(
+            self.deployment.directory, "charm", "metadata.yaml"))
+        other_metadata = os.stat(os.path.join(
+            other.directory, "charm", "metadata.yaml"))
+        self.assertEqual(metadata.st_ino, other_metadata.st_ino)
+
+    @inlineCallbacks
+    def test_destroy_releases_extracted_charm(self):
+        """
+        Destroying the last unit using a charm releases its extracted files.
+        """
+        self.deployment.unpack_charm(self.bundle)
+        store_path = self.deployment.charm_store.get_path(
+            self.bundle.get_sha256())
+        self.assertTrue(os.path.isdir(store_path))
+        yield self.deployment.destroy()
+        self.assertFalse(os.path.exists(store_path))
+
     def test_unpack_charm_exception_invalid_charm(self):
         """
         If the charm bundle is corrupted or invalid a deployment specific
@@ -14,6 +14,7 @@ from twisted.internet.protocol import ProcessProtocol
 from juju.charm.bundle import CharmBundle
 from juju.lib.twistutils import get_module_directory
 from juju.lib.lxc import LXCContainer, get_containers, LXCError
+from juju.unit.charm import ExtractedCharmStore
 
 from .errors import UnitDeploymentError
 
@@ -57,8 +58,10 @@ class UnitMachineDeployment(object):
 
     unit_agent_module = "juju.agents.unit"
 
-    def __init__(self, unit_name, juju_home):
+    def __init__(self, unit_name, juju_home, charm_cache_size=None):
         self.unit_name = unit_name
+        # Size cap of the unit agent's charm cache, in megabytes.
+        self.charm_cache_size = charm_cache_size
 
         assert ".." not in unit_name, "Invalid Unit Name"
         self.unit_path_name = unit_name.replace("/", "-")
@@ -70,6 +73,10 @@ class UnitMachineDeployment(object):
         self.pid_file = os.path.join(
             self.juju_home, "units", "%s.pid" % self.unit_path_name)
 
+        # Extracted charms are shared between the units of the machine.
+        self.charm_store = ExtractedCharmStore(
+            os.path.join(self.juju_home, "extracted-charms"))
+
     def start(self, machine_id, zookeeper_hosts, bundle):
         """Start a service unit agent."""
         # Extract the charm into the unit directory.
@@ -93,6 +100,8 @@ class UnitMachineDeployment(object):
         environ["JUJU_UNIT_NAME"] = self.unit_name
         environ["JUJU_HOME"] = self.juju_home
         environ["JUJU_ZOOKEEPER"] = zookeeper_hosts
+        if self.charm_cache_size:
+            environ["JUJU_CHARM_CACHE_SIZE"] = str(self.charm_cache_size)
         environ["PYTHONPATH"] = ":".join(
             filter(None, [
                 os.path.dirname(get_module_directory(juju)),
@@ -120,6 +129,9 @@ class UnitMachineDeployment(object):
         if os.path.exists(self.directory):
             shutil.rmtree(self.directory)
 
+        # Release extracted charms no longer used by any unit.
+        self.charm_store.collect()
+
     def is_running(self):
         """Is the service unit running."""
         try:
@@ -142,12 +154,17 @@ class UnitMachineDeployment(object):
         return succeed(True)
 
     def unpack_charm(self, charm):
-        """Unpack a charm to the service units directory."""
+        """Unpack a charm to the service units directory.
+
+        The charm's files are hardlinked from the machine's extracted
+        charm store, such that the bundle is only extracted once per
+        machine.
+        """
         if not isinstance(charm, CharmBundle):
             raise UnitDeploymentError(
                 "Invalid charm for deployment: %s" % charm.path)
 
-        charm.extract_to(os.path.join(self.directory, "charm"))
+        self.charm_store.deploy(charm, os.path.join(self.directory, "charm"))
 
 
 container_upstart_job_template = """\
@@ -184,8 +201,9 @@ class UnitContainerDeployment(UnitMachineDeployment):
     This is an ongoing development topic for LXC.
     """
 
-    def __init__(self, unit_name, juju_home):
-        super(UnitContainerDeployment, self).__init__(unit_name, juju_home)
+    def __init__(self, unit_name, juju_home, charm_cache_size=None):
+        super(UnitContainerDeployment, self).__init__(
+            unit_name, juju_home, charm_cache_size)
 
         self._unit_namespace = os.environ.get("JUJU_UNIT_NS")
         self._juju_origin = os.environ.get("JUJU_ORIGIN")
@@ -300,7 +318,9 @@ class UnitContainerDeployment(UnitMachineDeployment):
         # Create state directories for unit in the container
         self.setup_directories()
 
-        # Extract the charm bundle
+        # Extract the charm bundle. Unlike machine deployments, files are
+        # not shared with the host's extracted charm store, as that would
+        # break the isolation between containers.
         charm_path = os.path.join(
             self.directory, "var", "lib", "juju", "units",
             self.unit_path_name, "charm")
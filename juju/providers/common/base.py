@@ -28,6 +28,17 @@ class MachineProviderBase(object):
         * :meth:`close_port`
         * :meth:`get_opened_ports`
 
+    Providers able to launch several machines at once may also implement
+    the optional ``start_machines(machines_data)`` method, returning a list
+    of ``(success, result)`` tuples (as :class:`DeferredList` does) in the
+    order of `machines_data`. Callers fall back to :meth:`start_machine`
+    for providers without it.
+
+    Similarly, providers able to read the opened ports of every machine
+    at once may implement the optional ``get_all_opened_ports()`` method,
+    returning a dictionary mapping machine ids to sets of open
+    ``(port, protocol)`` pairs.
+
     You may want to override the following methods, but you should be careful
     to call :class:`MachineProviderBase`'s implementation (or be very sure you
     don't need to:
@@ -38,6 +49,11 @@ class MachineProviderBase(object):
     You probably shouldn't override anything else.
     """
 
+    # Does :meth:`connect` reach zookeeper through an ssh tunnel, which
+    # may then be shared between commands via ``open-tunnel --shared``.
+    # Providers connecting otherwise should set it to False.
+    connects_via_tunnel = True
+
     def __init__(self, environment_name, config):
         if ("authorized-keys-path" in config and
             "authorized-keys" in config):
@@ -122,6 +138,31 @@ class MachineProviderBase(object):
         """Returns a set of open (port, protocol) pairs for `machine`."""
         raise NotImplementedError()
 
+    @inlineCallbacks
+    def set_machine_ports(self, machine, machine_id, ports,
+                          opened_ports=None):
+        """Opens and closes ports such that exactly `ports` are open.
+
+        :param ports: the (port, protocol) pairs to be open on `machine`.
+        :type ports: set
+
+        :param opened_ports: the (port, protocol) pairs known to be open,
+            if any; they are read with :meth:`get_opened_ports` otherwise.
+        :type opened_ports: set
+
+        :return: the set of (port, protocol) pairs now open.
+        :rtype: :class:`twisted.internet.defer.Deferred`
+
+        Providers able to batch port changes should override this.
+        """
+        if opened_ports is None:
+            opened_ports = yield self.get_opened_ports(machine, machine_id)
+        for port, protocol in sorted(ports - opened_ports):
+            yield self.open_port(machine, machine_id, port, protocol)
+        for port, protocol in sorted(opened_ports - ports):
+            yield self.close_port(machine, machine_id, port, protocol)
+        returnValue(set(ports))
+
     #================================================================
     # Subclasses will not generally need to override the methods in
     # this block
@@ -1,3 +1,4 @@
+import os
 import random
 
 from twisted.internet.defer import inlineCallbacks, returnValue
@@ -7,14 +8,21 @@ from txzookeeper.client import ConnectionTimeoutException
 from juju.errors import EnvironmentNotFound, EnvironmentPending, NoConnection
 from juju.lib.twistutils import sleep
 from juju.state.sshclient import SSHClient
+from juju.state.tunnel import SharedTunnelClient, get_tunnel_socket_path
 
 from .utils import log
 
 
 class ZookeeperConnect(object):
 
-    def __init__(self, provider):
+    def __init__(self, provider, shared_tunnel=True):
+        """
+        :param provider: The machine provider of the environment.
+        :param bool shared_tunnel: whether to connect through the shared
+            tunnel of `juju open-tunnel --shared`, when one is running.
+        """
         self._provider = provider
+        self._shared_tunnel = shared_tunnel
 
     @inlineCallbacks
     def run(self, share=False):
@@ -37,6 +45,11 @@ class ZookeeperConnect(object):
         any such timeouts being done externally.
         """
         log.info("Connecting to environment...")
+        if self._shared_tunnel:
+            client = yield self._connect_shared_tunnel()
+            if client is not None:
+                log.info("Connected to environment via shared tunnel.")
+                returnValue(client)
         while True:
             try:
                 client = yield self._internal_connect(share)
@@ -75,6 +88,21 @@ class ZookeeperConnect(object):
         yield self.wait_for_initialization(client)
         returnValue(client)
 
+    @inlineCallbacks
+    def _connect_shared_tunnel(self):
+        """Attempt connection via a shared tunnel, returning None if none.
+        """
+        socket_path = get_tunnel_socket_path(self._provider.environment_name)
+        if not os.path.exists(socket_path):
+            returnValue(None)
+        try:
+            client = yield SharedTunnelClient().connect_shared(socket_path)
+        except (NoConnection, ConnectionTimeoutException) as e:
+            log.debug("Cannot use shared tunnel: %s", e)
+            returnValue(None)
+        yield self.wait_for_initialization(client)
+        returnValue(client)
+
     @inlineCallbacks
     def wait_for_initialization(self, client):
         exists_d, watch_d = client.exists_and_watch("/initialized")
@@ -6,6 +6,17 @@ import os
 
 from twisted.internet.defer import fail, succeed
 from juju.errors import FileNotFound
+from juju.lib.webclient import CHUNK_SIZE, get_file_size
+
+
+def copy_file(source, target, progress=None, total=None):
+    """Copy a file object to another one in chunks, reporting progress."""
+    copied = 0
+    for data in iter(lambda: source.read(CHUNK_SIZE), ""):
+        target.write(data)
+        copied += len(data)
+        if progress is not None:
+            progress(copied, total)
 
 
 class FileStorage(object):
@@ -13,14 +24,24 @@ class FileStorage(object):
     def __init__(self, path):
         self._path = path
 
-    def get(self, name):
+    def get(self, name, output=None, progress=None):
+        """Get a file object from storage.
+
+        :param output: A file object to copy the file to, which is
+            returned instead of the stored file.
+        :param progress: A callable reporting the bytes copied.
+        """
         file_path = os.path.join(
             self._path, *filter(None, name.split("/")))
-        if os.path.exists(file_path):
+        if not os.path.exists(file_path):
+            return fail(FileNotFound(file_path))
+        if output is None:
             return succeed(open(file_path))
-        return fail(FileNotFound(file_path))
+        with open(file_path, "rb") as f:
+            copy_file(f, output, progress, os.path.getsize(file_path))
+        return succeed(output)
 
-    def put(self, remote_path, file_object):
+    def put(self, remote_path, file_object, progress=None):
         store_path = os.path.join(
             self._path, *filter(None, remote_path.split("/")))
         store_path = os.path.abspath(store_path)
@@ -31,7 +52,8 @@ class FileStorage(object):
         if not os.path.exists(parent_store_path):
             os.makedirs(parent_store_path)
         with open(store_path, "wb") as f:
-            f.write(file_object.read())
+            copy_file(
+                file_object, f, progress, get_file_size(file_object))
         return succeed(True)
 
     def get_url(self, name):
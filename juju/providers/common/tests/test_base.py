@@ -33,6 +33,10 @@ class MachineProviderBaseTest(TestCase):
         self.assertEquals(provider.environment_name, "venus")
         self.assertEquals(provider.config, {"some": "config"})
 
+    def test_connects_via_tunnel(self):
+        """Providers connect through a tunnel unless they say otherwise."""
+        self.assertTrue(DummyProvider().connects_via_tunnel)
+
     def test_bad_config(self):
         try:
             DummyProvider({"authorized-keys": "foo",
@@ -1,4 +1,5 @@
 import logging
+import os
 import random
 
 from twisted.internet.defer import fail, inlineCallbacks, succeed
@@ -14,12 +15,15 @@ from juju.lib.testing import TestCase
 from juju.machine import ProviderMachine
 from juju.providers.common.base import MachineProviderBase
 from juju.state.sshclient import SSHClient
+from juju.state.tunnel import (
+    SharedTunnelClient, TunnelServer, get_tunnel_socket_path)
 from juju.tests.common import get_test_zookeeper_address
 
 
 class DummyProvider(MachineProviderBase):
 
     def __init__(self, *zookeepers):
+        self.environment_name = "firstenv"
         self._zookeepers = zookeepers
 
     def get_zookeeper_machines(self):
@@ -35,14 +39,31 @@ class NotBootstrappedProvider(MachineProviderBase):
     """Pretend to be an environment that has not been bootstrapped."""
 
     def __init__(self):
-        pass
+        self.environment_name = "firstenv"
 
     def get_zookeeper_machines(self):
         return fail(EnvironmentNotFound("is the environment bootstrapped?"))
 
 
+class FakeTunnel(object):
+    """Stands in for an SSHClient, tunneling to the test zookeeper."""
+
+    connected = True
+
+    @property
+    def local_port(self):
+        return int(get_test_zookeeper_address().split(":")[1])
+
+    def close(self):
+        self.connected = False
+
+
 class ConnectTest(TestCase):
 
+    def setUp(self):
+        # Isolate from any shared tunnel of the user running the tests.
+        self.change_environment(HOME=self.makeDir())
+
     def mock_connect(self, share, result):
         client = self.mocker.patch(SSHClient)
         client.connect("foo.example.com:2181", timeout=30, share=share)
@@ -237,3 +258,46 @@ class ConnectTest(TestCase):
         finally:
             deleteTree("/", client.handle)
             client.close()
+
+    @inlineCallbacks
+    def test_shared_tunnel(self):
+        """A running shared tunnel is used instead of a new ssh tunnel."""
+        log = self.capture_logging(level=logging.DEBUG)
+        server = TunnelServer(lambda: succeed(FakeTunnel()))
+        yield server.start(get_tunnel_socket_path("firstenv"))
+        self.addCleanup(server.stop)
+
+        zookeeper.set_debug_level(0)
+        client = ZookeeperClient()
+        yield client.connect(get_test_zookeeper_address())
+        try:
+            yield client.create("/initialized")
+            provider = DummyProvider(
+                ProviderMachine("i-amok", "foo.example.com"))
+            shared_client = yield provider.connect()
+            self.assertTrue(isinstance(shared_client, SharedTunnelClient))
+            shared_client.close()
+            self.assertIn("Connected to environment via shared tunnel.",
+                          log.getvalue())
+        finally:
+            deleteTree("/", client.handle)
+            client.close()
+
+    @inlineCallbacks
+    def test_stale_shared_tunnel(self):
+        """A shared tunnel socket without a server is ignored."""
+        log = self.capture_logging(level=logging.DEBUG)
+        socket_path = get_tunnel_socket_path("firstenv")
+        os.makedirs(os.path.dirname(socket_path))
+        open(socket_path, "w").close()
+
+        client = self.mocker.mock(type=SSHClient)
+        self.mock_connect(False, succeed(client))
+        client.exists_and_watch("/initialized")
+        self.mocker.result((succeed(True), None))
+        self.mocker.replay()
+
+        provider = DummyProvider(ProviderMachine("i-amok", "foo.example.com"))
+        result = yield provider.connect()
+        self.assertIdentical(result, client)
+        self.assertIn("Cannot use shared tunnel", log.getvalue())
@@ -60,3 +60,20 @@ class FileStorageTest(TestCase):
         return self.failUnlessFailure(
             self.storage.put("../../etc/profile.txt", file_obj),
             AssertionError)
+
+    @inlineCallbacks
+    def test_put_and_get_progress(self):
+        """Copies report their progress, and can be made to a file object.
+        """
+        progress = []
+        yield self.storage.put(
+            "/magic/beans.txt", StringIO("rabbits"),
+            lambda *args: progress.append(args))
+        self.assertEqual(progress, [(7, 7)])
+
+        output = StringIO()
+        result = yield self.storage.get(
+            "/magic/beans.txt", output, lambda *args: progress.append(args))
+        self.assertIdentical(result, output)
+        self.assertEqual(output.getvalue(), "rabbits")
+        self.assertEqual(progress, [(7, 7), (7, 7)])
@@ -12,6 +12,7 @@ from juju.errors import (
 
 from juju.machine import ProviderMachine
 from juju.state.placement import UNASSIGNED_POLICY
+from juju.providers.common.base import MachineProviderBase
 from juju.providers.common.files import FileStorage
 
 log = logging.getLogger("juju.providers")
@@ -25,7 +26,9 @@ class DummyMachine(ProviderMachine):
         self._opened_ports = set()
 
 
-class MachineProvider(object):
+class MachineProvider(MachineProviderBase):
+
+    connects_via_tunnel = False
 
     def __init__(self, environment_name, config):
         self.environment_name = environment_name
@@ -1,7 +1,8 @@
 import os
 import re
 
-from twisted.internet.defer import fail, inlineCallbacks, returnValue
+from twisted.internet.defer import (
+    DeferredList, fail, inlineCallbacks, returnValue)
 
 from txaws.ec2.exception import EC2Error
 from txaws.service import AWSServiceRegion
@@ -15,6 +16,7 @@ from .launch import EC2LaunchMachine
 from .machine import EC2ProviderMachine, machine_from_instance
 from .securitygroup import (
     open_provider_port, close_provider_port, get_provider_opened_ports,
+    get_all_provider_opened_ports, set_provider_ports,
     remove_security_groups, destroy_environment_security_group)
 from .utils import get_region_uri
 
@@ -74,6 +76,50 @@ class MachineProvider(MachineProviderBase):
         constraints = machine_data.get("constraints", {})
         return EC2LaunchMachine(self, master, constraints).run(machine_id)
 
+    @inlineCallbacks
+    def start_machines(self, machines_data):
+        """Start several (non master) EC2 machines in one call.
+
+        The zookeeper machines and the existing security groups are
+        looked up once for all the machines, and the juju provider group
+        is created at most once. Each machine still gets its own security
+        group and cloud-init user data, so instances are run concurrently
+        one per request.
+
+        :param list machines_data: a list of machine data dicts, as
+            accepted by :meth:`start_machine`.
+
+        :return: a list of ``(success, result)`` tuples, in the order of
+            `machines_data`, where `result` is either the list of started
+            :class:`juju.providers.ec2.machine.EC2ProviderMachine` or
+            the failure for that machine.
+        :rtype: :class:`twisted.internet.defer.Deferred`
+        """
+        for machine_data in machines_data:
+            if "machine-id" not in machine_data:
+                raise ProviderError(
+                    "Cannot launch a machine without specifying a machine-id")
+
+        zookeepers = yield self.get_zookeeper_machines()
+        launches = [
+            EC2LaunchMachine(self, False, machine_data.get("constraints", {}))
+            for machine_data in machines_data]
+        try:
+            security_groups = yield self.ec2.describe_security_groups()
+            group_names = set([group.name for group in security_groups])
+            if launches:
+                yield launches[0].ensure_provider_group(group_names)
+        except EC2Error, e:
+            raise ProviderInteractionError(
+                "Unexpected EC2Error preparing to start machines: %s" % e)
+
+        results = yield DeferredList(
+            [launch.start_machine(
+                machine_data["machine-id"], zookeepers, group_names)
+             for launch, machine_data in zip(launches, machines_data)],
+            consumeErrors=True)
+        returnValue(results)
+
     @inlineCallbacks
     def get_machines(self, instance_ids=()):
         """List machines running in the provider.
@@ -187,3 +233,17 @@ class MachineProvider(MachineProviderBase):
     def get_opened_ports(self, machine, machine_id):
         """Returns a set of open (port, proto) pairs for `machine`."""
         return get_provider_opened_ports(self, machine, machine_id)
+
+    def get_all_opened_ports(self):
+        """Returns the open (port, proto) pairs of all machines.
+
+        Reads every machine security group with a single request.
+        """
+        return get_all_provider_opened_ports(self)
+
+    def set_machine_ports(self, machine, machine_id, ports,
+                          opened_ports=None):
+        """Authorizes and revokes ports such that exactly `ports` are open.
+        """
+        return set_provider_ports(
+            self, machine, machine_id, ports, opened_ports)
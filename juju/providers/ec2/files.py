@@ -6,16 +6,22 @@ from base64 import b64encode
 
 import hmac
 import sha
+import shutil
+import tempfile
 import urllib
 import time
 
 from cStringIO import StringIO
+from xml.etree import ElementTree
 
-from twisted.internet.defer import fail
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.python.failure import Failure
 from twisted.web.error import Error
+from twisted.web.http import datetimeToString
 from txaws.s3.client import URLContext
 
 from juju.errors import FileNotFound
+from juju.lib.webclient import BodyProducer, WebClient, get_file_size
 
 _FILENOTFOUND_CODES = ("NoSuchKey", "NoSuchBucket")
 
@@ -26,12 +32,34 @@ def _safe_string(s):
     return s
 
 
+def _find_text(xml_bytes, tag):
+    """Return the text of the first `tag` element of an S3 response."""
+    for element in ElementTree.fromstring(xml_bytes).getiterator():
+        if element.tag.rpartition("}")[2] == tag:
+            return element.text
+
+
 class FileStorage(object):
-    """S3-backed :class:`FileStorage` abstraction"""
+    """S3-backed :class:`FileStorage` abstraction
+
+    Files are streamed to and from S3. Files larger than `part_size` are
+    uploaded in parts of that size, with a multipart upload.
+    """
+
+    # S3 requires parts of at least 5MB, but the last one.
+    part_size = 16 * 1024 * 1024
 
     def __init__(self, s3, bucket):
         self._s3 = s3
         self._bucket = bucket
+        self._client = WebClient(persistent=False)
+
+    def _sign(self, method, resource, date, content_type=""):
+        """Return the signature of a request of an S3 `resource`."""
+        signed = hmac.new(self._s3.creds.secret_key, digestmod=sha)
+        signed.update("%s\n\n%s\n%s\n%s" % (
+            method, content_type, date, resource))
+        return b64encode(signed.digest()).strip()
 
     def get_url(self, name):
         """Return a URL that can be used to access a stored file.
@@ -48,9 +76,8 @@ class FileStorage(object):
         expires = int(time.time()) + 365 * 24 * 3600 * 10
         name = _safe_string(name)
         path = "%s/%s" % (self._bucket, urllib.quote(name))
-        signed = hmac.new(self._s3.creds.secret_key, digestmod=sha)
-        signed.update("GET\n\n\n%s\n/%s" % (expires, path))
-        signature = urllib.quote_plus(b64encode(signed.digest()).strip())
+        signature = urllib.quote_plus(
+            self._sign("GET", "/%s" % path, expires))
 
         url_context = URLContext(
             self._s3.endpoint, urllib.quote(self._bucket), urllib.quote(name))
@@ -60,60 +87,152 @@ class FileStorage(object):
             signature, expires, self._s3.creds.access_key)
         return url
 
-    def get(self, name):
+    @inlineCallbacks
+    def _request(self, method, name="", query="", body=None,
+                 content_type=""):
+        """Make an authenticated request of the bucket, or of a file in it.
+
+        :param query: The S3 sub-resource of the request, ie. "uploads".
+
+        Returns the response, raising an `Error` for an error status.
+        """
+        name = urllib.quote(_safe_string(name))
+        resource = "/%s/%s" % (self._bucket, name)
+        url = URLContext(
+            self._s3.endpoint, urllib.quote(self._bucket), name).get_url()
+        if query:
+            resource += "?" + query
+            url += "?" + query
+        date = datetimeToString()
+        headers = {
+            "Date": date,
+            "Authorization": "AWS %s:%s" % (
+                self._s3.creds.access_key,
+                self._sign(method, resource, date, content_type))}
+        if content_type:
+            headers["Content-Type"] = content_type
+        response = yield self._client.request(method, url, headers, body)
+        yield self._client.check_status(response)
+        returnValue(response)
+
+    @inlineCallbacks
+    def get(self, name, output=None, progress=None):
         """Get a file object from S3.
 
         :param unicode name: S3 key for the desired file
 
-        :return: an open file object
+        :param output: a file object the content is streamed to, a
+            temporary file is used if not given
+
+        :param progress: a callable reporting the bytes received
+
+        :return: an open file object, positioned at the content's start
+            unless given as `output`
         :rtype: :class:`twisted.internet.defer.Deferred`
 
         :raises: :exc:`juju.errors.FileNotFound` if the file doesn't exist
         """
-        # for now we do the simplest thing and just fetch the file
-        # in a single call, s3 limits this to some mb, as we grow
-        # to have charms that might grow to this size, we can
-        # revisit fetching in batches (head request for size) and
-        # streaming to disk.
-        d = self._s3.get_object(self._bucket, _safe_string(name))
-
-        def on_content_retrieved(content):
-            return StringIO(content)
-        d.addCallback(on_content_retrieved)
-
-        def on_no_file(failure):
-            # Trap file not found errors and wrap them in an application error.
-            failure.trap(Error)
-            if str(failure.value.status) != "404":
-                return failure
-            return fail(FileNotFound("s3://%s/%s" % (self._bucket, name)))
-        d.addErrback(on_no_file)
-
-        return d
-
-    def put(self, remote_path, file_object):
+        try:
+            response = yield self._request("GET", name)
+        except Error, e:
+            # Wrap file not found errors in an application error.
+            if str(e.status) != "404":
+                raise
+            raise FileNotFound("s3://%s/%s" % (self._bucket, name))
+
+        if output is not None:
+            yield self._client.read(response, output, progress)
+            returnValue(output)
+        content = tempfile.TemporaryFile()
+        yield self._client.read(response, content, progress)
+        content.seek(0)
+        returnValue(content)
+
+    @inlineCallbacks
+    def put(self, remote_path, file_object, progress=None):
         """Upload a file to S3.
 
         :param unicode remote_path: key on which to store the content
 
-        :param file_object: open file object containing the content
+        :param file_object: open file object containing the content, it
+            is copied to a temporary file first if it can't be sought
+
+        :param progress: a callable reporting the bytes sent
 
         :rtype: :class:`twisted.internet.defer.Deferred`
         """
-        content = file_object.read()
-        path = _safe_string(remote_path)
-
-        def put(ignored):
-            return self._s3.put_object(self._bucket, path, content)
-
-        def create_retry(failure):
-            failure.trap(Error)
-            if str(failure.value.status) != "404":
-                return failure
-            d = self._s3.create_bucket(self._bucket)
-            d.addCallback(put)
-            return d
-
-        d = put(None)
-        d.addErrback(create_retry)
-        return d
+        size = get_file_size(file_object)
+        if size is None:
+            # S3 needs the size of the content up front.
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(file_object, spool)
+            spool.seek(0)
+            result = yield self.put(remote_path, spool, progress)
+            spool.close()
+            returnValue(result)
+
+        start = file_object.tell()
+        try:
+            yield self._upload(remote_path, file_object, size, progress)
+        except Error, e:
+            if str(e.status) != "404":
+                raise
+            response = yield self._request("PUT")
+            yield self._client.read(response)
+            file_object.seek(start)
+            yield self._upload(remote_path, file_object, size, progress)
+        returnValue(True)
+
+    @inlineCallbacks
+    def _upload(self, name, file_object, size, progress):
+        if size <= self.part_size:
+            response = yield self._request(
+                "PUT", name, body=BodyProducer(file_object, size, progress))
+            yield self._client.read(response)
+            return
+
+        response = yield self._request("POST", name, "uploads")
+        upload_id = _find_text((yield self._client.read(response)),
+                               "UploadId")
+        query = "uploadId=%s" % urllib.quote(upload_id)
+        try:
+            parts = []
+            offset = 0
+            while offset < size:
+                length = min(self.part_size, size - offset)
+                part_progress = None
+                if progress is not None:
+                    part_progress = (
+                        lambda sent, total, offset=offset:
+                        progress(offset + sent, size))
+                response = yield self._request(
+                    "PUT", name,
+                    "partNumber=%d&%s" % (len(parts) + 1, query),
+                    BodyProducer(file_object, length, part_progress))
+                yield self._client.read(response)
+                parts.append(
+                    response.headers.getRawHeaders("etag")[-1])
+                offset += length
+
+            manifest = "".join(
+                "<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>"
+                % (number, etag) for number, etag in enumerate(parts, 1))
+            response = yield self._request(
+                "POST", name, query, BodyProducer(StringIO(
+                    "<CompleteMultipartUpload>%s</CompleteMultipartUpload>"
+                    % manifest)),
+                content_type="application/xml")
+            # The completion may fail after the response status was sent.
+            result = yield self._client.read(response)
+            if _find_text(result, "Code") is not None:
+                raise Error("500", _find_text(result, "Message"))
+        except Exception:
+            failure = Failure()
+            # Discard the parts uploaded.
+            try:
+                response = yield self._request("DELETE", name, query)
+                yield self._client.read(response)
+            except Exception:
+                # The upload's error is the one to report.
+                pass
+            failure.raiseException()
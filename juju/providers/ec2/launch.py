@@ -13,7 +13,7 @@ class EC2LaunchMachine(LaunchMachine):
     """Amazon EC2 operation for launching an instance"""
 
     @inlineCallbacks
-    def start_machine(self, machine_id, zookeepers):
+    def start_machine(self, machine_id, zookeepers, group_names=None):
         """Actually launch an instance on EC2.
 
         :param str machine_id: the juju machine ID to assign
@@ -23,6 +23,10 @@ class EC2LaunchMachine(LaunchMachine):
         :type zookeepers: list of
             :class:`juju.providers.ec2.machine.EC2ProviderMachine`
 
+        :param group_names: names of the existing security groups, if already
+            known; they are described from EC2 otherwise.
+        :type group_names: set of str
+
         :return: a singe-entry list containing a
             :class:`juju.providers.ec2.machine.EC2ProviderMachine`
             representing the newly-launched machine
@@ -37,7 +41,7 @@ class EC2LaunchMachine(LaunchMachine):
         instance_type = self._provider.config.get(
             "default-instance-type", "m1.small")
         image_id = yield get_image_id(self._provider.config, self._constraints)
-        security_groups = yield self._ensure_groups(machine_id)
+        security_groups = yield self._ensure_groups(machine_id, group_names)
 
         instances = yield self._provider.ec2.run_instances(
             image_id=image_id,
@@ -50,7 +54,7 @@ class EC2LaunchMachine(LaunchMachine):
         returnValue([machine_from_instance(i) for i in instances])
 
     @inlineCallbacks
-    def _ensure_groups(self, machine_id):
+    def _ensure_groups(self, machine_id, group_names=None):
         """Ensure the juju group is the machine launch groups.
 
         Machines launched by juju are tagged with a group so they
@@ -61,42 +65,26 @@ class EC2LaunchMachine(LaunchMachine):
         so that its firewall rules can be configured per machine.
 
         :param machine_id: The juju machine ID of the new machine
+
+        :param group_names: The names of the existing security groups, if
+            already known.
         """
         juju_group = "juju-%s" % self._provider.environment_name
         juju_machine_group = "juju-%s-%s" % (
             self._provider.environment_name, machine_id)
 
-        security_groups = yield self._provider.ec2.describe_security_groups()
-        group_ids = [group.name for group in security_groups]
+        if group_names is None:
+            security_groups = yield (
+                self._provider.ec2.describe_security_groups())
+            group_names = set([group.name for group in security_groups])
 
         # Create the provider group if doesn't exist.
-        if not juju_group in group_ids:
-            log.debug("Creating juju provider group %s", juju_group)
-            yield self._provider.ec2.create_security_group(
-                juju_group,
-                "juju group for %s" % self._provider.environment_name)
-
-            # Authorize SSH.
-            yield self._provider.ec2.authorize_security_group(
-                juju_group,
-                ip_protocol="tcp",
-                from_port="22", to_port="22",
-                cidr_ip="0.0.0.0/0")
-
-            # We need to describe the group to pickup the owner_id for auth.
-            groups_info = yield self._provider.ec2.describe_security_groups(
-                juju_group)
-
-            # Authorize Internal ZK Traffic
-            yield self._provider.ec2.authorize_security_group(
-                juju_group,
-                source_group_name=juju_group,
-                source_group_owner_id=groups_info.pop().owner_id)
+        yield self.ensure_provider_group(group_names)
 
         # Create the machine-specific group, but first see if there's
         # one already existing from a previous machine launch;
         # if so, delete it, since it can have the wrong firewall setup
-        if juju_machine_group in group_ids:
+        if juju_machine_group in group_names:
             try:
                 yield self._provider.ec2.delete_security_group(
                     juju_machine_group)
@@ -116,3 +104,38 @@ class EC2LaunchMachine(LaunchMachine):
                 self._provider.environment_name, machine_id))
 
         returnValue([juju_group, juju_machine_group])
+
+    @inlineCallbacks
+    def ensure_provider_group(self, group_names):
+        """Create the juju provider group, if not in `group_names`.
+
+        :param group_names: The names of the existing security groups; the
+            provider group name is added to it once created.
+        :type group_names: set of str
+        """
+        juju_group = "juju-%s" % self._provider.environment_name
+        if juju_group in group_names:
+            return
+
+        log.debug("Creating juju provider group %s", juju_group)
+        yield self._provider.ec2.create_security_group(
+            juju_group,
+            "juju group for %s" % self._provider.environment_name)
+
+        # Authorize SSH.
+        yield self._provider.ec2.authorize_security_group(
+            juju_group,
+            ip_protocol="tcp",
+            from_port="22", to_port="22",
+            cidr_ip="0.0.0.0/0")
+
+        # We need to describe the group to pickup the owner_id for auth.
+        groups_info = yield self._provider.ec2.describe_security_groups(
+            juju_group)
+
+        # Authorize Internal ZK Traffic
+        yield self._provider.ec2.authorize_security_group(
+            juju_group,
+            source_group_name=juju_group,
+            source_group_owner_id=groups_info.pop().owner_id)
+        group_names.add(juju_group)
@@ -2,10 +2,13 @@ from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
 from txaws.ec2.exception import EC2Error
 
 from juju.errors import ProviderInteractionError
-from juju.lib.twistutils import gather_results
+from juju.lib.twistutils import gather_results, parallel_map
 
 from .utils import log
 
+# Maximum number of concurrent authorize/revoke requests per machine.
+PORT_CHANGE_CONCURRENCY = 8
+
 
 def _get_juju_security_group(provider):
     """Get EC2 security group name for environment of `provider`."""
@@ -81,8 +84,40 @@ def get_provider_opened_ports(provider, machine, machine_id):
             "Unexpected EC2Error getting open ports on machine %s: %s"
             % (machine.instance_id, e.get_error_messages()))
 
+    returnValue(_get_group_opened_ports(security_groups[0]))
+
+
+@inlineCallbacks
+def get_all_provider_opened_ports(provider):
+    """Gets the opened ports of all machines of `provider`.
+
+    Describes all security groups at once, returning a dictionary
+    mapping the machine id of each machine security group to its set of
+    (port, proto) pairs.
+    """
+    try:
+        security_groups = yield provider.ec2.describe_security_groups()
+    except EC2Error, e:
+        raise ProviderInteractionError(
+            "Unexpected EC2Error getting open ports: %s"
+            % e.get_error_messages())
+
+    prefix = _get_machine_group_name(provider, "")
+    opened_ports = {}
+    for security_group in security_groups:
+        machine_id = security_group.name[len(prefix):]
+        if not (security_group.name.startswith(prefix) and
+                machine_id.isdigit()):
+            continue
+        opened_ports[int(machine_id)] = _get_group_opened_ports(
+            security_group)
+    returnValue(opened_ports)
+
+
+def _get_group_opened_ports(security_group):
+    """Parses the IP permissions of a security group into (port, proto)s."""
     opened_ports = set()  # made up of (port, protocol) pairs
-    for ip_permission in security_groups[0].allowed_ips:
+    for ip_permission in security_group.allowed_ips:
         if ip_permission.cidr_ip != "0.0.0.0/0":
             continue
         from_port = int(ip_permission.from_port)
@@ -92,7 +127,33 @@ def get_provider_opened_ports(provider, machine, machine_id):
             # ignore multi-port ranges, since they are set outside of
             # juju (at this time at least)
             opened_ports.add((from_port, ip_permission.ip_protocol))
-    returnValue(opened_ports)
+    return opened_ports
+
+
+@inlineCallbacks
+def set_provider_ports(provider, machine, machine_id, ports,
+                       opened_ports=None):
+    """Authorize and revoke ports such that exactly `ports` are open.
+
+    The security group is only described if `opened_ports` is not
+    given. The port changes are requested concurrently; if any of them
+    fails, the error is raised once all of them have completed.
+    """
+    if opened_ports is None:
+        opened_ports = yield get_provider_opened_ports(
+            provider, machine, machine_id)
+
+    changes = [(open_provider_port, port, protocol)
+               for port, protocol in sorted(ports - opened_ports)]
+    changes.extend([(close_provider_port, port, protocol)
+                    for port, protocol in sorted(opened_ports - ports)])
+
+    def change_port(change):
+        change_function, port, protocol = change
+        return change_function(provider, machine, machine_id, port, protocol)
+
+    yield parallel_map(change_port, changes, PORT_CHANGE_CONCURRENCY)
+    returnValue(set(ports))
 
 
 def _get_machine_security_group_from_instance(provider, instance):
@@ -1,20 +1,27 @@
+from cStringIO import StringIO
 from yaml import dump
 
 from twisted.internet.defer import fail, succeed
 
 from txaws.s3.client import S3Client
-from txaws.s3.exception import S3Error
 from txaws.ec2.client import EC2Client
 from txaws.ec2.exception import EC2Error
 from txaws.ec2.model import Instance, Reservation, SecurityGroup
 
+from juju.errors import FileNotFound
 from juju.lib.mocker import KWARGS, MATCH
 from juju.providers.ec2 import MachineProvider
+from juju.providers.ec2.files import FileStorage
 from juju.providers.ec2.machine import EC2ProviderMachine
 
 MATCH_GROUP = MATCH(lambda x: x.startswith("juju-moon"))
 
 
+def MATCH_CONTENT(content):
+    """Match a file object holding `content`."""
+    return MATCH(lambda file_object: file_object.getvalue() == content)
+
+
 class EC2TestMixin(object):
 
     env_name = "moon"
@@ -78,6 +85,17 @@ class EC2TestMixin(object):
         self._service.get_ec2_client()
         self.mocker.result(self.ec2)
 
+        # mock out the provider storage, tested against a stand-in S3
+        storage_factory = self.mocker.replace(
+            "juju.providers.ec2.files.FileStorage")
+        self.storage = self.mocker.mock(FileStorage)
+        storage_factory(self.s3, self.env_name)
+        self.mocker.result(self.storage)
+        self.mocker.count(0, None)
+
+    def get_missing_file_error(self, name):
+        return FileNotFound("s3://%s/%s" % (self.env_name, name))
+
 
 class EC2MachineLaunchMixin(object):
 
@@ -155,18 +173,17 @@ class EC2MachineLaunchMixin(object):
             hosts = [self.get_instance(
                 "i-es-zoo", private_dns_name="es.example.internal")]
 
-        self.s3.get_object(self.env_name, "provider-state")
+        self.storage.get("provider-state")
         if hosts is False:
-            error = S3Error("<error/>", 404)
-            error.errors = [{"Code": "NoSuchKey"}]
-            self.mocker.result(fail(error))
+            self.mocker.result(fail(
+                self.get_missing_file_error("provider-state")))
             return
 
         state = dump({
             "zookeeper-instances":
             [i.instance_id for i in hosts]})
 
-        self.mocker.result(succeed(state))
+        self.mocker.result(succeed(StringIO(state)))
         if hosts:
             # connect grabs the first host of a set.
             self.ec2.describe_instances(hosts[0].instance_id)
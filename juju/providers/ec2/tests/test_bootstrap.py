@@ -1,3 +1,4 @@
+from cStringIO import StringIO
 import logging
 import os
 
@@ -11,7 +12,7 @@ from juju.lib.mocker import MATCH
 from juju.lib.testing import TestCase
 from juju.providers.ec2.machine import EC2ProviderMachine
 
-from .common import EC2TestMixin, EC2MachineLaunchMixin
+from .common import EC2TestMixin, EC2MachineLaunchMixin, MATCH_CONTENT
 
 
 DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
@@ -20,19 +21,17 @@ DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
 class EC2BootstrapTest(EC2TestMixin, EC2MachineLaunchMixin, TestCase):
 
     def _mock_verify(self):
-        self.s3.put_object(
-            self.env_name, "bootstrap-verify", "storage is writable")
+        self.storage.put(
+            "bootstrap-verify", MATCH_CONTENT("storage is writable"))
         self.mocker.result(succeed(True))
 
     def _mock_save(self):
         """Mock saving bootstrap instances to S3."""
 
-        def match_string(data):
-            return isinstance(data, str)
+        def match_string(file_object):
+            return isinstance(file_object.getvalue(), str)
 
-        self.s3.put_object(
-            self.env_name, "provider-state",
-            MATCH(match_string))
+        self.storage.put("provider-state", MATCH(match_string))
         self.mocker.result(succeed(True))
 
     def _mock_launch(self):
@@ -57,8 +56,8 @@ class EC2BootstrapTest(EC2TestMixin, EC2MachineLaunchMixin, TestCase):
 
         log = self.capture_logging("juju.common", level=logging.DEBUG)
 
-        self.s3.get_object(self.env_name, "provider-state")
-        self.mocker.result(succeed(""))
+        self.storage.get("provider-state")
+        self.mocker.result(succeed(StringIO("")))
         self._mock_verify()
         self.ec2.describe_security_groups()
         self.mocker.result(succeed([]))
@@ -87,8 +86,8 @@ class EC2BootstrapTest(EC2TestMixin, EC2MachineLaunchMixin, TestCase):
         provider instance group.
         """
         self.capture_logging("juju.ec2")
-        self.s3.get_object(self.env_name, "provider-state")
-        self.mocker.result(succeed(""))
+        self.storage.get("provider-state")
+        self.mocker.result(succeed(StringIO("")))
         self._mock_verify()
         self.ec2.describe_security_groups()
         self.mocker.result(succeed([
@@ -109,8 +108,8 @@ class EC2BootstrapTest(EC2TestMixin, EC2MachineLaunchMixin, TestCase):
         bootstrap instance, it will just return the existing machine.
         """
         state = yaml.dump({"zookeeper-instances": ["i-foobar"]})
-        self.s3.get_object(self.env_name, "provider-state")
-        self.mocker.result(succeed(state))
+        self.storage.get("provider-state")
+        self.mocker.result(succeed(StringIO(state)))
         self.ec2.describe_instances("i-foobar")
         self.mocker.result(succeed([self.get_instance("i-foobar")]))
         self.mocker.replay()
@@ -136,8 +135,8 @@ class EC2BootstrapTest(EC2TestMixin, EC2MachineLaunchMixin, TestCase):
         The provider bootstrap will launch an instance when run if there
         is no existing instance.
         """
-        self.s3.get_object(self.env_name, "provider-state")
-        self.mocker.result(succeed(""))
+        self.storage.get("provider-state")
+        self.mocker.result(succeed(StringIO("")))
         self._mock_verify()
         self.ec2.describe_security_groups()
         self.mocker.result(succeed([
@@ -1,117 +1,290 @@
+from base64 import b64encode
 from cStringIO import StringIO
+import hashlib
+import hmac
+import sha
 import time
+import urllib
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.protocols.policies import WrappingFactory
 from twisted.web.error import Error
-from txaws.s3.exception import S3Error
+from twisted.web.resource import Resource
+from twisted.web.server import Site
 
-from juju.lib.mocker import MATCH
 from juju.lib.testing import TestCase
 from juju.errors import FileNotFound
+from juju.providers.ec2 import MachineProvider
+from juju.providers.ec2.files import FileStorage
 from juju.providers.ec2.tests.common import EC2TestMixin
 
+S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class StubS3(Resource):
+    """A stand-in S3, checking the signature of the requests."""
+
+    isLeaf = True
+
+    def __init__(self, test, secret_key):
+        Resource.__init__(self)
+        self._test = test
+        self._secret_key = secret_key
+        self.buckets = set()
+        # (bucket, key) -> content
+        self.objects = {}
+        # upload id -> {part number: content}
+        self.uploads = {}
+        # (method, uri) of the requests received
+        self.requests = []
+        # status code of every response, if set
+        self.status = None
+        self.fail_completion = False
+
+    def error(self, request, status, code):
+        request.setResponseCode(status)
+        return "<Error><Code>%s</Code><Message>%s</Message></Error>" % (
+            code, code)
+
+    def render(self, request):
+        self.requests.append((request.method, request.uri))
+        signed = hmac.new(self._secret_key, digestmod=sha)
+        signed.update("%s\n\n%s\n%s\n%s" % (
+            request.method, request.getHeader("content-type") or "",
+            request.getHeader("date"), request.uri))
+        if request.getHeader("authorization") != "AWS 0f62e973d5f8:%s" % (
+                b64encode(signed.digest()).strip()):
+            return self.error(request, 403, "SignatureDoesNotMatch")
+        if self.status is not None:
+            return self.error(request, self.status, "InternalError")
+
+        bucket, _, key = request.path[1:].partition("/")
+        key = urllib.unquote(key)
+        if not key:
+            self._test.assertEquals(request.method, "PUT")
+            self.buckets.add(bucket)
+            return ""
+        if bucket not in self.buckets:
+            return self.error(request, 404, "NoSuchBucket")
+        return Resource.render(self, request)
+
+    def get_key(self, request):
+        bucket, _, key = request.path[1:].partition("/")
+        return bucket, urllib.unquote(key)
+
+    def render_GET(self, request):
+        content = self.objects.get(self.get_key(request))
+        if content is None:
+            return self.error(request, 404, "NoSuchKey")
+        return content
+
+    def render_PUT(self, request):
+        content = request.content.read()
+        if "partNumber" in request.args:
+            [upload_id] = request.args["uploadId"]
+            [number] = request.args["partNumber"]
+            self.uploads[upload_id][int(number)] = content
+            request.setHeader(
+                "ETag", '"%s"' % hashlib.md5(content).hexdigest())
+        else:
+            self.objects[self.get_key(request)] = content
+        return ""
+
+    def render_POST(self, request):
+        if "uploads" in request.args:
+            upload_id = "upload-%d" % len(self.requests)
+            self.uploads[upload_id] = {}
+            return (
+                '<InitiateMultipartUploadResult xmlns="%s">'
+                '<UploadId>%s</UploadId>'
+                '</InitiateMultipartUploadResult>' % (
+                    S3_NAMESPACE, upload_id))
+
+        [upload_id] = request.args["uploadId"]
+        self._test.assertEquals(
+            request.getHeader("content-type"), "application/xml")
+        if self.fail_completion:
+            return self.error(request, 200, "InternalError")
+        parts = self.uploads.pop(upload_id)
+        manifest = "".join(
+            "<Part><PartNumber>%d</PartNumber><ETag>\"%s\"</ETag></Part>"
+            % (number, hashlib.md5(parts[number]).hexdigest())
+            for number in sorted(parts))
+        self._test.assertEquals(
+            request.content.read(),
+            "<CompleteMultipartUpload>%s</CompleteMultipartUpload>"
+            % manifest)
+        self.objects[self.get_key(request)] = "".join(
+            parts[number] for number in sorted(parts))
+        return ('<CompleteMultipartUploadResult xmlns="%s">'
+                '</CompleteMultipartUploadResult>' % S3_NAMESPACE)
+
+    def render_DELETE(self, request):
+        [upload_id] = request.args["uploadId"]
+        del self.uploads[upload_id]
+        request.setResponseCode(204)
+        return ""
+
+
+class UnsizedFile(object):
+    """A file object which can't be sought, like a pipe."""
+
+    def __init__(self, content):
+        self._file = StringIO(content)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
 
 class FileStorageTestCase(EC2TestMixin, TestCase):
 
+    def setUp(self):
+        super(FileStorageTestCase, self).setUp()
+        # Use the real S3 client, against a stand-in S3.
+        self.mocker.reset()
+        self.s3 = StubS3(self, self.get_config()["secret-key"])
+        self.s3.buckets.add(self.get_config()["control-bucket"])
+        self.port = reactor.listenTCP(
+            0, WrappingFactory(Site(self.s3, timeout=None)),
+            interface="127.0.0.1")
+
+    def tearDown(self):
+        super(FileStorageTestCase, self).tearDown()
+        return self.port.stopListening()
+
     def get_storage(self):
-        provider = self.get_provider()
-        storage = provider.get_file_storage()
-        return storage
+        config = self.get_config()
+        config["s3-uri"] = "http://127.0.0.1:%d/" % self.port.getHost().port
+        return MachineProvider(self.env_name, config).get_file_storage()
+
+    def get_stored(self, key):
+        return self.s3.objects.get((self.get_config()["control-bucket"], key))
 
+    @inlineCallbacks
     def test_put_file(self):
         """
         A file can be put in the storage.
         """
         content = "blah blah"
-        control_bucket = self.get_config()["control-bucket"]
-        self.s3.put_object(
-            control_bucket, "pirates/content.txt", content)
-        self.mocker.result(succeed(""))
-        self.mocker.replay()
-
         storage = self.get_storage()
-        d = storage.put("pirates/content.txt", StringIO(content))
-
-        def validate_result(result):
-            self.assertIdentical(result, "")
-
-        d.addCallback(validate_result)
-        return d
+        result = yield storage.put("pirates/content.txt", StringIO(content))
+        self.assertIdentical(result, True)
+        self.assertEqual(self.get_stored("pirates/content.txt"), content)
+        self.assertEqual(
+            self.s3.requests, [("PUT", "/moon/pirates/content.txt")])
 
+    @inlineCallbacks
     def test_put_file_unicode(self):
         """
         A file can be put in the storage with a unicode key, will
-        be implicitly converted to a string. The reason for this
-        conversion is that the txaws will raise an exception on
-        unicode strings passed as keys.
+        be implicitly converted to a utf8 string.
         """
         content = "blah blah"
-        control_bucket = self.get_config()["control-bucket"]
-        self.s3.put_object(
-            control_bucket,
-            "\xe2\x99\xa3\xe2\x99\xa6\xe2\x99\xa5\xe2\x99\xa0.txt",
-            content)
-        self.mocker.result(succeed(""))
-        self.mocker.replay()
-
         storage = self.get_storage()
-        d = storage.put(u"\u2663\u2666\u2665\u2660.txt", StringIO(content))
-
-        def validate_result(result):
-            self.assertIdentical(result, "")
-
-        d.addCallback(validate_result)
-        return d
+        yield storage.put(u"\u2663\u2666\u2665\u2660.txt", StringIO(content))
+        self.assertEqual(
+            self.get_stored(
+                "\xe2\x99\xa3\xe2\x99\xa6\xe2\x99\xa5\xe2\x99\xa0.txt"),
+            content)
 
+    @inlineCallbacks
     def test_put_file_no_bucket(self):
         """The buket will be created if it doesn't exist yet"""
         content = "blah blah"
-        control_bucket = self.get_config()["control-bucket"]
-        self.s3.put_object(
-            control_bucket, "pirates/content.txt", content)
-        error = Error("404", "Not Found")
-        self.mocker.result(fail(error))
-        self.s3.create_bucket(control_bucket)
-        self.mocker.result(succeed(None))
-        self.s3.put_object(
-            control_bucket, "pirates/content.txt", content)
-        self.mocker.result(succeed(""))
-        self.mocker.replay()
-
+        self.s3.buckets.clear()
         storage = self.get_storage()
-        d = storage.put(u"pirates/content.txt", StringIO(content))
-
-        def validate_result(result):
-            self.assertIdentical(result, "")
-
-        d.addCallback(validate_result)
-        return d
+        result = yield storage.put(u"pirates/content.txt", StringIO(content))
+        self.assertIdentical(result, True)
+        self.assertEqual(self.get_stored("pirates/content.txt"), content)
+        self.assertEqual(
+            self.s3.requests,
+            [("PUT", "/moon/pirates/content.txt"),
+             ("PUT", "/moon/"),
+             ("PUT", "/moon/pirates/content.txt")])
 
-    def verify_strange_put_error(self, error):
+    @inlineCallbacks
+    def test_put_file_unknown_error(self):
         """Weird errors? don't even try"""
-        content = "blah blah"
-        control_bucket = self.get_config()["control-bucket"]
-        self.s3.put_object(
-            control_bucket, "pirates/content.txt", content)
-        self.mocker.result(fail(error))
-        self.mocker.replay()
+        self.s3.status = 500
+        storage = self.get_storage()
+        error = yield self.assertFailure(
+            storage.put(u"pirates/content.txt", StringIO("blah blah")),
+            Error)
+        self.assertEqual(error.status, "500")
+        self.assertEqual(len(self.s3.requests), 1)
+
+    @inlineCallbacks
+    def test_put_file_bad_credentials(self):
+        """Requests are signed with the secret key."""
+        storage = self.get_storage()
+        self.s3._secret_key = "not-the-secret"
+        error = yield self.assertFailure(
+            storage.put(u"pirates/content.txt", StringIO("blah blah")),
+            Error)
+        self.assertEqual(error.status, "403")
+
+    @inlineCallbacks
+    def test_put_file_progress(self):
+        """The bytes sent are reported while the file is uploaded."""
+        content = "x" * 150000
+        progress = []
+        storage = self.get_storage()
+        yield storage.put(
+            "pirates/content.txt", StringIO(content),
+            lambda *args: progress.append(args))
+        self.assertEqual(self.get_stored("pirates/content.txt"), content)
+        self.assertEqual(
+            progress, [(65536, 150000), (131072, 150000), (150000, 150000)])
 
+    @inlineCallbacks
+    def test_put_file_unsized(self):
+        """A file of unknown size is spooled to disk, and uploaded."""
         storage = self.get_storage()
-        d = storage.put(u"pirates/content.txt", StringIO(content))
-        self.assertFailure(d, type(error))
-        return d
+        yield storage.put("pirates/content.txt", UnsizedFile("blah blah"))
+        self.assertEqual(self.get_stored("pirates/content.txt"), "blah blah")
+
+    @inlineCallbacks
+    def test_put_file_multipart(self):
+        """Files larger than the part size are uploaded in parts."""
+        self.patch(FileStorage, "part_size", 5)
+        progress = []
+        storage = self.get_storage()
+        yield storage.put(
+            "pirates/content.txt", StringIO("arrr, me hearties"),
+            lambda *args: progress.append(args))
+        self.assertEqual(
+            self.get_stored("pirates/content.txt"), "arrr, me hearties")
+        self.assertEqual(self.s3.uploads, {})
+        self.assertEqual(
+            [method for method, uri in self.s3.requests],
+            ["POST", "PUT", "PUT", "PUT", "PUT", "POST"])
+        self.assertEqual(
+            self.s3.requests[1],
+            ("PUT", "/moon/pirates/content.txt?partNumber=1&"
+             "uploadId=upload-1"))
+        self.assertEqual(
+            progress, [(5, 17), (10, 17), (15, 17), (17, 17)])
 
-    def test_put_file_unknown_error(self):
-        return self.verify_strange_put_error(Exception("cellosticks"))
+    @inlineCallbacks
+    def test_put_file_multipart_error(self):
+        """A multipart upload which fails is aborted."""
+        self.patch(FileStorage, "part_size", 5)
+        self.s3.fail_completion = True
+        storage = self.get_storage()
+        yield self.assertFailure(
+            storage.put("pirates/content.txt", StringIO("arrr, me hearties")),
+            Error)
+        self.assertEqual(self.get_stored("pirates/content.txt"), None)
+        self.assertEqual(self.s3.uploads, {})
+        self.assertEqual(self.s3.requests[-1][0], "DELETE")
 
     def test_get_url(self):
         """A url can be generated for any stored file."""
-        self.mocker.reset()
-
         # Freeze time for the hmac comparison
         self.patch(time, "time", lambda: 1313469969.311376)
 
-        storage = self.get_storage()
+        storage = self.get_provider().get_file_storage()
         url = storage.get_url("pirates/content.txt")
         self.assertTrue(url.startswith(
             "https://s3.amazonaws.com/moon/pirates/content.txt?"))
@@ -124,12 +297,10 @@ class FileStorageTestCase(EC2TestMixin, TestCase):
 
     def test_get_url_unicode(self):
         """A url can be generated for *any* stored file."""
-        self.mocker.reset()
-
         # Freeze time for the hmac comparison
         self.patch(time, "time", lambda: 1315469969.311376)
 
-        storage = self.get_storage()
+        storage = self.get_provider().get_file_storage()
         url = storage.get_url(u"\u2663\u2666\u2665\u2660.txt")
         self.assertTrue(url.startswith(
             "https://s3.amazonaws.com/moon/"
@@ -141,58 +312,43 @@ class FileStorageTestCase(EC2TestMixin, TestCase):
              "Expires=1630829969",
              "Signature=bbmdpkLqmrY4ebc2eoCJgt95ojg%3D"])
 
+    @inlineCallbacks
     def test_get_file(self):
         """Retrieving a file from storage returns a temporary file."""
-        content = "blah blah"
-        control_bucket = self.get_config()["control-bucket"]
-        self.s3.get_object(
-            control_bucket, "pirates/content.txt")
-        self.mocker.result(succeed(content))
-        self.mocker.replay()
-
+        self.s3.objects[("moon", "pirates/content.txt")] = "blah blah"
         storage = self.get_storage()
-        d = storage.get("pirates/content.txt")
-
-        def validate_result(result):
-            self.assertEqual(result.read(), content)
-
-        d.addCallback(validate_result)
-        return d
+        result = yield storage.get("pirates/content.txt")
+        self.assertEqual(result.read(), "blah blah")
 
+    @inlineCallbacks
     def test_get_file_unicode(self):
         """Retrieving a file with a unicode object, will refetch with
         a utf8 interpretation."""
-        content = "blah blah"
-        control_bucket = self.get_config()["control-bucket"]
-
-        def match_string(s):
-            self.assertEqual(
-                s, "\xe2\x99\xa3\xe2\x99\xa6\xe2\x99\xa5\xe2\x99\xa0.txt")
-            self.assertFalse(isinstance(s, unicode))
-            return True
-
-        self.s3.get_object(control_bucket, MATCH(match_string))
-        self.mocker.result(succeed(content))
-        self.mocker.replay()
-
+        self.s3.objects[(
+            "moon", "\xe2\x99\xa3\xe2\x99\xa6\xe2\x99\xa5\xe2\x99\xa0.txt")
+            ] = "blah blah"
         storage = self.get_storage()
-        d = storage.get(u"\u2663\u2666\u2665\u2660.txt")
-
-        def validate_result(result):
-            self.assertEqual(result.read(), content)
-
-        d.addCallback(validate_result)
-        return d
+        result = yield storage.get(u"\u2663\u2666\u2665\u2660.txt")
+        self.assertEqual(result.read(), "blah blah")
+
+    @inlineCallbacks
+    def test_get_file_output(self):
+        """A file can be retrieved to a file object, reporting progress."""
+        self.s3.objects[("moon", "pirates/content.txt")] = "blah blah"
+        output = StringIO()
+        progress = []
+        storage = self.get_storage()
+        result = yield storage.get(
+            "pirates/content.txt", output,
+            lambda *args: progress.append(args))
+        self.assertIdentical(result, output)
+        self.assertEqual(output.getvalue(), "blah blah")
+        self.assertEqual(progress, [(9, 9)])
 
     def test_get_file_nonexistant(self):
         """Retrieving a nonexistant file raises a file not found error."""
         control_bucket = self.get_config()["control-bucket"]
         file_name = "pirates/ship.txt"
-        error = Error("404", "Not Found")
-        self.s3.get_object(control_bucket, file_name)
-        self.mocker.result(fail(error))
-        self.mocker.replay()
-
         storage = self.get_storage()
         d = storage.get(file_name)
         self.failUnlessFailure(d, FileNotFound)
@@ -207,14 +363,8 @@ class FileStorageTestCase(EC2TestMixin, TestCase):
         """
         An unexpected error from s3 on file retrieval is exposed via the api.
         """
-        control_bucket = self.get_config()["control-bucket"]
-        file_name = "pirates/ship.txt"
-        self.s3.get_object(
-            control_bucket, file_name)
-        self.mocker.result(fail(S3Error("<error/>", 503)))
-        self.mocker.replay()
-
+        self.s3.status = 503
         storage = self.get_storage()
-        d = storage.get(file_name)
-        self.failUnlessFailure(d, S3Error)
+        d = storage.get("pirates/ship.txt")
+        self.failUnlessFailure(d, Error)
         return d
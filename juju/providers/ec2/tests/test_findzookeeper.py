@@ -1,7 +1,8 @@
+from cStringIO import StringIO
+
 from twisted.internet.defer import fail, succeed
 
 from txaws.ec2.exception import EC2Error
-from txaws.s3.exception import S3Error
 
 from yaml import dump
 
@@ -21,7 +22,7 @@ def _invalid_id_error():
 class EC2FindZookeepersTest(EC2TestMixin, TestCase):
 
     def mock_load_state(self, result):
-        self.s3.get_object(self.env_name, "provider-state")
+        self.storage.get("provider-state")
         self.mocker.result(result)
 
     def assert_no_environment(self):
@@ -40,16 +41,15 @@ class EC2FindZookeepersTest(EC2TestMixin, TestCase):
         When loading saved state from S3, the provider method gracefully
         handles the scenario where there is no saved state.
         """
-        error = S3Error("<error/>", 404)
-        error.errors = [{"Code": "NoSuchKey"}]
-        return self.verify_no_environment(fail(error))
+        return self.verify_no_environment(fail(
+            self.get_missing_file_error("provider-state")))
 
     def test_empty_state(self):
         """
         When loading saved state from S3, the provider method gracefully
         handles the scenario where there is no saved zookeeper state.
         """
-        return self.verify_no_environment(succeed(dump([])))
+        return self.verify_no_environment(succeed(StringIO(dump([]))))
 
     def test_no_hosts(self):
         """
@@ -57,7 +57,8 @@ class EC2FindZookeepersTest(EC2TestMixin, TestCase):
         the provider method correctly detects this and raises
         EnvironmentNotFound.
         """
-        return self.verify_no_environment(succeed(dump({"abc": 123})))
+        return self.verify_no_environment(
+            succeed(StringIO(dump({"abc": 123}))))
 
     def test_machines_not_running(self):
         """
@@ -65,7 +66,8 @@ class EC2FindZookeepersTest(EC2TestMixin, TestCase):
         are not actually running, the provider method detects this and raises
         EnvironmentNotFound.
         """
-        self.mock_load_state(succeed(dump({"zookeeper-instances": ["i-x"]})))
+        self.mock_load_state(
+            succeed(StringIO(dump({"zookeeper-instances": ["i-x"]}))))
         self.ec2.describe_instances("i-x")
         self.mocker.result(succeed([]))
         self.mocker.replay()
@@ -73,9 +75,9 @@ class EC2FindZookeepersTest(EC2TestMixin, TestCase):
         return self.assert_no_environment()
 
     def check_good_instance_state(self, state):
-        self.s3.get_object(self.env_name, "provider-state")
-        self.mocker.result(succeed(dump(
-            {"zookeeper-instances": ["i-foobar"]})))
+        self.storage.get("provider-state")
+        self.mocker.result(succeed(StringIO(dump(
+            {"zookeeper-instances": ["i-foobar"]}))))
         self.ec2.describe_instances("i-foobar")
         self.mocker.result(succeed([self.get_instance("i-foobar", state)]))
         self.mocker.replay()
@@ -102,13 +104,13 @@ class EC2FindZookeepersTest(EC2TestMixin, TestCase):
         return a one-element list containing the first one
         encountered.
         """
-        self.s3.get_object(self.env_name, "provider-state")
-        self.mocker.result(succeed(dump(
+        self.storage.get("provider-state")
+        self.mocker.result(succeed(StringIO(dump(
             {"zookeeper-instances": ["i-abef014589",
                                      "i-amnotyours",
                                      "i-amdead",
                                      "i-amok",
-                                     "i-amtoo"]})))
+                                     "i-amtoo"]}))))
 
         # Zk instances are checked individually to handle invalid ids correctly
         self.ec2.describe_instances("i-abef014589")
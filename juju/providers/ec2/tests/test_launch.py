@@ -2,7 +2,7 @@ import os
 
 import yaml
 
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import fail, inlineCallbacks, succeed
 
 from txaws.ec2.model import Instance, SecurityGroup
 
@@ -41,6 +41,65 @@ class EC2MachineLaunchTest(EC2TestMixin, EC2MachineLaunchMixin, TestCase):
 
         self.mocker.result(succeed([instance]))
 
+    @inlineCallbacks
+    def test_provider_launch_many(self):
+        """
+        Several machines can be launched at once, with the zookeeper hosts
+        and existing security groups looked up only once.
+        """
+        self.ec2.describe_security_groups()
+        self.mocker.result(succeed([]))
+        self._mock_create_group()
+        self._mock_create_machine_group("1")
+        self._mock_create_machine_group("2")
+        self._mock_get_zookeeper_hosts()
+        get_public_key = self.mocker.replace(
+            "juju.providers.common.utils.get_user_authorized_keys")
+        get_public_key(MATCH(lambda arg: isinstance(arg, dict)))
+        self.mocker.count(2)
+        self.mocker.result("zebra")
+        for machine_id in ("1", "2"):
+            self.ec2.run_instances(
+                image_id="ami-default",
+                instance_type="m1.small",
+                max_count=1,
+                min_count=1,
+                security_groups=["juju-moon", "juju-moon-%s" % machine_id],
+                user_data=MATCH(lambda data: True))
+            self.mocker.result(succeed(
+                [self.get_instance("i-foobar%s" % machine_id)]))
+        self.mocker.replay()
+
+        provider = self.get_provider()
+        provider.config["default-image-id"] = "ami-default"
+        results = yield provider.start_machines(
+            [{"machine-id": "1"}, {"machine-id": "2"}])
+        self.assertEqual(len(results), 2)
+        for (success, machines), machine_id in zip(results, ("1", "2")):
+            self.assertTrue(success)
+            self.assert_machine(machines[0], "i-foobar%s" % machine_id, "")
+
+    def test_provider_launch_many_ec2_error(self):
+        """
+        An EC2 error preparing the security groups of a bulk launch is a
+        provider error.
+        """
+        self._mock_get_zookeeper_hosts()
+        self.ec2.describe_security_groups()
+        self.mocker.result(fail(self.get_ec2_error(
+            "juju-moon", format="The security group %r is unavailable")))
+        self.mocker.replay()
+        d = self.get_provider().start_machines([{"machine-id": "1"}])
+        self.assertFailure(d, ProviderInteractionError)
+        return d
+
+    def test_provider_launch_many_bad_data(self):
+        self.mocker.replay()
+        d = self.get_provider().start_machines(
+            [{"machine-id": "1"}, {}])
+        self.assertFailure(d, ProviderError)
+        return d
+
     def test_bad_data(self):
         self.mocker.replay()
         d = self.get_provider().start_machine({})
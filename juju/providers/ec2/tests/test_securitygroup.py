@@ -8,6 +8,7 @@ from juju.lib.testing import TestCase
 from juju.machine import ProviderMachine
 from juju.providers.ec2.securitygroup import (
     open_provider_port, close_provider_port, get_provider_opened_ports,
+    get_all_provider_opened_ports, set_provider_ports,
     remove_security_groups, destroy_environment_security_group)
 from juju.providers.ec2.tests.common import (
     EC2TestMixin, MATCH_GROUP, Observed, MockInstanceState)
@@ -74,6 +75,73 @@ class EC2PortMgmtTest(EC2TestMixin, TestCase):
             provider, machine, "machine-1")
         self.assertEqual(opened_ports, set([(53, "udp"), (80, "tcp")]))
 
+    @inlineCallbacks
+    def test_get_all_provider_opened_ports(self):
+        """All machine groups are read with a single describe request."""
+        self.ec2.describe_security_groups()
+        self.mocker.result(succeed([
+                    SecurityGroup("juju-moon", "the environment group"),
+                    SecurityGroup("default", "not a juju group"),
+                    SecurityGroup(
+                        "juju-moon-0", "a machine group",
+                        ips=[IPPermission("tcp", "80", "80", "0.0.0.0/0")]),
+                    SecurityGroup(
+                        "juju-moon-2", "a machine group",
+                        ips=[IPPermission("udp", "53", "53", "0.0.0.0/0"),
+                             IPPermission("tcp", "443", "443", "10.1.2.3")]),
+                    ]))
+        self.mocker.replay()
+
+        provider = self.get_provider()
+        opened_ports = yield get_all_provider_opened_ports(provider)
+        self.assertEqual(
+            opened_ports, {0: set([(80, "tcp")]), 2: set([(53, "udp")])})
+
+    @inlineCallbacks
+    def test_set_provider_ports(self):
+        """Only the port differences are requested, without a describe."""
+        self.ec2.authorize_security_group(
+            "juju-moon-1", ip_protocol="tcp", from_port="443",
+            to_port="443", cidr_ip="0.0.0.0/0")
+        self.mocker.result(succeed(True))
+        self.ec2.authorize_security_group(
+            "juju-moon-1", ip_protocol="udp", from_port="53",
+            to_port="53", cidr_ip="0.0.0.0/0")
+        self.mocker.result(succeed(True))
+        self.ec2.revoke_security_group(
+            "juju-moon-1", ip_protocol="tcp", from_port="22",
+            to_port="22", cidr_ip="0.0.0.0/0")
+        self.mocker.result(succeed(True))
+        self.mocker.replay()
+
+        provider = self.get_provider()
+        machine = ProviderMachine("i-foobar", "x1.example.com")
+        ports = set([(80, "tcp"), (443, "tcp"), (53, "udp")])
+        opened_ports = yield set_provider_ports(
+            provider, machine, 1, ports, set([(80, "tcp"), (22, "tcp")]))
+        self.assertEqual(opened_ports, ports)
+
+    @inlineCallbacks
+    def test_set_provider_ports_error(self):
+        """An error is raised once all of the port changes complete."""
+        self.ec2.authorize_security_group(
+            "juju-moon-1", ip_protocol="tcp", from_port="80",
+            to_port="80", cidr_ip="0.0.0.0/0")
+        self.mocker.result(fail(self.get_ec2_error("i-foobar")))
+        self.ec2.authorize_security_group(
+            "juju-moon-1", ip_protocol="tcp", from_port="443",
+            to_port="443", cidr_ip="0.0.0.0/0")
+        self.mocker.result(succeed(True))
+        self.mocker.replay()
+
+        provider = self.get_provider()
+        machine = ProviderMachine("i-foobar", "x1.example.com")
+        yield self.assertFailure(
+            set_provider_ports(
+                provider, machine, 1, set([(80, "tcp"), (443, "tcp")]),
+                set()),
+            ProviderInteractionError)
+
     @inlineCallbacks
     def test_open_provider_port_unknown_instance(self):
         """Verify open port op will use the correct EC2 API."""
@@ -2,7 +2,7 @@ from twisted.internet.defer import succeed, fail, inlineCallbacks
 
 from juju.lib.testing import TestCase
 from juju.providers.ec2.tests.common import (
-    EC2TestMixin, MATCH_GROUP, Observed, MockInstanceState)
+    EC2TestMixin, MATCH_CONTENT, MATCH_GROUP, Observed, MockInstanceState)
 
 from juju.machine import ProviderMachine
 
@@ -168,7 +168,7 @@ class EC2DestroyTest(EC2TestMixin, TestCase):
         The destroy_environment operation terminates all running and pending
         instances associated to the `MachineProvider` instance.
         """
-        self.s3.put_object("moon", "provider-state", "{}\n")
+        self.storage.put("provider-state", MATCH_CONTENT("{}\n"))
         self.mocker.result(succeed(None))
         self.ec2.describe_instances()
         instances = [
@@ -215,7 +215,7 @@ class EC2DestroyTest(EC2TestMixin, TestCase):
     @inlineCallbacks
     def test_s3_failure(self):
         """Failing to store empty state should not stop us killing machines"""
-        self.s3.put_object("moon", "provider-state", "{}\n")
+        self.storage.put("provider-state", MATCH_CONTENT("{}\n"))
         self.mocker.result(fail(SomeError()))
         self.ec2.describe_instances()
         self.mocker.result(succeed([self.get_instance("i-canbekilled")]))
@@ -249,7 +249,7 @@ class EC2DestroyTest(EC2TestMixin, TestCase):
         If there are no instances to shutdown, running the destroy_environment
         operation does nothing.
         """
-        self.s3.put_object("moon", "provider-state", "{}\n")
+        self.storage.put("provider-state", MATCH_CONTENT("{}\n"))
         self.mocker.result(succeed(None))
         self.ec2.describe_instances()
         self.mocker.result(succeed([]))
@@ -37,6 +37,9 @@ class MachineProvider(MachineProviderBase):
     Only the host machine is utilized.
     """
 
+    # Zookeeper runs on the host, it's connected to directly.
+    connects_via_tunnel = False
+
     def __init__(self, environment_name, config):
         super(MachineProvider, self).__init__(environment_name, config)
         self._qualified_name = self._get_qualified_name()
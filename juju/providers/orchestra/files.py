@@ -1,14 +1,14 @@
-from cStringIO import StringIO
+import tempfile
 import urllib
 import urlparse
 
-from twisted.web.client import getPage
+from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.web.error import Error
 
 from juju.errors import FileNotFound, ProviderError
+from juju.lib.webclient import BodyProducer, WebClient, get_header
 from juju.providers.common.utils import convert_unknown_error
-from juju.providers.orchestra.digestauth import (
-    DigestAuthenticator, get_page_auth)
+from juju.providers.orchestra.digestauth import DigestAuthenticator
 
 
 def _convert_error(failure, method, url, errors):
@@ -23,7 +23,13 @@ def _convert_error(failure, method, url, errors):
 
 
 class FileStorage(object):
-    """A WebDAV-backed :class:`FileStorage` abstraction"""
+    """A WebDAV-backed :class:`FileStorage` abstraction
+
+    Files are streamed to and from the server, files of unknown size
+    being uploaded with a chunked transfer encoding. The server's last
+    authentication challenge is kept to authenticate the next uploads
+    up front, instead of sending their content twice.
+    """
 
     def __init__(self, config):
         fallback_url = "http://%(orchestra-server)s/webdav" % config
@@ -31,6 +37,8 @@ class FileStorage(object):
         self._auth = DigestAuthenticator(
             config.get("storage-user", config["orchestra-user"]),
             config.get("storage-pass", config["orchestra-pass"]))
+        self._challenge = None
+        self._client = WebClient(persistent=False)
 
     def get_url(self, name):
         """Return a URL that can be used to access a stored file.
@@ -49,36 +57,84 @@ class FileStorage(object):
             urllib.quote(path.encode("utf-8")),
             "", ""))
 
-    def get(self, name):
+    def get(self, name, output=None, progress=None):
         """Get a file object from the Orchestra WebDAV server.
 
         :param unicode name: path to for the desired file
 
-        :return: an open file object
+        :param output: a file object the content is streamed to, a
+            temporary file is used if not given
+
+        :param progress: a callable reporting the bytes received
+
+        :return: an open file object, positioned at the content's start
+            unless given as `output`
         :rtype: :class:`twisted.internet.defer.Deferred`
 
         :raises: :exc:`juju.errors.FileNotFound` if the file doesn't exist
         """
         url = self.get_url(name)
-        d = getPage(url)
-        d.addCallback(StringIO)
+        d = self._get(url, output, progress)
         d.addErrback(_convert_error, "GET", url, {404: FileNotFound(url)})
         return d
 
-    def put(self, name, file_object):
+    @inlineCallbacks
+    def _get(self, url, output, progress):
+        response = yield self._client.get(url)
+        if output is not None:
+            yield self._client.read(response, output, progress)
+            returnValue(output)
+        content = tempfile.TemporaryFile()
+        yield self._client.read(response, content, progress)
+        content.seek(0)
+        returnValue(content)
+
+    def put(self, name, file_object, progress=None):
         """Upload a file to WebDAV.
 
         :param unicode remote_path: path on which to store the content
 
-        :param file_object: open file object containing the content
+        :param file_object: open file object containing the content, it
+            must be seekable for the content to be sent again if the
+            server asks for authentication
+
+        :param progress: a callable reporting the bytes sent
 
         :rtype: :class:`twisted.internet.defer.Deferred`
         """
         url = self.get_url(name)
-        postdata = file_object.read()
-        d = get_page_auth(url, self._auth, method="PUT", postdata=postdata)
+        d = self._put(url, file_object, progress)
         d.addCallback(lambda _: True)
         d.addErrback(_convert_error, "PUT", url, {401: ProviderError(
             "The supplied storage credentials were not accepted by the "
             "server")})
         return d
+
+    @inlineCallbacks
+    def _put(self, url, file_object, progress):
+        start = None
+        try:
+            start = file_object.tell()
+        except (AttributeError, IOError):
+            pass
+
+        challenged = False
+        while True:
+            headers = {}
+            if self._challenge is not None:
+                headers["Authorization"] = self._auth.authenticate(
+                    "PUT", url, self._challenge)
+            response = yield self._client.request(
+                "PUT", url, headers, BodyProducer(file_object, None, progress))
+            challenge = get_header(response, "www-authenticate")
+            if response.code != 401 or challenged or challenge is None \
+                    or start is None:
+                break
+            # Authenticate with the new challenge, and send again.
+            yield self._client.read(response)
+            self._challenge = challenge
+            challenged = True
+            file_object.seek(start)
+
+        yield self._client.check_status(response)
+        yield self._client.read(response)
@@ -1,4 +1,5 @@
 from base64 import b64decode
+from cStringIO import StringIO
 import os
 from xmlrpclib import Fault
 from yaml import dump, load
@@ -7,8 +8,9 @@ from twisted.internet.defer import fail, succeed
 from twisted.web.error import Error
 from twisted.web.xmlrpc import Proxy
 
-from juju.lib.mocker import ANY, MATCH
+from juju.lib.mocker import MATCH
 from juju.providers.orchestra import MachineProvider
+from juju.providers.orchestra.files import FileStorage
 
 DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
 
@@ -34,14 +36,12 @@ class OrchestraTestMixin(object):
         Proxy_m = self.mocker.replace(Proxy, spec=None)
         Proxy_m("http://somewhe.re/cobbler_api")
         self.mocker.result(self.proxy_m)
-        self.getPage = self.mocker.replace("twisted.web.client.getPage")
-        self.get_page_auth = self.mocker.replace(
-            "juju.providers.orchestra.digestauth.get_page_auth")
+        self.storage_m = self.mocker.patch(FileStorage)
 
     def mock_fs_get(self, url, code, content=None):
-        self.getPage(url)
+        self.storage_m._get(url, None, None)
         if code == 200:
-            self.mocker.result(succeed(content))
+            self.mocker.result(succeed(StringIO(content)))
         else:
             self.mocker.result(fail(Error(str(code))))
 
@@ -49,8 +49,8 @@ class OrchestraTestMixin(object):
         # NOTE: in some respects, it would be better to simulate the complete
         # interaction with the webdav provider; the factors that work against
         # doing so are:
-        # 1) authentication is tested on DigestAuthenticator, on get_page_auth,
-        #    and again on FileStorage; even if it were easy to do so, testing
+        # 1) authentication is tested on DigestAuthenticator, and again on
+        #    FileStorage; even if it were easy to do so, testing
         #    the same paths at yet another level starts to feel somewhat
         #    superfluous.
         # 2) it's not *easy* to do so: we'd have a unique storage URL base for
@@ -60,9 +60,10 @@ class OrchestraTestMixin(object):
         #    *hard* to do so, but it's time-consuming and costs more complexity
         #    -- in a large number of the orchestra tests -- than is warranted
         #    by whatever additional verification it might allow for.
-        self.get_page_auth(url, ANY, method="PUT", postdata=expect)
+        self.storage_m._put(
+            url, MATCH(lambda f: f.getvalue() == expect), None)
         if code in (201, 204):
-            self.mocker.result(succeed(""))
+            self.mocker.result(succeed(None))
         else:
             self.mocker.result(fail(Error(str(code))))
 
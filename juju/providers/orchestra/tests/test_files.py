@@ -1,17 +1,30 @@
 from cStringIO import StringIO
 
-from twisted.internet.defer import fail, succeed
-from twisted.web.error import Error
+from twisted.internet.defer import inlineCallbacks
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
 
 from juju.errors import FileNotFound, ProviderError, ProviderInteractionError
-from juju.lib.testing import TestCase
 from juju.providers.orchestra import MachineProvider
 
 from .test_digestauth import GetPageAuthTestCase
 
 
-class SomeError(Exception):
-    pass
+class DroppingResource(Resource):
+
+    def render(self, request):
+        request.transport.loseConnection()
+        return NOT_DONE_YET
+
+
+class UnsizedFile(object):
+    """A file object which can't be sought, like a pipe."""
+
+    def __init__(self, content):
+        self._file = StringIO(content)
+
+    def read(self, size=-1):
+        return self._file.read(size)
 
 
 def get_file_storage(custom_config=None):
@@ -30,69 +43,76 @@ def get_file_storage(custom_config=None):
     return provider.get_file_storage()
 
 
-class FileStorageGetTest(TestCase):
+class FileStorageGetTest(GetPageAuthTestCase):
 
-    def setUp(self):
-        self.uuid4_m = self.mocker.replace("uuid.uuid4")
-        self.getPage = self.mocker.replace("twisted.web.client.getPage")
+    def get_file_storage(self):
+        return get_file_storage({"storage-url": self.get_base_url()})
 
     def test_get_url(self):
-        self.mocker.replay()
         fs = get_file_storage()
         self.assertEquals(fs.get_url("angry/birds"),
                           "http://somewhe.re/angry/birds")
 
     def test_get_url_fallback(self):
-        self.mocker.replay()
         fs = get_file_storage({})
         self.assertEquals(fs.get_url("angry/birds"),
                           "http://somewhereel.se/webdav/angry/birds")
 
     def test_get(self):
-        self.getPage("http://somewhe.re/rubber/chicken")
-        self.mocker.result(succeed("pulley"))
-        self.mocker.replay()
-
-        fs = get_file_storage()
-        d = fs.get("rubber/chicken")
+        self.add_plain("chicken", "GET", "pulley")
+        fs = self.get_file_storage()
+        d = fs.get("chicken")
 
         def verify(result):
             self.assertEquals(result.read(), "pulley")
         d.addCallback(verify)
         return d
 
-    def check_get_error(self, result, err_type, err_message):
-        self.getPage("http://somewhe.re/rubber/chicken")
-        self.mocker.result(result)
-        self.mocker.replay()
+    @inlineCallbacks
+    def test_get_output(self):
+        """A file can be retrieved to a file object, reporting progress."""
+        self.add_plain("chicken", "GET", "pulley")
+        output = StringIO()
+        progress = []
+        fs = self.get_file_storage()
+        result = yield fs.get(
+            "chicken", output, lambda *args: progress.append(args))
+        self.assertIdentical(result, output)
+        self.assertEquals(output.getvalue(), "pulley")
+        self.assertEquals(progress, [(6, 6)])
 
-        fs = get_file_storage()
-        d = fs.get("rubber/chicken")
+    def check_get_error(self, err_type, err_message):
+        fs = self.get_file_storage()
+        d = fs.get("chicken")
         self.assertFailure(d, err_type)
 
         def verify(error):
-            self.assertEquals(str(error), err_message)
+            self.assertEquals(
+                str(error), err_message % self.get_url("chicken"))
         d.addCallback(verify)
         return d
 
     def test_get_error(self):
-        return self.check_get_error(
-            fail(SomeError("pow!")),
-            ProviderInteractionError,
-            "Unexpected SomeError interacting with provider: pow!")
+        self.root.putChild("chicken", DroppingResource())
+        fs = self.get_file_storage()
+        d = fs.get("chicken")
+        self.assertFailure(d, ProviderInteractionError)
+
+        def verify(error):
+            # The failure is a ResponseFailed, or a subclass of it.
+            self.assertTrue(str(error).startswith("Unexpected Response"))
+            self.assertIn("interacting with provider", str(error))
+        d.addCallback(verify)
+        return d
 
     def test_get_404(self):
         return self.check_get_error(
-            fail(Error("404")),
-            FileNotFound,
-            "File was not found: 'http://somewhe.re/rubber/chicken'")
+            FileNotFound, "File was not found: '%s'")
 
     def test_get_bad_code(self):
+        self.add_plain("chicken", "GET", "", status=999)
         return self.check_get_error(
-            fail(Error("999")),
-            ProviderError,
-            "Unexpected HTTP 999 trying to GET "
-            "http://somewhe.re/rubber/chicken")
+            ProviderError, "Unexpected HTTP 999 trying to GET %s")
 
 
 class FileStoragePutTest(GetPageAuthTestCase):
@@ -133,6 +153,27 @@ class FileStoragePutTest(GetPageAuthTestCase):
         d.addCallback(self.assertEquals, True)
         return d
 
+    @inlineCallbacks
+    def test_put_progress(self):
+        """The bytes sent are reported while the file is uploaded."""
+        self.add_plain("peregrine", "PUT", "", "x" * 100000, 201)
+        progress = []
+        fs = self.get_file_storage()
+        yield fs.put("peregrine", StringIO("x" * 100000),
+                     lambda *args: progress.append(args))
+        self.assertEquals(progress, [(65536, 100000), (100000, 100000)])
+
+    @inlineCallbacks
+    def test_put_unsized(self):
+        """A file of unknown size is uploaded with a chunked encoding."""
+        progress = []
+        self.add_plain("peregrine", "PUT", "", "croissant", 201)
+        fs = self.get_file_storage()
+        result = yield fs.put("peregrine", UnsizedFile("croissant"),
+                              lambda *args: progress.append(args))
+        self.assertEquals(result, True)
+        self.assertEquals(progress, [(9, None)])
+
     def auth_common(self, username, status, with_user=True):
         self.setup_mock()
         self.uuid4_m()
@@ -185,6 +226,26 @@ class FileStoragePutTest(GetPageAuthTestCase):
         d.addCallback(self.assertEquals, True)
         return d
 
+    @inlineCallbacks
+    def test_auth_reused(self):
+        """Uploads after the first one are authenticated up front."""
+        self.setup_mock()
+        self.uuid4_m()
+        self.mocker.result("dinner")
+        self.uuid4_m()
+        self.mocker.result("supper")
+        self.mocker.replay()
+
+        responses = []
+        self.add_auth(
+            "possum", "PUT", "", "Digest realm=sparta, nonce=meh, qop=auth",
+            responses.append, expect_content="canabalt", status=201)
+        fs = self.get_file_storage()
+        yield fs.put("possum", StringIO("canabalt"))
+        yield fs.put("possum", StringIO("canabalt"))
+        self.assertEquals(len(responses), 2)
+        self.assertIn('nc="00000002", cnonce="supper"', responses[1])
+
     def test_auth_fallback_error(self):
         d = self.auth_common("fallback-user", 747, False)
         self.assertFailure(d, ProviderError)
@@ -1,5 +1,25 @@
+import logging
+import posixpath
+
 import zookeeper
 
+from twisted.internet.defer import (
+    Deferred, inlineCallbacks, returnValue, succeed)
+from twisted.python.failure import Failure
+
+from juju.state.errors import StopWatcher
+from juju.state.watches import watch_registry
+
+
+log = logging.getLogger("juju.state.agent")
+
+# Agent presence nodes are grouped per kind of domain object under these
+# containers, such that the liveness of all the agents of a kind can be
+# read with a single get_children call.
+AGENTS_PATH = "/agents"
+MACHINE_AGENTS_PATH = AGENTS_PATH + "/machines"
+UNIT_AGENTS_PATH = AGENTS_PATH + "/units"
+
 
 class AgentStateMixin(object):
     """A mixin for state objects that will have agents processes.
@@ -8,19 +28,39 @@ class AgentStateMixin(object):
     Subclasses must implement M{_get_agent_path}.
     """
 
+    @inlineCallbacks
     def has_agent(self):
         """Does this domain object have an agent connected.
 
         Return boolean deferred informing whether an agent is
-        connected.
+        connected. To check many domain objects, use a L{PresenceIndex}
+        instead.
         """
-        d = self._client.exists(self._get_agent_path())
+        exists = yield self._client.exists(self._get_agent_path())
+        if not exists:
+            exists = yield self.has_legacy_agent()
+        returnValue(bool(exists))
+
+    def has_legacy_agent(self):
+        """Is an agent of an earlier version connected.
+
+        Agents of versions before the presence containers connect at the
+        path given by M{_get_legacy_agent_path}, they are still found
+        while an environment is being upgraded.
+        """
+        path = self._get_legacy_agent_path()
+        if path is None:
+            return succeed(False)
+        d = self._client.exists(path)
         d.addCallback(lambda result: bool(result))
         return d
 
     def _get_agent_path(self):
         raise NotImplementedError
 
+    def _get_legacy_agent_path(self):
+        return None
+
     def watch_agent(self):
         """Observe changes to an agent's presence.
 
@@ -32,11 +72,182 @@ class AgentStateMixin(object):
         """
         exists_d, watch_d = self._client.exists_and_watch(
             self._get_agent_path())
-        exists_d.addCallback(lambda result: bool(result))
-        return exists_d, watch_d
+        legacy_path = self._get_legacy_agent_path()
+        if legacy_path is None:
+            exists_d.addCallback(lambda result: bool(result))
+            return exists_d, watch_d
+
+        # Observe the presence of an agent of an earlier version as
+        # well, firing on the first change of either.
+        changed_d = Deferred()
 
+        def changed(result):
+            if changed_d.called:
+                return
+            if isinstance(result, Failure):
+                changed_d.errback(result)
+            else:
+                changed_d.callback(result)
+
+        watch_d.addBoth(changed)
+
+        def check_legacy(exists):
+            if exists:
+                return True
+            legacy_exists_d, legacy_watch_d = self._client.exists_and_watch(
+                legacy_path)
+            legacy_watch_d.addBoth(changed)
+            legacy_exists_d.addCallback(lambda result: bool(result))
+            return legacy_exists_d
+
+        exists_d.addCallback(check_legacy)
+        return exists_d, changed_d
+
+    @inlineCallbacks
     def connect_agent(self):
         """Inform juju that this associated agent is alive.
         """
-        return self._client.create(
-            self._get_agent_path(), flags=zookeeper.EPHEMERAL)
+        path = self._get_agent_path()
+        try:
+            result = yield self._client.create(
+                path, flags=zookeeper.EPHEMERAL)
+        except zookeeper.NoNodeException:
+            # Environments initialized before the presence containers
+            # existed get them created on first use.
+            yield _create_containers(self._client, posixpath.dirname(path))
+            result = yield self._client.create(
+                path, flags=zookeeper.EPHEMERAL)
+        returnValue(result)
+
+
+@inlineCallbacks
+def _create_containers(client, path):
+    """Create the node at `path` and any missing parent, if needed."""
+    parent = posixpath.dirname(path)
+    if parent != "/" and not (yield client.exists(parent)):
+        yield _create_containers(client, parent)
+    try:
+        yield client.create(path)
+    except zookeeper.NodeExistsException:
+        pass
+
+
+class PresenceIndex(object):
+    """The presence of all the agents of one kind of domain object.
+
+    Instead of an exists call per domain object, the index reads the
+    presence nodes within an agents container with a single get_children
+    call, either once via L{snapshot}, or kept current via L{watch}.
+    """
+
+    def __init__(self, client, path):
+        """
+        :param client: A connected zookeeper client.
+        :param path: The agents container, ie. L{MACHINE_AGENTS_PATH} or
+            L{UNIT_AGENTS_PATH}.
+        """
+        self._client = client
+        self._path = path
+        self._agents = None
+        self._watching = False
+        self._registered_watch = None
+
+    @property
+    def watching(self):
+        """Is the index kept current by a watch."""
+        return self._watching
+
+    @inlineCallbacks
+    def snapshot(self):
+        """Read the presence of all agents, returning their internal ids.
+        """
+        try:
+            children = yield self._client.get_children(self._path)
+        except zookeeper.NoNodeException:
+            children = []
+        self._agents = set(children)
+        returnValue(set(self._agents))
+
+    def get_agents(self):
+        """Return the internal ids of the domain objects with an agent."""
+        if self._agents is None:
+            raise RuntimeError("Presence index has not been read")
+        return set(self._agents)
+
+    def has_agent(self, domain_object):
+        """Does `domain_object` have an agent connected.
+
+        Answers from the last snapshot or watch, without any request.
+        """
+        return domain_object.internal_id in self.get_agents()
+
+    @inlineCallbacks
+    def check_agent(self, domain_object):
+        """Does `domain_object` have an agent connected, of any version.
+
+        Answers from the last snapshot or watch if the agent is found
+        there, otherwise checks for an agent of an earlier version,
+        connected outside of the index's container.
+        """
+        if self.has_agent(domain_object):
+            returnValue(True)
+        result = yield domain_object.has_legacy_agent()
+        returnValue(result)
+
+    @inlineCallbacks
+    def watch(self, callback=None):
+        """Keep the index current, until L{stop} is called.
+
+        @param callback: An optional function called with the old and the
+            new sets of internal ids on each change, the old one being None
+            the first time. It may raise L{StopWatcher} to stop the watch.
+
+        Returns a deferred firing once the index has been read.
+        """
+        self._watching = True
+        if self._registered_watch is not None:
+            self._registered_watch.stop()
+        self._registered_watch = watch_registry.add(
+            "presence", self._path, callback or self)
+        yield self._watch(callback)
+
+    def stop(self):
+        """Stop maintaining the index."""
+        self._watching = False
+        if self._registered_watch is not None:
+            self._registered_watch.stop()
+
+    @inlineCallbacks
+    def _watch(self, callback):
+        if not self._watching or not self._client.connected:
+            self._registered_watch.stop()
+            return
+        exists_d, exists_watch_d = self._client.exists_and_watch(self._path)
+        if not (yield exists_d):
+            # Wait for the container to be created by the first agent.
+            if (yield self._changed(set(), callback)):
+                exists_watch_d.addCallback(
+                    lambda event: self._watch(callback))
+            return
+        try:
+            children_d, watch_d = self._client.get_children_and_watch(
+                self._path)
+            children = yield children_d
+        except zookeeper.NoNodeException:
+            yield self._watch(callback)
+            return
+        if (yield self._changed(set(children), callback)):
+            watch_d.addCallback(lambda event: self._watch(callback))
+
+    @inlineCallbacks
+    def _changed(self, agents, callback):
+        old_agents, self._agents = self._agents, agents
+        if callback is not None and old_agents != agents:
+            try:
+                yield self._registered_watch.fire(
+                    callback, old_agents, set(agents))
+            except StopWatcher:
+                self._watching = False
+        if not self._watching:
+            self._registered_watch.stop()
+        returnValue(self._watching)
@@ -8,6 +8,7 @@ from txzookeeper.utils import retry_change
 
 from juju.state.errors import StopWatcher
 from juju.state.topology import InternalTopology
+from juju.state.watches import watch_registry
 
 
 log = logging.getLogger("juju.state")
@@ -74,7 +75,8 @@ class StateBase(object):
                             change_content_function)
 
     @inlineCallbacks
-    def _watch_topology(self, watch_topology_function):
+    def _watch_topology(self, watch_topology_function, owner=None,
+                        _watch=None):
         """Changes in the /topology node will fire the given callback.
 
         @param watch_topology_function: A function/method which accepts two
@@ -90,28 +92,37 @@ class StateBase(object):
         will make it bail out).  In order to cleanly stop the watcher, a
         StopWatch exception can be raised by the callback.
 
+        The watch is accounted in the watch registry, for the `owner`
+        of the watch if given, otherwise for `watch_topology_function`.
+
         Note that this method name is underlined to mean "protected", not
         "private", since the only purpose of this method is to be used by
         subclasses.
         """
+        if _watch is None:
+            _watch = watch_registry.add(
+                "topology", "/topology", owner or watch_topology_function)
         # Need to guard on the client being connected in the case
         # 1) a watch is waiting to run (in the reactor);
         # 2) and the connection is closed.
         # Because _watch_topology always chains to __watch_topology,
         # the other guarding seen with `StopWatcher` is done there.
         if not self._client.connected:
+            _watch.stop()
             return
         exists, watch = self._client.exists_and_watch("/topology")
         stat = yield exists
 
         if stat is not None:
-            yield self.__topology_changed(None, watch_topology_function)
+            yield self.__topology_changed(
+                None, watch_topology_function, _watch)
         else:
             watch.addCallback(self.__topology_changed,
-                              watch_topology_function)
+                              watch_topology_function, _watch)
 
     @inlineCallbacks
-    def __topology_changed(self, ignored, watch_topology_function):
+    def __topology_changed(self, ignored, watch_topology_function,
+                           registered_watch):
         """Internal callback used by _watch_topology()."""
         # Need to guard on the client being connected in the case
         # 1) a watch is waiting to run (in the reactor);
@@ -120,6 +131,7 @@ class StateBase(object):
         # It remains the reponsibility of `watch_topology_function` to
         # raise `StopWatcher`, per the doc of `_topology_changed`.
         if not self._client.connected:
+            registered_watch.stop()
             return
         try:
             get, watch = self._client.get_and_watch("/topology")
@@ -130,13 +142,16 @@ class StateBase(object):
             # things.  We'll set the watch back, and once the new
             # content comes up, we'll present the delta as usual.
             log.warning("The /topology node went missing!")
-            self._watch_topology(watch_topology_function)
+            self._watch_topology(
+                watch_topology_function, _watch=registered_watch)
         else:
             new_topology = InternalTopology()
             new_topology.parse(content)
             try:
-                yield watch_topology_function(self._old_topology, new_topology)
+                yield registered_watch.fire(
+                    watch_topology_function, self._old_topology, new_topology)
             except StopWatcher:
                 return
             self._old_topology = new_topology
-            watch.addCallback(self.__topology_changed, watch_topology_function)
+            watch.addCallback(self.__topology_changed,
+                              watch_topology_function, registered_watch)
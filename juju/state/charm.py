@@ -21,7 +21,8 @@ class CharmStateManager(StateBase):
     """Manages the state of charms in an environment."""
 
     @inlineCallbacks
-    def add_charm_state(self, charm_id, charm, url):
+    def add_charm_state(self, charm_id, charm, url, manifest=None,
+                        delta=None):
         """Register metadata about the provided Charm.
 
         :param str charm_id: The key under which to store the Charm.
@@ -29,6 +30,13 @@ class CharmStateManager(StateBase):
         :param charm: The Charm itself.
 
         :param url: The provider storage url for the Charm.
+
+        :param manifest: The provider storage "url" and "sha256" of the
+            manifest of the Charm's files, see `juju.charm.delta`.
+
+        :param delta: The id of the charm the Charm upgrades as "base",
+            and the provider storage "url" and "sha256" of the delta
+            bundle of the files changed since.
         """
         charm_data = {
             "config": charm.config.get_serialization_data(),
@@ -36,6 +44,10 @@ class CharmStateManager(StateBase):
             "sha256": charm.get_sha256(),
             "url": url
         }
+        if manifest is not None:
+            charm_data["manifest"] = manifest
+        if delta is not None:
+            charm_data["delta"] = delta
 
         # XXX In the future we'll have to think about charm
         #     replacements here. For now this will do, and will
@@ -77,6 +89,8 @@ class CharmState(object):
         self._sha256 = charm_data["sha256"]
 
         self._bundle_url = charm_data.get("url")
+        self._manifest = charm_data.get("manifest")
+        self._delta = charm_data.get("delta")
 
     @property
     def name(self):
@@ -94,6 +108,16 @@ class CharmState(object):
         """The url to the charm bundle in the provider storage."""
         return self._bundle_url
 
+    @property
+    def manifest(self):
+        """The url and sha256 of the charm's manifest, if published."""
+        return self._manifest
+
+    @property
+    def delta(self):
+        """The base charm id, url and sha256 of the delta, if published."""
+        return self._delta
+
     @property
     def id(self):
         """The charm id"""
@@ -8,6 +8,7 @@ from txzookeeper.utils import retry_change
 from juju.environment.config import EnvironmentsConfig
 from juju.state.errors import EnvironmentStateNotFound
 from juju.state.base import StateBase
+from juju.state.watches import watch_registry
 
 
 SETTINGS_PATH = "/settings"
@@ -78,6 +79,29 @@ class GlobalSettingsStateManager(StateBase):
         """
         return self._set_value("debug-log", bool(enabled))
 
+    def get_debug_log_limits(self):
+        """Return the rate limits of the debug log records of agents.
+
+        The limits are a dictionary of the `rate` and `burst` of records
+        shipped per second by each agent, and of the `sampling` fraction of
+        records shipped by log channel. Returns None if not set.
+        """
+        return self._get_value("debug-log-limits")
+
+    def set_debug_log_limits(self, rate=None, burst=None, sampling=None):
+        """Set the rate limits of the debug log records of agents.
+
+        :param rate: The number of records per second shipped by an agent,
+            unlimited if 0, the agent's default if None.
+        :param burst: The number of records an agent ships in a burst, the
+            agent's default if None.
+        :param sampling: A dictionary of the fraction of records shipped
+            by log channel.
+        """
+        return self._set_value(
+            "debug-log-limits",
+            {"rate": rate, "burst": burst, "sampling": sampling or {}})
+
     @inlineCallbacks
     def _get_value(self, key, default=None):
         try:
@@ -126,6 +150,7 @@ class _RuntimeWatcher(object):
         self._callback = callback
         self._watching = False
         self._error_callback = error_callback
+        self._registered_watch = None
 
     @property
     def is_running(self):
@@ -141,6 +166,8 @@ class _RuntimeWatcher(object):
         """
         assert not self._watching, "Already Watching"
         self._watching = True
+        self._registered_watch = watch_registry.add(
+            "global_settings", SETTINGS_PATH, self._callback)
 
         # This logic will break if the node is removed, and so will
         # the function below, but the internal logic never removes
@@ -158,6 +185,8 @@ class _RuntimeWatcher(object):
     def stop(self):
         """Stop the environment watcher, no more callbacks will be invoked."""
         self._watching = False
+        if self._registered_watch is not None:
+            self._registered_watch.stop()
 
     @inlineCallbacks
     def _on_settings_changed(self, change_event=True):
@@ -165,12 +194,13 @@ class _RuntimeWatcher(object):
         """
         # Ensure the watch is active, and the client is connected.
         if not self._watching or not self._client.connected:
+            self._registered_watch.stop()
             returnValue(False)
 
         exists_d, watch_d = self._client.exists_and_watch(SETTINGS_PATH)
 
         try:
-            yield self._callback(change_event)
+            yield self._registered_watch.fire(self._callback, change_event)
         except Exception, e:
             self._watching = False
             if self._error_callback:
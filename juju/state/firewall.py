@@ -1,13 +1,14 @@
 import logging
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from juju.errors import MachinesNotFound
 from juju.state.errors import (
     ServiceStateNotFound, ServiceUnitStateNotFound, StateChanged,
     StopWatcher)
 from juju.state.machine import MachineStateManager
-from juju.state.service import ServiceStateManager
+from juju.state.service import ServiceStateManager, ServiceUnitState
+from juju.state.utils import get_many
 
 
 log = logging.getLogger("juju.state.expose")
@@ -15,6 +16,64 @@ log = logging.getLogger("juju.state.expose")
 NotExposed = object()
 
 
+class PortIndex(object):
+    """In-memory index of machine units, unit ports and exposed services.
+
+    The index is only updated by the firewall manager's watches, such
+    that it reflects the state seen by them. Any lookup not covered by
+    a watch returns None, and the state must then be read instead.
+    """
+
+    def __init__(self):
+        # Map machine ID to the set of names of its assigned units.
+        self._machine_units = {}
+        # Map unit name to the ID of the machine it is assigned to.
+        self._unit_machines = {}
+        # Map unit name to the set of its open (port, proto) pairs.
+        self._unit_ports = {}
+        # Map service name to its exposed flag.
+        self._exposed = {}
+
+    def set_machine_units(self, machine_id, unit_names):
+        for unit_name in self._machine_units.pop(machine_id, ()):
+            if self._unit_machines.get(unit_name) == machine_id:
+                del self._unit_machines[unit_name]
+        self._machine_units[machine_id] = set(unit_names)
+        for unit_name in unit_names:
+            self._unit_machines[unit_name] = machine_id
+
+    def get_machine_units(self, machine_id):
+        return self._machine_units.get(machine_id)
+
+    def get_unit_machine(self, unit_name):
+        return self._unit_machines.get(unit_name)
+
+    def set_unit_ports(self, unit_name, ports):
+        self._unit_ports[unit_name] = set(ports)
+
+    def get_unit_ports(self, unit_name):
+        return self._unit_ports.get(unit_name)
+
+    def discard_unit_ports(self, unit_name):
+        self._unit_ports.pop(unit_name, None)
+
+    def set_exposed(self, service_name, exposed):
+        self._exposed[service_name] = exposed
+        if not exposed:
+            # The ports of units of unexposed services are not watched.
+            prefix = service_name + "/"
+            for unit_name in self._unit_ports.keys():
+                if unit_name.startswith(prefix):
+                    del self._unit_ports[unit_name]
+
+    def get_exposed(self, service_name):
+        return self._exposed.get(service_name)
+
+    def discard_service(self, service_name):
+        self.set_exposed(service_name, False)
+        del self._exposed[service_name]
+
+
 class FirewallManager(object):
     """Manages the opening and closing of ports in the firewall.
     """
@@ -29,6 +88,7 @@ class FirewallManager(object):
         :param provider: A machine provider, used for making the
             actual changes in the environment to firewall settings.
         """
+        self._client = client
         self.machine_state_manager = MachineStateManager(client)
         self.service_state_manager = ServiceStateManager(client)
         self.is_running = is_running
@@ -45,6 +105,17 @@ class FirewallManager(object):
         # Machines to retry open_close_ports because of earlier errors
         self._retry_machines_on_port_error = set()
 
+        # Map machine ID to the set of (port, proto) pairs known to be
+        # open in the provider, saving a provider read per port change.
+        self._opened_ports = {}
+
+        # Map machine ID to its provider machine.
+        self._provider_machines = {}
+
+        # Index of the state seen by the watches, saving the reread of
+        # every unit of a machine on each change.
+        self._index = PortIndex()
+
         # Registration of observers for corresponding actions
         self._open_close_ports_observers = set()
         self._open_close_ports_on_machine_observers = set()
@@ -69,7 +140,7 @@ class FirewallManager(object):
         provisioning agent periodically rechecks machines so as to
         support retries of security group operations that failed for
         that provider. This method is called by the corresponding
-        :method:`juju.agents.provision.ProvisioningAgent.process_machine`
+        :method:`juju.agents.provision.ProvisioningAgent.process_machines`
         in the provisioning agent.
         """
         if machine_state.id in self._retry_machines_on_port_error:
@@ -88,12 +159,43 @@ class FirewallManager(object):
             """
             log.debug("Assigned units for machine %r: old=%r, new=%r",
                       machine_state.id, old_units, new_units)
+            self._index.set_machine_units(machine_state.id, new_units or ())
             return self.open_close_ports_on_machine(machine_state.id)
 
         if machine_state.id not in self._watched_machines:
             self._watched_machines.add(machine_state.id)
+            # The watch only fires once the machine has units.
+            self._index.set_machine_units(machine_state.id, ())
             yield machine_state.watch_assigned_units(cb_watch_assigned_units)
 
+    @inlineCallbacks
+    def refresh_opened_ports(self):
+        """Reread the opened ports known for all machines.
+
+        Called on each full reconciliation pass by the provisioning agent,
+        such that changes made outside of juju are eventually noticed.
+        Providers supporting it read the ports of all machines with a
+        single request, the ports of each machine are read on their next
+        change otherwise.
+        """
+        self._opened_ports.clear()
+        self._provider_machines.clear()
+        get_all_opened_ports = getattr(
+            self.provider, "get_all_opened_ports", None)
+        if get_all_opened_ports is None:
+            return
+        opened_ports = yield get_all_opened_ports()
+        self._opened_ports.update(opened_ports)
+
+    def invalidate_opened_ports(self, machine_id):
+        """Forget the opened ports and provider machine of `machine_id`.
+
+        Must be called whenever a machine's ports change other than through
+        this manager, such as when its provider machine is (re)launched.
+        """
+        self._opened_ports.pop(machine_id, None)
+        self._provider_machines.pop(machine_id, None)
+
     @inlineCallbacks
     def watch_service_changes(self, old_services, new_services):
         """Manage watching service exposed status.
@@ -108,6 +210,7 @@ class FirewallManager(object):
         removed_services = old_services - new_services
         for service_name in removed_services:
             self._watched_services.pop(service_name, None)
+            self._index.discard_service(service_name)
         for service_name in new_services:
             yield self._setup_new_service_watch(service_name)
 
@@ -143,6 +246,7 @@ class FirewallManager(object):
                 log.debug("Service %r is exposed", service_name)
             else:
                 log.debug("Service %r is unexposed", service_name)
+            self._index.set_exposed(service_name, exposed)
 
             try:
                 unit_states = yield service_state.get_all_unit_states()
@@ -178,6 +282,7 @@ class FirewallManager(object):
             removed_service_units = old_service_units - new_service_units
             for unit_name in removed_service_units:
                 watched_units.discard(unit_name)
+                self._index.discard_unit_ports(unit_name)
                 if not self.is_running():
                     raise StopWatcher()
                 try:
@@ -216,6 +321,9 @@ class FirewallManager(object):
                 unit_name not in watched_units):
                 log.debug("Stopping ports watch for %r", unit_name)
                 raise StopWatcher()
+            ports = yield unit_state.get_open_ports()
+            self._index.set_unit_ports(
+                unit_name, [(port["port"], port["proto"]) for port in ports])
             yield self.open_close_ports(unit_state)
 
         yield unit_state.watch_ports(cb_watch_ports)
@@ -236,8 +344,10 @@ class FirewallManager(object):
         if not self.is_running():
             raise StopWatcher()
         try:
+            machine_id = self._index.get_unit_machine(unit_state.unit_name)
             try:
-                machine_id = yield unit_state.get_assigned_machine_id()
+                if machine_id is None:
+                    machine_id = yield unit_state.get_assigned_machine_id()
             except StateChanged:
                 log.debug("Stopping watch, machine %r no longer in topology",
                           unit_state.unit_name)
@@ -270,35 +380,28 @@ class FirewallManager(object):
 
         This machine supports multiple service units being assigned to a
         machine; all service units are checked each time this is
-        called to determine the active set of ports to be opened.
+        called to determine the active set of ports to be opened. The
+        units, their ports and exposed flags are taken from the index
+        maintained by the watches, and only read when not watched.
         """
         if not self.is_running():
             raise StopWatcher()
         try:
-            machine_state = yield self.machine_state_manager.get_machine_state(
-                machine_id)
-            instance_id = yield machine_state.get_instance_id()
-            machine = yield self.provider.get_machine(instance_id)
-            unit_states = yield machine_state.get_all_service_unit_states()
-            policy_ports = set()
-            for unit_state in unit_states:
-                service_state = yield self.service_state_manager.\
-                    get_service_state(unit_state.service_name)
-                exposed = yield service_state.get_exposed_flag()
-                if exposed:
-                    ports = yield unit_state.get_open_ports()
-                    for port in ports:
-                        policy_ports.add(
-                            (port["port"], port["proto"]))
-            current_ports = yield self.provider.get_opened_ports(
-                machine, machine_id)
-            to_open = policy_ports - current_ports
-            to_close = current_ports - policy_ports
-            for port, proto in to_open:
-                yield self.provider.open_port(machine, machine_id, port, proto)
-            for port, proto in to_close:
-                yield self.provider.close_port(
-                    machine, machine_id, port, proto)
+            machine = self._provider_machines.get(machine_id)
+            if machine is None:
+                machine_state = yield self.machine_state_manager.\
+                    get_machine_state(machine_id)
+                instance_id = yield machine_state.get_instance_id()
+                machine = yield self.provider.get_machine(instance_id)
+                self._provider_machines[machine_id] = machine
+            policy_ports = yield self._get_policy_ports(machine_id)
+            # The known ports are forgotten until the change succeeds, so
+            # a failure rereads the provider's ports on the retry.
+            current_ports = self._opened_ports.pop(machine_id, None)
+            if current_ports != policy_ports:
+                current_ports = yield self.provider.set_machine_ports(
+                    machine, machine_id, policy_ports, current_ports)
+            self._opened_ports[machine_id] = current_ports
         except MachinesNotFound:
             log.info("No provisioned machine for machine %r", machine_id)
         except Exception:
@@ -312,3 +415,51 @@ class FirewallManager(object):
             observers = list(self._open_close_ports_on_machine_observers)
             for observer in observers:
                 yield observer(machine_id)
+
+    @inlineCallbacks
+    def _get_policy_ports(self, machine_id):
+        """Return the (port, proto) pairs to be opened on `machine_id`."""
+        unit_names = self._index.get_machine_units(machine_id)
+        if unit_names is None:
+            machine_state = yield self.machine_state_manager.\
+                get_machine_state(machine_id)
+            unit_states = yield machine_state.get_all_service_unit_states()
+            units = dict([(unit_state.unit_name, unit_state)
+                          for unit_state in unit_states])
+        else:
+            units = dict.fromkeys(unit_names)
+
+        policy_ports = set()
+        unread_units = []
+        for unit_name, unit_state in sorted(units.items()):
+            service_name = unit_name.split("/")[0]
+            exposed = self._index.get_exposed(service_name)
+            service_state = None
+            if exposed is None:
+                service_state = yield self.service_state_manager.\
+                    get_service_state(service_name)
+                exposed = yield service_state.get_exposed_flag()
+            if not exposed:
+                continue
+            ports = self._index.get_unit_ports(unit_name)
+            if ports is not None:
+                policy_ports.update(ports)
+                continue
+            if unit_state is None:
+                if service_state is None:
+                    service_state = yield self.service_state_manager.\
+                        get_service_state(service_name)
+                unit_state = yield service_state.get_unit_state(unit_name)
+            unread_units.append(unit_state)
+
+        # The ports of units not watched are read in a single round trip.
+        results = yield get_many(
+            self._client, [unread_unit.get_ports_path()
+                           for unread_unit in unread_units],
+            missing_ok=True)
+        for result in results:
+            if result is None:
+                continue
+            for port in ServiceUnitState.parse_open_ports(result[0]):
+                policy_ports.add((port["port"], port["proto"]))
+        returnValue(policy_ports)
@@ -1,4 +1,6 @@
 from twisted.internet.defer import inlineCallbacks, returnValue
+
+from juju.lib.twistutils import parallel_map
 from juju.state.base import StateBase
 from juju.state.errors import (UnitRelationStateNotFound, StateNotFound)
 from juju.state.service import ServiceStateManager, parse_service_name
@@ -244,7 +246,10 @@ class RelationHookContext(HookContext):
         usage model, doesn't seem to be worth logging).
         """
         rel_state = yield self._setup_relation_state()
-        relation_setting_changes = yield rel_state.write()
-        yield super(RelationHookContext, self).flush()
+        # The relation settings and the config are independent nodes,
+        # written concurrently.
+        relation_setting_changes, _ = yield parallel_map(
+            lambda write: write(),
+            [rel_state.write, super(RelationHookContext, self).flush], 2)
         returnValue(relation_setting_changes)
 
@@ -3,6 +3,7 @@ import logging
 from twisted.internet.defer import inlineCallbacks
 from txzookeeper.client import ZOO_OPEN_ACL_UNSAFE
 
+from .agent import AGENTS_PATH, MACHINE_AGENTS_PATH, UNIT_AGENTS_PATH
 from .auth import make_ace
 from .environment import GlobalSettingsStateManager
 from .machine import MachineStateManager
@@ -42,6 +43,9 @@ class StateHierarchy(object):
         yield self.client.create("/machines", acls=acls)
         yield self.client.create("/units", acls=acls)
         yield self.client.create("/relations", acls=acls)
+        yield self.client.create(AGENTS_PATH, acls=acls)
+        yield self.client.create(MACHINE_AGENTS_PATH, acls=acls)
+        yield self.client.create(UNIT_AGENTS_PATH, acls=acls)
 
         # Create the node representing the bootstrap machine (ourself)
         manager = MachineStateManager(self.client)
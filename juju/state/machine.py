@@ -8,7 +8,7 @@ from twisted.internet.defer import (
 from txzookeeper.utils import retry_change
 
 
-from juju.state.agent import AgentStateMixin
+from juju.state.agent import AgentStateMixin, MACHINE_AGENTS_PATH
 from juju.state.errors import (
     MachineStateNotFound, StateChanged, MachineStateInUse)
 from juju.state.base import StateBase
@@ -19,9 +19,12 @@ class MachineStateManager(StateBase):
     """Manages the state of machines in an environment."""
 
     @inlineCallbacks
-    def add_machine_state(self):
+    def add_machine_state(self, standby=False):
         """Create a new machine state.
 
+        @param standby: Whether the machine is added to the standby pool
+            of idle machines, see L{juju.state.pool}.
+
         @return: MachineState for the created machine.
         """
         path = yield self._client.create(
@@ -31,6 +34,8 @@ class MachineStateManager(StateBase):
 
         def add_machine(topology):
             topology.add_machine(internal_id)
+            if standby:
+                topology.set_machine_standby(internal_id, "pending")
         yield self._retry_topology_change(add_machine)
 
         returnValue(MachineState(self._client, internal_id))
@@ -127,7 +132,7 @@ class MachineStateManager(StateBase):
             if old_machines != new_machines:
                 return callback(old_machines, new_machines)
 
-        return self._watch_topology(watch_topology)
+        return self._watch_topology(watch_topology, owner=callback)
 
 
 class MachineState(StateBase, AgentStateMixin):
@@ -168,6 +173,10 @@ class MachineState(StateBase, AgentStateMixin):
 
     def _get_agent_path(self):
         """Get the zookeeper path for the machine agent."""
+        return "%s/%s" % (MACHINE_AGENTS_PATH, self._internal_id)
+
+    def _get_legacy_agent_path(self):
+        """Get the zookeeper path of machine agents of earlier versions."""
         return "%s/agent" % self._zk_path
 
     def set_instance_id(self, instance_id):
@@ -213,7 +222,7 @@ class MachineState(StateBase, AgentStateMixin):
         juju.state.errors.StopWatch exception.
         """
         return self._watch_topology(
-            _WatchAssignedUnits(self._internal_id, callback))
+            _WatchAssignedUnits(self._internal_id, callback), owner=callback)
 
     @inlineCallbacks
     def get_all_service_unit_states(self):
@@ -0,0 +1,163 @@
+"""A warm standby pool of idle machines.
+
+Placing a unit on a new machine waits for the machine to be launched,
+booted and for its machine agent to connect, before the unit can be
+deployed. The standby pool keeps a number of idle machines around,
+marked as standby in the topology, such that units are placed on an
+already running machine instead.
+
+Standby machines are regular machine states, launched by the
+provisioning agent like any other machine. A standby machine is
+"pending" until its machine agent connects, and "ready" thereafter.
+`ServiceUnitState.assign_to_unused_machine` prefers ready standby
+machines, removing the machine it picks from the pool.
+"""
+import logging
+import time
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from juju.lib.twistutils import concurrent_execution_guard
+from juju.state.agent import PresenceIndex, MACHINE_AGENTS_PATH
+from juju.state.base import StateBase
+from juju.state.errors import MachineStateInUse, StateChanged
+from juju.state.machine import (
+    MachineState, MachineStateManager, _public_machine_id)
+
+
+log = logging.getLogger("juju.state.pool")
+
+
+class MachinePoolManager(StateBase):
+    """Maintains the standby pool of idle machines.
+
+    The pool is checked periodically by the provisioning agent via
+    L{check_pool}, which marks standby machines with a connected agent as
+    ready, and adds or removes standby machines to match the pool size.
+    """
+
+    def __init__(self, client, size=0, refill_rate=1, idle_timeout=None,
+                 presence=None):
+        """Initialize a machine pool manager.
+
+        :param client: A connected zookeeper client.
+        :param size: The number of standby machines to keep, the pool is
+            disabled if 0.
+        :param refill_rate: The maximum number of standby machines added
+            per check.
+        :param idle_timeout: Seconds without any unit placed, after which
+            the pool is drained until units are placed again. The pool is
+            never drained if None.
+        :param presence: A watched L{PresenceIndex} of the machine agents.
+            Without one, the presence of all the machine agents is read
+            on each check.
+        """
+        super(MachinePoolManager, self).__init__(client)
+        if presence is None:
+            presence = PresenceIndex(client, MACHINE_AGENTS_PATH)
+        self.presence = presence
+        self.machine_state_manager = MachineStateManager(client)
+        self.configure(size, refill_rate, idle_timeout)
+        self._last_activity = time.time()
+        self._used_machines = None
+
+    def configure(self, size=0, refill_rate=1, idle_timeout=None):
+        """Change the pool settings, effective on the next check."""
+        self.size = size or 0
+        self.refill_rate = max(1, refill_rate or 1)
+        self.idle_timeout = idle_timeout or None
+
+    def get_target_size(self, now=None):
+        """The number of standby machines the pool should have."""
+        if now is None:
+            now = time.time()
+        if (self.idle_timeout is not None and
+                now - self._last_activity > self.idle_timeout):
+            return 0
+        return self.size
+
+    @concurrent_execution_guard("_checking_pool")
+    @inlineCallbacks
+    def check_pool(self):
+        """Bring the standby pool up to date.
+
+        Returns a report of the pool's standby and ready machines, and of
+        the machines added and removed by this check.
+        """
+        now = time.time()
+        topology = yield self._read_topology()
+
+        # The root machine hosts the provisioning agent, never units.
+        root_machine = "machine-%010d" % 0
+        standby = {}
+        used = set()
+        for machine_id in topology.get_machines():
+            status = topology.get_machine_standby(machine_id)
+            if status is not None:
+                standby[machine_id] = status
+            elif (machine_id != root_machine and
+                  topology.machine_has_units(machine_id)):
+                used.add(machine_id)
+
+        # Any unit placed on a fresh machine counts as pool activity.
+        if self._used_machines is not None and used - self._used_machines:
+            self._last_activity = now
+        self._used_machines = used
+
+        pending = [pending_id for pending_id, pending_status
+                   in standby.items() if pending_status == "pending"]
+        if pending and not self.presence.watching:
+            yield self.presence.snapshot()
+        for machine_id in sorted(pending):
+            machine_state = MachineState(self._client, machine_id)
+            if self.presence.has_agent(machine_state):
+                yield self._set_ready(machine_id)
+                standby[machine_id] = "ready"
+
+        report = {"standby": len(standby),
+                  "ready": standby.values().count("ready"),
+                  "added": 0, "removed": 0}
+
+        target = self.get_target_size(now)
+        if len(standby) > target:
+            # Remove pending machines first, and the newest ones first.
+            surplus = sorted(standby, reverse=True)
+            surplus.sort(key=lambda m: standby[m] == "ready")
+            for machine_id in surplus[:len(standby) - target]:
+                removed = yield self._remove(machine_id)
+                report["removed"] += int(removed)
+        elif len(standby) < target:
+            for i in range(min(self.refill_rate, target - len(standby))):
+                machine_state = yield self.machine_state_manager.\
+                    add_machine_state(standby=True)
+                log.debug("Added standby machine %s", machine_state.id)
+                report["added"] += 1
+
+        if report["added"] or report["removed"]:
+            log.info(
+                "Standby pool has %d machines (%d ready), added %d "
+                "removed %d", report["standby"], report["ready"],
+                report["added"], report["removed"])
+        returnValue(report)
+
+    def _set_ready(self, machine_id):
+
+        def set_ready(topology):
+            # The machine may have just been drawn from the pool.
+            if (topology.has_machine(machine_id) and
+                    topology.get_machine_standby(machine_id) == "pending"):
+                topology.set_machine_standby(machine_id, "ready")
+        return self._retry_topology_change(set_ready)
+
+    @inlineCallbacks
+    def _remove(self, machine_id):
+        try:
+            removed = yield self.machine_state_manager.remove_machine_state(
+                _public_machine_id(machine_id))
+        except (MachineStateInUse, StateChanged):
+            # The machine was just drawn from the pool.
+            returnValue(False)
+        if removed:
+            log.debug("Removed standby machine %s",
+                      _public_machine_id(machine_id))
+        returnValue(removed)
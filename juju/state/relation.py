@@ -5,11 +5,12 @@ import yaml
 import zookeeper
 
 from twisted.internet.defer import (
-    inlineCallbacks, returnValue, maybeDeferred, Deferred)
+    inlineCallbacks, returnValue, Deferred)
 
 from txzookeeper.utils import retry_change
 
 from juju.state.base import StateBase
+from juju.state.watches import watch_registry
 from juju.state.errors import (
     DuplicateEndpoints, IncompatibleEndpoints, RelationAlreadyExists,
     RelationStateNotFound, StateChanged, UnitRelationStateNotFound,
@@ -482,6 +483,8 @@ class RelationUnitWatcherBase(StateBase):
         self._callback = callback
         self._stopped = None
         self._unit_name_map = None
+        self._members_watch = None
+        self._settings_watches = {}
         self._log = logging.getLogger("unit.relation.watch")
 
     def _watch_container(self, watch_established_callback=None):
@@ -605,7 +608,7 @@ class RelationUnitWatcherBase(StateBase):
 
         # Invoke callback
         callback_d.addCallback(
-            lambda (old_units, new_units): maybeDeferred(
+            lambda (old_units, new_units): self._members_watch.fire(
                 self._callback,
                 old_units=sorted(old_units),
                 new_units=sorted(new_units)))
@@ -640,6 +643,7 @@ class RelationUnitWatcherBase(StateBase):
             # watch will handle add/removes
             exists_d, watch_d = self._client.exists_and_watch(settings_path)
             settings_watches.append(watch_d)
+            self._get_settings_watch(unit_id, settings_path)
 
         return settings_watches
 
@@ -675,8 +679,12 @@ class RelationUnitWatcherBase(StateBase):
 
         # Don't process deleted units or if we've been stopped.
         if self._stopped or not unit_id in self._units:
+            registered_watch = self._settings_watches.pop(unit_id, None)
+            if registered_watch is not None:
+                registered_watch.stop()
             return
 
+        registered_watch = self._get_settings_watch(unit_id, event.path)
         exists_d, watch_d = self._client.exists_and_watch(event.path)
 
         # We don't process settings deleted events here. We should get
@@ -691,13 +699,21 @@ class RelationUnitWatcherBase(StateBase):
             # fires, and defer on the user callback, we won't fire the
             # watch on this node till the callback has completed.
             exists_d.addCallback(
-                lambda (unit_name,): maybeDeferred(
+                lambda (unit_name,): registered_watch.fire(
                     self._callback, modified=unit_name))
 
         # Restablish the child watch callback after the user callback completes
         exists_d.addCallback(
             lambda result: watch_d.addCallback(self._cb_unit_change))
 
+    def _get_settings_watch(self, unit_id, settings_path):
+        """Return the registered watch of a unit's settings."""
+        registered_watch = self._settings_watches.get(unit_id)
+        if registered_watch is None or not registered_watch.active:
+            registered_watch = self._settings_watches[unit_id] = \
+                watch_registry.add("relation_settings", settings_path, self)
+        return registered_watch
+
     def _filter_units(self, units):
         """A utility method to filter the unit relations based on relation type
         """
@@ -715,6 +731,12 @@ class RelationUnitWatcherBase(StateBase):
         from the stopped period will be sent after restarting.
         """
         self._stopped = True
+        # Any armed watch is ignored from now on.
+        if self._members_watch is not None:
+            self._members_watch.stop()
+        for registered_watch in self._settings_watches.values():
+            registered_watch.stop()
+        self._settings_watches.clear()
         self._log.debug("relation watcher stop")
 
     def start(self):
@@ -732,6 +754,8 @@ class RelationUnitWatcherBase(StateBase):
         """
         assert self._stopped or self._stopped is None, "Already started"
         self._stopped = False
+        self._members_watch = watch_registry.add(
+            "relation_members", self._container_path, self)
 
         watcher_started = Deferred()
 
@@ -1,13 +1,12 @@
 import yaml
 import zookeeper
 
-from twisted.internet.defer import (
-    inlineCallbacks, returnValue, maybeDeferred)
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from txzookeeper.utils import retry_change
 
 from juju.charm.url import CharmURL
-from juju.state.agent import AgentStateMixin
+from juju.state.agent import AgentStateMixin, UNIT_AGENTS_PATH
 from juju.state.base import StateBase
 from juju.state.endpoint import RelationEndpoint
 from juju.state.errors import (
@@ -20,10 +19,14 @@ from juju.state.charm import CharmStateManager
 from juju.state.relation import ServiceRelationState, RelationStateManager
 from juju.state.machine import _public_machine_id, MachineState
 from juju.state.utils import remove_tree, dict_merge, YAMLState
+from juju.state.watches import watch_registry
 
 RETRY_HOOKS = 1000
 NO_HOOKS = 1001
 
+# Order of preference of unused machines, by standby pool status.
+_STANDBY_PREFERENCE = {"ready": 0, None: 1, "pending": 2}
+
 
 class ServiceStateManager(StateBase):
     """Manages the state of services in an environment."""
@@ -221,7 +224,7 @@ class ServiceStateManager(StateBase):
             if old_services != new_services:
                 return callback(old_services, new_services)
 
-        return self._watch_topology(watch_topology)
+        return self._watch_topology(watch_topology, owner=callback)
 
 
 class ServiceState(StateBase):
@@ -468,7 +471,7 @@ class ServiceState(StateBase):
                     _to_service_relation_state(
                         self._client, self._internal_id, new_relations))
 
-        return self._watch_topology(watch_topology)
+        return self._watch_topology(watch_topology, owner=callback)
 
     @inlineCallbacks
     def watch_config_state(self, callback):
@@ -486,12 +489,18 @@ class ServiceState(StateBase):
         will make it bail out).  In order to cleanly stop the watcher, a
         StopWatch exception can be raised by the callback.
         """
+        registered_watch = watch_registry.add(
+            "config", self._config_path, callback)
+
         @inlineCallbacks
         def watcher(change_event):
-            if self._client.connected:
-                exists_d, watch_d = self._client.exists_and_watch(
-                    self._config_path)
-            yield callback(change_event)
+            if not self._client.connected:
+                # The watch can't be re-armed anymore.
+                registered_watch.stop()
+                return
+            exists_d, watch_d = self._client.exists_and_watch(
+                self._config_path)
+            yield registered_watch.fire(callback, change_event)
             watch_d.addCallback(watcher)
 
         exists_d, watch_d = self._client.exists_and_watch(self._config_path)
@@ -500,7 +509,7 @@ class ServiceState(StateBase):
 
         # Setup the watch deferred callback after the user defined callback
         # has returned successfully from the existence invocation.
-        callback_d = maybeDeferred(callback, bool(exists))
+        callback_d = registered_watch.fire(callback, bool(exists))
         callback_d.addCallback(
             lambda x: watch_d.addCallback(watcher) and x)
 
@@ -547,7 +556,7 @@ class ServiceState(StateBase):
             if old_service_units != new_service_units:
                 return callback(old_service_units, new_service_units)
 
-        return self._watch_topology(watch_topology)
+        return self._watch_topology(watch_topology, owner=callback)
 
     @inlineCallbacks
     def set_exposed_flag(self):
@@ -601,6 +610,9 @@ class ServiceState(StateBase):
         exception.
         """
 
+        registered_watch = watch_registry.add(
+            "exposed", self._exposed_path, callback)
+
         @inlineCallbacks
         def manage_callback(*ignored):
             # Need to guard on the client being connected in the case
@@ -610,13 +622,14 @@ class ServiceState(StateBase):
             # It remains the reponsibility of `callback` to raise
             # `StopWatcher`, per above.
             if not self._client.connected:
+                registered_watch.stop()
                 returnValue(None)
             exists_d, watch_d = self._client.exists_and_watch(
                 self._exposed_path)
             stat = yield exists_d
             exists = bool(stat)
             try:
-                yield callback(exists)
+                yield registered_watch.fire(callback, exists)
             except StopWatcher:
                 returnValue(None)
             watch_d.addCallback(manage_callback)
@@ -703,8 +716,31 @@ class ServiceUnitState(StateBase, AgentStateMixin):
         """The path for the open ports for this service unit."""
         return "/units/%s/ports" % self._internal_id
 
+    def get_ports_path(self):
+        """Get the zookeeper path of the open ports of this service unit.
+
+        Allows reading the ports of many units at once, their content is
+        parsed with L{parse_open_ports}.
+        """
+        return self._ports_path
+
+    @staticmethod
+    def parse_open_ports(content):
+        """Parse the content of the open ports node of a service unit.
+
+        Returns the open ports, in the format of L{get_open_ports}.
+        """
+        data = yaml.load(content)
+        if data is None:
+            return ()
+        return data.get("open", ())
+
     def _get_agent_path(self):
         """Get the zookeeper path for the service unit agent."""
+        return "%s/%s" % (UNIT_AGENTS_PATH, self._internal_id)
+
+    def _get_legacy_agent_path(self):
+        """Get the zookeeper path of unit agents of earlier versions."""
         return "/units/%s/agent" % self._internal_id
 
     @inlineCallbacks
@@ -864,7 +900,13 @@ class ServiceUnitState(StateBase, AgentStateMixin):
                         topology.machine_has_units(m))])
             if not unused_machines:
                 raise NoUnusedMachines()
-            unused_machine_internal_id = unused_machines[0]
+            # Prefer standby machines whose agent is already connected,
+            # and leave standby machines still booting for last.
+            unused_machine_internal_id = min(
+                unused_machines,
+                key=lambda m: _STANDBY_PREFERENCE[
+                    topology.get_machine_standby(m)])
+            topology.set_machine_standby(unused_machine_internal_id, None)
             topology.assign_service_unit_to_machine(
                 self._internal_service_id,
                 self._internal_id,
@@ -976,21 +1018,26 @@ class ServiceUnitState(StateBase, AgentStateMixin):
         """
         debug_path = "/units/%s/debug" % self._internal_id
 
+        registered_watch = watch_registry.add(
+            "hook_debug", debug_path, callback)
+
         @inlineCallbacks
         def watcher(change_event):
             if permanent and self._client.connected:
                 exists_d, watch_d = self._client.exists_and_watch(debug_path)
 
-            yield callback(change_event)
+            yield registered_watch.fire(callback, change_event)
 
-            if permanent:
+            if permanent and self._client.connected:
                 watch_d.addCallback(watcher)
+            else:
+                registered_watch.stop()
 
         exists_d, watch_d = self._client.exists_and_watch(debug_path)
         exists = yield exists_d
         # Setup the watch deferred callback after the user defined callback
         # has returned successfully from the existence invocation.
-        callback_d = maybeDeferred(callback, bool(exists))
+        callback_d = registered_watch.fire(callback, bool(exists))
         callback_d.addCallback(
             lambda x: watch_d.addCallback(watcher) and x)
         # Wait on the first callback, reflecting present state, not a zk watch
@@ -1048,16 +1095,21 @@ class ServiceUnitState(StateBase, AgentStateMixin):
         """
         upgrade_path = "/units/%s/upgrade" % self._internal_id
 
+        registered_watch = watch_registry.add(
+            "upgrade_flag", upgrade_path, callback)
+
         @inlineCallbacks
         def watcher(change_event):
 
             if permanent and self._client.connected:
                 exists_d, watch_d = self._client.exists_and_watch(upgrade_path)
 
-            yield callback(change_event)
+            yield registered_watch.fire(callback, change_event)
 
-            if permanent:
+            if permanent and self._client.connected:
                 watch_d.addCallback(watcher)
+            else:
+                registered_watch.stop()
 
         exists_d, watch_d = self._client.exists_and_watch(upgrade_path)
 
@@ -1065,7 +1117,7 @@ class ServiceUnitState(StateBase, AgentStateMixin):
 
         # Setup the watch deferred callback after the user defined callback
         # has returned successfully from the existence invocation.
-        callback_d = maybeDeferred(callback, bool(exists))
+        callback_d = registered_watch.fire(callback, bool(exists))
         callback_d.addCallback(
             lambda x: watch_d.addCallback(watcher) and x)
         # Wait on the first callback, reflecting present state, not a zk watch
@@ -1129,15 +1181,19 @@ class ServiceUnitState(StateBase, AgentStateMixin):
                resolved setting. Subsequent invocations will be with change
                events.
         """
+        registered_watch = watch_registry.add(
+            "resolved", self._unit_resolve_path, callback)
+
         @inlineCallbacks
         def watcher(change_event):
             if not self._client.connected:
+                registered_watch.stop()
                 returnValue(None)
 
             exists_d, watch_d = self._client.exists_and_watch(
                 self._unit_resolve_path)
             try:
-                yield callback(change_event)
+                yield registered_watch.fire(callback, change_event)
             except StopWatcher:
                 returnValue(None)
             watch_d.addCallback(watcher)
@@ -1148,7 +1204,7 @@ class ServiceUnitState(StateBase, AgentStateMixin):
 
         # Setup the watch deferred callback after the user defined callback
         # has returned successfully from the existence invocation.
-        callback_d = maybeDeferred(callback, bool(exists))
+        callback_d = registered_watch.fire(callback, bool(exists))
         callback_d.addCallback(
             lambda x: watch_d.addCallback(watcher) and x)
         callback_d.addErrback(
@@ -1247,14 +1303,18 @@ class ServiceUnitState(StateBase, AgentStateMixin):
                resolved setting. Subsequent invocations will be with change
                events.
         """
+        registered_watch = watch_registry.add(
+            "relation_resolved", self._relation_resolved_path, callback)
+
         @inlineCallbacks
         def watcher(change_event):
             if not self._client.connected:
+                registered_watch.stop()
                 returnValue(None)
             exists_d, watch_d = self._client.exists_and_watch(
                 self._relation_resolved_path)
             try:
-                yield callback(change_event)
+                yield registered_watch.fire(callback, change_event)
             except StopWatcher:
                 returnValue(None)
 
@@ -1267,7 +1327,7 @@ class ServiceUnitState(StateBase, AgentStateMixin):
 
         # Setup the watch deferred callback after the user defined callback
         # has returned successfully from the existence invocation.
-        callback_d = maybeDeferred(callback, bool(exists))
+        callback_d = registered_watch.fire(callback, bool(exists))
         callback_d.addCallback(
             lambda x: watch_d.addCallback(watcher) and x)
         callback_d.addErrback(
@@ -1333,10 +1393,7 @@ class ServiceUnitState(StateBase, AgentStateMixin):
             content, stat = yield self._client.get(self._ports_path)
         except zookeeper.NoNodeException:
             returnValue([])
-        data = yaml.load(content)
-        if data is None:
-            returnValue(())
-        returnValue(data.get("open", ()))
+        returnValue(self.parse_open_ports(content))
 
     @inlineCallbacks
     def watch_ports(self, callback):
@@ -1348,14 +1405,18 @@ class ServiceUnitState(StateBase, AgentStateMixin):
             node. Subsequent invocations will be with change
             events.
         """
+        registered_watch = watch_registry.add(
+            "ports", self._ports_path, callback)
+
         @inlineCallbacks
         def watcher(change_event):
             if not self._client.connected:
+                registered_watch.stop()
                 returnValue(None)
             exists_d, watch_d = self._client.exists_and_watch(
                 self._ports_path)
             try:
-                yield callback(change_event)
+                yield registered_watch.fire(callback, change_event)
             except StopWatcher:
                 returnValue(None)
 
@@ -1366,7 +1427,7 @@ class ServiceUnitState(StateBase, AgentStateMixin):
 
         # Setup the watch deferred callback after the user defined callback
         # has returned successfully from the existence invocation.
-        callback_d = maybeDeferred(callback, bool(exists))
+        callback_d = registered_watch.fire(callback, bool(exists))
         callback_d.addCallback(
             lambda x: watch_d.addCallback(watcher) and x)
         callback_d.addErrback(
@@ -21,6 +21,7 @@ class SSHClient(SecurityPolicyConnection):
     """
 
     remote_user = "ubuntu"
+    local_port = None
     _process = None
 
     @inlineCallbacks
@@ -42,7 +43,7 @@ class SSHClient(SecurityPolicyConnection):
         start_time = time.time()
 
         # Determine which port we'll be using.
-        local_port = get_open_port()
+        local_port = self.local_port = get_open_port()
         port_watcher = PortWatcher("localhost", local_port, timeout)
 
         tunnel_error = Deferred()
@@ -1,11 +1,13 @@
 import zookeeper
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed
 from txzookeeper.tests.utils import deleteTree
 
 from juju.lib.testing import TestCase
 from juju.state.base import StateBase
-from juju.state.agent import AgentStateMixin
+from juju.state.agent import (
+    AgentStateMixin, PresenceIndex, UNIT_AGENTS_PATH)
+from juju.state.errors import StopWatcher
 
 
 class DomainObject(StateBase, AgentStateMixin):
@@ -14,7 +16,23 @@ class DomainObject(StateBase, AgentStateMixin):
         return "/agent"
 
 
-class AgentDomainTest(TestCase):
+class ContainedDomainObject(StateBase, AgentStateMixin):
+
+    def __init__(self, client, internal_id):
+        super(ContainedDomainObject, self).__init__(client)
+        self.internal_id = internal_id
+
+    def _get_agent_path(self):
+        return "%s/%s" % (UNIT_AGENTS_PATH, self.internal_id)
+
+
+class UpgradedDomainObject(ContainedDomainObject):
+
+    def _get_legacy_agent_path(self):
+        return "/agent"
+
+
+class AgentTestBase(TestCase):
 
     @inlineCallbacks
     def setUp(self):
@@ -31,6 +49,9 @@ class AgentDomainTest(TestCase):
         deleteTree("/", client.handle)
         yield client.close()
 
+
+class AgentDomainTest(AgentTestBase):
+
     @inlineCallbacks
     def test_has_agent(self):
         domain = DomainObject(self.client)
@@ -92,3 +113,114 @@ class AgentDomainTest(TestCase):
 
         event = yield watch_d
         self.assertEqual(event.type_name, "deleted")
+
+    @inlineCallbacks
+    def test_connect_agent_creates_containers(self):
+        """Agents containers missing from older environments are created."""
+        domain = ContainedDomainObject(self.client, "unit-0000000001")
+        self.assertFalse((yield self.client.exists(UNIT_AGENTS_PATH)))
+        yield domain.connect_agent()
+        self.assertTrue((yield domain.has_agent()))
+        children = yield self.client.get_children(UNIT_AGENTS_PATH)
+        self.assertEqual(children, ["unit-0000000001"])
+
+    @inlineCallbacks
+    def test_has_agent_legacy(self):
+        """Agents of earlier versions, at the legacy path, are found."""
+        domain = UpgradedDomainObject(self.client, "unit-0000000001")
+        self.assertFalse((yield domain.has_agent()))
+        yield DomainObject(self.client).connect_agent()
+        self.assertTrue((yield domain.has_agent()))
+        self.assertTrue((yield domain.has_legacy_agent()))
+
+    @inlineCallbacks
+    def test_watch_agent_legacy(self):
+        """The presence of an agent of an earlier version is watched."""
+        domain = UpgradedDomainObject(self.client, "unit-0000000001")
+        yield DomainObject(self.client).connect_agent()
+        exists_d, watch_d = domain.watch_agent()
+        self.assertIs((yield exists_d), True)
+        yield self.client.delete("/agent")
+        event = yield watch_d
+        self.assertEqual(event.type_name, "deleted")
+
+        # The agent reconnects once upgraded.
+        exists_d, watch_d = domain.watch_agent()
+        self.assertIs((yield exists_d), False)
+        yield domain.connect_agent()
+        event = yield watch_d
+        self.assertEqual(event.type_name, "created")
+        self.assertIs((yield domain.watch_agent()[0]), True)
+
+
+class PresenceIndexTest(AgentTestBase):
+
+    @inlineCallbacks
+    def test_snapshot(self):
+        index = PresenceIndex(self.client, UNIT_AGENTS_PATH)
+        self.assertRaises(RuntimeError, index.get_agents)
+        self.assertEqual((yield index.snapshot()), set())
+
+        unit_1 = ContainedDomainObject(self.client, "unit-0000000001")
+        unit_2 = ContainedDomainObject(self.client, "unit-0000000002")
+        yield unit_1.connect_agent()
+        self.assertEqual((yield index.snapshot()), set(["unit-0000000001"]))
+        self.assertTrue(index.has_agent(unit_1))
+        self.assertFalse(index.has_agent(unit_2))
+
+    @inlineCallbacks
+    def test_check_agent_legacy(self):
+        """Agents of earlier versions are found outside of the index."""
+        index = PresenceIndex(self.client, UNIT_AGENTS_PATH)
+        unit_1 = UpgradedDomainObject(self.client, "unit-0000000001")
+        unit_2 = UpgradedDomainObject(self.client, "unit-0000000002")
+        yield unit_1.connect_agent()
+        yield index.snapshot()
+        self.assertTrue((yield index.check_agent(unit_1)))
+        self.assertFalse((yield index.check_agent(unit_2)))
+
+        yield DomainObject(self.client).connect_agent()
+        self.assertFalse(index.has_agent(unit_2))
+        self.assertTrue((yield index.check_agent(unit_2)))
+
+    @inlineCallbacks
+    def test_watch(self):
+        """The index is kept current, changes are passed to the callback.
+        """
+        changes = []
+
+        def callback(old, new):
+            changes.append((old, new))
+            return succeed(None)
+
+        index = PresenceIndex(self.client, UNIT_AGENTS_PATH)
+        yield index.watch(callback)
+        self.assertTrue(index.watching)
+        self.assertEqual(changes, [(None, set())])
+
+        # The watch survives the creation of the container.
+        client = self.get_zookeeper_client()
+        yield client.connect()
+        unit_1 = ContainedDomainObject(client, "unit-0000000001")
+        yield unit_1.connect_agent()
+        while not index.get_agents():
+            yield self.sleep(0.05)
+        self.assertTrue(index.has_agent(unit_1))
+        self.assertEqual(changes[-1], (set(), set(["unit-0000000001"])))
+
+        # An agent going away is observed.
+        yield client.close()
+        while index.get_agents():
+            yield self.sleep(0.05)
+        self.assertFalse(index.has_agent(unit_1))
+
+    @inlineCallbacks
+    def test_watch_stop(self):
+        """Raising StopWatcher from the callback stops the watch."""
+
+        def callback(old, new):
+            raise StopWatcher()
+
+        index = PresenceIndex(self.client, UNIT_AGENTS_PATH)
+        yield index.watch(callback)
+        self.assertFalse(index.watching)
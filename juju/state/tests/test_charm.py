@@ -136,3 +136,29 @@ class CharmStateManagerTest(StateTestBase):
             "local:series/dummy-1")
         sha256 = yield charm_state.get_sha256()
         self.assertEquals(sha256, self.charm.get_sha256())
+
+    @inlineCallbacks
+    def test_manifest_and_delta(self):
+        """
+        The manifest of a charm's files and the delta from the charm it
+        upgrades are stored when given.
+        """
+        manifest = {"url": "http://example.com/manifest", "sha256": "abc"}
+        delta = {"base": "local:series/dummy-0",
+                 "url": "http://example.com/delta", "sha256": "def"}
+        yield self.charm_state_manager.add_charm_state(
+            self.charm_id, self.charm, "http://example.com/abc",
+            manifest=manifest, delta=delta)
+        charm_state = yield self.charm_state_manager.get_charm_state(
+            "local:series/dummy-1")
+        self.assertEquals(charm_state.manifest, manifest)
+        self.assertEquals(charm_state.delta, delta)
+
+    @inlineCallbacks
+    def test_no_manifest(self):
+        yield self.charm_state_manager.add_charm_state(
+            self.charm_id, self.charm, "http://example.com/abc")
+        charm_state = yield self.charm_state_manager.get_charm_state(
+            "local:series/dummy-1")
+        self.assertIdentical(charm_state.manifest, None)
+        self.assertIdentical(charm_state.delta, None)
@@ -154,6 +154,16 @@ class GlobalSettingsTest(StateTestBase):
         value = yield self.manager.is_debug_log_enabled()
         self.assertFalse(value)
 
+    @inlineCallbacks
+    def test_set_debug_log_limits(self):
+        """The debug log rate limits are set via the runtime manager."""
+        self.assertEqual((yield self.manager.get_debug_log_limits()), None)
+        yield self.manager.set_debug_log_limits(
+            rate=10, sampling={"hook.output": 0.5})
+        self.assertEqual(
+            (yield self.manager.get_debug_log_limits()),
+            {"rate": 10, "burst": None, "sampling": {"hook.output": 0.5}})
+
     @inlineCallbacks
     def test_watcher(self):
         """Use the watch facility of the settings manager to observer changes.
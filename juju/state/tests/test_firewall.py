@@ -6,11 +6,14 @@ from twisted.internet.defer import (
 from juju.environment.config import EnvironmentsConfig
 from juju.errors import ProviderInteractionError
 from juju.lib.mocker import MATCH
+from juju.lib.testing import TestCase
+from juju.lib.zkprofile import ZookeeperProfiler
 from juju.providers.dummy import DummyMachine, MachineProvider
 from juju.state.errors import StopWatcher
-from juju.state.firewall import FirewallManager
-from juju.state.machine import MachineStateManager
-from juju.state.service import ServiceStateManager
+from juju.state.firewall import FirewallManager, PortIndex
+from juju.state.machine import MachineState, MachineStateManager
+from juju.state.service import (
+    ServiceState, ServiceStateManager, ServiceUnitState)
 from juju.state.tests.test_service import ServiceStateManagerTestBase
 
 
@@ -576,6 +579,183 @@ class FirewallMachineTest(FirewallTestBase):
         self.assertIn("Opened 80/tcp on provider machine 0",
                       self.output.getvalue())
 
+    def record_provider_calls(self, *names):
+        """Record the calls of the provider methods `names`."""
+        calls = []
+        for name in names:
+            method = getattr(self.provider, name)
+
+            def record(*args, **kw):
+                calls.append(record.name)
+                return record.method(*args, **kw)
+            record.name, record.method = name, method
+            self.patch(self.provider, name, record)
+        return calls
+
+    @inlineCallbacks
+    def setup_exposed_unit(self):
+        manager = MachineStateManager(self.client)
+        machine = yield manager.add_machine_state()
+        yield self.provide_machine(machine)
+        wordpress = yield self.add_service("wordpress")
+        yield wordpress.set_exposed_flag()
+        wordpress_0 = yield wordpress.add_unit_state()
+        yield wordpress_0.assign_to_machine(machine)
+        returnValue((machine, wordpress_0))
+
+    @inlineCallbacks
+    def test_open_close_ports_on_machine_uses_known_ports(self):
+        """Ports known to be opened are not read from the provider again.
+        """
+        machine, wordpress_0 = yield self.setup_exposed_unit()
+        calls = self.record_provider_calls(
+            "get_opened_ports", "set_machine_ports")
+
+        yield wordpress_0.open_port(80, "tcp")
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+        self.assertEqual(calls, ["set_machine_ports", "get_opened_ports"])
+
+        yield wordpress_0.open_port(443, "tcp")
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+        self.assertEqual(calls[2:], ["set_machine_ports"])
+        self.assertEqual((yield self.get_provider_ports(machine)),
+                         set([(80, "tcp"), (443, "tcp")]))
+
+        # Without any change, the provider is not called at all.
+        del calls[:]
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+        self.assertEqual(calls, [])
+
+    @inlineCallbacks
+    def test_refresh_opened_ports(self):
+        """The known opened ports are reread with one provider request."""
+        machine, wordpress_0 = yield self.setup_exposed_unit()
+        yield wordpress_0.open_port(80, "tcp")
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+
+        # Simulate a port closed outside of juju, noticed on refresh.
+        self.patch(self.provider, "get_all_opened_ports",
+                   lambda: succeed({machine.id: set()}))
+        yield self.firewall_manager.refresh_opened_ports()
+        calls = self.record_provider_calls(
+            "get_opened_ports", "open_port")
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+        self.assertEqual(calls, ["open_port"])
+
+    @inlineCallbacks
+    def test_refresh_opened_ports_unsupported(self):
+        """Without a bulk api, ports are reread per machine on change."""
+        machine, wordpress_0 = yield self.setup_exposed_unit()
+        yield wordpress_0.open_port(80, "tcp")
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+
+        yield self.firewall_manager.refresh_opened_ports()
+        calls = self.record_provider_calls("get_opened_ports")
+        yield self.firewall_manager.open_close_ports_on_machine(machine.id)
+        self.assertEqual(calls, ["get_opened_ports"])
+
+    @inlineCallbacks
+    def wait_on_index(self, machine, unit_name, ports):
+        """Wait until the index and the provider agree on `ports`."""
+        index = self.firewall_manager._index
+        while True:
+            provider_ports = yield self.get_provider_ports(machine)
+            if (index.get_unit_machine(unit_name) == machine.id and
+                    index.get_unit_ports(unit_name) == set(ports) and
+                    provider_ports == set(ports)):
+                break
+            yield self.poke_zk()
+
+    @inlineCallbacks
+    def test_port_change_uses_index(self):
+        """A watched port change is applied without rereading the machine.
+
+        The machine's units, their ports and the exposed flags are kept
+        in the index by the watches, so a port change costs a single
+        read of the unit's ports and a single provider diff.
+        """
+        self.start()
+        machine, wordpress_0 = yield self.setup_exposed_unit()
+        yield self.firewall_manager.process_machine(machine)
+        yield wordpress_0.open_port(80, "tcp")
+        yield self.wait_on_index(machine, "wordpress/0", [(80, "tcp")])
+
+        reads = []
+
+        def record(name):
+            def read(*args, **kw):
+                reads.append(name)
+                return fail(AssertionError("%s not expected" % name))
+            return read
+        self.patch(MachineState, "get_all_service_unit_states",
+                   record("get_all_service_unit_states"))
+        self.patch(ServiceState, "get_exposed_flag",
+                   record("get_exposed_flag"))
+        self.patch(ServiceUnitState, "get_assigned_machine_id",
+                   record("get_assigned_machine_id"))
+        calls = self.record_provider_calls(
+            "get_machine", "get_opened_ports", "set_machine_ports")
+
+        expected_machines = self.wait_on_expected_machines(set([0]))
+        yield wordpress_0.open_port(443, "tcp")
+        self.assertTrue((yield expected_machines))
+        self.assertEqual(reads, [])
+        self.assertEqual(calls, ["set_machine_ports"])
+        self.assertEqual((yield self.get_provider_ports(machine)),
+                         set([(80, "tcp"), (443, "tcp")]))
+        self.stop()
+
+    @inlineCallbacks
+    def test_unwatched_unit_ports_read_concurrently(self):
+        """The ports of the unwatched units of a machine are read in a
+        single round trip, however many units there are."""
+        machine, wordpress_0 = yield self.setup_exposed_unit()
+        wordpress = yield self.service_state_manager.get_service_state(
+            "wordpress")
+        self.firewall_manager._index.set_exposed("wordpress", True)
+        yield wordpress_0.open_port(80, "tcp")
+
+        @inlineCallbacks
+        def profile_policy_ports():
+            profiler = ZookeeperProfiler()
+            profiler.install()
+            try:
+                ports = yield self.firewall_manager._get_policy_ports(
+                    machine.id)
+            finally:
+                profiler.uninstall()
+            returnValue((ports, profiler))
+
+        ports, one_unit = yield profile_policy_ports()
+        self.assertEqual(ports, set([(80, "tcp")]))
+
+        for port in (81, 82, 83):
+            unit = yield wordpress.add_unit_state()
+            yield unit.assign_to_machine(machine)
+            yield unit.open_port(port, "tcp")
+        ports, four_units = yield profile_policy_ports()
+        self.assertEqual(len(ports), 4)
+        self.assertEqual(
+            four_units.stats[("get", "/units/*/ports")].count, 4)
+        self.assertEqual(four_units.round_trips, one_unit.round_trips)
+
+    @inlineCallbacks
+    def test_index_tracks_unexpose(self):
+        """Unexposing a service closes its ports via the index."""
+        self.start()
+        machine, wordpress_0 = yield self.setup_exposed_unit()
+        yield self.firewall_manager.process_machine(machine)
+        yield wordpress_0.open_port(80, "tcp")
+        yield self.wait_on_index(machine, "wordpress/0", [(80, "tcp")])
+
+        wordpress = yield self.service_state_manager.get_service_state(
+            "wordpress")
+        expected_units = self.wait_on_expected_units(set(["wordpress/0"]))
+        yield wordpress.clear_exposed_flag()
+        self.assertTrue((yield expected_units))
+        self.assertEqual((yield self.get_provider_ports(machine)), set())
+        self.stop()
+
     @inlineCallbacks
     def test_process_machine_ignores_stop_watcher(self):
         """Verify that process machine catches `StopWatcher`.
@@ -680,3 +860,37 @@ class FirewallObserversTest(FirewallTestBase):
         self.assertEqual(
             calls[0],
             set([("a", machine.id), ("b", machine.id)]))
+
+
+class PortIndexTest(TestCase):
+
+    def test_machine_units(self):
+        index = PortIndex()
+        self.assertEqual(index.get_machine_units(0), None)
+        index.set_machine_units(0, ["wordpress/0", "mysql/0"])
+        self.assertEqual(index.get_machine_units(0),
+                         set(["wordpress/0", "mysql/0"]))
+        self.assertEqual(index.get_unit_machine("mysql/0"), 0)
+
+        index.set_machine_units(0, ["wordpress/0"])
+        self.assertEqual(index.get_unit_machine("mysql/0"), None)
+        self.assertEqual(index.get_unit_machine("wordpress/0"), 0)
+
+    def test_unexpose_discards_unit_ports(self):
+        index = PortIndex()
+        self.assertEqual(index.get_exposed("wordpress"), None)
+        index.set_exposed("wordpress", True)
+        index.set_unit_ports("wordpress/0", [(80, "tcp")])
+        index.set_unit_ports("wordpress-admin/0", [(8080, "tcp")])
+        self.assertEqual(index.get_unit_ports("wordpress/0"),
+                         set([(80, "tcp")]))
+
+        index.set_exposed("wordpress", False)
+        self.assertEqual(index.get_exposed("wordpress"), False)
+        self.assertEqual(index.get_unit_ports("wordpress/0"), None)
+        self.assertEqual(index.get_unit_ports("wordpress-admin/0"),
+                         set([(8080, "tcp")]))
+
+        index.discard_service("wordpress-admin")
+        self.assertEqual(index.get_exposed("wordpress-admin"), None)
+        self.assertEqual(index.get_unit_ports("wordpress-admin/0"), None)
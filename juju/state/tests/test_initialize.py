@@ -52,6 +52,9 @@ class LayoutTest(TestCase):
         yield self.assert_existence_and_acl("/units")
         yield self.assert_existence_and_acl("/machines")
         yield self.assert_existence_and_acl("/relations")
+        yield self.assert_existence_and_acl("/agents")
+        yield self.assert_existence_and_acl("/agents/machines")
+        yield self.assert_existence_and_acl("/agents/units")
         yield self.assert_existence_and_acl("/initialized")
 
         machine_state_manager = MachineStateManager(self.client)
@@ -52,6 +52,16 @@ class MachineStateManagerTest(StateTestBase):
         self.assertTrue(topology.has_machine("machine-0000000000"))
         self.assertTrue(topology.has_machine("machine-0000000001"))
 
+    @inlineCallbacks
+    def test_add_standby_machine(self):
+        """A machine state may be added to the standby pool."""
+        machine_state = yield self.machine_state_manager.add_machine_state(
+            standby=True)
+        topology = yield self.get_topology()
+        self.assertEqual(
+            topology.get_machine_standby(machine_state.internal_id),
+            "pending")
+
     @inlineCallbacks
     def test_machine_str_representation(self):
         """The str(machine) value includes the machine id.
@@ -283,7 +293,7 @@ class MachineStateManagerTest(StateTestBase):
         event = yield watch_d
         self.assertEqual(event.type_name, "created")
         self.assertEqual(event.path,
-                         "/machines/%s/agent" % machine_state.internal_id)
+                         "/agents/machines/%s" % machine_state.internal_id)
 
     @inlineCallbacks
     def test_watch_machines_initial_callback(self):
@@ -0,0 +1,119 @@
+import logging
+
+from twisted.internet.defer import inlineCallbacks
+
+from juju.state.pool import MachinePoolManager
+from juju.state.tests.test_service import ServiceStateManagerTestBase
+
+
+class MachinePoolManagerTest(ServiceStateManagerTestBase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(MachinePoolManagerTest, self).setUp()
+        # The root machine, never part of the pool.
+        yield self.machine_state_manager.add_machine_state()
+        self.pool = MachinePoolManager(self.client, size=2)
+        self.output = self.capture_logging(
+            "juju.state.pool", level=logging.DEBUG)
+
+    @inlineCallbacks
+    def assert_standby(self, expected):
+        topology = yield self.get_topology()
+        standby = {}
+        for machine_id in topology.get_machines():
+            status = topology.get_machine_standby(machine_id)
+            if status is not None:
+                standby[int(machine_id.split("-")[1])] = status
+        self.assertEqual(standby, expected)
+
+    @inlineCallbacks
+    def test_disabled_pool(self):
+        """A pool of size 0 adds no machines."""
+        self.pool.configure(size=0)
+        report = yield self.pool.check_pool()
+        self.assertEqual(report["added"], 0)
+        yield self.assert_standby({})
+
+    @inlineCallbacks
+    def test_refill(self):
+        """The pool is refilled by up to refill_rate machines per check."""
+        report = yield self.pool.check_pool()
+        self.assertEqual(report["added"], 1)
+        yield self.assert_standby({1: "pending"})
+
+        report = yield self.pool.check_pool()
+        self.assertEqual(report["added"], 1)
+        yield self.assert_standby({1: "pending", 2: "pending"})
+
+        report = yield self.pool.check_pool()
+        self.assertEqual(report["added"], 0)
+        self.assertEqual(report["standby"], 2)
+
+    @inlineCallbacks
+    def test_refill_rate(self):
+        self.pool.configure(size=3, refill_rate=2)
+        yield self.pool.check_pool()
+        yield self.assert_standby({1: "pending", 2: "pending"})
+        yield self.pool.check_pool()
+        yield self.assert_standby({1: "pending", 2: "pending", 3: "pending"})
+
+    @inlineCallbacks
+    def test_ready_once_agent_connected(self):
+        """A standby machine is ready once its machine agent connects."""
+        self.pool.configure(size=1)
+        yield self.pool.check_pool()
+        machine_state = yield self.machine_state_manager.get_machine_state(1)
+        yield machine_state.connect_agent()
+
+        report = yield self.pool.check_pool()
+        self.assertEqual(report["ready"], 1)
+        yield self.assert_standby({1: "ready"})
+
+    @inlineCallbacks
+    def test_draw_refills(self):
+        """A machine drawn by a unit leaves the pool, which is refilled."""
+        self.pool.configure(size=1)
+        yield self.pool.check_pool()
+        service_state = yield self.add_service_from_charm("wordpress")
+        unit_state = yield service_state.add_unit_state()
+        machine_state = yield unit_state.assign_to_unused_machine()
+        self.assertEqual(machine_state.id, 1)
+        yield self.assert_standby({})
+
+        yield self.pool.check_pool()
+        yield self.assert_standby({2: "pending"})
+
+    @inlineCallbacks
+    def test_shrink(self):
+        """Surplus machines are removed, pending and newest ones first."""
+        self.pool.configure(size=3, refill_rate=3)
+        yield self.pool.check_pool()
+        machine_state = yield self.machine_state_manager.get_machine_state(3)
+        yield machine_state.connect_agent()
+
+        self.pool.configure(size=1)
+        report = yield self.pool.check_pool()
+        self.assertEqual(report["removed"], 2)
+        yield self.assert_standby({3: "ready"})
+        self.assertIn("Removed standby machine 2", self.output.getvalue())
+
+    @inlineCallbacks
+    def test_idle_timeout(self):
+        """The pool is drained when idle, and refilled on activity."""
+        self.pool.configure(size=1, idle_timeout=60)
+        yield self.pool.check_pool()
+        yield self.assert_standby({1: "pending"})
+
+        self.pool._last_activity -= 120
+        self.assertEqual(self.pool.get_target_size(), 0)
+        yield self.pool.check_pool()
+        yield self.assert_standby({})
+
+        # A unit placed on a new machine is activity.
+        machine_state = yield self.machine_state_manager.add_machine_state()
+        service_state = yield self.add_service_from_charm("wordpress")
+        unit_state = yield service_state.add_unit_state()
+        yield unit_state.assign_to_machine(machine_state)
+        yield self.pool.check_pool()
+        yield self.assert_standby({3: "pending"})
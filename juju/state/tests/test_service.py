@@ -1326,7 +1326,7 @@ class ServiceStateManagerTest(ServiceStateManagerTestBase):
         event = yield watch_d
         self.assertEqual(event.type_name, "created")
         self.assertEqual(event.path,
-                         "/units/%s/agent" % unit_state.internal_id)
+                         "/agents/units/%s" % unit_state.internal_id)
 
     @inlineCallbacks
     def test_get_charm_id(self):
@@ -1453,6 +1453,37 @@ class ServiceStateManagerTest(ServiceStateManagerTestBase):
             ["machine-0000000000", "machine-0000000001"])
         yield self.assert_machine_assignments("wordpress", [1])
 
+    @inlineCallbacks
+    def test_assign_unit_to_unused_machine_prefers_standby(self):
+        """Ready standby machines are preferred, pending ones used last.
+
+        The assigned machine is removed from the standby pool.
+        """
+        yield self.machine_state_manager.add_machine_state()
+        pending = yield self.machine_state_manager.add_machine_state(
+            standby=True)
+        yield self.machine_state_manager.add_machine_state()
+        ready = yield self.machine_state_manager.add_machine_state(
+            standby=True)
+
+        def set_ready(topology):
+            topology.set_machine_standby(ready.internal_id, "ready")
+        yield self.machine_state_manager._retry_topology_change(set_ready)
+
+        service_state = yield self.add_service_from_charm("wordpress")
+        machine_ids = []
+        for i in range(3):
+            unit_state = yield service_state.add_unit_state()
+            machine_state = yield unit_state.assign_to_unused_machine()
+            machine_ids.append(machine_state.id)
+        self.assertEqual(machine_ids, [3, 2, 1])
+
+        topology = yield self.get_topology()
+        self.assertEqual(
+            topology.get_machine_standby(ready.internal_id), None)
+        self.assertEqual(
+            topology.get_machine_standby(pending.internal_id), None)
+
     @inlineCallbacks
     def test_assign_unit_to_unused_machine_with_changing_state_service(self):
         """Verify `StateChanged` raised if service is manipulated during reuse.
@@ -99,6 +99,21 @@ class InternalTopologyMapTest(TestCase):
             InternalTopologyError,
             self.topology.machine_has_units, "m-nonesuch")
 
+    def test_machine_standby(self):
+        """Machines may be marked as standby, and unmarked again."""
+        self.topology.add_machine("m-0")
+        self.assertEqual(self.topology.get_machine_standby("m-0"), None)
+        self.topology.set_machine_standby("m-0", "pending")
+        self.assertEqual(self.topology.get_machine_standby("m-0"), "pending")
+        self.topology.set_machine_standby("m-0", None)
+        self.assertEqual(self.topology.get_machine_standby("m-0"), None)
+        self.assertRaises(
+            InternalTopologyError,
+            self.topology.set_machine_standby, "m-nonesuch", "ready")
+        self.assertRaises(
+            InternalTopologyError,
+            self.topology.get_machine_standby, "m-nonesuch")
+
     def test_add_service(self):
         """
         The topology map is stored as YAML at the moment, so it
@@ -0,0 +1,118 @@
+import os
+
+import zookeeper
+
+from twisted.internet.defer import fail, inlineCallbacks, succeed
+
+from juju.errors import NoConnection
+from juju.lib.testing import TestCase
+from juju.state.tunnel import (
+    SharedTunnelClient, TunnelServer, get_tunnel_socket_path)
+from juju.tests.common import get_test_zookeeper_address
+
+
+class FakeTunnel(object):
+    """Stands in for an SSHClient, tunneling to the test zookeeper."""
+
+    def __init__(self):
+        self.local_port = int(get_test_zookeeper_address().split(":")[1])
+        self.connected = True
+
+    def close(self):
+        self.connected = False
+
+
+class TunnelServerTest(TestCase):
+
+    def setUp(self):
+        zookeeper.set_debug_level(0)
+        self.socket_path = os.path.join(self.makeDir(), "env.sock")
+        self.tunnels = []
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            return self.server.stop()
+
+    def connect(self):
+        tunnel = FakeTunnel()
+        self.tunnels.append(tunnel)
+        return succeed(tunnel)
+
+    @inlineCallbacks
+    def start_server(self, idle_timeout=None, connect=None):
+        self.server = TunnelServer(connect or self.connect, idle_timeout)
+        yield self.server.start(self.socket_path)
+
+    @inlineCallbacks
+    def connect_client(self):
+        client = yield SharedTunnelClient().connect_shared(self.socket_path)
+        self.assertTrue(client.connected)
+        self.assertTrue((yield client.exists("/zookeeper")))
+        client.close()
+
+    def test_get_tunnel_socket_path(self):
+        self.change_environment(HOME="/home/magicmock")
+        self.assertEqual(get_tunnel_socket_path("firstenv"),
+                         "/home/magicmock/.juju/tunnels/firstenv.sock")
+
+    @inlineCallbacks
+    def test_shared_tunnel(self):
+        """Clients connect through the single tunnel of the server."""
+        yield self.start_server()
+        self.assertEqual(len(self.tunnels), 1)
+        yield self.connect_client()
+        yield self.connect_client()
+        self.assertEqual(len(self.tunnels), 1)
+
+    @inlineCallbacks
+    def test_tunnel_reopened(self):
+        """A tunnel which went away is reopened on the next use."""
+        yield self.start_server()
+        self.tunnels[0].close()
+        yield self.connect_client()
+        self.assertEqual(len(self.tunnels), 2)
+
+    @inlineCallbacks
+    def test_tunnel_error(self):
+        """Tunnel errors are passed along to the client."""
+        yield self.start_server()
+        self.tunnels[0].close()
+        self.server._connect = lambda: fail(NoConnection("Tunnel broke"))
+        try:
+            yield SharedTunnelClient().connect_shared(self.socket_path)
+        except NoConnection, e:
+            self.assertEqual(str(e), "Tunnel broke")
+        else:
+            self.fail("Should have raised NoConnection")
+
+    @inlineCallbacks
+    def test_no_server(self):
+        """Connecting without a server raises NoConnection."""
+        try:
+            yield SharedTunnelClient().connect_shared(self.socket_path)
+        except NoConnection:
+            pass
+        else:
+            self.fail("Should have raised NoConnection")
+
+    @inlineCallbacks
+    def test_idle_timeout(self):
+        """The server stops when unused for its idle timeout."""
+        yield self.start_server(idle_timeout=0.1)
+        yield self.server.stopped
+        self.assertFalse(self.tunnels[0].connected)
+        self.assertEqual(self.server.client, None)
+
+    @inlineCallbacks
+    def test_idle_timeout_held_by_clients(self):
+        """The server is not idle while a client holds the tunnel."""
+        yield self.start_server(idle_timeout=0.1)
+        client = yield SharedTunnelClient().connect_shared(self.socket_path)
+        yield self.sleep(0.3)
+        self.assertFalse(self.server.stopped.called)
+        self.assertEqual(self.server.leases, 1)
+
+        client.close()
+        yield self.server.stopped
+        self.assertEqual(self.server.leases, 0)
@@ -12,10 +12,12 @@ from txzookeeper import ZookeeperClient
 import yaml
 
 from juju.lib.testing import TestCase
+from juju.lib.zkprofile import ZookeeperProfiler
 from juju.state.errors import StateChanged, StateNotFound
 from juju.state.utils import (
-    PortWatcher, remove_tree, dict_merge,
-    get_open_port, YAMLState, AddedItem, ModifiedItem, DeletedItem)
+    PortWatcher, remove_tree, dict_merge, get_many, set_many, delete_many,
+    get_children_recursive, get_open_port, YAMLState, AddedItem,
+    ModifiedItem, DeletedItem)
 
 from juju.tests.common import get_test_zookeeper_address
 
@@ -208,6 +210,126 @@ class RemoveTreeTest(TestCase):
         children = yield self.client.get_children("/")
         self.assertNotIn("zoo", children)
 
+    @inlineCallbacks
+    def test_remove_tree_round_trips(self):
+        """Each level of the tree costs a read and a delete round trip."""
+        yield self.client.create("/zoo")
+        yield self.client.create("/zoo/mammals")
+        yield self.client.create("/zoo/mammals/elephant")
+        yield self.client.create("/zoo/mammals/giraffe")
+        yield self.client.create("/zoo/reptiles")
+        yield self.client.create("/zoo/reptiles/snake")
+
+        profiler = ZookeeperProfiler()
+        profiler.install()
+        try:
+            yield remove_tree(self.client, "/zoo")
+        finally:
+            profiler.uninstall()
+
+        # 6 nodes, each read and deleted, over 3 levels.
+        self.assertEqual(
+            sum(stats.count for stats in profiler.stats.values()), 12)
+        self.assertEqual(profiler.round_trips, 6)
+
+    @inlineCallbacks
+    def test_remove_tree_concurrently(self):
+        """The nodes of a level are removed concurrently."""
+        yield self.client.create("/zoo")
+        for i in range(5):
+            yield self.client.create("/zoo/%d" % i)
+
+        delete = self.client.delete
+        outstanding = []
+        concurrency = []
+
+        def counting_delete(path):
+            outstanding.append(path)
+            concurrency.append(len(outstanding))
+            d = delete(path)
+            d.addBoth(lambda result: outstanding.remove(path) or result)
+            return d
+        self.patch(self.client, "delete", counting_delete)
+
+        yield remove_tree(self.client, "/zoo", limit=3)
+        self.assertEqual(len(concurrency), 6)
+        self.assertEqual(max(concurrency), 3)
+        self.assertFalse((yield self.client.exists("/zoo")))
+
+
+class BulkHelpersTest(TestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(BulkHelpersTest, self).setUp()
+        zookeeper.set_debug_level(0)
+        self.client = ZookeeperClient(get_test_zookeeper_address())
+        yield self.client.connect()
+        yield self.client.create("/zoo")
+        yield self.client.create("/zoo/mammals", "hairy")
+        yield self.client.create("/zoo/mammals/elephant", "big")
+        yield self.client.create("/zoo/reptiles", "scaly")
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield remove_tree(self.client, "/zoo")
+        self.client.close()
+        yield super(BulkHelpersTest, self).tearDown()
+
+    @inlineCallbacks
+    def test_get_many(self):
+        results = yield get_many(
+            self.client, ["/zoo/reptiles", "/zoo/mammals/elephant"])
+        self.assertEqual([content for content, stat in results],
+                         ["scaly", "big"])
+
+    @inlineCallbacks
+    def test_get_many_missing(self):
+        results = yield get_many(
+            self.client, ["/zoo/birds", "/zoo/reptiles"], missing_ok=True)
+        self.assertEqual(results[0], None)
+        self.assertEqual(results[1][0], "scaly")
+
+        try:
+            yield get_many(self.client, ["/zoo/reptiles", "/zoo/birds"])
+        except zookeeper.NoNodeException:
+            pass
+        else:
+            self.fail("Should have raised NoNodeException")
+
+    @inlineCallbacks
+    def test_set_many(self):
+        yield set_many(self.client, [("/zoo/mammals", "furry"),
+                                     ("/zoo/reptiles", "cold")])
+        results = yield get_many(
+            self.client, ["/zoo/mammals", "/zoo/reptiles"])
+        self.assertEqual([content for content, stat in results],
+                         ["furry", "cold"])
+
+    @inlineCallbacks
+    def test_delete_many(self):
+        yield delete_many(
+            self.client, ["/zoo/mammals/elephant", "/zoo/reptiles"])
+        children = yield self.client.get_children("/zoo")
+        self.assertEqual(children, ["mammals"])
+
+        yield delete_many(self.client, ["/zoo/reptiles"], missing_ok=True)
+        try:
+            yield delete_many(self.client, ["/zoo/reptiles"])
+        except zookeeper.NoNodeException:
+            pass
+        else:
+            self.fail("Should have raised NoNodeException")
+
+    @inlineCallbacks
+    def test_get_children_recursive(self):
+        descendants = yield get_children_recursive(self.client, "/zoo")
+        self.assertEqual(descendants, ["/zoo/mammals", "/zoo/reptiles",
+                                       "/zoo/mammals/elephant"])
+        self.assertEqual(
+            (yield get_children_recursive(self.client, "/zoo/reptiles")),
+            [])
+
 
 class DictMergeTest(TestCase):
 
@@ -0,0 +1,226 @@
+import gc
+import logging
+
+from twisted.application.service import Service
+from twisted.internet.defer import Deferred, fail, inlineCallbacks, succeed
+
+from juju.lib.testing import TestCase
+from juju.state.errors import StopWatcher
+from juju.state.service import ServiceStateManager
+from juju.state.tests.test_service import ServiceStateManagerTestBase
+from juju.state.watches import WatchRegistry, watch_registry
+
+
+class Owner(object):
+
+    def __init__(self):
+        self.calls = []
+        self._running = True
+
+    def callback(self, *args):
+        self.calls.append(args)
+
+
+class WatchRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = WatchRegistry()
+
+    def test_add_stop(self):
+        """Watches are counted per category and path prefix."""
+        first = self.registry.add("ports", "/units/unit-0000000001/ports")
+        self.registry.add("ports", "/units/unit-0000000002/ports")
+        self.registry.add("topology", "/topology")
+        self.assertEqual(len(self.registry.get_active()), 3)
+        self.assertEqual(len(self.registry.get_active("ports")), 2)
+
+        stats = self.registry.get_stats()
+        self.assertEqual(
+            sorted(stats), [("ports", "/units/*/ports"),
+                            ("topology", "/topology")])
+        self.assertEqual(stats[("ports", "/units/*/ports")].active, 2)
+
+        first.stop()
+        first.stop()
+        self.assertFalse(first.active)
+        self.assertEqual(stats[("ports", "/units/*/ports")].active, 1)
+        self.assertEqual(stats[("ports", "/units/*/ports")].started, 2)
+
+    @inlineCallbacks
+    def test_fire(self):
+        """Firing a watch accounts for the fire and the callback latency."""
+        owner = Owner()
+        watch = self.registry.add("ports", "/units/unit-0000000001/ports",
+                                  owner.callback)
+        result = yield watch.fire(lambda value: succeed(value * 2), 21)
+        self.assertEqual(result, 42)
+        yield watch.fire(owner.callback, True)
+        self.assertEqual(owner.calls, [(True,)])
+
+        stats = self.registry.get_stats()[("ports", "/units/*/ports")]
+        self.assertEqual(watch.fires, 2)
+        self.assertEqual(stats.fires, 2)
+        self.assertTrue(stats.max_time >= 0)
+        self.assertTrue(stats.get_fire_rate() > 0)
+        self.assertTrue(watch.active)
+
+    @inlineCallbacks
+    def test_failed_fire_stops(self):
+        """A failing callback, ie. one stopping the watch, ends the watch."""
+        watch = self.registry.add("ports", "/units/unit-0000000001/ports")
+        try:
+            yield watch.fire(lambda: fail(StopWatcher()))
+        except StopWatcher:
+            pass
+        self.assertFalse(watch.active)
+        self.assertEqual(self.registry.get_active(), [])
+
+    @inlineCallbacks
+    def test_leaks(self):
+        """A watch whose owner stopped is a leak."""
+        owner = Owner()
+        watch = self.registry.add("topology", "/topology", owner.callback)
+        self.registry.add("topology", "/topology")
+        self.assertEqual(self.registry.get_leaks(), [])
+        self.assertIdentical(watch.owner, owner)
+
+        owner._running = False
+        self.assertEqual(self.registry.get_leaks(), [watch])
+        yield watch.fire(owner.callback)
+        self.assertEqual(watch.fires_after_stop, 1)
+        self.assertEqual(
+            self.registry.get_stats()[("topology", "/topology")].
+            fires_after_stop, 1)
+
+        report = self.registry.format_report()
+        self.assertIn("Watches: 2 active, 1 leaked", report)
+        self.assertIn(
+            "Leaked watch topology on /topology, owner Owner is stopped",
+            report)
+
+        watch.stop()
+        self.assertEqual(self.registry.get_leaks(), [])
+
+    def test_collected_owner_leaks(self):
+        """A watch whose owner was garbage collected is a leak."""
+        owner = Owner()
+        watch = self.registry.add("topology", "/topology", owner)
+        del owner
+        gc.collect()
+        self.assertEqual(watch.owner, None)
+        self.assertEqual(self.registry.get_leaks(), [watch])
+
+    def test_owner_state(self):
+        """The owner's stopped state is read from its usual attributes."""
+
+        class Stoppable(object):
+            _stopped = None
+
+        class Runnable(object):
+
+            def __init__(self):
+                self.flag = True
+
+            def is_running(self):
+                return self.flag
+
+        stoppable = Stoppable()
+        runnable = Runnable()
+        self.registry.add("relation_members", "/relations", stoppable)
+        self.registry.add("exposed", "/services", runnable)
+        self.assertEqual(self.registry.get_leaks(), [])
+
+        stoppable._stopped = True
+        runnable.flag = False
+        self.assertEqual(
+            [watch.category for watch in self.registry.get_leaks()],
+            ["exposed", "relation_members"])
+
+    def test_owner_service_running(self):
+        """The int running flag of a Twisted service is honored."""
+        owner = Service()
+        self.registry.add("topology", "/topology", owner)
+        self.assertEqual(owner.running, 0)
+        self.assertEqual(len(self.registry.get_leaks()), 1)
+        owner.startService()
+        self.assertEqual(self.registry.get_leaks(), [])
+
+    def test_dump(self):
+        output = self.capture_logging("juju.state.watches")
+        owner = Owner()
+        self.registry.add("topology", "/topology", owner)
+        self.registry.dump(logging.getLogger("juju.state.watches"))
+        self.assertIn("Watches: 1 active, 0 leaked", output.getvalue())
+
+
+class StateWatchesTest(ServiceStateManagerTestBase):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(StateWatchesTest, self).setUp()
+        watch_registry.clear()
+        self.addCleanup(watch_registry.clear)
+
+    @inlineCallbacks
+    def test_watch_ports(self):
+        """A ports watch is registered until stopped by its callback."""
+        unit_state = yield self.get_unit_state()
+        owner = Owner()
+
+        def callback(value):
+            owner.callback(value)
+            if len(owner.calls) == 2:
+                raise StopWatcher()
+
+        yield unit_state.watch_ports(callback)
+        [watch] = watch_registry.get_active("ports")
+        self.assertEqual(
+            watch.path, "/units/%s/ports" % unit_state.internal_id)
+
+        yield unit_state.open_port(80, "tcp")
+        yield self.poke_zk()
+        self.assertEqual(len(owner.calls), 2)
+        self.assertEqual(watch_registry.get_active("ports"), [])
+        self.assertEqual(
+            watch_registry.get_stats()[("ports", "/units/*/ports")].fires, 2)
+
+    @inlineCallbacks
+    def test_watch_config_state_disconnected(self):
+        """A config watch is stopped once its client is disconnected."""
+        yield self.add_service("wordpress")
+        client = self.get_zookeeper_client()
+        yield client.connect()
+        service_state = yield ServiceStateManager(client).get_service_state(
+            "wordpress")
+
+        watch_d = Deferred()
+        mock_client = self.mocker.patch(client)
+        mock_client.exists_and_watch(
+            "/services/%s/config" % service_state.internal_id)
+        self.mocker.result((succeed(None), watch_d))
+        self.mocker.replay()
+
+        owner = Owner()
+        yield service_state.watch_config_state(owner.callback)
+        self.assertEqual(len(watch_registry.get_active("config")), 1)
+
+        yield client.close()
+        watch_d.callback(None)
+        self.assertEqual(watch_registry.get_active("config"), [])
+        self.assertEqual(owner.calls, [(False,)])
+
+    @inlineCallbacks
+    def test_watch_topology_leak(self):
+        """A topology watch kept by a stopped owner is reported as leaked."""
+        owner = Owner()
+        yield self.service_state_manager.watch_service_states(owner.callback)
+        [watch] = watch_registry.get_active("topology")
+        self.assertIdentical(watch.owner, owner)
+        self.assertEqual(watch_registry.get_leaks(), [])
+
+        owner._running = False
+        self.assertEqual(watch_registry.get_leaks(), [watch])
+
+        yield self.add_service_from_charm("mysql")
+        yield self.poke_zk()
+        self.assertEqual(watch.fires_after_stop, 1)
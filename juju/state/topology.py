@@ -102,6 +102,25 @@ class InternalTopology(object):
                     return True
         return False
 
+    def set_machine_standby(self, machine_id, status):
+        """Set the standby pool status of machine_id.
+
+        Standby machines are kept idle for units to be placed on, their
+        status is either "pending" until their agent connects, or
+        "ready". A status of None removes the machine from the pool.
+        """
+        self._assert_machine(machine_id)
+        machine = self._state["machines"][machine_id]
+        if status is None:
+            machine.pop("standby", None)
+        else:
+            machine["standby"] = status
+
+    def get_machine_standby(self, machine_id):
+        """Return the standby pool status of machine_id, or None."""
+        self._assert_machine(machine_id)
+        return self._state["machines"][machine_id].get("standby")
+
     def remove_machine(self, machine_id):
         """Remove machine_id from this topology.
         """
@@ -0,0 +1,219 @@
+"""Sharing of an environment's ssh tunnel between juju commands.
+
+Connecting to an environment finds its zookeeper machines and spawns
+an ssh process forwarding a local port, before the zookeeper session
+can be established. A L{TunnelServer}, run by `juju open-tunnel
+--shared`, keeps the tunnel open and serves its local address to
+other juju commands over a unix socket, such that they only pay for a
+local zookeeper session handshake.
+
+Each command holds its socket connection for as long as it uses the
+tunnel. The server shuts itself down once it has been without any such
+connection for its idle timeout.
+"""
+import logging
+import os
+
+from twisted.internet.defer import (
+    Deferred, inlineCallbacks, maybeDeferred, returnValue)
+from twisted.internet.error import ConnectError
+from twisted.internet.protocol import ClientCreator, ServerFactory
+from twisted.protocols.basic import LineReceiver
+from twisted.python.failure import Failure
+
+from juju.errors import NoConnection
+from juju.state.security import SecurityPolicyConnection
+
+
+log = logging.getLogger("juju.state.tunnel")
+
+
+def get_tunnel_socket_path(environment_name):
+    """Return the path of the shared tunnel socket of an environment."""
+    return os.path.expanduser(
+        "~/.juju/tunnels/%s.sock" % environment_name)
+
+
+class TunnelLeaseProtocol(LineReceiver):
+    """Server side of a command's use of the shared tunnel."""
+
+    def connectionMade(self):
+        self.factory.acquire()
+
+    def connectionLost(self, reason):
+        self.factory.release()
+
+    def lineReceived(self, line):
+        if line != "connect":
+            self.sendLine("error unknown request %r" % line)
+            return
+        d = self.factory.get_address()
+        d.addCallback(self.sendLine)
+        d.addErrback(
+            lambda failure: self.sendLine(
+                "error %s" % failure.getErrorMessage()))
+
+
+class TunnelServer(ServerFactory):
+    """Serves the address of a shared tunnel to an environment.
+
+    :param connect: A callable returning a deferred connected
+        L{juju.state.sshclient.SSHClient}, called again should the tunnel
+        go away.
+    :param idle_timeout: Seconds without any command using the tunnel,
+        after which the server stops. The server never stops if None.
+    """
+
+    protocol = TunnelLeaseProtocol
+
+    def __init__(self, connect, idle_timeout=None):
+        self._connect = connect
+        self.idle_timeout = idle_timeout
+        self.client = None
+        self.leases = 0
+        self.stopped = Deferred()
+        self._waiters = None
+        self._listening_port = None
+        self._idle_call = None
+
+    @inlineCallbacks
+    def start(self, socket_path):
+        """Open the tunnel, and serve it on `socket_path`."""
+        from twisted.internet import reactor
+
+        socket_dir = os.path.dirname(socket_path)
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        # The lock file guards against another live server, a stale
+        # socket left by a dead one is replaced.
+        self._listening_port = reactor.listenUNIX(
+            socket_path, self, mode=0600, wantPID=True)
+        try:
+            yield self.get_address()
+        except:
+            yield self.stop()
+            raise
+        self._schedule_idle_stop()
+        log.info("Serving shared tunnel on %s", socket_path)
+
+    def get_address(self):
+        """Return a deferred local address of the tunnel.
+
+        The tunnel is reopened if it went away.
+        """
+        if self.client is not None and self.client.connected:
+            return maybeDeferred(self._get_client_address, self.client)
+        if self._waiters is None:
+            log.debug("Opening tunnel")
+            self._waiters = []
+            d = maybeDeferred(self._connect)
+            d.addBoth(self._connected)
+        waiter = Deferred()
+        waiter.addCallback(self._get_client_address)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _connected(self, result):
+        waiters, self._waiters = self._waiters, None
+        if not isinstance(result, Failure):
+            self.client = result
+        for waiter in waiters:
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+
+    def _get_client_address(self, client):
+        return "localhost:%d" % client.local_port
+
+    def acquire(self):
+        self.leases += 1
+        if self._idle_call is not None:
+            self._idle_call.cancel()
+            self._idle_call = None
+
+    def release(self):
+        self.leases -= 1
+        self._schedule_idle_stop()
+
+    def _schedule_idle_stop(self):
+        from twisted.internet import reactor
+
+        if (self.leases or self.idle_timeout is None or
+                self._idle_call is not None or self.stopped.called):
+            return
+        self._idle_call = reactor.callLater(self.idle_timeout, self._idle)
+
+    def _idle(self):
+        self._idle_call = None
+        log.info("Shared tunnel idle for %ds, closing", self.idle_timeout)
+        return self.stop()
+
+    @inlineCallbacks
+    def stop(self):
+        """Close the tunnel and stop serving it."""
+        if self._idle_call is not None:
+            self._idle_call.cancel()
+            self._idle_call = None
+        if self._listening_port is not None:
+            yield self._listening_port.stopListening()
+            self._listening_port = None
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if not self.stopped.called:
+            self.stopped.callback(None)
+
+
+class _TunnelLeaseClientProtocol(LineReceiver):
+
+    def __init__(self):
+        self.address = Deferred()
+
+    def lineReceived(self, line):
+        if self.address.called:
+            return
+        if line.startswith("error "):
+            self.address.errback(NoConnection(line[len("error "):]))
+        else:
+            self.address.callback(line)
+
+    def connectionLost(self, reason):
+        if not self.address.called:
+            self.address.errback(NoConnection("Shared tunnel went away"))
+
+
+class SharedTunnelClient(SecurityPolicyConnection):
+    """A ZookeeperClient connected through a L{TunnelServer}'s tunnel.
+
+    The client holds on to the tunnel until it is closed.
+    """
+
+    _lease = None
+
+    @inlineCallbacks
+    def connect_shared(self, socket_path, timeout=30):
+        """Connect through the shared tunnel served on `socket_path`."""
+        from twisted.internet import reactor
+
+        try:
+            self._lease = yield ClientCreator(
+                reactor, _TunnelLeaseClientProtocol).connectUNIX(
+                socket_path, timeout=timeout)
+        except ConnectError, e:
+            raise NoConnection("Cannot reach shared tunnel: %s" % e)
+        try:
+            self._lease.sendLine("connect")
+            address = yield self._lease.address
+            yield self.connect(address, timeout)
+        except:
+            self.close()
+            raise
+        returnValue(self)
+
+    def close(self):
+        """Close the zookeeper connection, and release the shared tunnel."""
+        super(SharedTunnelClient, self).close()
+        if self._lease is not None:
+            self._lease.transport.loseConnection()
+            self._lease = None
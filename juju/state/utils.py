@@ -10,6 +10,7 @@ from txzookeeper.utils import retry_change
 import yaml
 import zookeeper
 
+from juju.lib.twistutils import parallel_map
 from juju.state.errors import StateChanged
 from juju.state.errors import StateNotFound
 
@@ -75,11 +76,95 @@ class PortWatcher(object):
         return deferToThread(self.sync_wait)
 
 
+# Maximum number of outstanding requests of the bulk zookeeper helpers.
+ZK_CONCURRENCY = 16
+
+
+def _join_path(path, child):
+    return "%s/%s" % (path.rstrip("/"), child)
+
+
+def _ignore_missing(failure):
+    failure.trap(zookeeper.NoNodeException)
+
+
+def get_many(client, paths, limit=ZK_CONCURRENCY, missing_ok=False):
+    """Get the content of many nodes concurrently.
+
+    Returns a deferred list of (content, stat) tuples, in the order of
+    `paths`. With `missing_ok`, a missing node results in None, otherwise
+    the error of the first failing path (in `paths` order) is raised once
+    all the requests completed.
+    """
+
+    def get(path):
+        d = client.get(path)
+        if missing_ok:
+            d.addErrback(_ignore_missing)
+        return d
+    return parallel_map(get, paths, limit)
+
+
+def set_many(client, items, limit=ZK_CONCURRENCY):
+    """Set the content of many nodes concurrently.
+
+    `items` is a sequence of (path, content) pairs. Returns a deferred
+    list of the resulting stats in the order of `items`, raising the
+    error of the first failing path once all the requests completed.
+    """
+    return parallel_map(
+        lambda (path, content): client.set(path, content), items, limit)
+
+
+def delete_many(client, paths, limit=ZK_CONCURRENCY, missing_ok=False):
+    """Delete many nodes concurrently.
+
+    With `missing_ok`, nodes already gone are ignored, otherwise the error
+    of the first failing path is raised once all the requests completed.
+    """
+
+    def delete(path):
+        d = client.delete(path)
+        if missing_ok:
+            d.addErrback(_ignore_missing)
+        return d
+    return parallel_map(delete, paths, limit)
+
+
 @inlineCallbacks
-def remove_tree(client, path):
-    children = yield client.get_children(path)
-    for child in children:
-        yield remove_tree(client, "%s/%s" % (path, child))
+def get_children_recursive(client, path, limit=ZK_CONCURRENCY):
+    """Return the paths of all the descendants of `path`.
+
+    The tree is read level by level, with the children of all the nodes
+    of a level read concurrently. Paths are returned parents first, ie. in
+    breadth first order.
+    """
+    descendants = []
+    level = [path]
+    while level:
+        children = yield parallel_map(client.get_children, level, limit)
+        level = [_join_path(parent, child)
+                 for parent, names in zip(level, children)
+                 for child in sorted(names)]
+        descendants.extend(level)
+    returnValue(descendants)
+
+
+@inlineCallbacks
+def remove_tree(client, path, limit=ZK_CONCURRENCY):
+    """Remove the node at `path`, along with all of its descendants.
+
+    The nodes of each level of the tree are removed concurrently, the
+    deepest level first.
+    """
+    descendants = yield get_children_recursive(client, path, limit)
+    depth = path.rstrip("/").count("/")
+    levels = {}
+    for descendant in descendants:
+        levels.setdefault(descendant.count("/") - depth, []).append(
+            descendant)
+    for level in sorted(levels, reverse=True):
+        yield delete_many(client, levels[level], limit)
     yield client.delete(path)
 
 
@@ -0,0 +1,250 @@
+"""Accounting of the perpetual zookeeper watches of a process.
+
+The watch methods of the state api re-arm their zookeeper watch after
+each callback, until the callback raises L{StopWatcher} or the client
+is disconnected. Each such watch is registered with the process wide
+L{watch_registry} for as long as it stays armed, which accounts for
+the number of live watches, their fire rate and callback latency, per
+category and path prefix.
+
+A watch whose owner has been stopped, but which is still armed, is a
+leak: it keeps a zookeeper watch and the owner alive, and typically
+keeps invoking the owner's callback. The owner of a watch is the
+object of its callback method, and it is deemed stopped by its
+`is_running`, `running`, `_running` or `_stopped` attribute, or once
+it has been garbage collected.
+"""
+import logging
+import signal
+import time
+import weakref
+
+from twisted.internet.defer import maybeDeferred
+from twisted.python.failure import Failure
+
+from juju.lib.zkprofile import normalize_path
+
+
+log = logging.getLogger("juju.state.watches")
+
+
+def _get_owner(owner):
+    """Return the object owning a watch, given it or its callback."""
+    return getattr(owner, "im_self", owner)
+
+
+def _is_stopped(owner):
+    """Whether a watch's owner reports itself as stopped.
+
+    Flags may be ints as well as bools, as Twisted's `Service.running`.
+    """
+    stopped = getattr(owner, "_stopped", None)
+    if isinstance(stopped, int):
+        return bool(stopped)
+    for name in ("is_running", "running", "_running"):
+        running = getattr(owner, name, None)
+        if callable(running):
+            running = running()
+        if isinstance(running, int):
+            return not running
+    return False
+
+
+class Watch(object):
+    """A perpetual watch registered with a L{WatchRegistry}.
+
+    The watch must be fired through L{fire} for its callback latency to be
+    accounted, and stopped once it is not re-armed anymore.
+    """
+
+    def __init__(self, registry, category, path, owner=None):
+        self._registry = registry
+        self.category = category
+        self.path = path
+        self.prefix = normalize_path(path)
+        self.created = time.time()
+        self.fires = 0
+        self.fires_after_stop = 0
+        self.active = True
+        owner = _get_owner(owner)
+        self._owner_type = type(owner).__name__ if owner is not None else None
+        self._owner = None
+        if owner is not None:
+            try:
+                self._owner = weakref.ref(owner)
+            except TypeError:
+                self._owner = lambda: owner
+
+    @property
+    def owner(self):
+        """The owner of the watch, None if unknown or collected."""
+        return self._owner is not None and self._owner() or None
+
+    @property
+    def owner_stopped(self):
+        """Whether the owner of the watch is stopped or was collected."""
+        if self._owner is None:
+            return False
+        owner = self._owner()
+        return owner is None or _is_stopped(owner)
+
+    def fire(self, callback, *args, **kw):
+        """Invoke a watch `callback`, accounting for its latency.
+
+        Returns the deferred result of the callback. A failing callback,
+        including one raising L{StopWatcher}, stops the watch.
+        """
+        self.fires += 1
+        if self.owner_stopped:
+            self.fires_after_stop += 1
+            log.debug("Watch %s on %s fired after its owner %s stopped",
+                      self.category, self.path, self._owner_type)
+        start = time.time()
+
+        def record(result):
+            self._registry._record(self, time.time() - start)
+            if isinstance(result, Failure):
+                self.stop()
+            return result
+        return maybeDeferred(callback, *args, **kw).addBoth(record)
+
+    def stop(self):
+        """Unregister the watch, once it will not be re-armed."""
+        if self.active:
+            self.active = False
+            self._registry._remove(self)
+
+    def __repr__(self):
+        return "<Watch %s %s owner:%s>" % (
+            self.category, self.path, self._owner_type)
+
+
+class WatchStats(object):
+    """The statistics of the watches of a category and path prefix."""
+
+    def __init__(self):
+        self.active = 0
+        self.started = 0
+        self.fires = 0
+        self.fires_after_stop = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.first_started = time.time()
+
+    def get_fire_rate(self, now=None):
+        """Fires per second since the first watch was started."""
+        elapsed = (now or time.time()) - self.first_started
+        return elapsed > 0 and self.fires / elapsed or 0.0
+
+    def get_mean_time(self):
+        return self.fires and self.total_time / self.fires or 0.0
+
+
+class WatchRegistry(object):
+    """Accounts for the perpetual watches of a process."""
+
+    def __init__(self):
+        self._watches = set()
+        self._stats = {}
+        self._signals = set()
+
+    def add(self, category, path, owner=None):
+        """Register a new watch, and return its L{Watch}.
+
+        :param category: The kind of watch, ie. "topology" or "ports".
+        :param path: The zookeeper path watched.
+        :param owner: The object owning the watch, or its bound callback
+            method.
+        """
+        watch = Watch(self, category, path, owner)
+        self._watches.add(watch)
+        stats = self._get_stats(watch)
+        stats.active += 1
+        stats.started += 1
+        return watch
+
+    def _get_stats(self, watch):
+        key = (watch.category, watch.prefix)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = WatchStats()
+        return stats
+
+    def _record(self, watch, duration):
+        stats = self._get_stats(watch)
+        stats.fires += 1
+        stats.total_time += duration
+        stats.max_time = max(stats.max_time, duration)
+        if watch.owner_stopped:
+            stats.fires_after_stop += 1
+
+    def _remove(self, watch):
+        if watch in self._watches:
+            self._watches.remove(watch)
+            self._get_stats(watch).active -= 1
+
+    def get_active(self, category=None):
+        """Return the active watches, optionally of a category."""
+        return sorted(
+            [watch for watch in self._watches
+             if category is None or watch.category == category],
+            key=lambda watch: (watch.category, watch.path))
+
+    def get_stats(self):
+        """Return the L{WatchStats} by (category, path prefix)."""
+        return dict(self._stats)
+
+    def get_leaks(self):
+        """Return the active watches whose owner is stopped."""
+        return [watch for watch in self.get_active() if watch.owner_stopped]
+
+    def format_report(self):
+        """Return a report of the watches, and of any leaked watch."""
+        now = time.time()
+        leaks = self.get_leaks()
+        lines = [
+            "Watches: %d active, %d leaked" % (len(self._watches), len(leaks)),
+            "%-20s %-40s %6s %6s %8s %9s %9s %6s" % (
+                "category", "path", "active", "fires", "fires/s",
+                "mean(s)", "max(s)", "late")]
+        for (category, prefix), stats in sorted(self._stats.items()):
+            lines.append("%-20s %-40s %6d %6d %8.3f %9.3f %9.3f %6d" % (
+                category, prefix, stats.active, stats.fires,
+                stats.get_fire_rate(now), stats.get_mean_time(),
+                stats.max_time, stats.fires_after_stop))
+        for watch in leaks:
+            lines.append("Leaked watch %s on %s, owner %s is stopped" % (
+                watch.category, watch.path, watch._owner_type))
+        return "\n".join(lines)
+
+    def dump(self, log):
+        """Log the report, as a warning if any watch leaked."""
+        level = self.get_leaks() and logging.WARNING or logging.INFO
+        log.log(level, "%s", self.format_report())
+
+    def dump_on_signal(self, log, signum=signal.SIGUSR2):
+        """Log the report from the reactor whenever `signum` is received.
+
+        Any previous handler of `signum` is still invoked. The handler is
+        only installed once per signal.
+        """
+        from twisted.internet import reactor
+        if signum in self._signals:
+            return
+        self._signals.add(signum)
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame):
+            reactor.callFromThread(self.dump, log)
+            if callable(previous):
+                previous(signum, frame)
+        signal.signal(signum, handler)
+
+    def clear(self):
+        """Forget all watches and statistics, a testing aid."""
+        self._watches.clear()
+        self._stats.clear()
+
+
+# The process wide registry, used by the state api.
+watch_registry = WatchRegistry()
@@ -1,37 +1,488 @@
-
+import errno
+import fcntl
+import hashlib
+import logging
 import os
 import shutil
+import stat
+import tempfile
+import time
+from contextlib import contextmanager
+from zipfile import ZipFile
+
+import yaml
 
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.web.client import downloadPage
 from twisted.web.error import Error
 
-from juju.errors import FileNotFound
+from juju.errors import CharmError, FileNotFound
 from juju.charm.bundle import CharmBundle
-from juju.lib import under
+from juju.charm.delta import CharmDelta, load_manifest
 from juju.state.charm import CharmStateManager
 
 
+log = logging.getLogger("juju.unit.charm")
+
+# Default size cap of a charm cache, in megabytes.
+DEFAULT_CACHE_SIZE = 512
+
+
+def get_default_cache_size():
+    """Return the charm cache size cap in bytes.
+
+    The cap may be overridden via $JUJU_CHARM_CACHE_SIZE (in megabytes),
+    which unit deployments set for the unit agents they start from the
+    machine agent's cache size.
+    """
+    size = os.environ.get("JUJU_CHARM_CACHE_SIZE") or DEFAULT_CACHE_SIZE
+    return int(size) * 1024 * 1024
+
+
+class _HashingFile(object):
+    """File wrapper computing the digest of the data written through it.
+
+    Allows verifying a download as it streams in, instead of rereading
+    the file once complete.
+    """
+
+    def __init__(self, file, hash_type=hashlib.sha256):
+        self._file = file
+        self.hash = hash_type()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class CharmCache(object):
+    """A content addressed local cache of charm bundles.
+
+    Bundles are stored in the cache directory under their sha256
+    digest. A bundle only becomes visible under its digest once its
+    content has been verified, by way of an atomic rename from a
+    temporary file, so any bundle found in the cache is a verified
+    copy. The cache is bounded in size, least recently used bundles
+    are evicted once the cap is exceeded, except for bundles pinned
+    while in use.
+
+    The cache directory is shared by the agents of a machine, so pins
+    are held as shared locks on a pin file per bundle, which eviction,
+    in any process, must take exclusively to remove a bundle.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        if max_size is None:
+            max_size = get_default_cache_size()
+        self.max_size = max_size
+        # sha256 -> [locked pin file, number of users of the bundle]
+        self._pinned = {}
+
+    def _get_pin_path(self, checksum):
+        return os.path.join(self.directory, ".pins", checksum)
+
+    def pin(self, checksum):
+        """Protect the bundle with the given sha256 from eviction.
+
+        Pins are counted, each must be released with :meth:`unpin`.
+        """
+        if checksum not in self._pinned:
+            pin_path = self._get_pin_path(checksum)
+            if not os.path.exists(os.path.dirname(pin_path)):
+                os.makedirs(os.path.dirname(pin_path))
+            pin_file = open(pin_path, "a")
+            fcntl.flock(pin_file, fcntl.LOCK_SH)
+            self._pinned[checksum] = [pin_file, 0]
+        self._pinned[checksum][1] += 1
+
+    def unpin(self, checksum):
+        """Release a pin taken with :meth:`pin`."""
+        pin = self._pinned[checksum]
+        pin[1] -= 1
+        if not pin[1]:
+            del self._pinned[checksum]
+            # Closing the pin file releases its lock.
+            pin[0].close()
+
+    def _remove_unpinned(self, checksum, path):
+        """Remove a bundle unless pinned by any process, returning if so.
+        """
+        pin_path = self._get_pin_path(checksum)
+        if not os.path.exists(pin_path):
+            os.remove(path)
+            return True
+        # The pin file is kept, a pin may be taken on it concurrently.
+        with open(pin_path, "a") as pin_file:
+            try:
+                fcntl.flock(pin_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                return False
+            try:
+                os.remove(path)
+            finally:
+                fcntl.flock(pin_file, fcntl.LOCK_UN)
+        return True
+
+    def get_path(self, checksum):
+        """Return the cache path of the bundle with the given sha256."""
+        return os.path.join(self.directory, checksum)
+
+    def get(self, checksum):
+        """Return the cached bundle with the given sha256, or None.
+
+        Marks the bundle as recently used.
+        """
+        path = self.get_path(checksum)
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return CharmBundle(path)
+
+    @inlineCallbacks
+    def fetch(self, charm_state):
+        """Return a bundle for the charm, downloading it if not cached.
+        """
+        checksum = yield charm_state.get_sha256()
+        bundle = self.get(checksum)
+        if bundle is not None:
+            log.debug("Using cached charm %s", charm_state.id)
+            returnValue(bundle)
+
+        path = yield self.fetch_file(charm_state.bundle_url, checksum)
+        log.debug("Cached charm %s (%d bytes)",
+                  charm_state.id, os.path.getsize(path))
+        returnValue(CharmBundle(path))
+
+    @inlineCallbacks
+    def fetch_file(self, url, checksum):
+        """Return the cache path of the file at `url` with the given sha256.
+
+        The file is downloaded, and verified, if not cached.
+        """
+        path = self.get_path(checksum)
+        if os.path.exists(path):
+            os.utime(path, None)
+            returnValue(path)
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        output = _HashingFile(os.fdopen(fd, "wb"))
+        try:
+            yield self._retrieve(url, output)
+            output.close()
+            digest = output.hash.hexdigest()
+            if digest != checksum:
+                raise CharmError(
+                    url, "sha256 mismatch, expected %s got %s" % (
+                        checksum, digest))
+            os.rename(temp_path, path)
+        finally:
+            output.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.evict(keep=checksum)
+        returnValue(path)
+
+    def _retrieve(self, bundle_url, output):
+        """Stream the bundle at `bundle_url` into `output`."""
+        if bundle_url.startswith("file://"):
+            file_path = bundle_url[len("file://"):]
+            if not os.path.exists(file_path):
+                raise FileNotFound(bundle_url)
+            with open(file_path, "rb") as source:
+                shutil.copyfileobj(source, output)
+            return
+
+        d = downloadPage(bundle_url, output)
+
+        def on_error(failure):
+            failure.trap(Error)
+            raise FileNotFound(bundle_url)
+
+        d.addErrback(on_error)
+        return d
+
+    def evict(self, keep=None):
+        """Evict least recently used bundles until within the size cap.
+
+        @param keep: sha256 of a bundle which must not be evicted, in
+            addition to the pinned bundles.
+
+        Returns the number of bytes reclaimed.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.startswith("."):
+                continue
+            path = os.path.join(self.directory, name)
+            info = os.stat(path)
+            entries.append((info.st_mtime, info.st_size, name, path))
+            total += info.st_size
+
+        reclaimed = 0
+        for mtime, size, name, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if name == keep or not self._remove_unpinned(name, path):
+                continue
+            log.debug("Evicted cached charm %s", name)
+            total -= size
+            reclaimed += size
+        return reclaimed
+
+
+class ExtractedCharmStore(object):
+    """A per machine store of extracted charms, shared between units.
+
+    Each charm bundle is extracted once, into a store directory keyed by
+    the bundle's sha256, and unit charm directories are populated from
+    the store instead of extracting the bundle again.
+
+    Hooks run as root, so file permissions can't stop a hook writing to
+    a file in place. Only files the bundle ships without write
+    permission, which the charm thus declares it doesn't modify, are
+    shared between units via hardlinks to the store. Every other file is
+    copied, giving each unit a private copy it may write to. Deploying
+    into a unit directory always replaces files rather than writing them
+    in place. A manifest of the size and mtime of every file is kept for
+    each store entry, such that an entry modified in place regardless
+    is detected, discarded and extracted again.
+
+    Deploying and collecting entries are serialized, across processes,
+    with a lock file in the store directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, checksum):
+        """Return the store path of the charm with the given sha256."""
+        return os.path.join(self.directory, checksum)
+
+    def _get_manifest_path(self, checksum):
+        return os.path.join(self.directory, ".manifests", checksum)
+
+    @contextmanager
+    def _locked(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _build_manifest(self, path):
+        manifest = {}
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in filenames:
+                file_path = os.path.join(dirpath, name)
+                info = os.lstat(file_path)
+                manifest[os.path.relpath(file_path, path)] = [
+                    info.st_size, int(info.st_mtime)]
+        return manifest
+
+    def verify(self, checksum):
+        """Is there an unmodified store entry for the given sha256."""
+        path = self.get_path(checksum)
+        manifest_path = self._get_manifest_path(checksum)
+        if not (os.path.isdir(path) and os.path.exists(manifest_path)):
+            return False
+        with open(manifest_path) as manifest_file:
+            manifest = yaml.safe_load(manifest_file.read())
+        return manifest == self._build_manifest(path)
+
+    def extract(self, bundle):
+        """Extract the bundle into the store, if needed, returning its path.
+        """
+        with self._locked():
+            return self._extract(bundle)
+
+    def _extract(self, bundle):
+        checksum = bundle.get_sha256()
+        path = self.get_path(checksum)
+        if self.verify(checksum):
+            return path
+
+        if os.path.exists(path):
+            log.warning("Discarding modified extracted charm %s", checksum)
+            self._remove(path)
+
+        manifest_path = self._get_manifest_path(checksum)
+        if not os.path.exists(os.path.dirname(manifest_path)):
+            os.makedirs(os.path.dirname(manifest_path))
+
+        # Extract to a temporary directory, and move into place when done.
+        temp_path = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            zf = ZipFile(bundle.path, "r")
+            for info in zf.infolist():
+                mode = info.external_attr >> 16
+                extract_path = zf.extract(info, temp_path)
+                if os.path.isdir(extract_path):
+                    continue
+                os.chmod(extract_path, stat.S_IMODE(mode) or 0644)
+            with open(manifest_path, "w") as fh:
+                fh.write(yaml.safe_dump(self._build_manifest(temp_path)))
+            os.rename(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                self._remove(temp_path)
+        return path
+
+    def deploy(self, bundle, target):
+        """Populate `target` with the content of the charm bundle.
+
+        Read-only files are hardlinked from the store, falling back to a
+        copy where a hardlink is not possible (ie. across filesystems),
+        other files are copied. Any existing file in `target` is
+        replaced, never written to.
+
+        Returns a dictionary with deployment statistics.
+        """
+        with self._locked():
+            return self._deploy(bundle, target)
+
+    def _deploy(self, bundle, target):
+        start = time.time()
+        source = self._extract(bundle)
+        stats = {"linked_files": 0, "linked_bytes": 0,
+                 "copied_files": 0, "copied_bytes": 0}
+
+        for dirpath, dirnames, filenames in os.walk(source):
+            target_dir = os.path.normpath(
+                os.path.join(target, os.path.relpath(dirpath, source)))
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            for name in filenames:
+                source_path = os.path.join(dirpath, name)
+                target_path = os.path.join(target_dir, name)
+                if os.path.lexists(target_path):
+                    os.remove(target_path)
+                if os.path.islink(source_path):
+                    os.symlink(os.readlink(source_path), target_path)
+                    continue
+                info = os.stat(source_path)
+                if not info.st_mode & 0222:
+                    try:
+                        os.link(source_path, target_path)
+                    except OSError, e:
+                        if e.errno not in (errno.EXDEV, errno.EPERM,
+                                           errno.EMLINK):
+                            raise
+                    else:
+                        stats["linked_files"] += 1
+                        stats["linked_bytes"] += info.st_size
+                        continue
+                shutil.copy2(source_path, target_path)
+                os.chmod(target_path, info.st_mode | stat.S_IWUSR)
+                stats["copied_files"] += 1
+                stats["copied_bytes"] += info.st_size
+
+        stats["duration"] = time.time() - start
+        log.info(
+            "Deployed charm %s to %s in %0.3fs, linked %d files "
+            "(%d bytes) copied %d files (%d bytes)",
+            bundle.get_sha256(), target, stats["duration"],
+            stats["linked_files"], stats["linked_bytes"],
+            stats["copied_files"], stats["copied_bytes"])
+        return stats
+
+    def get_disk_usage(self):
+        """Return the number of bytes used by the store's files."""
+        total = 0
+        if not os.path.exists(self.directory):
+            return total
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for name in filenames:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+        return total
+
+    def collect(self):
+        """Remove store entries no longer linked into any unit directory.
+
+        Returns the number of bytes reclaimed.
+        """
+        if not os.path.exists(self.directory):
+            return 0
+        with self._locked():
+            return self._collect()
+
+    def _collect(self):
+        reclaimed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            in_use = False
+            size = 0
+            for dirpath, dirnames, filenames in os.walk(path):
+                for file_name in filenames:
+                    info = os.lstat(os.path.join(dirpath, file_name))
+                    size += info.st_size
+                    if stat.S_ISREG(info.st_mode) and info.st_nlink > 1:
+                        in_use = True
+            if in_use:
+                continue
+            log.debug("Removing unused extracted charm %s", name)
+            self._remove(path)
+            manifest_path = self._get_manifest_path(name)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            reclaimed += size
+        return reclaimed
+
+    def _remove(self, path):
+        # Store files are read-only, but their directories are not, so
+        # the tree can be removed as is.
+        shutil.rmtree(path)
+
+
 @inlineCallbacks
 def download_charm(client, charm_id, charms_directory):
+    """Retrieve a charm bundle, via the charm cache in `charms_directory`.
+    """
     charm_state_manager = CharmStateManager(client)
     charm_state = yield charm_state_manager.get_charm_state(charm_id)
+    bundle = yield CharmCache(charms_directory).fetch(charm_state)
+    returnValue(bundle)
 
-    # Calculate local charm path
-    checksum = yield charm_state.get_sha256()
-    charm_key = under.quote("%s:%s" % (charm_state.id, checksum))
-    local_charm_path = os.path.join(
-        charms_directory, charm_key)
-
-    # Retrieve charm from provider storage link
-    if charm_state.bundle_url.startswith("file://"):
-        file_path = charm_state.bundle_url[len("file://"):]
-        if not os.path.exists(file_path):
-            raise FileNotFound(charm_state.bundle_url)
-        shutil.copyfileobj(open(file_path), open(local_charm_path, "w"))
-    else:
-        try:
-            yield downloadPage(charm_state.bundle_url, local_charm_path)
-        except Error:
-            raise FileNotFound(charm_state.bundle_url)
-    returnValue(CharmBundle(local_charm_path))
+
+@inlineCallbacks
+def download_charm_delta(client, charm_id, base_charm_id, charms_directory):
+    """Retrieve the delta from a charm to its upgrade, if published.
+
+    Returns a `CharmDelta`, or None if no delta from `base_charm_id` was
+    published along with the charm. The manifests of both charms and the
+    delta are fetched through the charm cache.
+    """
+    charm_state_manager = CharmStateManager(client)
+    charm_state = yield charm_state_manager.get_charm_state(charm_id)
+    delta = charm_state.delta
+    if not delta or delta["base"] != base_charm_id or \
+            charm_state.manifest is None:
+        returnValue(None)
+    base_state = yield charm_state_manager.get_charm_state(base_charm_id)
+    if base_state.manifest is None:
+        returnValue(None)
+    cache = CharmCache(charms_directory)
+    manifests = []
+    for info in (base_state.manifest, charm_state.manifest):
+        path = yield cache.fetch_file(info["url"], info["sha256"])
+        with open(path) as f:
+            manifests.append(load_manifest(f.read()))
+    path = yield cache.fetch_file(delta["url"], delta["sha256"])
+    returnValue(CharmDelta(path, *manifests))
@@ -9,6 +9,7 @@ from juju.hooks.invoker import Invoker
 from juju.hooks.scheduler import HookScheduler
 from juju.state.hook import RelationChange, HookContext
 from juju.state.errors import StopWatcher, UnitRelationStateNotFound
+from juju.lib.twistutils import parallel_map
 
 from juju.unit.workflow import RelationWorkflowState
 
@@ -25,6 +26,9 @@ class UnitLifecycle(object):
     according to the current unit workflow state and transitions.
     """
 
+    # Maximum number of new unit relations set up concurrently.
+    relation_concurrency = 10
+
     def __init__(self, client, unit, service, unit_path, executor):
         self._client = client
         self._unit = unit
@@ -257,26 +261,35 @@ class UnitLifecycle(object):
             workflow = self._relations.pop(relation_id)
             yield workflow.transition_state("departed")
 
-        # Process new relations.
-        for relation_id in added:
-            service_relation = new_relations[relation_id]
-            try:
-                unit_relation = yield service_relation.get_unit_state(
-                    self._unit)
-            except UnitRelationStateNotFound:
-                # This unit has not yet been assigned a unit relation state,
-                # Go ahead and add one.
-                unit_relation = yield service_relation.add_unit_state(
-                    self._unit)
-
-            self._log.debug(
-                "Starting new relation: %s", service_relation.relation_name)
-
-            workflow = self._get_unit_relation_workflow(unit_relation,
-                                                        service_relation)
-            # Start it before storing it.
-            yield workflow.fire_transition("start")
-            self._relations[service_relation.internal_relation_id] = workflow
+        # Process new relations, setting up their unit relation state,
+        # watches and workflows concurrently. We still hold the run lock
+        # here, and each workflow is only stored once it has started.
+        yield parallel_map(
+            self._start_relation,
+            [new_relations[relation_id] for relation_id in added],
+            self.relation_concurrency)
+
+    @inlineCallbacks
+    def _start_relation(self, service_relation):
+        """Create the unit relation state if needed and start its workflow.
+        """
+        try:
+            unit_relation = yield service_relation.get_unit_state(
+                self._unit)
+        except UnitRelationStateNotFound:
+            # This unit has not yet been assigned a unit relation state,
+            # Go ahead and add one.
+            unit_relation = yield service_relation.add_unit_state(
+                self._unit)
+
+        self._log.debug(
+            "Starting new relation: %s", service_relation.relation_name)
+
+        workflow = self._get_unit_relation_workflow(unit_relation,
+                                                    service_relation)
+        # Start it before storing it.
+        yield workflow.fire_transition("start")
+        self._relations[service_relation.internal_relation_id] = workflow
 
     def _get_unit_path(self):
         """Retrieve the root path of the unit.
@@ -1,6 +1,7 @@
 from functools import partial
 import os
 import shutil
+import stat
 
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed, fail
 from twisted.web.error import Error
@@ -12,13 +13,12 @@ from juju.charm.publisher import CharmPublisher
 from juju.charm.tests import local_charm_id
 from juju.charm.tests.test_directory import sample_directory
 from juju.environment.config import EnvironmentsConfig
-from juju.errors import FileNotFound
-from juju.lib import under
+from juju.errors import CharmError, FileNotFound
 from juju.state.environment import EnvironmentStateManager
 from juju.state.errors import CharmStateNotFound
 from juju.state.tests.common import StateTestBase
 
-from juju.unit.charm import download_charm
+from juju.unit.charm import CharmCache, ExtractedCharmStore, download_charm
 
 from juju.lib.mocker import MATCH
 
@@ -78,15 +78,15 @@ class DownloadTestCase(CharmPublisherTestBase):
 
         # Verify the downloaded copy
         checksum = charm.get_sha256()
-        charm_id = local_charm_id(charm)
-        charm_key = under.quote("%s:%s" % (charm_id, checksum))
-        charm_path = os.path.join(charm_directory, charm_key)
+        charm_path = os.path.join(charm_directory, checksum)
 
         self.assertTrue(os.path.exists(charm_path))
         bundle = CharmBundle(charm_path)
         self.assertEquals(bundle.get_revision(), charm.get_revision())
 
         self.assertEqual(checksum, bundle.get_sha256())
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(charm_directory), [checksum])
 
     @inlineCallbacks
     def test_charm_missing_download_file(self):
@@ -123,13 +123,15 @@ class DownloadTestCase(CharmPublisherTestBase):
         download_page = self.mocker.replace(downloadPage)
         download_page(
             MATCH(partial(match_string, "http://example.com/foobar.zip")),
-            MATCH(partial(match_string, "local_3a_series_2f_dummy-1")))
+            MATCH(lambda value: hasattr(value, "write")))
 
-        def bundle_in_place(url, local_path):
+        def bundle_in_place(url, local_file):
             # must keep ref to charm else temp file goes out of scope.
             charm = get_charm_from_path(sample_directory)
             bundle = charm.as_bundle()
-            shutil.copyfile(bundle.path, local_path)
+            with open(bundle.path) as bundle_file:
+                shutil.copyfileobj(bundle_file, local_file)
+            local_file.close()
 
         self.mocker.call(bundle_in_place)
         self.mocker.result(succeed(True))
@@ -162,7 +164,7 @@ class DownloadTestCase(CharmPublisherTestBase):
         download_page = self.mocker.replace(downloadPage)
         download_page(
             MATCH(partial(match_string, "http://example.com/foobar.zip")),
-            MATCH(partial(match_string, "local_3a_series_2f_dummy-1")))
+            MATCH(lambda value: hasattr(value, "write")))
 
         self.mocker.result(fail(Error("400", "Bad Stuff", "")))
         self.mocker.replay()
@@ -175,6 +177,7 @@ class DownloadTestCase(CharmPublisherTestBase):
             download_charm(self.client, charm_state.id, charm_directory),
             FileNotFound)
         self.assertIn(remote_url, str(error))
+        self.assertEqual(os.listdir(charm_directory), [])
 
     @inlineCallbacks
     def test_charm_download_not_found(self):
@@ -189,3 +192,215 @@ class DownloadTestCase(CharmPublisherTestBase):
             CharmStateNotFound)
 
         self.assertEquals(str(error), "Charm 'local:mickey-21' was not found")
+
+
+class CharmCacheTest(CharmPublisherTestBase):
+
+    @inlineCallbacks
+    def test_cached_charm_not_downloaded(self):
+        """A verified copy in the cache is used without a download."""
+        charm, charm_state = yield self.publish_charm()
+        cache = CharmCache(self.makeDir())
+        bundle = yield cache.fetch(charm_state)
+
+        # Remove the source, the cached copy is still available.
+        os.remove(charm_state.bundle_url[len("file://"):])
+        cached = yield cache.fetch(charm_state)
+        self.assertEqual(cached.path, bundle.path)
+        self.assertEqual(cached.get_revision(), charm.get_revision())
+
+    @inlineCallbacks
+    def test_checksum_mismatch(self):
+        """A download not matching the charm's sha256 is discarded."""
+        charm, charm_state = yield self.publish_charm()
+        with open(charm_state.bundle_url[len("file://"):], "a") as fh:
+            fh.write("corruption")
+
+        charm_directory = self.makeDir()
+        cache = CharmCache(charm_directory)
+        error = yield self.assertFailure(
+            cache.fetch(charm_state), CharmError)
+        self.assertIn("sha256 mismatch", str(error))
+        self.assertEqual(os.listdir(charm_directory), [])
+
+    def test_get_missing(self):
+        cache = CharmCache(self.makeDir())
+        self.assertIdentical(cache.get("abc"), None)
+
+    def test_default_cache_size(self):
+        self.change_environment(JUJU_CHARM_CACHE_SIZE="3")
+        self.assertEqual(CharmCache(self.makeDir()).max_size, 3 * 1024 * 1024)
+
+    def test_evict_least_recently_used(self):
+        """Eviction removes the least recently used entries first."""
+        charm_directory = self.makeDir()
+        for index, name in enumerate(["a", "b", "c"]):
+            path = os.path.join(charm_directory, name)
+            with open(path, "w") as fh:
+                fh.write("x" * 10)
+            os.utime(path, (index, index))
+        # A temporary file of an in progress download is left alone.
+        self.makeFile("x" * 10, dirname=charm_directory, prefix=".tmp-")
+
+        cache = CharmCache(charm_directory, max_size=20)
+        self.assertEqual(cache.evict(), 10)
+        self.assertEqual(
+            sorted(name for name in os.listdir(charm_directory)
+                   if not name.startswith(".")),
+            ["b", "c"])
+
+    def test_evict_keeps_requested(self):
+        charm_directory = self.makeDir()
+        for index, name in enumerate(["a", "b"]):
+            path = os.path.join(charm_directory, name)
+            with open(path, "w") as fh:
+                fh.write("x" * 10)
+            os.utime(path, (index, index))
+
+        cache = CharmCache(charm_directory, max_size=5)
+        self.assertEqual(cache.evict(keep="a"), 10)
+        self.assertEqual(os.listdir(charm_directory), ["a"])
+
+    def test_evict_keeps_pinned(self):
+        """Bundles pinned by in-flight deploys are not evicted."""
+        charm_directory = self.makeDir()
+        for index, name in enumerate(["a", "b", "c"]):
+            path = os.path.join(charm_directory, name)
+            with open(path, "w") as fh:
+                fh.write("x" * 10)
+            os.utime(path, (index, index))
+
+        cache = CharmCache(charm_directory, max_size=5)
+        cache.pin("a")
+        cache.pin("a")
+        self.assertEqual(cache.evict(keep="c"), 10)
+        self.assertEqual(
+            sorted(os.listdir(charm_directory)), [".pins", "a", "c"])
+
+        # A pin holds until every user released it.
+        cache.unpin("a")
+        self.assertEqual(cache.evict(keep="c"), 0)
+        cache.unpin("a")
+        self.assertEqual(cache.evict(keep="c"), 10)
+        self.assertEqual(sorted(os.listdir(charm_directory)), [".pins", "c"])
+
+    def test_evict_keeps_pinned_by_other_cache(self):
+        """Bundles pinned by another agent sharing the cache are kept."""
+        charm_directory = self.makeDir()
+        for index, name in enumerate(["a", "b"]):
+            path = os.path.join(charm_directory, name)
+            with open(path, "w") as fh:
+                fh.write("x" * 10)
+            os.utime(path, (index, index))
+
+        machine_cache = CharmCache(charm_directory, max_size=5)
+        unit_cache = CharmCache(charm_directory, max_size=5)
+        machine_cache.pin("a")
+        self.assertEqual(unit_cache.evict(keep="b"), 0)
+        self.assertTrue(os.path.exists(os.path.join(charm_directory, "a")))
+
+        machine_cache.unpin("a")
+        self.assertEqual(unit_cache.evict(keep="b"), 10)
+        self.assertFalse(os.path.exists(os.path.join(charm_directory, "a")))
+
+
+class ExtractedCharmStoreTest(StateTestBase):
+
+    def setUp(self):
+        super(ExtractedCharmStoreTest, self).setUp()
+        charm_directory = os.path.join(self.makeDir(), "sample")
+        shutil.copytree(sample_directory, charm_directory)
+        # The charm ships its metadata read-only, declaring it's shared.
+        os.chmod(os.path.join(charm_directory, "metadata.yaml"), 0444)
+        self.charm = get_charm_from_path(charm_directory)
+        self.bundle = self.charm.as_bundle()
+        self.store = ExtractedCharmStore(self.makeDir())
+
+    def get_entries(self):
+        return [name for name in os.listdir(self.store.directory)
+                if not name.startswith(".")]
+
+    def test_deploy_shares_files(self):
+        """Units deployed from the same bundle share its read-only files.
+        """
+        target1 = os.path.join(self.makeDir(), "charm")
+        target2 = os.path.join(self.makeDir(), "charm")
+        stats = self.store.deploy(self.bundle, target1)
+        self.store.deploy(self.bundle, target2)
+
+        self.assertEqual(stats["linked_files"], 1)
+        self.assertTrue(stats["copied_files"] > 0)
+        self.assertIn("duration", stats)
+
+        metadata1 = os.stat(os.path.join(target1, "metadata.yaml"))
+        metadata2 = os.stat(os.path.join(target2, "metadata.yaml"))
+        self.assertEqual(metadata1.st_ino, metadata2.st_ino)
+        self.assertFalse(metadata1.st_mode & stat.S_IWUSR)
+
+        charm = get_charm_from_path(target2)
+        self.assertEqual(charm.get_revision(), self.charm.get_revision())
+        self.assertEqual(self.get_entries(), [self.bundle.get_sha256()])
+
+    def test_deploy_copies_writable_files(self):
+        """Files a hook may write are private to each unit."""
+        target1 = os.path.join(self.makeDir(), "charm")
+        target2 = os.path.join(self.makeDir(), "charm")
+        self.store.deploy(self.bundle, target1)
+        self.store.deploy(self.bundle, target2)
+
+        # A hook writing to a file in place only changes its unit's copy.
+        with open(os.path.join(target1, "config.yaml"), "w") as fh:
+            fh.write("changed")
+        with open(os.path.join(target2, "config.yaml")) as fh:
+            self.assertEqual(
+                fh.read(),
+                open(os.path.join(sample_directory, "config.yaml")).read())
+        self.assertTrue(
+            self.store.verify(self.bundle.get_sha256()))
+
+    def test_deploy_preserves_executable(self):
+        target = os.path.join(self.makeDir(), "charm")
+        self.store.deploy(self.bundle, target)
+        hook_path = os.path.join(target, "hooks", "install")
+        self.assertTrue(os.access(hook_path, os.X_OK))
+
+    def test_deploy_replaces_existing_files(self):
+        """Deploying over a unit directory never writes to shared files."""
+        target1 = os.path.join(self.makeDir(), "charm")
+        target2 = os.path.join(self.makeDir(), "charm")
+        self.store.deploy(self.bundle, target1)
+        self.store.deploy(self.bundle, target2)
+        self.store.deploy(self.bundle, target2)
+
+        with open(os.path.join(target1, "metadata.yaml")) as fh:
+            self.assertEqual(
+                fh.read(),
+                open(os.path.join(sample_directory, "metadata.yaml")).read())
+
+    def test_modified_entry_extracted_again(self):
+        """A store entry modified in place is discarded and re-extracted."""
+        checksum = self.bundle.get_sha256()
+        path = self.store.extract(self.bundle)
+        self.assertTrue(self.store.verify(checksum))
+
+        revision_path = os.path.join(path, "revision")
+        os.chmod(revision_path, 0644)
+        with open(revision_path, "a") as fh:
+            fh.write("\n\n")
+        self.assertFalse(self.store.verify(checksum))
+
+        self.store.extract(self.bundle)
+        self.assertTrue(self.store.verify(checksum))
+
+    def test_collect_unused(self):
+        """Entries not linked into a unit directory are collected."""
+        target = os.path.join(self.makeDir(), "charm")
+        self.store.deploy(self.bundle, target)
+        usage = self.store.get_disk_usage()
+        self.assertTrue(usage > 0)
+
+        self.assertEqual(self.store.collect(), 0)
+        shutil.rmtree(target)
+        self.assertTrue(self.store.collect() > 0)
+        self.assertEqual(self.get_entries(), [])
+        self.assertEqual(self.store.get_disk_usage(), 0)
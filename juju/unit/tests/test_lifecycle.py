@@ -566,6 +566,44 @@ class UnitLifecycleTest(LifecycleTestBase):
             set([x.strip() for x in open(file_path).readlines()]),
             set(["joined", "changed", "joined", "changed", "departed"]))
 
+    @inlineCallbacks
+    def test_new_relations_started_concurrently(self):
+        """Relations added to the service are set up concurrently, up to
+        the lifecycle's relation concurrency limit."""
+        added_states = [self.states]
+        for service_name in ("wordpress-2", "wordpress-3"):
+            endpoint = RelationEndpoint(
+                service_name, "client-server", "db", "client")
+            added_states.append((
+                yield self.add_relation_service_unit_to_another_endpoint(
+                    self.states, endpoint)))
+        self.lifecycle.relation_concurrency = 2
+
+        in_flight = []
+        max_in_flight = []
+        original_start = self.lifecycle._start_relation
+
+        @inlineCallbacks
+        def track_start(service_relation):
+            in_flight.append(service_relation)
+            max_in_flight.append(len(in_flight))
+            try:
+                yield original_start(service_relation)
+            finally:
+                in_flight.remove(service_relation)
+
+        self.lifecycle._start_relation = track_start
+        yield self.lifecycle.start()
+
+        # More than one relation was started at a time, but never more
+        # than the limit.
+        self.assertEqual(len(max_in_flight), 3)
+        self.assertEqual(max(max_in_flight), 2)
+        for states in added_states:
+            workflow = self.lifecycle.get_relation_workflow(
+                states["relation"].internal_id)
+            self.assertEqual((yield workflow.get_state()), "up")
+
     @inlineCallbacks
     def test_removed_relation_depart(self):
         """